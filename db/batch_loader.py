@@ -0,0 +1,200 @@
+import asyncio
+import collections
+import decimal
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, List
+
+from db.mysql_pool import MySQLConnectionPool, _quote_identifier
+
+# 把同一张表、同一列上的点查合并成一条 SELECT ... WHERE col IN (...)
+# exist_data_by_kw一次查一个值，检查几千个值就是几千次往返；DataLoader把一个时间窗口(window_ms)内
+# 各个线程/协程提交的值攒起来，去重后按max_batch分块查询，再按列值把结果分给每个调用方
+#
+# 1. load()立即返回Future，不阻塞；get()/load_many()是阻塞的写法，aload()/aload_many()给asyncio用
+# 2. 攒批在一个后台线程里做，查询交给parallel个线程执行，一批在查的时候下一批继续攒
+# 3. 结果默认按列值精确匹配(统一转成字符串比较)，适合_bin/区分大小写的列；
+#    数值先规整再转字符串，1、1.0、Decimal('1.00')是同一个值，True当成1；
+#    case_insensitive=True时字符串去掉末尾空格再转小写比较，和*_ci PAD SPACE排序规则一致，
+#    'ABC'查到的'abc'也能分给'ABC'的调用方；列的排序规则不是*_ci时不要打开，否则大小写不同的值会拿到对方的行
+# 4. 一批查询失败(包括结果里没有column这一列)时，这批所有调用方的Future都设置同一个异常
+#
+# usage:
+#   loader = DataLoader(pool, 'user', 'name', window_ms=2, max_batch=500)
+#   loader.get('gavin')                                  # 同exist_data_by_kw(...)，不存在返回None
+#   loader.load_many(names)                              # 批量
+#   await loader.aload('gavin')                          # asyncio
+#   loader.close()
+
+
+def _number_key(value) -> str:
+    """int/float/Decimal规整成同一种写法，不带多余的0也不用科学计数法；float按repr转，0.1不会变成0.1000000000000000055"""
+    if isinstance(value, float):
+        value = repr(value)
+    elif isinstance(value, bool):
+        value = int(value)
+    number = decimal.Decimal(value)
+    if not number.is_finite():
+        return str(number)
+    if number.is_zero():
+        return '0'
+    return format(number.normalize(), 'f')
+
+
+def _match_key(value) -> str:
+    if isinstance(value, (bytes, bytearray)):
+        value = bytes(value).decode('utf-8', 'surrogateescape')
+    elif isinstance(value, (int, float, decimal.Decimal)):
+        return _number_key(value)
+    return str(value)
+
+
+def _folded_match_key(value) -> str:
+    if isinstance(value, (bytes, bytearray, str)):
+        return _match_key(value).rstrip(' ').lower()
+    return _match_key(value)
+
+
+class DataLoader:
+    def __init__(self, pool: MySQLConnectionPool, table_name: str, column: str, columns: str = '*',
+                 window_ms: float = 2, max_batch: int = 500, parallel: int = 4, many: bool = False,
+                 case_insensitive: bool = False):
+        """
+            columns: 查询的列，默认*；不是*时会自动带上column
+            many: False时每个值返回第一行或None(同exist_data_by_kw)，True时返回所有匹配的行
+            case_insensitive: column是*_ci排序规则时打开，忽略大小写和末尾空格匹配结果
+        """
+        self.pool = pool
+        self.column = column
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.many = many
+        self._key = _folded_match_key if case_insensitive else _match_key
+        if columns != '*' and column not in [c.strip() for c in columns.split(',')]:
+            columns = f'{columns}, {column}'
+        self.sql_head = "select {0} from {1} where {2} in (".format(columns, _quote_identifier(table_name),
+                                                                    _quote_identifier(column))
+        self._queue: 'queue.Queue' = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=parallel, thread_name_prefix='data-loader')
+        self._stats = collections.Counter()
+        self._stats_lock = threading.Lock()
+        self._closed = False
+        # load()和close()互斥，关闭之后不会有请求排在结束标记后面
+        self._close_lock = threading.Lock()
+        self._dispatcher = threading.Thread(target=self._dispatch, name='data-loader-dispatch', daemon=True)
+        self._dispatcher.start()
+
+    def load(self, value) -> Future:
+        future = Future()
+        with self._close_lock:
+            if self._closed:
+                raise RuntimeError('DataLoader is closed')
+            self._queue.put((value, future))
+        return future
+
+    def get(self, value, timeout: float = None):
+        return self.load(value).result(timeout)
+
+    def load_many(self, values: Iterable, timeout: float = None) -> List:
+        futures = [self.load(value) for value in values]
+        return [future.result(timeout) for future in futures]
+
+    async def aload(self, value):
+        return await asyncio.wrap_future(self.load(value))
+
+    async def aload_many(self, values: Iterable) -> List:
+        return list(await asyncio.gather(*[self.aload(value) for value in values]))
+
+    def _collect(self) -> List:
+        """等第一个请求，然后最多再等window秒或者攒满max_batch个不同的值"""
+        first = self._queue.get()
+        if first is None:
+            return [None]
+        batch = [first]
+        values = {self._key(first[0])}
+        deadline = time.monotonic() + self.window
+        while len(values) < self.max_batch:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is None:
+                batch.append(None)
+                break
+            batch.append(item)
+            values.add(self._key(item[0]))
+        return batch
+
+    def _dispatch(self):
+        while True:
+            batch = self._collect()
+            stop = batch[-1] is None
+            requests = [item for item in batch if item is not None]
+            if requests:
+                self._executor.submit(self._run_batch, requests)
+            if stop:
+                return
+
+    def _run_batch(self, requests: List):
+        # 调用方已经cancel的不查；标记成运行中之后就cancel不了，下面设置结果不会冲突
+        requests = [(value, future) for value, future in requests if future.set_running_or_notify_cancel()]
+        waiting: Dict[str, List] = collections.defaultdict(list)
+        values = []
+        try:
+            for value, future in requests:
+                key = self._key(value)
+                if key not in waiting:
+                    values.append(value)
+                waiting[key].append(future)
+            if not values:
+                return
+            rows = self.pool.fetchall(self.sql_head + ','.join(['%s'] * len(values)) + ')', values)
+            if rows and self.column not in rows[0]:
+                raise KeyError(f'column {self.column!r} is not in the result columns {list(rows[0])}')
+            matched: Dict[str, List] = collections.defaultdict(list)
+            for row in rows:
+                matched[self._key(row[self.column])].append(row)
+            for key, futures in waiting.items():
+                found = matched.get(key, [])
+                result = found if self.many else (found[0] if found else None)
+                for future in futures:
+                    future.set_result(result)
+        except BaseException as e:
+            # 不管在哪一步出错，还没有结果的调用方都拿到这个异常，不会一直等下去
+            for value, future in requests:
+                if not future.done():
+                    future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        with self._stats_lock:
+            self._stats['queries'] += 1
+            self._stats['requests'] += len(requests)
+            self._stats['values'] += len(values)
+            self._stats['max_batch'] = max(self._stats['max_batch'], len(values))
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        for name in ('queries', 'requests', 'values', 'max_batch'):
+            stats.setdefault(name, 0)
+        stats['requests_per_query'] = stats['requests'] / stats['queries'] if stats['queries'] else 0.0
+        return stats
+
+    def close(self):
+        """已经提交的请求查完再退出"""
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._dispatcher.join()
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,336 @@
+import bisect
+import collections
+import logging
+import re
+import threading
+import time
+from typing import Dict, List, Sequence
+
+import pymysql
+from pymysql.cursors import DictCursor
+
+from db.mysql_pool import MySQLConnectionPool
+
+# 带监控和后台健康检查的PooledDB
+# gen_pool默认连接数不设上限，也看不到取连接等了多久、有多少连接在用、连接创建得多频繁
+#
+# 1. 指标：取连接等待时间直方图、正在用/空闲的连接数、创建连接的总数和最近一分钟的速率、
+#    按sql指纹(字面量和占位符换成?)统计的执行耗时直方图和错误数
+# 2. 后台线程每check_interval秒：ping空闲连接，断了的关掉；空闲太久(超过max_idle_time)并且多于min_idle的关掉；
+#    空闲连接少于min_idle时预先建好。取连接时就不用再ping(gen_pool的ping=0)
+# 3. 可以直接当MySQLConnectionPool的pooled_db用：MySQLConnectionPool(..., pooled_db=InstrumentedPool(...))
+#
+# 空闲连接列表、锁、在用连接数用的是DBUtils PooledDB的内部属性(_idle_cache/_lock/_connections)
+#
+# usage:
+#   pool = InstrumentedPool('127.0.0.1', 3306, 'root', '123456', 'test', min_idle=4, max_connections=32)
+#   db = MySQLConnectionPool('127.0.0.1', 3306, 'root', '123456', 'test', pooled_db=pool)
+#   db.fetchone("select 1")
+#   pool.stats()
+
+# 毫秒
+DEFAULT_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+OTHER_FINGERPRINT = '<other>'
+
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"")
+_NUMBER_RE = re.compile(r'(?<![\w$])-?\d+(?:\.\d+)?(?:e[+-]?\d+)?\b', re.IGNORECASE)
+_PLACEHOLDER_RE = re.compile(r'%(?:\(\w+\))?s')
+_LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_SPACE_RE = re.compile(r'\s+')
+
+
+def fingerprint(sql) -> str:
+    """select * from t where id = 1 and name in ('a', 'b') -> select * from t where id = ? and name in (?+)"""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    sql = _STRING_RE.sub('?', sql)
+    sql = _PLACEHOLDER_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = _LIST_RE.sub('(?+)', sql)
+    return _SPACE_RE.sub(' ', sql).strip().lower()
+
+
+class Histogram:
+    """固定桶的直方图，单位毫秒，分位数取所在桶的上界"""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, value_ms: float):
+        self.counts[bisect.bisect_left(self.buckets, value_ms)] += 1
+        self.total += 1
+        self.sum += value_ms
+        if value_ms > self.max:
+            self.max = value_ms
+
+    def percentile(self, p: float) -> float:
+        if self.total == 0:
+            return 0.0
+        target = max(1, round(self.total * p / 100.0))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.buckets[index], self.max) if index < len(self.buckets) else self.max
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            'count': self.total,
+            'mean_ms': round(self.sum / self.total, 3) if self.total else 0.0,
+            'p50_ms': self.percentile(50),
+            'p99_ms': self.percentile(99),
+            'max_ms': round(self.max, 3),
+        }
+
+
+class PoolMetrics:
+    def __init__(self, max_fingerprints: int = 500):
+        self.max_fingerprints = max_fingerprints
+        self.lock = threading.Lock()
+        self.checkout_wait = Histogram()
+        self.queries: Dict[str, Histogram] = {}
+        self.errors: Dict[str, int] = collections.Counter()
+        self.counters = collections.Counter()
+        # 最近一分钟创建连接的时间，算创建速率
+        self.created_times = collections.deque()
+
+    def connection_created(self):
+        now = time.monotonic()
+        with self.lock:
+            self.counters['created'] += 1
+            self.created_times.append(now)
+            while self.created_times and self.created_times[0] < now - 60:
+                self.created_times.popleft()
+
+    def checkout(self, wait_ms: float):
+        with self.lock:
+            self.checkout_wait.record(wait_ms)
+
+    def query(self, sql, elapsed_ms: float, failed: bool):
+        key = fingerprint(sql)
+        with self.lock:
+            histogram = self.queries.get(key)
+            if histogram is None:
+                # 指纹太多时(比如拼了字面量以外的动态sql)合并到一起，内存不会无限增长
+                if len(self.queries) >= self.max_fingerprints:
+                    key = OTHER_FINGERPRINT
+                histogram = self.queries.setdefault(key, Histogram())
+            histogram.record(elapsed_ms)
+            if failed:
+                self.errors[key] += 1
+
+    def incr(self, name: str, count: int = 1):
+        with self.lock:
+            self.counters[name] += count
+
+
+class _CountingCreator:
+    """PooledDB的creator，建连接时计数；DBUtils通过dbapi/threadsafety属性识别驱动"""
+    dbapi = pymysql
+    threadsafety = pymysql.threadsafety
+
+    def __init__(self, metrics: PoolMetrics, connect=pymysql.connect):
+        self.metrics = metrics
+        self.connect_func = connect
+
+    def __call__(self, *args, **kwargs):
+        connection = self.connect_func(*args, **kwargs)
+        self.metrics.connection_created()
+        return connection
+
+
+class InstrumentedCursor:
+    def __init__(self, cursor, metrics: PoolMetrics):
+        self._cursor = cursor
+        self._metrics = metrics
+
+    def _timed(self, method, sql, *args):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = method(sql, *args)
+            failed = False
+            return result
+        finally:
+            self._metrics.query(sql, (time.perf_counter() - start) * 1000, failed)
+
+    def execute(self, sql, args=None):
+        return self._timed(self._cursor.execute, sql, args)
+
+    def executemany(self, sql, args):
+        return self._timed(self._cursor.executemany, sql, args)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    """PooledDB取出的连接，游标的执行时间按指纹统计，close()时记下最后使用时间"""
+
+    def __init__(self, connection, metrics: PoolMetrics):
+        self._connection = connection
+        self._metrics = metrics
+
+    @property
+    def _con(self):
+        # MySQLConnectionPool按这个拿底层的SteadyDBConnection做ping检查
+        return self._connection._con
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._connection.cursor(*args, **kwargs), self._metrics)
+
+    def close(self):
+        if self._connection is None:
+            return
+        self._connection._con.last_used = time.monotonic()
+        self._connection.close()
+        self._connection = None
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+
+class InstrumentedPool:
+    def __init__(self, host: str, port: int, user: str, passwd: str, db: str, min_idle: int = 0,
+                 max_connections: int = 0, max_idle: int = 0, check_interval: float = 30,
+                 max_idle_time: float = 600, charset: str = 'utf8', cursorclass=DictCursor,
+                 local_infile: bool = False, connect=pymysql.connect):
+        """
+            min_idle: 后台线程保持的最少空闲连接数
+            max_connections: 同时取出(在用)的连接上限，达到后取连接会阻塞等待，0表示不限制
+            max_idle: 空闲连接上限，超过的连接还回来时直接关闭，0表示不限制
+            connect: 建连接的函数，默认pymysql.connect
+        """
+        if max_connections and min_idle > max_connections:
+            raise ValueError('min_idle must not exceed max_connections')
+        # max_idle就是maxcached，超过的空闲连接还回来时会被关掉，预热永远补不满min_idle
+        if max_idle and min_idle > max_idle:
+            raise ValueError('min_idle must not exceed max_idle')
+        self.min_idle = min_idle
+        self.max_connections = max_connections
+        self.check_interval = check_interval
+        self.max_idle_time = max_idle_time
+        self.metrics = PoolMetrics()
+        self.pool = MySQLConnectionPool.gen_pool(host, port, user, passwd, db, charset=charset,
+                                                 cursorclass=cursorclass, local_infile=local_infile, ping=0,
+                                                 creator=_CountingCreator(self.metrics, connect),
+                                                 maxcached=max_idle, maxconnections=max_connections)
+        self._stopped = threading.Event()
+        self._health = threading.Thread(target=self._health_loop, name='mysql-pool-health', daemon=True)
+        self._health.start()
+
+    def connection(self) -> InstrumentedConnection:
+        start = time.perf_counter()
+        connection = self.pool.connection()
+        self.metrics.checkout((time.perf_counter() - start) * 1000)
+        return InstrumentedConnection(connection, self.metrics)
+
+    # 后台检查
+    def _health_loop(self):
+        while not self._stopped.is_set():
+            try:
+                self.check_idle()
+                self.prewarm()
+            except Exception as e:
+                logging.warning(f'MySQL pool health check failed: {str(e)}')
+            self._stopped.wait(self.check_interval)
+
+    def check_idle(self):
+        """
+            取出空闲超过check_interval(最后一次使用或者检查之后)的连接逐个ping，活着的放回去，
+            其他空闲连接留在池里照常被取走
+        """
+        now = time.monotonic()
+        with self.pool._lock:
+            check, keep = [], []
+            for steady in self.pool._idle_cache:
+                last_alive = max(getattr(steady, 'last_used', 0), getattr(steady, 'last_checked', 0))
+                (check if now - last_alive >= self.check_interval else keep).append(steady)
+            self.pool._idle_cache[:] = keep
+        alive = []
+        for steady in check:
+            idle_time = now - getattr(steady, 'last_used', now)
+            if idle_time > self.max_idle_time and len(keep) + len(alive) >= self.min_idle:
+                self._close_steady(steady)
+                self.metrics.incr('closed_idle')
+                continue
+            try:
+                steady._con.ping(reconnect=False)
+                self.metrics.incr('pings')
+                # 只记检查时间，不改last_used，不影响max_idle_time
+                steady.last_checked = time.monotonic()
+                alive.append(steady)
+            except Exception:
+                self._close_steady(steady)
+                self.metrics.incr('closed_dead')
+        self._put_idle(alive)
+
+    def prewarm(self):
+        while not self._stopped.is_set():
+            with self.pool._lock:
+                if len(self.pool._idle_cache) >= self.min_idle:
+                    return
+            # 建连接不持有锁
+            steady = self.pool.steady_connection()
+            steady.last_used = time.monotonic()
+            self.metrics.incr('prewarmed')
+            self._put_idle([steady])
+
+    def _put_idle(self, connections: List):
+        if not connections:
+            return
+        with self.pool._lock:
+            self.pool._idle_cache.extend(connections)
+            self.pool._lock.notify_all()
+
+    @staticmethod
+    def _close_steady(steady):
+        try:
+            steady._close()
+        except Exception:
+            pass
+
+    def stats(self) -> dict:
+        with self.pool._lock:
+            active = self.pool._connections
+            idle = len(self.pool._idle_cache)
+        now = time.monotonic()
+        with self.metrics.lock:
+            created_last_min = sum(1 for t in self.metrics.created_times if t >= now - 60)
+            stats = {
+                'active': active,
+                'idle': idle,
+                'created': self.metrics.counters['created'],
+                'created_per_min': created_last_min,
+                'checkout_wait': self.metrics.checkout_wait.summary(),
+                'queries': {sql: dict(h.summary(), errors=self.metrics.errors.get(sql, 0))
+                            for sql, h in self.metrics.queries.items()},
+            }
+            for name in ('pings', 'closed_dead', 'closed_idle', 'prewarmed'):
+                stats[name] = self.metrics.counters[name]
+        return stats
+
+    def report(self, top: int = 10):
+        stats = self.stats()
+        wait = stats['checkout_wait']
+        logging.info(f"MySQL pool active={stats['active']} idle={stats['idle']} created={stats['created']} "
+                     f"created/min={stats['created_per_min']} checkout wait p50={wait['p50_ms']}ms "
+                     f"p99={wait['p99_ms']}ms max={wait['max_ms']}ms dead={stats['closed_dead']}")
+        slowest = sorted(stats['queries'].items(), key=lambda item: item[1]['mean_ms'] * item[1]['count'],
+                         reverse=True)[:top]
+        for sql, summary in slowest:
+            logging.info(f"  count={summary['count']} mean={summary['mean_ms']}ms p99={summary['p99_ms']}ms "
+                         f"errors={summary['errors']} {sql[:200]}")
+
+    def close(self):
+        self._stopped.set()
+        self._health.join(timeout=self.check_interval + 5)
+        self.pool.close()
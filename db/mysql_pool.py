@@ -1,10 +1,52 @@
 import datetime
+import itertools
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from typing import Iterable, Iterator, List, Mapping, Sequence
 
 # reference https://github.com/MaiXiaochai/MySQLUtils/blob/master/mysql_pool.py
 import pymysql
 from dbutils.pooled_db import PooledDB
-from pymysql.cursors import DictCursor
+from pymysql.cursors import DictCursor, SSCursor, SSDictCursor
+
+from db.query_cache import QueryCache
+
+
+# LOAD DATA的字段格式：tab分隔，换行分行，反斜杠转义，NULL写成\\N
+_TSV_ESCAPES = {ord('\\'): '\\\\', ord('\t'): '\\t', ord('\n'): '\\n', ord('\r'): '\\r', 0: '\\0'}
+
+
+def _quote_identifier(name: str) -> str:
+    """库名、表名、列名加反引号，db.table分开加"""
+    return '.'.join('`' + part.replace('`', '``') + '`' for part in name.split('.'))
+
+
+def _row_values(row, columns: Sequence[str]) -> Sequence:
+    return [row[c] for c in columns] if isinstance(row, Mapping) else row
+
+
+def _rollback(_conn):
+    """回滚失败(比如连接已经断了)只记日志，调用方接着抛原来的异常"""
+    try:
+        _conn.rollback()
+    except Exception as e:
+        logging.warning(f'MySQL rollback failed: {str(e)}')
+
+
+def _tsv_field(value) -> str:
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, (bytes, bytearray)):
+        value = bytes(value).decode('utf-8', 'surrogateescape')
+    return str(value).translate(_TSV_ESCAPES)
 
 
 class MySQLConnectionPool:
@@ -15,23 +57,37 @@ class MySQLConnectionPool:
                  port: int,
                  user: str,
                  passwd: str,
-                 db: str):
+                 db: str,
+                 local_infile: bool = False,
+                 query_cache: QueryCache = None,
+                 ping_interval: float = 30,
+                 pooled_db=None):
 
         # utf8mb4 是utf8的超集
-        self.__pool = self.gen_pool(host, port, user, passwd, db)  # 返回类字典类型游标
+        # pooled_db: 外部创建的连接池(比如InstrumentedPool)，不传时用gen_pool创建
+        # 外部传入的池可能被多个实例共用，close/__del__只关自己创建的池
+        self.__owns_pool = pooled_db is None
+        self.__pool = self.gen_pool(host, port, user, passwd, db, local_infile=local_infile) if pooled_db is None \
+            else pooled_db  # 返回类字典类型游标
+        # 连接空闲超过这么多秒，取出来时先ping一次；不再每次取连接都ping
+        self.ping_interval = ping_interval
+        self.__max_allowed_packet = None
+        # fetchone/fetchall传了cache_ttl时用，写操作按表名失效
+        self.query_cache = query_cache
 
     @staticmethod
-    def gen_pool(host, port, user, passwd, db, charset='utf8', cursorclass=DictCursor):
+    def gen_pool(host, port, user, passwd, db, charset='utf8', cursorclass=DictCursor, local_infile=False,
+                 autocommit=True, reset=False, ping=0, creator=pymysql, maxcached=0, maxconnections=0):
         pool = PooledDB(
-            creator=pymysql,  # 使用链接数据库的模块
+            creator=creator,  # 使用链接数据库的模块
             mincached=0,  # 初始化连接池时创建的连接数。默认为0，即初始化时不创建连接(建议默认0，假如非0的话，在某些数据库不可用时，整个项目会启动不了)
-            maxcached=0,  # 池中空闲连接的最大数量。默认为0，即无最大数量限制(建议默认)
+            maxcached=maxcached,  # 池中空闲连接的最大数量。默认为0，即无最大数量限制(建议默认)
             maxshared=0,  # 池中共享连接的最大数量。默认为0，即每个连接都是专用的，不可共享(不常用，建议默认)
-            maxconnections=0,  # 被允许的最大连接数。默认为0，无最大数量限制
+            maxconnections=maxconnections,  # 被允许的最大连接数。默认为0，无最大数量限制
             blocking=True,  # 连接数达到最大时，新连接是否可阻塞。默认False，即达到最大连接数时，再取新连接将会报错。(建议True，达到最大连接数时，新连接阻塞，等待连接数减少再连接)
             maxusage=0,  # 连接的最大使用次数。默认0，即无使用次数限制。(建议默认)
-            reset=True,  # 当连接返回到池中时，重置连接的方式。默认True，总是执行回滚
-            ping=1,  # 确定何时使用ping()检查连接。默认1，即当连接被取走，做一次ping操作。0是从不ping，1是默认，2是当该连接创建游标时ping，4是执行sql语句时ping，7是总是ping
+            reset=reset,  # 当连接返回到池中时，重置连接的方式。True总是执行回滚；False只有begin()开始的事务没结束时才回滚(连接是autocommit的，读不需要回滚)
+            ping=ping,  # 确定何时使用ping()检查连接。1是当连接被取走，做一次ping操作。0是从不ping，2是当该连接创建游标时ping，4是执行sql语句时ping，7是总是ping。默认0，按ping_interval检查
             host=host,
             port=port,
             user=user,
@@ -39,50 +95,341 @@ class MySQLConnectionPool:
             db=db,
             charset=charset,
             cursorclass=cursorclass,
-            use_unicode=True
+            use_unicode=True,
+            autocommit=autocommit,  # 读不用commit；写事务用transaction()，显式begin/commit
+            local_infile=local_infile  # load_data需要，服务端也要打开local_infile
         )
         return pool
 
-    @property
-    # todo 抽空看下装饰器的实现
+    def _checkout(self):
+        """从池里取连接，空闲超过ping_interval的先ping，断了pymysql会重连"""
+        _conn = self.__pool.connection()
+        # _conn._con是DBUtils的SteadyDBConnection，再往下一层是pymysql的连接
+        steady = _conn._con
+        last_used = getattr(steady, 'last_used', None)
+        # InstrumentedPool后台ping过的连接记了last_checked，也算最近确认过是活的
+        if last_used is not None and \
+                time.monotonic() - max(last_used, getattr(steady, 'last_checked', 0)) > self.ping_interval:
+            try:
+                steady._con.ping(reconnect=True)
+            except Exception:
+                _conn.close()
+                raise
+        return _conn
+
+    def _release(self, _conn):
+        _conn._con.last_used = time.monotonic()
+        _conn.close()
+
     @contextmanager
-    def pool(self):
-        _conn = None
-        _cursor = None
+    def read(self, cursorclass=None):
+        """
+            只读：连接是autocommit的，不begin也不commit/rollback，一次查询只有一次往返
+            with pool.read() as cursor:
+        """
+        _conn = self._checkout()
+        try:
+            _cursor = _conn.cursor(cursorclass) if cursorclass else _conn.cursor()
+            try:
+                yield _cursor
+            finally:
+                _cursor.close()
+        finally:
+            self._release(_conn)
+
+    @contextmanager
+    def transaction(self):
+        """
+            事务：begin，正常结束commit，抛异常rollback
+            with pool.transaction() as cursor:
+        """
+        _conn = self._checkout()
         try:
-            _conn = self.__pool.connection()
             _cursor = _conn.cursor()
-            yield _cursor
+            try:
+                _conn.begin()
+                yield _cursor
+                _conn.commit()
+            except BaseException:
+                _rollback(_conn)
+                raise
+            finally:
+                _cursor.close()
         finally:
-            _conn.commit()
-            _cursor.close()
-            _conn.close()
+            self._release(_conn)
+
+    @property
+    # todo 抽空看下装饰器的实现
+    def pool(self):
+        """同transaction()，以前出错也会commit"""
+        return self.transaction()
 
     def execute(self, sql, args=None):
-        with self.pool as cursor:
-            cursor.execute(sql, args)
+        try:
+            with self.read() as cursor:
+                # get_autocommit()看的是本地记下的服务端状态，不用往返
+                if cursor.connection.get_autocommit():
+                    # 单条语句在autocommit下自己就是一个事务，不需要begin/commit
+                    cursor.execute(sql, args)
+                    return
+            # 连接不是autocommit的(gen_pool(autocommit=False)或者外部传入的pooled_db)，不提交的话归还时会被回滚
+            with self.transaction() as cursor:
+                cursor.execute(sql, args)
+        finally:
+            self._invalidate(sql=sql)
 
     def executemany(self, sql, args):
-        with self.pool as cursor:
-            cursor.executemany(sql, args)
+        try:
+            with self.transaction() as cursor:
+                cursor.executemany(sql, args)
+        finally:
+            self._invalidate(sql=sql)
 
-    def fetchall(self, sql, args=None):
-        with self.pool as cursor:
-            cursor.execute(sql, args)
-            return cursor.fetchall()
+    def _invalidate(self, sql: str = None, table_name: str = None):
+        # 执行失败也可能已经写了一部分(比如自动提交的DDL)，不管成功与否都失效
+        if self.query_cache is None:
+            return
+        if table_name is not None:
+            self.query_cache.invalidate_tables([table_name])
+        else:
+            self.query_cache.invalidate_sql(sql)
 
-    def fetchone(self, sql, args=None):
-        with self.pool as cursor:
+    def _fetch(self, method: str, sql, args):
+        with self.read() as cursor:
             cursor.execute(sql, args)
-            return cursor.fetchone()
+            return getattr(cursor, method)()
+
+    def _cached_fetch(self, method: str, sql, args, cache_ttl: float):
+        if self.query_cache is None or not cache_ttl:
+            return self._fetch(method, sql, args)
+        return self.query_cache.get_or_load(method, sql, args, lambda: self._fetch(method, sql, args), cache_ttl)
+
+    def fetchall(self, sql, args=None, cache_ttl: float = None):
+        """cache_ttl: 创建时传了query_cache才有效，结果缓存多少秒"""
+        return self._cached_fetch('fetchall', sql, args, cache_ttl)
+
+    def fetchone(self, sql, args=None, cache_ttl: float = None):
+        return self._cached_fetch('fetchone', sql, args, cache_ttl)
+
+    def iter_chunks(self, sql, args=None, chunk_size: int = 1000, dict_rows: bool = True,
+                    net_write_timeout: int = None) -> Iterator[List]:
+        """
+            流式读取大结果集，每次返回chunk_size行，内存占用和结果集大小无关
+            用的是不缓冲的服务端游标(SSDictCursor/SSCursor)，行从socket上边读边返回；
+            连接在生成器结束或者被close()之前一直占用，期间这个连接上不能执行其他sql
+            提前退出时关闭游标会把剩下的行从网络上读完丢掉，服务端才能接着用这个连接
+            消费慢时服务端发送会超时(net_write_timeout，默认60秒)，可以调大，结束后恢复成全局值
+        """
+        _conn = self._checkout()
+        _cursor = None
+        try:
+            _cursor = _conn.cursor(SSDictCursor if dict_rows else SSCursor)
+            if net_write_timeout:
+                _cursor.execute("SET SESSION net_write_timeout = %s", (net_write_timeout,))
+            _cursor.execute(sql, args)
+            while True:
+                rows = _cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            try:
+                if _cursor is not None:
+                    _cursor.close()
+                    if net_write_timeout:
+                        _cursor = _conn.cursor()
+                        _cursor.execute("SET SESSION net_write_timeout = @@GLOBAL.net_write_timeout")
+                        _cursor.close()
+            finally:
+                self._release(_conn)
+
+    def iter_rows(self, sql, args=None, chunk_size: int = 1000, dict_rows: bool = True,
+                  net_write_timeout: int = None) -> Iterator:
+        """
+            流式读取大结果集，逐行返回，见iter_chunks
+            for row in pool.iter_rows("select * from user where create_time > %s", (day,)):
+        """
+        chunks = self.iter_chunks(sql, args, chunk_size, dict_rows, net_write_timeout)
+        try:
+            for rows in chunks:
+                yield from rows
+        finally:
+            chunks.close()
+
+    def max_allowed_packet(self) -> int:
+        if self.__max_allowed_packet is None:
+            self.__max_allowed_packet = int(self.fetchone("SELECT @@max_allowed_packet packet").get('packet'))
+        return self.__max_allowed_packet
+
+    def _insert_chunk(self, head: str, tail: str, placeholder: str, rows: List, columns: Sequence[str],
+                      max_bytes: int) -> int:
+        """一批行拼成若干条多行INSERT，每条不超过max_bytes，整批执行完提交一次"""
+        _conn = self._checkout()
+        _cursor = None
+        try:
+            _cursor = _conn.cursor()
+            _conn.begin()
+            encoding = _cursor.connection.encoding
+            head_bytes, tail_bytes = head.encode(encoding), tail.encode(encoding)
+            values, size = [], len(head_bytes) + len(tail_bytes)
+            for row in rows:
+                value = _cursor.mogrify(placeholder, _row_values(row, columns)).encode(encoding, 'surrogateescape')
+                # 逗号占1字节
+                if values and size + len(value) + 1 > max_bytes:
+                    _cursor.execute(head_bytes + b','.join(values) + tail_bytes)
+                    values, size = [], len(head_bytes) + len(tail_bytes)
+                values.append(value)
+                size += len(value) + 1
+            if values:
+                _cursor.execute(head_bytes + b','.join(values) + tail_bytes)
+            _conn.commit()
+            return len(rows)
+        except Exception:
+            _rollback(_conn)
+            raise
+        finally:
+            if _cursor is not None:
+                _cursor.close()
+            self._release(_conn)
+
+    def _bulk(self, head: str, tail: str, columns: Sequence[str], rows: Iterable, commit_rows: int, parallel: int,
+              max_statement_bytes: int) -> int:
+        placeholder = '(' + ','.join(['%s'] * len(columns)) + ')'
+        # 留出协议头的余量
+        max_bytes = min(max_statement_bytes, self.max_allowed_packet() - 1024)
+        rows = iter(rows)
+        chunks = iter(lambda: list(itertools.islice(rows, commit_rows)), [])
+        if parallel <= 1:
+            return sum(self._insert_chunk(head, tail, placeholder, chunk, columns, max_bytes) for chunk in chunks)
+        # 每个chunk用自己的连接、单独提交；排队的chunk不超过2*parallel个，内存占用是固定的
+        inflight = threading.BoundedSemaphore(parallel * 2)
+        failed = threading.Event()
+        futures = []
+
+        def done(future):
+            inflight.release()
+            if future.exception() is not None:
+                failed.set()
+
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            for chunk in chunks:
+                inflight.acquire()
+                # 有chunk失败就不再提交新的
+                if failed.is_set():
+                    inflight.release()
+                    break
+                future = executor.submit(self._insert_chunk, head, tail, placeholder, chunk, columns, max_bytes)
+                future.add_done_callback(done)
+                futures.append(future)
+        return sum(future.result() for future in futures)
+
+    def bulk_insert(self, table_name: str, columns: Sequence[str], rows: Iterable, commit_rows: int = 10000,
+                    parallel: int = 1, ignore: bool = False, max_statement_bytes: int = 4 * 1024 * 1024) -> int:
+        """
+            大批量写入：rows可以是生成器，每行是按columns顺序的序列或者dict，返回写入的行数
+            拼成多行INSERT INTO t (...) VALUES (...),(...)，单条语句不超过max_allowed_packet和max_statement_bytes
+            (太大的语句会让从库回放、锁持有时间变长)，每commit_rows行提交一次
+            parallel > 1时多个连接并发写入不同的chunk，每个chunk单独提交，失败时已提交的chunk不会回滚
+        """
+        head = "INSERT {0}INTO {1} ({2}) VALUES ".format('IGNORE ' if ignore else '', _quote_identifier(table_name),
+                                                        ','.join(_quote_identifier(c) for c in columns))
+        try:
+            return self._bulk(head, '', columns, rows, commit_rows, parallel, max_statement_bytes)
+        finally:
+            self._invalidate(table_name=table_name)
+
+    def bulk_upsert(self, table_name: str, columns: Sequence[str], rows: Iterable, update_columns: Sequence[str] = None,
+                    commit_rows: int = 10000, parallel: int = 1, max_statement_bytes: int = 4 * 1024 * 1024) -> int:
+        """
+            同bulk_insert，主键或唯一键冲突时更新update_columns(默认是全部columns)
+            用VALUES(col)引用新值，8.0.20之后会有deprecation warning，但5.7也能用
+        """
+        head = "INSERT INTO {0} ({1}) VALUES ".format(_quote_identifier(table_name),
+                                                      ','.join(_quote_identifier(c) for c in columns))
+        tail = " ON DUPLICATE KEY UPDATE " + ','.join('{0}=VALUES({0})'.format(_quote_identifier(c))
+                                                      for c in (update_columns or columns))
+        try:
+            return self._bulk(head, tail, columns, rows, commit_rows, parallel, max_statement_bytes)
+        finally:
+            self._invalidate(table_name=table_name)
+
+    def load_data(self, table_name: str, columns: Sequence[str], rows: Iterable, replace: bool = False) -> int:
+        """
+            LOAD DATA LOCAL INFILE导入，比多行INSERT快，需要连接池用local_infile=True创建、服务端打开local_infile
+            rows在后台线程里编码成tsv写进一个命名管道，pymysql从管道里读了发给服务端，不落盘也不占内存
+            重复键默认忽略(LOCAL的默认行为)，replace=True时覆盖；整个导入是一个事务，返回影响的行数
+        """
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'rows.tsv')
+        os.mkfifo(path)
+        errors = []
+        stop = threading.Event()
+
+        def write_rows():
+            try:
+                with open(path, 'w', encoding='utf-8', errors='surrogateescape', newline='') as f:
+                    for row in rows:
+                        if stop.is_set():
+                            break
+                        f.write('\t'.join(_tsv_field(v) for v in _row_values(row, columns)) + '\n')
+            except BrokenPipeError:
+                # 读端提前关闭，错误在读端报
+                pass
+            except Exception as e:
+                errors.append(e)
+
+        writer = threading.Thread(target=write_rows, daemon=True)
+        writer.start()
+        sql = ("LOAD DATA LOCAL INFILE %s {0} INTO TABLE {1} CHARACTER SET utf8mb4 "
+               "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' ({2})").format(
+            'REPLACE' if replace else 'IGNORE', _quote_identifier(table_name),
+            ','.join(_quote_identifier(c) for c in columns))
+        _conn = _cursor = None
+        try:
+            _conn = self._checkout()
+            _cursor = _conn.cursor()
+            _conn.begin()
+            affected = _cursor.execute(sql, (path,))
+            writer.join()
+            if errors:
+                # 写到一半出错时服务端收到的是不完整的数据
+                raise errors[0]
+            _conn.commit()
+            return affected
+        except Exception:
+            if _conn is not None:
+                _rollback(_conn)
+            raise
+        finally:
+            # 服务端没有读完管道(比如没有打开local_infile)时，写线程阻塞在打开或者写管道上：
+            # 通知它停下，打开读端把已经写进去的数据读掉，直到它退出
+            if writer.is_alive():
+                stop.set()
+                fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+                try:
+                    while writer.is_alive():
+                        try:
+                            os.read(fd, 65536)
+                        except BlockingIOError:
+                            pass
+                        writer.join(0.01)
+                finally:
+                    os.close(fd)
+            if _cursor is not None:
+                _cursor.close()
+            if _conn is not None:
+                self._release(_conn)
+            shutil.rmtree(directory)
+            # 中途失败时可能已经写进去一部分行，和execute一样不管成功与否都失效
+            self._invalidate(table_name=table_name)
 
-    def has_table(self, table_name: str) -> bool:
+    def has_table(self, table_name: str, cache_ttl: float = None) -> bool:
         """
             该用户下是否存在表table_name
         """
         sql = "SELECT count(*) total FROM information_schema.TABLES WHERE table_name =%(table_name)s"
         arg = {'table_name': table_name}
-        return self.fetchone(sql, arg).get('total') == 1
+        return self.fetchone(sql, arg, cache_ttl).get('total') == 1
 
     def exist_data_by_kw(self, table_name: str, data: dict):
         """表table_name中是否存在where key = value的数据"""
@@ -95,10 +442,13 @@ class MySQLConnectionPool:
         return f_data
 
     def close(self):
-        self.__pool.close()
+        if self.__owns_pool:
+            self.__pool.close()
 
     def __del__(self):
-        self.close()
+        # gen_pool抛异常时__init__没走完，没有池可关
+        if getattr(self, '_MySQLConnectionPool__pool', None) is not None:
+            self.close()
 
 if __name__ == '__main__':
     # 补齐参数
@@ -107,7 +457,7 @@ if __name__ == '__main__':
     version = 1
     sql = f"select update_time from redis_cluster where name = '{cluster_name}' and version = {version}  limit 1"
     print(sql)
-    results = pool.fetchall(sql)
+    results = pool.fetchall(sql, cache_ttl=60)
     row = results[0]
     if row['update_time'] + datetime.timedelta(days=1) < datetime.datetime.now():
         print(row['update_time'])
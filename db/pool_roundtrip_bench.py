@@ -0,0 +1,93 @@
+import argparse
+import threading
+import time
+
+import pymysql
+
+from db.mysql_pool import MySQLConnectionPool
+
+# 统计一次fetchone实际发了几次请求(往返)：
+#   legacy: 以前的配置，取连接时ping、用完commit、还回池里rollback(reset=True)
+#   read:   autocommit连接 + read()，只有查询本身，空闲超过ping_interval才ping
+#   txn:    transaction()，begin + 查询 + commit
+# 往返次数在客户端统计：pymysql每发一个命令(COM_QUERY/COM_PING)走一次_execute_command
+# usage: python3 -m db.pool_roundtrip_bench --host 127.0.0.1 --user root --passwd 123456 --db test -n 2000
+
+_counter = {'commands': 0}
+_lock = threading.Lock()
+
+
+class CountingConnection(pymysql.connections.Connection):
+    def _execute_command(self, command, sql):
+        with _lock:
+            _counter['commands'] += 1
+        return super()._execute_command(command, sql)
+
+
+def counting_connect(*args, **kwargs):
+    return CountingConnection(*args, **kwargs)
+
+
+# DBUtils按这两个属性判断驱动
+counting_connect.dbapi = pymysql
+counting_connect.threadsafety = pymysql.threadsafety
+
+
+class CountingPool(MySQLConnectionPool):
+    @staticmethod
+    def gen_pool(*args, **kwargs):
+        return MySQLConnectionPool.gen_pool(*args, creator=counting_connect, **kwargs)
+
+
+def legacy_fetchone(raw_pool, sql):
+    # 和改动之前的MySQLConnectionPool.pool + fetchone一样
+    _conn = raw_pool.connection()
+    _cursor = _conn.cursor()
+    try:
+        _cursor.execute(sql)
+        return _cursor.fetchone()
+    finally:
+        _conn.commit()
+        _cursor.close()
+        _conn.close()
+
+
+def transaction_fetchone(pool, sql):
+    with pool.transaction() as cursor:
+        cursor.execute(sql)
+        return cursor.fetchone()
+
+
+def measure(name: str, call, n: int):
+    call()  # 建连接不算
+    with _lock:
+        before = _counter['commands']
+    start = time.perf_counter()
+    for _ in range(n):
+        call()
+    duration = time.perf_counter() - start
+    with _lock:
+        commands = _counter['commands'] - before
+    print(f"{name:<10}{n:>8}{commands / n:>14.2f}{duration / n * 1e6:>12.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='measure round trips per fetchone for the legacy and read paths')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3306)
+    parser.add_argument('--user', type=str, default='root')
+    parser.add_argument('--passwd', type=str, default='')
+    parser.add_argument('--db', type=str, default='test')
+    parser.add_argument('-n', type=int, default=2000, help='fetchone calls per mode')
+    args = parser.parse_args()
+
+    sql = "select 1 one"
+    cfg = dict(host=args.host, port=args.port, user=args.user, passwd=args.passwd, db=args.db)
+    legacy = CountingPool.gen_pool(**cfg, autocommit=False, reset=True, ping=1)
+    pool = CountingPool(**cfg)
+    print(f"{'mode':<10}{'calls':>8}{'round trips':>14}{'us/call':>12}")
+    measure('legacy', lambda: legacy_fetchone(legacy, sql), args.n)
+    measure('read', lambda: pool.fetchone(sql), args.n)
+    measure('txn', lambda: transaction_fetchone(pool, sql), args.n)
+    legacy.close()
+    pool.close()
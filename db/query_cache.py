@@ -0,0 +1,212 @@
+import collections
+import re
+import threading
+import time
+from typing import Callable, Dict, FrozenSet, Hashable, Optional, Tuple
+
+# 查询结果缓存，给MySQLConnectionPool的fetchone/fetchall用
+# has_table、按名字查配置这类元数据查询反复执行同样的sql和参数，结果很少变化
+#
+# 1. key是规整过空白的sql加参数，LRU淘汰，每个缓存项有自己的ttl
+# 2. sql里FROM/JOIN后面的表名记在缓存项上，通过同一个pool执行的写语句(execute/executemany/bulk_*)
+#    按表名删掉相关的缓存项；DDL还会删掉查information_schema的缓存项(比如has_table)
+#    别的进程、或者用pool上下文直接拿游标写的数据感知不到，只能等ttl过期
+# 3. 每张表有一个版本号，写的时候加一；读之前记下版本号，读完版本号变了说明期间有写，结果不放进缓存
+# 4. 解析不出表名(或者没能解析全)的读不缓存，这样的写清空整个缓存；参数不能hash的读也不缓存
+#
+# usage:
+#   pool = MySQLConnectionPool(**cfg, query_cache=QueryCache(max_entries=1000))
+#   pool.fetchone("select update_time from redis_cluster where name = %s", (name,), cache_ttl=60)
+#   pool.query_cache.stats()
+
+# information_schema里的表统一记成这个名字，DDL时失效
+SCHEMA_TABLE = 'information_schema'
+
+# 字符串、标识符、括号和逗号，字符串先去掉，里面的关键字不当真
+_STRING_RE = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"", re.DOTALL)
+_TOKEN_RE = re.compile(r'(?:`[^`]*`|[\w$]+)(?:\s*\.\s*(?:`[^`]*`|[\w$]+))*|[(),;]')
+# 后面跟表名的关键字；FROM/UPDATE/TABLE后面是逗号分隔的表列表，每项可以带别名
+_TABLE_KEYWORDS = {'from', 'join', 'straight_join', 'into', 'update', 'table', 'truncate', 'to'}
+_LIST_KEYWORDS = {'from', 'update', 'table'}
+# 表列表到这些关键字为止
+_END_KEYWORDS = {'where', 'group', 'order', 'limit', 'having', 'union', 'window', 'for', 'lock', 'set',
+                 'values', 'value', 'select', 'procedure', 'like', 'add', 'modify', 'change', 'drop'}
+# 表名前面可以出现的修饰词，跳过
+_TABLE_MODIFIERS = {'table', 'only', 'if', 'not', 'exists', 'low_priority', 'ignore'}
+# 出现在表名位置上但不是表名，遇到了就当解析不出来
+_NOT_TABLES = {'select', 'lateral', 'json_table', 'with'}
+_DDL_RE = re.compile(r'^\s*(?:create|drop|alter|rename|truncate)\b', re.IGNORECASE)
+_LOCKING_READ_RE = re.compile(r'\bfor\s+update\b|\block\s+in\s+share\s+mode\b|\bfor\s+share\b', re.IGNORECASE)
+_SPACE_RE = re.compile(r'\s+')
+
+
+def normalize_sql(sql: str) -> str:
+    return _SPACE_RE.sub(' ', sql).strip().rstrip(';').rstrip()
+
+
+def sql_tables(sql: str) -> FrozenSet[str]:
+    """
+        sql里引用的表名，小写，去掉库名；information_schema的表记成SCHEMA_TABLE
+        有表名没能完整解析出来的时候返回空集合，读不缓存、写清空整个缓存，不会漏掉依赖
+    """
+    tables = set()
+    depth = 0
+    # 正在解析表列表的括号层数，子查询里的FROM结束后外层的列表继续
+    list_depths = []
+    expect_table = False
+    for token in _TOKEN_RE.findall(_STRING_RE.sub("''", sql)):
+        word = token.lower()
+        if token == '(':
+            # 表名位置上是括号：派生表，里面的FROM会单独解析
+            expect_table = False
+            depth += 1
+        elif token == ')':
+            if expect_table:
+                return frozenset()
+            depth -= 1
+            while list_depths and list_depths[-1] > depth:
+                list_depths.pop()
+        elif token in (',', ';'):
+            if expect_table:
+                return frozenset()
+            if token == ',' and list_depths and list_depths[-1] == depth:
+                expect_table = True
+            elif token == ';':
+                list_depths.clear()
+        elif expect_table:
+            if word in _TABLE_MODIFIERS:
+                continue
+            if word in _NOT_TABLES:
+                return frozenset()
+            expect_table = False
+            parts = [part.strip().strip('`') for part in word.split('.')]
+            if parts[0] == SCHEMA_TABLE:
+                tables.add(SCHEMA_TABLE)
+            elif parts[-1] != 'dual':
+                tables.add(parts[-1])
+        elif word in _TABLE_KEYWORDS:
+            expect_table = True
+            if word in _LIST_KEYWORDS and not (list_depths and list_depths[-1] == depth):
+                list_depths.append(depth)
+        elif word in _END_KEYWORDS and list_depths and list_depths[-1] == depth:
+            list_depths.pop()
+    if expect_table:
+        return frozenset()
+    return frozenset(tables)
+
+
+def _freeze(args) -> Hashable:
+    """参数转成可以做key的形式，转不了的(比如bytearray)调用方hash时会抛TypeError"""
+    if isinstance(args, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in args.items()))
+    if isinstance(args, (list, tuple)):
+        return tuple(_freeze(v) for v in args)
+    if isinstance(args, (set, frozenset)):
+        return frozenset(_freeze(v) for v in args)
+    return args
+
+
+def _copy_result(result):
+    # DictCursor的行是dict，调用方改了会改到缓存里，复制一层
+    if isinstance(result, dict):
+        return dict(result)
+    if isinstance(result, (list, tuple)):
+        return [dict(row) if isinstance(row, dict) else row for row in result]
+    return result
+
+
+class QueryCache:
+    def __init__(self, max_entries: int = 1000, default_ttl: float = 60):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        # (类型, sql, 参数) -> (结果, 过期时间, 表名)
+        self._entries: 'collections.OrderedDict[tuple, Tuple[object, float, FrozenSet[str]]]' = \
+            collections.OrderedDict()
+        self._versions: Dict[str, int] = collections.defaultdict(int)
+        # 整个缓存清空的次数，解析不出表名的写会清空缓存
+        self._epoch = 0
+        self._lock = threading.Lock()
+        self._counters = collections.Counter()
+
+    def get_or_load(self, kind: str, sql: str, args, loader: Callable, ttl: Optional[float] = None):
+        """
+            kind区分fetchone/fetchall，同样的sql两种结果不一样
+            命中时返回缓存结果的副本，否则执行loader并在期间没有写的情况下放进缓存
+        """
+        tables = sql_tables(sql)
+        if not tables or _LOCKING_READ_RE.search(sql):
+            self._count('uncacheable')
+            return loader()
+        key = (kind, normalize_sql(sql), _freeze(args))
+        try:
+            hash(key)
+        except TypeError:
+            self._count('uncacheable')
+            return loader()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(key)
+                self._counters['hits'] += 1
+                return _copy_result(entry[0])
+            if entry is not None:
+                del self._entries[key]
+                self._counters['expired'] += 1
+            self._counters['misses'] += 1
+            snapshot = self._snapshot(tables)
+        result = loader()
+        ttl = self.default_ttl if ttl is None else ttl
+        with self._lock:
+            if self._snapshot(tables) != snapshot:
+                self._counters['stale_loads'] += 1
+                return result
+            self._entries[key] = (_copy_result(result), time.monotonic() + ttl, tables)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+        return result
+
+    def _snapshot(self, tables: FrozenSet[str]) -> tuple:
+        return (self._epoch,) + tuple(self._versions[table] for table in sorted(tables))
+
+    def invalidate_sql(self, sql: str):
+        """写语句执行之后调用，删掉它涉及的表上的缓存"""
+        tables = set(sql_tables(sql))
+        if not tables:
+            self.clear()
+            return
+        if _DDL_RE.match(sql):
+            tables.add(SCHEMA_TABLE)
+        self.invalidate_tables(tables)
+
+    def invalidate_tables(self, tables):
+        tables = {table.replace('`', '').lower().split('.')[-1] for table in tables}
+        with self._lock:
+            for table in tables:
+                self._versions[table] += 1
+            stale = [key for key, entry in self._entries.items() if entry[2] & tables]
+            for key in stale:
+                del self._entries[key]
+            self._counters['invalidations'] += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._counters['invalidations'] += len(self._entries)
+            self._entries.clear()
+
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = len(self._entries)
+        for name in ('hits', 'misses', 'expired', 'evictions', 'invalidations', 'stale_loads', 'uncacheable'):
+            stats.setdefault(name, 0)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
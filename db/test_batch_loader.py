@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from unittest import TestCase
+
+from db.batch_loader import DataLoader
+
+
+class FakePool:
+    """只实现DataLoader用到的fetchall，按IN里的值返回行"""
+
+    def __init__(self, rows, fail: bool = False):
+        self.rows = rows
+        self.fail = fail
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def fetchall(self, sql, args=None):
+        with self.lock:
+            self.queries.append((sql, list(args)))
+        time.sleep(0.005)
+        if self.fail:
+            raise RuntimeError('server gone')
+        # 和*_ci PAD SPACE排序规则一样忽略大小写和末尾空格
+        wanted = {str(v).rstrip(' ').lower() for v in args}
+        return [row for row in self.rows if str(row['name']).rstrip(' ').lower() in wanted]
+
+
+class AllRowsPool(FakePool):
+    """不按值过滤，所有行都返回，看DataLoader自己怎么把行分给调用方"""
+
+    def fetchall(self, sql, args=None):
+        with self.lock:
+            self.queries.append((sql, list(args)))
+        return list(self.rows)
+
+
+class TestDataLoader(TestCase):
+    def setUp(self):
+        self.pool = FakePool([{'id': i, 'name': f'user{i}'} for i in range(1000)] + [{'id': 1000, 'name': 'user1'}])
+
+    def test_coalesce_threads(self):
+        with DataLoader(self.pool, 'user', 'name', window_ms=20, max_batch=100, case_insensitive=True) as loader:
+            with ThreadPoolExecutor(max_workers=50) as executor:
+                results = list(executor.map(loader.get, [f'user{i}' for i in range(200)] + ['nobody', 'USER5']))
+        self.assertEqual([row['id'] for row in results[:200]], list(range(200)))
+        self.assertIsNone(results[200])
+        self.assertEqual(results[201]['id'], 5)
+        self.assertEqual(self.pool.queries[0][0], "select * from `user` where `name` in (" + ','.join(
+            ['%s'] * len(self.pool.queries[0][1])) + ')')
+        self.assertTrue(all(len(args) <= 100 for _, args in self.pool.queries))
+        self.assertLess(len(self.pool.queries), 20)
+        self.assertEqual(loader.stats()['requests'], 202)
+
+    def test_many_and_duplicates(self):
+        with DataLoader(self.pool, 'user', 'name', columns='id', max_batch=3, many=True) as loader:
+            results = loader.load_many(['user1', 'user1', 'user2', 'user3', 'user4'])
+        self.assertEqual([[row['id'] for row in rows] for rows in results], [[1, 1000], [1, 1000], [2], [3], [4]])
+        self.assertEqual([args for _, args in self.pool.queries], [['user1', 'user2', 'user3'], ['user4']])
+        self.assertTrue(self.pool.queries[0][0].startswith('select id, name from'))
+
+    def test_async_and_errors(self):
+        async def run(loader):
+            return await loader.aload_many([f'user{i}' for i in range(10)])
+
+        with DataLoader(self.pool, 'user', 'name') as loader:
+            rows = asyncio.run(run(loader))
+        self.assertEqual([row['id'] for row in rows], list(range(10)))
+        self.assertEqual(len(self.pool.queries), 1)
+
+        with DataLoader(FakePool([], fail=True), 'user', 'name') as loader:
+            futures = [loader.load(i) for i in range(3)]
+            for future in futures:
+                with self.assertRaises(RuntimeError):
+                    future.result()
+
+    def test_exact_match_by_default(self):
+        # FakePool忽略大小写返回行，默认按精确值分配，'ABC'和'abc'各拿各的
+        pool = FakePool([{'id': 1, 'name': 'ABC'}, {'id': 2, 'name': 'abc'}])
+        with DataLoader(pool, 'user', 'name', window_ms=20) as loader:
+            self.assertEqual([row and row['id'] for row in loader.load_many(['abc', 'ABC', 'Abc'])], [2, 1, None])
+        self.assertEqual(len(pool.queries), 1)
+        with DataLoader(pool, 'user', 'name', window_ms=20, many=True, case_insensitive=True) as loader:
+            rows = loader.get('Abc ')
+        self.assertEqual([row['id'] for row in rows], [1, 2])
+
+    def test_load_after_close(self):
+        loader = DataLoader(self.pool, 'user', 'name')
+        future = loader.load('user1')
+        loader.close()
+        self.assertEqual(future.result(1)['id'], 1)
+        with self.assertRaises(RuntimeError):
+            loader.load('user2')
+
+    def test_numeric_match(self):
+        # MySQL按数值比较，DECIMAL列返回Decimal，调用方传int/float/Decimal都要分到同一行
+        pool = AllRowsPool([{'id': 1, 'price': Decimal('1.50')}, {'id': 2, 'price': Decimal('10')},
+                            {'id': 3, 'price': 0.1}, {'id': 4, 'price': 1}])
+        with DataLoader(pool, 'goods', 'price', window_ms=20) as loader:
+            rows = loader.load_many([1.5, Decimal('1.5'), 10, 10.0, Decimal('1E+1'), Decimal('0.1'), True, 1.0, 2])
+        self.assertEqual([row and row['id'] for row in rows], [1, 1, 2, 2, 2, 3, 4, 4, None])
+        self.assertEqual(len(pool.queries), 1)
+        # 规整后相同的值只查一次
+        self.assertEqual(len(pool.queries[0][1]), 5)
+
+    def test_bad_column(self):
+        # 列名大小写和结果里的key不一致时，所有调用方都拿到异常，而不是一直等下去
+        pool = AllRowsPool([{'id': 1, 'name': 'user1'}])
+        with DataLoader(pool, 'user', 'Name', window_ms=20) as loader:
+            futures = [loader.load(value) for value in ('user1', 'user2')]
+            for future in futures:
+                with self.assertRaisesRegex(KeyError, 'Name'):
+                    future.result(1)
+            self.assertEqual(loader.stats()['queries'], 0)
+
+    def test_bad_row(self):
+        # 分配结果时出错(行里的值转不成key)，调用方都拿到异常；已经cancel的不受影响
+        class BadValue:
+            def __str__(self):
+                raise ValueError('bad value')
+
+        pool = AllRowsPool([{'id': 1, 'name': BadValue()}])
+        with DataLoader(pool, 'user', 'name', window_ms=20) as loader:
+            cancelled = loader.load('user1')
+            cancelled.cancel()
+            futures = [loader.load(value) for value in ('user1', 'user2')]
+            for future in futures:
+                with self.assertRaisesRegex(ValueError, 'bad value'):
+                    future.result(1)
+        self.assertTrue(cancelled.cancelled())
+        self.assertEqual(len(pool.queries), 1)
+        self.assertEqual(pool.queries[0][1], ['user1', 'user2'])
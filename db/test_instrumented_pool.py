@@ -0,0 +1,170 @@
+import gc
+import threading
+import time
+from unittest import TestCase
+
+from db.instrumented_pool import Histogram, InstrumentedPool, fingerprint
+from db.mysql_pool import MySQLConnectionPool
+
+
+class FakeConnection:
+    """代替pymysql连接，不需要MySQL服务：ping可以设置成失败，执行的sql记下来"""
+    # DBUtils从连接上找驱动的异常类型
+    OperationalError = InterfaceError = InternalError = ConnectionError
+
+    def __init__(self, autocommit=True, **kwargs):
+        self.alive = True
+        self.autocommit = autocommit
+        self.executed = []
+        self.commits = 0
+        self.rollback_error = None
+
+    def ping(self, reconnect=True):
+        if not self.alive:
+            raise ConnectionError('gone')
+
+    def cursor(self, *args):
+        return FakeCursor(self)
+
+    def get_autocommit(self):
+        return self.autocommit
+
+    def begin(self):
+        pass
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        if self.rollback_error:
+            raise self.rollback_error
+
+    def close(self):
+        self.alive = False
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, sql, args=None):
+        if 'bad' in sql:
+            raise ValueError('syntax error')
+        self.connection.executed.append(sql)
+        time.sleep(0.001)
+
+    def fetchone(self):
+        return {'one': 1}
+
+    def close(self):
+        pass
+
+
+class TestInstrumentedPool(TestCase):
+    def setUp(self):
+        self.connections = []
+        self.lock = threading.Lock()
+
+    def connect(self, **kwargs):
+        connection = FakeConnection(**kwargs)
+        with self.lock:
+            self.connections.append(connection)
+        return connection
+
+    def test_fingerprint(self):
+        self.assertEqual(fingerprint("SELECT * FROM t WHERE id = 12 AND name IN ('a', 'b''c')  AND x=-1.5"),
+                         "select * from t where id = ? and name in (?+) and x=?")
+        self.assertEqual(fingerprint("select * from t2 where id in (%s,%s,%s) and k = %(k)s"),
+                         "select * from t2 where id in (?+) and k = ?")
+
+    def test_histogram(self):
+        histogram = Histogram()
+        for value in [0.2] * 98 + [30, 700]:
+            histogram.record(value)
+        self.assertEqual(histogram.percentile(50), 0.25)
+        self.assertEqual(histogram.percentile(99), 50)
+        self.assertEqual(histogram.summary()['max_ms'], 700)
+
+    def test_metrics_and_prewarm(self):
+        pool = InstrumentedPool('127.0.0.1', 3306, 'root', '', 'test', min_idle=3, check_interval=0.05,
+                                connect=self.connect)
+        try:
+            deadline = time.time() + 2
+            while pool.stats()['idle'] < 3 and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(pool.stats()['prewarmed'], 3)
+
+            db = MySQLConnectionPool('127.0.0.1', 3306, 'root', '', 'test', pooled_db=pool)
+            for i in range(20):
+                self.assertEqual(db.fetchone(f"select {i} one"), {'one': 1})
+            with self.assertRaises(ValueError):
+                db.fetchone("select bad")
+            stats = pool.stats()
+            # 预热的连接够用，没有新建
+            self.assertEqual(stats['created'], 3)
+            self.assertEqual(stats['checkout_wait']['count'], 21)
+            self.assertEqual(stats['queries']['select ? one']['count'], 20)
+            self.assertEqual(stats['queries']['select bad']['errors'], 1)
+            self.assertEqual(stats['active'], 0)
+
+            # 空闲连接断了，后台检查关掉并补齐
+            for connection in list(self.connections):
+                connection.alive = False
+            deadline = time.time() + 2
+            while pool.stats()['closed_dead'] < 3 and time.time() < deadline:
+                time.sleep(0.01)
+            while pool.stats()['idle'] < 3 and time.time() < deadline:
+                time.sleep(0.01)
+            stats = pool.stats()
+            self.assertEqual((stats['closed_dead'], stats['idle'], stats['created']), (3, 3, 6))
+        finally:
+            pool.close()
+
+    def test_execute_commits_without_autocommit(self):
+        pool = InstrumentedPool('127.0.0.1', 3306, 'root', '', 'test',
+                                connect=lambda **kwargs: self.connect(**dict(kwargs, autocommit=False)))
+        try:
+            db = MySQLConnectionPool('127.0.0.1', 3306, 'root', '', 'test', pooled_db=pool)
+            db.execute("update t set x = 1")
+            self.assertEqual([c.commits for c in self.connections], [1])
+            # 回滚失败只记日志，抛出的还是原来的异常
+            self.connections[0].rollback_error = ConnectionError('gone')
+            with self.assertLogs(level='WARNING'):
+                with self.assertRaises(ValueError):
+                    db.execute("update bad")
+        finally:
+            pool.close()
+
+    def test_execute_autocommit_skips_commit(self):
+        pool = InstrumentedPool('127.0.0.1', 3306, 'root', '', 'test', connect=self.connect)
+        try:
+            db = MySQLConnectionPool('127.0.0.1', 3306, 'root', '', 'test', pooled_db=pool)
+            db.execute("update t set x = 1")
+            self.assertEqual([(c.executed, c.commits) for c in self.connections], [(["update t set x = 1"], 0)])
+        finally:
+            pool.close()
+
+    def test_shared_pool_outlives_wrappers(self):
+        # 多个MySQLConnectionPool共用一个外部传入的池，其中一个close或者被回收都不能关掉这个池
+        pool = InstrumentedPool('127.0.0.1', 3306, 'root', '', 'test', min_idle=2, check_interval=0.05,
+                                connect=self.connect)
+        try:
+            first = MySQLConnectionPool('127.0.0.1', 3306, 'root', '', 'test', pooled_db=pool)
+            second = MySQLConnectionPool('127.0.0.1', 3306, 'root', '', 'test', pooled_db=pool)
+            first.fetchone("select 1 one")
+            first.close()
+            del first
+            gc.collect()
+            self.assertEqual(second.fetchone("select 2 one"), {'one': 1})
+            self.assertTrue(pool._health.is_alive())
+            self.assertTrue(all(connection.alive for connection in self.connections))
+        finally:
+            pool.close()
+
+    def test_min_idle_limits(self):
+        with self.assertRaises(ValueError):
+            InstrumentedPool('127.0.0.1', 3306, 'root', '', 'test', min_idle=4, max_idle=2, connect=self.connect)
+        with self.assertRaises(ValueError):
+            InstrumentedPool('127.0.0.1', 3306, 'root', '', 'test', min_idle=4, max_connections=2,
+                             connect=self.connect)
+        self.assertEqual(self.connections, [])
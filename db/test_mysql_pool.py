@@ -3,6 +3,16 @@ from unittest import TestCase
 from db.mysql_pool import MySQLConnectionPool
 
 
+# 流式读取、批量写入、事务这几个测试用的库
+db_cfg = {
+    'host': '127.0.0.1',
+    'port': 3306,
+    'user': 'root',
+    'passwd': '123456',
+    'db': 'test'
+}
+
+
 class TestMySQLConnectionPool(TestCase):
     def test_fetchone(self):
         cfg = {
@@ -21,3 +31,73 @@ class TestMySQLConnectionPool(TestCase):
         print(result)
         print(number, type(number))
         self.assertEqual(number, 1)
+
+    def test_iter_chunks(self):
+        db = MySQLConnectionPool(**db_cfg)
+        # 10万行的结果集，按块流式读取
+        sql = ("select a.n * 1000 + b.n id from "
+               "(select @a := @a + 1 n from information_schema.COLUMNS, (select @a := -1) t limit 100) a, "
+               "(select @b := @b + 1 n from information_schema.COLUMNS, (select @b := -1) t limit 1000) b")
+        sizes = [len(rows) for rows in db.iter_chunks(sql, chunk_size=30000)]
+        self.assertEqual(sizes, [30000, 30000, 30000, 10000])
+
+        total = sum(1 for _ in db.iter_rows(sql, dict_rows=False))
+        self.assertEqual(total, 100000)
+
+        # 提前退出后连接还回池里，能继续使用
+        rows = db.iter_rows(sql, net_write_timeout=600)
+        self.assertIn('id', next(rows))
+        rows.close()
+        self.assertEqual(db.fetchone("select @@SESSION.net_write_timeout = @@GLOBAL.net_write_timeout same").get('same'), 1)
+
+    def test_bulk_insert_upsert(self):
+        db = MySQLConnectionPool(**db_cfg, local_infile=True)
+        db.execute("DROP TABLE IF EXISTS bulk_test")
+        db.execute("CREATE TABLE bulk_test (id INT PRIMARY KEY, name VARCHAR(64), score INT)")
+        try:
+            rows = ((i, f"name'{i}\t", i) for i in range(50000))
+            self.assertEqual(db.bulk_insert('bulk_test', ['id', 'name', 'score'], rows, commit_rows=7000, parallel=4), 50000)
+            self.assertEqual(db.fetchone("select count(*) total from bulk_test").get('total'), 50000)
+
+            rows = ({'id': i, 'name': 'new', 'score': -i} for i in range(49000, 51000))
+            self.assertEqual(db.bulk_upsert('bulk_test', ['id', 'name', 'score'], rows, update_columns=['score']), 2000)
+            self.assertEqual(db.fetchone("select name, score from bulk_test where id = 49999"),
+                             {'name': "name'49999\t", 'score': -49999})
+            self.assertEqual(db.fetchone("select count(*) total from bulk_test").get('total'), 51000)
+
+            rows = ((i, None if i % 2 else 'a\\b\nc', i) for i in range(60000, 70000))
+            self.assertEqual(db.load_data('bulk_test', ['id', 'name', 'score'], rows), 10000)
+            self.assertEqual(db.fetchone("select name from bulk_test where id = 60000").get('name'), 'a\\b\nc')
+            self.assertIsNone(db.fetchone("select name from bulk_test where id = 60001").get('name'))
+        finally:
+            db.execute("DROP TABLE bulk_test")
+
+    def test_transaction(self):
+        db = MySQLConnectionPool(**db_cfg)
+        db.execute("DROP TABLE IF EXISTS txn_test")
+        db.execute("CREATE TABLE txn_test (id INT PRIMARY KEY)")
+        try:
+            with db.transaction() as cursor:
+                cursor.execute("insert into txn_test values (1)")
+            # 出错时回滚，以前的pool会把前面的insert提交掉
+            with self.assertRaises(Exception):
+                with db.pool as cursor:
+                    cursor.execute("insert into txn_test values (2)")
+                    cursor.execute("insert into txn_test values (1)")
+            self.assertEqual(db.fetchall("select id from txn_test"), [{'id': 1}])
+            with db.read() as cursor:
+                cursor.execute("select @@autocommit autocommit")
+                self.assertEqual(cursor.fetchone().get('autocommit'), 1)
+        finally:
+            db.execute("DROP TABLE txn_test")
+
+    def test_execute_without_autocommit(self):
+        # 不是autocommit的连接池，execute也要提交
+        db = MySQLConnectionPool(**db_cfg, pooled_db=MySQLConnectionPool.gen_pool(**db_cfg, autocommit=False, reset=True))
+        db.execute("DROP TABLE IF EXISTS txn_test")
+        db.execute("CREATE TABLE txn_test (id INT PRIMARY KEY)")
+        try:
+            db.execute("insert into txn_test values (1)")
+            self.assertEqual(MySQLConnectionPool(**db_cfg).fetchall("select id from txn_test"), [{'id': 1}])
+        finally:
+            db.execute("DROP TABLE txn_test")
@@ -0,0 +1,103 @@
+import threading
+import time
+from unittest import TestCase
+
+from db.query_cache import QueryCache, SCHEMA_TABLE, normalize_sql, sql_tables
+
+
+class TestQueryCache(TestCase):
+    def setUp(self):
+        self.cache = QueryCache(max_entries=3, default_ttl=60)
+        self.loads = 0
+
+    def load(self, value):
+        def loader():
+            self.loads += 1
+            return value
+        return loader
+
+    def test_sql_tables(self):
+        self.assertEqual(sql_tables("select * from `test`.`User` u join orders o on u.id = o.uid"),
+                         {'user', 'orders'})
+        self.assertEqual(sql_tables("SELECT count(*) total FROM information_schema.TABLES WHERE table_name = %s"),
+                         {SCHEMA_TABLE})
+        self.assertEqual(sql_tables("insert into a (x) select x from b, c"), {'a', 'b', 'c'})
+        self.assertEqual(sql_tables("LOAD DATA LOCAL INFILE %s INTO TABLE `t` (a)"), {'t'})
+        self.assertEqual(sql_tables("select 1"), frozenset())
+        # 逗号连接带别名的表、派生表、字符串里的关键字
+        self.assertEqual(sql_tables("select * from a x, (select id from c) d, b y where x.id = y.id"),
+                         {'a', 'b', 'c'})
+        self.assertEqual(sql_tables("update a x, b as y set x.v = y.v where x.name = 'from z, w'"), {'a', 'b'})
+        self.assertEqual(sql_tables("drop table if exists a, b"), {'a', 'b'})
+        self.assertEqual(sql_tables("rename table a to b"), {'a', 'b'})
+        # 解析不全的当成解析不出来
+        self.assertEqual(sql_tables("select * from json_table(@j, '$[*]' columns (a int path '$')) j"), frozenset())
+        self.assertEqual(normalize_sql(" select *\n  from t ;"), "select * from t")
+
+    def test_hit_ttl_and_lru(self):
+        sql = "select * from user where id = %s"
+        self.assertEqual(self.cache.get_or_load('fetchone', sql, (1,), self.load({'id': 1})), {'id': 1})
+        row = self.cache.get_or_load('fetchone', "select *  from user\nwhere id = %s", [1], self.load(None))
+        self.assertEqual(row, {'id': 1})
+        # 返回的是副本
+        row['id'] = 2
+        self.assertEqual(self.cache.get_or_load('fetchone', sql, (1,), self.load(None)), {'id': 1})
+        self.assertEqual(self.loads, 1)
+
+        self.cache.get_or_load('fetchone', sql, (2,), self.load({'id': 2}), ttl=0.01)
+        time.sleep(0.02)
+        self.cache.get_or_load('fetchone', sql, (2,), self.load({'id': 2}))
+        for i in range(3, 6):
+            self.cache.get_or_load('fetchone', sql, (i,), self.load({'id': i}))
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['expired']), (2, 6, 1))
+        self.assertEqual((stats['entries'], stats['evictions']), (3, 2))
+        self.assertAlmostEqual(stats['hit_rate'], 0.25)
+
+    def test_invalidation(self):
+        self.cache.get_or_load('fetchall', "select * from user", None, self.load([{'id': 1}]))
+        self.cache.get_or_load('fetchone', "select count(*) total from information_schema.TABLES", None,
+                               self.load({'total': 1}))
+        self.cache.invalidate_sql("update orders set x = 1")
+        self.assertEqual(self.cache.stats()['entries'], 2)
+        self.cache.invalidate_sql("UPDATE `test`.`user` SET name = 'a'")
+        self.assertEqual(self.cache.stats()['entries'], 1)
+        self.cache.invalidate_sql("create table foo (id int)")
+        self.assertEqual(self.cache.stats()['entries'], 0)
+        # 加锁读和没有表名的读不缓存
+        self.cache.get_or_load('fetchone', "select * from user for update", None, self.load(1))
+        self.cache.get_or_load('fetchone', "select now()", None, self.load(1))
+        self.assertEqual(self.cache.stats()['uncacheable'], 2)
+
+    def test_join_alias_invalidation(self):
+        sql = "select * from user u, orders o where u.id = o.uid"
+        self.cache.get_or_load('fetchall', sql, None, self.load([]))
+        self.cache.invalidate_sql("delete from orders where id = 1")
+        self.assertEqual(self.cache.stats()['entries'], 0)
+
+    def test_unhashable_args(self):
+        sql = "select * from user where id in %s"
+        self.cache.get_or_load('fetchall', sql, ({1, 2},), self.load([1]))
+        self.assertEqual(self.cache.get_or_load('fetchall', sql, (frozenset([2, 1]),), self.load(None)), [1])
+        # 转不成可hash形式的参数不缓存
+        self.assertEqual(self.cache.get_or_load('fetchall', sql, (bytearray(b'x'),), self.load([2])), [2])
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['uncacheable'], stats['entries']), (1, 1, 1))
+
+    def test_write_during_load_is_not_cached(self):
+        started, release = threading.Event(), threading.Event()
+
+        def slow_loader():
+            started.set()
+            release.wait()
+            return [{'id': 1}]
+
+        thread = threading.Thread(target=self.cache.get_or_load, args=('fetchall', "select * from user", None,
+                                                                        slow_loader))
+        thread.start()
+        started.wait()
+        self.cache.invalidate_tables(['user'])
+        release.set()
+        thread.join()
+        self.assertEqual(self.cache.stats()['entries'], 0)
+        self.assertEqual(self.cache.stats()['stale_loads'], 1)
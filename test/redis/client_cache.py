@@ -0,0 +1,348 @@
+# encoding: utf-8
+import collections
+import logging
+import sys
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+import redis
+from redis.connection import Connection
+
+# 客户端缓存：读多写少的配置、字典类key缓存在进程里，key被修改时redis主动通知失效(CLIENT TRACKING)
+#
+# 失效通知：用RESP2的REDIRECT方式，单独一条连接SUBSCRIBE __redis__:invalidate，读数据的每条连接建立时执行
+#   CLIENT TRACKING ON REDIRECT <订阅连接的id>，redis记住这条连接读过哪些key，key被修改、删除、过期、淘汰时
+#   往订阅连接发一条消息，后台线程收到后从本地缓存删掉。连接池不用改，redis-py 5也不用开RESP3
+# bcast_prefixes：广播模式，redis不记录读过哪些key，匹配前缀的key被修改都会通知，服务端不占内存；
+#   只缓存匹配前缀的key，前缀尽量覆盖要缓存的key并且不要太宽，否则会收到大量用不上的通知
+#
+# 一致性：
+#   1. 读之前先登记，读的过程中收到这个key的失效通知就不放进缓存，避免把修改前的值缓存下来
+#   2. 服务端是按连接记录读过的key，读数据的连接断开后这条连接读过的key不会再通知，所以任意连接断开都清空缓存
+#   3. 订阅连接断开期间会漏掉通知：清空缓存并暂停缓存，重连后从连接池取出的老连接先重连，带上新的REDIRECT id
+#   4. 通过这个客户端的写命令(set/delete/hset...)执行后立即删本地缓存，不等异步通知，保证自己写完能读到
+#
+# 只支持单机(或者集群里的单个节点)，缓存get/mget/hgetall的结果，其他命令原样转发
+# usage:
+#   cache = CachingClient(redis.Redis(host='10.13.246.139', port=12345), max_keys=10000)
+#   cache.get('config:switch')
+#   cache.stats()
+#   cache.close()
+
+INVALIDATE_CHANNEL = b'__redis__:invalidate'
+
+# 每个缓存项除了key和value之外大概的开销：OrderedDict节点、tuple、bytes对象头
+ENTRY_OVERHEAD = 200
+
+
+def _to_bytes(key) -> bytes:
+    if isinstance(key, bytes):
+        return key
+    return str(key).encode('utf-8')
+
+
+def _value_size(value) -> int:
+    if value is None:
+        return 0
+    if isinstance(value, dict):
+        return sum(len(k) + len(v) for k, v in value.items())
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    return sys.getsizeof(value)
+
+
+class TrackingConnection(Connection):
+    """建立连接时打开CLIENT TRACKING，断开时通知缓存清空"""
+
+    def __init__(self, tracking_cache=None, **kwargs):
+        super().__init__(**kwargs)
+        self.tracking_cache = tracking_cache
+        self.tracking = False
+        self.redirect_id = None
+
+    def on_connect(self):
+        super().on_connect()
+        self.redirect_id = self.tracking_cache.redirect_id
+        args = self.tracking_cache.tracking_args()
+        if args is None:
+            return
+        self.send_command('CLIENT', 'TRACKING', 'ON', *args)
+        if self.read_response() not in (b'OK', 'OK'):
+            raise redis.ResponseError('CLIENT TRACKING failed')
+        self.tracking = True
+
+    def disconnect(self, *args):
+        if self.tracking:
+            self.tracking = False
+            self.tracking_cache.flush('connection closed')
+        super().disconnect(*args)
+
+
+class TrackingConnectionPool(redis.ConnectionPool):
+    """订阅连接重连后id变了，取出的连接如果还REDIRECT到老的id就重连一次"""
+
+    def __init__(self, tracking_cache, **kwargs):
+        super().__init__(connection_class=TrackingConnection, tracking_cache=tracking_cache, **kwargs)
+        self.tracking_cache = tracking_cache
+
+    def get_connection(self, *args, **kwargs):
+        connection = super().get_connection(*args, **kwargs)
+        if connection.redirect_id != self.tracking_cache.redirect_id:
+            # 这条连接读过的key在订阅连接断开时已经清掉了，重连不用再清空缓存
+            connection.tracking = False
+            connection.disconnect()
+            connection.connect()
+        return connection
+
+
+class CachingClient:
+    def __init__(self, client: redis.Redis, max_keys: int = 10000, max_bytes: int = 64 * 1024 * 1024,
+                 bcast_prefixes: Iterable[str] = None, max_age: float = 0):
+        """
+            client: 已有的redis.Redis，用它的连接参数建一个打开了tracking的连接池，原来的客户端不受影响
+            max_age: 缓存项最长保留秒数，0表示只靠失效通知
+        """
+        self.max_keys = max_keys
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.prefixes = [_to_bytes(p) for p in bcast_prefixes] if bcast_prefixes else None
+        self.connection_kwargs = dict(client.connection_pool.connection_kwargs)
+        self.connection_kwargs.pop('protocol', None)
+        # (命令, key) -> (value, 放进缓存的时间, 大小)，按最近使用排序
+        self._entries: 'collections.OrderedDict[tuple, tuple]' = collections.OrderedDict()
+        # 正在从redis读的缓存项 -> 读之前登记的标记，收到失效通知时删掉
+        self._pending: Dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._counters = collections.Counter()
+        # 订阅连接的CLIENT ID，数据连接的失效通知都转发给它
+        self.redirect_id: Optional[int] = None
+        self._stopped = threading.Event()
+        self._ready = threading.Event()
+        self._listener_error: Optional[Exception] = None
+
+        self.pool = TrackingConnectionPool(self, **self.connection_kwargs)
+        self.client = redis.Redis(connection_pool=self.pool)
+        self._listener = threading.Thread(target=self._listen, name='client-cache-invalidate', daemon=True)
+        self._listener.start()
+        if not self._ready.wait(self.connection_kwargs.get('socket_connect_timeout') or 10):
+            self.close()
+            raise redis.ConnectionError(f'invalidation listener not ready: {self._listener_error}')
+
+    def tracking_args(self) -> Optional[List]:
+        if self.redirect_id is None:
+            return None
+        args = ['REDIRECT', self.redirect_id]
+        if self.prefixes is not None:
+            args.append('BCAST')
+            for prefix in self.prefixes:
+                args += ['PREFIX', prefix]
+        return args
+
+    # 失效通知
+    def _subscribe(self) -> Connection:
+        connection = Connection(**self.connection_kwargs)
+        connection.connect()
+        connection.send_command('CLIENT', 'ID')
+        client_id = int(connection.read_response())
+        connection.send_command('SUBSCRIBE', INVALIDATE_CHANNEL)
+        connection.read_response()
+        self.redirect_id = client_id
+        return connection
+
+    def _listen(self):
+        connection = None
+        while not self._stopped.is_set():
+            try:
+                if connection is None:
+                    connection = self._subscribe()
+                    # 断开期间开始的读不能放进缓存
+                    self.flush('invalidation connection ready')
+                    self._ready.set()
+                    logging.debug(f'Client cache subscribed, redirect id {self.redirect_id}')
+                if not connection.can_read(timeout=0.5):
+                    continue
+                message = connection.read_response()
+                if _to_bytes(message[0]) == b'message' and _to_bytes(message[1]) == INVALIDATE_CHANNEL:
+                    self._invalidate(message[2])
+            except (redis.ConnectionError, redis.TimeoutError, OSError) as e:
+                self._listener_error = e
+                self._ready.clear()
+                self.redirect_id = None
+                self.flush('invalidation connection lost')
+                if connection is not None:
+                    connection.disconnect()
+                    connection = None
+                    logging.warning(f'Client cache invalidation connection lost: {str(e)}')
+                self._stopped.wait(1)
+        if connection is not None:
+            connection.disconnect()
+
+    def _invalidate(self, keys):
+        # keys为空表示FLUSHALL/FLUSHDB，整个缓存失效
+        if keys is None:
+            self.flush('flushed on server')
+            return
+        with self._lock:
+            self._counters['invalidations'] += len(keys)
+            for key in map(_to_bytes, keys):
+                for entry_key in ((b'get', key), (b'hgetall', key)):
+                    self._pending.pop(entry_key, None)
+                    self._remove(entry_key)
+
+    def _remove(self, entry_key: tuple):
+        entry = self._entries.pop(entry_key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def flush(self, reason: str = 'manual'):
+        with self._lock:
+            if self._entries or self._pending:
+                logging.debug(f'Client cache flushed: {reason}')
+            self._counters['flushes'] += 1
+            self._entries.clear()
+            self._pending.clear()
+            self._bytes = 0
+
+    def invalidate(self, *keys):
+        self._invalidate([_to_bytes(key) for key in keys])
+
+    # 缓存读写
+    def _count(self, name: str):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _cacheable(self, key: bytes) -> bool:
+        if not self._ready.is_set():
+            return False
+        return self.prefixes is None or any(key.startswith(prefix) for prefix in self.prefixes)
+
+    def _lookup(self, entry_key: tuple):
+        """命中返回(True, value)；没命中时登记并返回(False, 标记)"""
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is not None and (not self.max_age or time.monotonic() - entry[1] < self.max_age):
+                self._entries.move_to_end(entry_key)
+                self._counters['hits'] += 1
+                return True, entry[0]
+            if entry is not None:
+                self._remove(entry_key)
+            self._counters['misses'] += 1
+            token = object()
+            self._pending[entry_key] = token
+            return False, token
+
+    def _store(self, entry_key: tuple, token, value):
+        size = len(entry_key[1]) + _value_size(value) + ENTRY_OVERHEAD
+        with self._lock:
+            if self._pending.get(entry_key) is not token:
+                # 读的过程中被修改过，或者缓存被清空过
+                return
+            del self._pending[entry_key]
+            if size > self.max_bytes:
+                return
+            self._remove(entry_key)
+            self._entries[entry_key] = (value, time.monotonic(), size)
+            self._bytes += size
+            while len(self._entries) > self.max_keys or self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted[2]
+                self._counters['evictions'] += 1
+
+    def _cached_read(self, command: bytes, key, fetch):
+        key = _to_bytes(key)
+        if not self._cacheable(key):
+            self._count('uncached')
+            return fetch(key)
+        entry_key = (command, key)
+        hit, value = self._lookup(entry_key)
+        if hit:
+            return value
+        try:
+            result = fetch(key)
+        except Exception:
+            with self._lock:
+                self._pending.pop(entry_key, None)
+            raise
+        self._store(entry_key, value, result)
+        return result
+
+    def get(self, name):
+        return self._cached_read(b'get', name, self.client.get)
+
+    def hgetall(self, name):
+        return self._cached_read(b'hgetall', name, self.client.hgetall)
+
+    def mget(self, keys, *args):
+        keys = [keys] if isinstance(keys, (bytes, str)) else list(keys)
+        keys = [_to_bytes(key) for key in keys + list(args)]
+        results: List = [None] * len(keys)
+        missing = []
+        for i, key in enumerate(keys):
+            if not self._cacheable(key):
+                self._count('uncached')
+                missing.append((i, key, None))
+                continue
+            hit, value = self._lookup((b'get', key))
+            if hit:
+                results[i] = value
+            else:
+                missing.append((i, key, value))
+        if missing:
+            try:
+                values = self.client.mget([key for _, key, _ in missing])
+            except Exception:
+                with self._lock:
+                    for _, key, _ in missing:
+                        self._pending.pop((b'get', key), None)
+                raise
+            for (i, key, token), value in zip(missing, values):
+                results[i] = value
+                if token is not None:
+                    self._store((b'get', key), token, value)
+        return results
+
+    # 自己写的key立即失效，不等通知
+    def set(self, name, value, *args, **kwargs):
+        try:
+            return self.client.set(name, value, *args, **kwargs)
+        finally:
+            self.invalidate(name)
+
+    def delete(self, *names):
+        try:
+            return self.client.delete(*names)
+        finally:
+            self.invalidate(*names)
+
+    def hset(self, name, *args, **kwargs):
+        try:
+            return self.client.hset(name, *args, **kwargs)
+        finally:
+            self.invalidate(name)
+
+    def hdel(self, name, *keys):
+        try:
+            return self.client.hdel(name, *keys)
+        finally:
+            self.invalidate(name)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats['keys'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        for name in ('hits', 'misses', 'invalidations', 'evictions', 'flushes', 'uncached'):
+            stats.setdefault(name, 0)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def close(self):
+        self._stopped.set()
+        self._listener.join(timeout=2)
+        self.pool.disconnect()
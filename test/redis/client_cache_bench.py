@@ -0,0 +1,94 @@
+# encoding: utf-8
+import argparse
+import random
+import threading
+import time
+
+import redis
+
+from client_cache import CachingClient
+
+# 对比直接读和客户端缓存读：发到redis的GET次数(INFO commandstats)、每次读的耗时、命中率
+# 读的key按zipf分布挑，模拟少数配置key被反复读；另一个线程按--writes-per-sec修改key，验证失效通知
+# 结束时检查缓存里的值和redis一致
+# 只用于测试环境：会往目标实例写入并删除--prefix开头的key
+# usage: python3 client_cache_bench.py --host 127.0.0.1 -p 6379 --keys 1000 --reads 200000
+
+
+def get_calls(client) -> int:
+    return client.info('commandstats').get('cmdstat_get', {}).get('calls', 0)
+
+
+def zipf_keys(keys, count: int, s: float):
+    weights = [1 / (rank + 1) ** s for rank in range(len(keys))]
+    return random.choices(keys, weights=weights, k=count)
+
+
+def writer(client, keys, writes_per_sec: int, stop: threading.Event, counter: list):
+    interval = 1 / writes_per_sec
+    while not stop.is_set():
+        client.set(random.choice(keys), random.randint(0, 10 ** 9))
+        counter[0] += 1
+        stop.wait(interval)
+
+
+def run(name: str, reader, direct, keys, reads, writes_per_sec: int):
+    stop = threading.Event()
+    writes = [0]
+    thread = None
+    if writes_per_sec > 0:
+        thread = threading.Thread(target=writer, args=(direct, keys, writes_per_sec, stop, writes), daemon=True)
+        thread.start()
+    before = get_calls(direct)
+    start = time.perf_counter()
+    for key in reads:
+        reader.get(key)
+    duration = time.perf_counter() - start
+    stop.set()
+    if thread is not None:
+        thread.join()
+    # commandstats里包括检查一致性之前的所有GET，先算差值
+    calls = get_calls(direct) - before
+    print(f"{name:<8}{len(reads):>10}{calls:>12}{duration / len(reads) * 1e6:>10.1f}{writes[0]:>9}")
+    return calls
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark GET round trips saved by client side caching')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=6379)
+    parser.add_argument('-a', '--password', type=str, default=None)
+    parser.add_argument('--prefix', type=str, default='client_cache_bench:')
+    parser.add_argument('--keys', type=int, default=1000)
+    parser.add_argument('--reads', type=int, default=200000)
+    parser.add_argument('--zipf', type=float, default=1.1, help='zipf exponent of the key popularity')
+    parser.add_argument('--writes-per-sec', type=int, default=100)
+    parser.add_argument('--max-keys', type=int, default=500, help='client cache size')
+    parser.add_argument('--bcast', action='store_true', help='use broadcast tracking on --prefix')
+    args = parser.parse_args()
+
+    direct = redis.Redis(host=args.host, port=args.port, password=args.password)
+    keys = [f'{args.prefix}{i}' for i in range(args.keys)]
+    direct.mset({key: i for i, key in enumerate(keys)})
+    random.seed(1)
+    reads = zipf_keys(keys, args.reads, args.zipf)
+
+    cache = CachingClient(direct, max_keys=args.max_keys, bcast_prefixes=[args.prefix] if args.bcast else None)
+    try:
+        print(f"{'client':<8}{'reads':>10}{'GET calls':>12}{'us/read':>10}{'writes':>9}")
+        plain_calls = run('plain', direct, direct, keys, reads, args.writes_per_sec)
+        cached_calls = run('cached', cache, direct, keys, reads, args.writes_per_sec)
+        stats = cache.stats()
+        print(f"GET round trips reduced by {1 - cached_calls / plain_calls:.1%}; hit_rate={stats['hit_rate']:.1%} "
+              f"invalidations={stats['invalidations']} evictions={stats['evictions']} "
+              f"cached_keys={stats['keys']} cached_bytes={stats['bytes']}")
+        # 等最后几条失效通知到达后，缓存里的值应该和redis一致
+        time.sleep(0.2)
+        with cache._lock:
+            cached = {entry_key[1]: entry[0] for entry_key, entry in cache._entries.items()}
+        actual = dict(zip(cached, direct.mget(list(cached)))) if cached else {}
+        stale = sum(1 for key, value in cached.items() if actual[key] != value)
+        print(f"stale entries after invalidation: {stale}/{len(cached)}")
+    finally:
+        cache.close()
+        direct.delete(*keys)
@@ -0,0 +1,118 @@
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+import unittest
+
+import redis
+
+from client_cache import CachingClient
+
+REDIS_SERVER = shutil.which('redis-server')
+
+
+def wait_for(check, timeout: float = 5):
+    deadline = time.time() + timeout
+    while not check():
+        if time.time() > deadline:
+            raise TimeoutError('condition not met')
+        time.sleep(0.01)
+
+
+@unittest.skipUnless(REDIS_SERVER, 'redis-server not found')
+class TestCachingClient(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            cls.port = s.getsockname()[1]
+        cls.dir = tempfile.mkdtemp()
+        cls.server = subprocess.Popen([REDIS_SERVER, '--port', str(cls.port), '--bind', '127.0.0.1', '--dir', cls.dir,
+                                       '--save', '', '--appendonly', 'no'],
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        cls.direct = redis.Redis(port=cls.port)
+        wait_for(lambda: cls._ping(cls.direct))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.direct.close()
+        cls.server.terminate()
+        cls.server.wait()
+        shutil.rmtree(cls.dir)
+
+    @staticmethod
+    def _ping(client) -> bool:
+        try:
+            return client.ping()
+        except redis.ConnectionError:
+            return False
+
+    def setUp(self):
+        self.direct.flushall()
+
+    def test_invalidation(self):
+        cache = CachingClient(self.direct)
+        try:
+            self.direct.set('a', 1)
+            self.direct.hset('h', 'f', 1)
+            self.assertEqual(cache.get('a'), b'1')
+            self.assertEqual(cache.get('a'), b'1')
+            self.assertEqual(cache.hgetall('h'), {b'f': b'1'})
+            self.assertEqual(cache.mget(['a', 'missing']), [b'1', None])
+            stats = cache.stats()
+            self.assertEqual((stats['hits'], stats['misses']), (2, 3))
+            # 别的客户端修改，等通知到达后缓存失效
+            self.direct.set('a', 2)
+            self.direct.hset('h', 'f', 2)
+            wait_for(lambda: cache.stats()['keys'] == 1)
+            self.assertEqual(cache.get('a'), b'2')
+            self.assertEqual(cache.hgetall('h'), {b'f': b'2'})
+            # 自己写的立即能读到
+            cache.set('a', 3)
+            self.assertEqual(cache.get('a'), b'3')
+            self.direct.flushall()
+            wait_for(lambda: cache.stats()['keys'] == 0)
+        finally:
+            cache.close()
+
+    def test_lru_bound(self):
+        cache = CachingClient(self.direct, max_keys=10)
+        try:
+            self.direct.mset({f'k{i}': i for i in range(20)})
+            for i in range(20):
+                cache.get(f'k{i}')
+            stats = cache.stats()
+            self.assertEqual(stats['keys'], 10)
+            self.assertEqual(stats['evictions'], 10)
+            cache.get('k19')
+            self.assertEqual(cache.stats()['hits'], 1)
+        finally:
+            cache.close()
+
+    def test_bcast_and_reconnect(self):
+        cache = CachingClient(self.direct, bcast_prefixes=['cfg:'])
+        try:
+            self.direct.set('cfg:a', 1)
+            self.direct.set('other', 1)
+            cache.get('cfg:a')
+            cache.get('other')
+            self.assertEqual(cache.stats()['uncached'], 1)
+            self.direct.set('cfg:a', 2)
+            wait_for(lambda: cache.stats()['keys'] == 0)
+            self.assertEqual(cache.get('cfg:a'), b'2')
+            # 断开订阅连接：缓存清空，重连后数据连接换成新的REDIRECT，修改仍然能收到通知
+            redirect_id = cache.redirect_id
+            self.direct.client_kill_filter(_id=redirect_id)
+            wait_for(lambda: cache.redirect_id not in (None, redirect_id))
+            self.assertEqual(cache.stats()['keys'], 0)
+            self.assertEqual(cache.get('cfg:a'), b'2')
+            self.direct.set('cfg:a', 3)
+            wait_for(lambda: cache.stats()['keys'] == 0)
+            self.assertEqual(cache.get('cfg:a'), b'3')
+        finally:
+            cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,272 @@
+# encoding: utf-8
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import redis
+from redis.exceptions import RedisError, ResponseError
+
+from slot import CLUSTER_SLOTS, key_hash_slot
+
+# 根据CLUSTER SLOTS构建slot到master节点的路由表，本地计算key所在的节点，不需要每个key都去问一次redis
+# 非集群模式的实例会被当成一个拥有全部slot的master
+# 路由表可以连同cluster epoch一起缓存到磁盘，epoch没变就不用重新拉CLUSTER SLOTS
+
+Node = Tuple[str, int]
+
+
+def _to_str(value) -> str:
+    return value.decode('utf-8') if isinstance(value, bytes) else str(value)
+
+
+def fetch_slot_ranges(client: redis.Redis, seed_host: str) -> List[Tuple[int, int, Node]]:
+    """执行CLUSTER SLOTS，返回[(start, end, (host, port))]，按start排序"""
+    try:
+        reply = client.execute_command('CLUSTER', 'SLOTS')
+    except ResponseError as e:
+        if 'cluster support disabled' not in str(e):
+            raise
+        port = client.connection_pool.connection_kwargs.get('port', 6379)
+        return [(0, CLUSTER_SLOTS - 1, (seed_host, int(port)))]
+    ranges = []
+    for item in reply:
+        start, end, master = int(item[0]), int(item[1]), item[2]
+        host = _to_str(master[0])
+        # 节点没有配置announce地址时host可能为空，这时就是当前连接的节点
+        if host in ('', '?'):
+            host = seed_host
+        ranges.append((start, end, (host, int(master[1]))))
+    ranges.sort()
+    return ranges
+
+
+def fetch_cluster_epoch(client: redis.Redis) -> int:
+    """CLUSTER INFO里的cluster_current_epoch，故障切换、迁移slot之后会变大；非集群模式返回0"""
+    try:
+        info = client.execute_command('CLUSTER', 'INFO')
+    except ResponseError as e:
+        if 'cluster support disabled' not in str(e):
+            raise
+        return 0
+    for line in _to_str(info).splitlines():
+        if line.startswith('cluster_current_epoch:'):
+            return int(line.split(':', 1)[1])
+    return 0
+
+
+def parse_moved(message: str) -> Optional[Tuple[int, Node]]:
+    """解析'MOVED 3999 127.0.0.1:6381'，不是MOVED错误返回None"""
+    parts = str(message).split()
+    if len(parts) != 3 or parts[0] != 'MOVED':
+        return None
+    host, _, port = parts[2].rpartition(':')
+    return int(parts[1]), (host, int(port))
+
+
+class SlotRouter:
+    """slot -> master路由表，区间用bisect查找。可以缓存到磁盘，收到MOVED时自动刷新"""
+
+    def __init__(self, ranges: List[Tuple[int, int, Node]], epoch: int = 0, seed: Node = None,
+                 password: str = None, connect_timeout: int = 5):
+        self.epoch = epoch
+        self.seed = seed
+        self.password = password
+        self.connect_timeout = connect_timeout
+        self.refresh_lock = threading.Lock()
+        self._set_ranges(ranges)
+
+    def _set_ranges(self, ranges: List[Tuple[int, int, Node]]):
+        ranges = sorted(ranges)
+        # 区间列表和起点列表一起替换，其他线程读到的总是一致的一对
+        self._table = (ranges, [r[0] for r in ranges])
+
+    @property
+    def ranges(self) -> List[Tuple[int, int, Node]]:
+        return self._table[0]
+
+    def _client(self, node: Node) -> redis.Redis:
+        return redis.Redis(host=node[0], port=node[1], password=self.password, socket_timeout=self.connect_timeout,
+                           socket_connect_timeout=self.connect_timeout)
+
+    @classmethod
+    def from_seed(cls, host: str, port: int = 6379, password: str = None, connect_timeout: int = 5):
+        router = cls([], seed=(host, port), password=password, connect_timeout=connect_timeout)
+        router.refresh()
+        return router
+
+    @classmethod
+    def from_cache(cls, cache_file: str, host: str, port: int = 6379, password: str = None,
+                   connect_timeout: int = 5, max_age: float = 3600, offline: bool = False):
+        """优先用磁盘缓存。缓存超过max_age秒时只用一次CLUSTER INFO比较epoch，epoch变了才重新拉CLUSTER SLOTS"""
+        router = cls([], seed=(host, port), password=password, connect_timeout=connect_timeout)
+        try:
+            with open(cache_file, 'r') as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = None
+        if cache and tuple(cache.get('seed', ())) == (host, port):
+            router._set_ranges([(start, end, (node_host, node_port))
+                                for start, end, node_host, node_port in cache['ranges']])
+            router.epoch = cache['epoch']
+            fresh = time.time() - cache.get('saved_at', 0) < max_age
+            if offline or fresh:
+                return router
+            client = router._client((host, port))
+            try:
+                epoch = fetch_cluster_epoch(client)
+            finally:
+                client.close()
+            if epoch == router.epoch:
+                router.save(cache_file)
+                return router
+            logging.info(f"Cluster epoch changed {router.epoch} -> {epoch}, refreshing slot cache")
+        elif offline:
+            raise FileNotFoundError(f'no usable slot cache in {cache_file}')
+        router.refresh()
+        router.save(cache_file)
+        return router
+
+    def save(self, cache_file: str):
+        cache = {
+            'seed': list(self.seed),
+            'epoch': self.epoch,
+            'saved_at': time.time(),
+            'ranges': [[start, end, node[0], node[1]] for start, end, node in self.ranges],
+        }
+        directory = os.path.dirname(cache_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_file = cache_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(cache, f)
+        os.replace(tmp_file, cache_file)
+
+    def refresh(self, node: Node = None):
+        """重新拉取CLUSTER SLOTS，优先问指定的节点，失败了再依次问seed和已知的master"""
+        candidates = [n for n in [node, self.seed] + self.masters() if n is not None]
+        last_error = None
+        with self.refresh_lock:
+            for candidate in dict.fromkeys(candidates):
+                client = self._client(candidate)
+                try:
+                    ranges = fetch_slot_ranges(client, candidate[0])
+                    epoch = fetch_cluster_epoch(client)
+                except RedisError as e:
+                    last_error = e
+                    continue
+                finally:
+                    client.close()
+                self._set_ranges(ranges)
+                self.epoch = epoch
+                logging.info(f"Loaded {len(ranges)} slot ranges from {candidate[0]}:{candidate[1]}, epoch={epoch}")
+                return
+        raise last_error or RedisError('no node to refresh slot ranges from')
+
+    def handle_moved(self, error) -> Optional[Node]:
+        """收到MOVED后刷新路由表，返回slot现在所在的节点；不是MOVED错误返回None"""
+        moved = parse_moved(str(error))
+        if moved is None:
+            return None
+        slot, node = moved
+        if self.node_for_slot(slot) != node:
+            try:
+                self.refresh(node)
+            except RedisError as e:
+                logging.warning(f"Refresh slot ranges after MOVED failed: {str(e)}")
+            # 迁移还没完成时CLUSTER SLOTS可能还是旧的，以MOVED为准
+            if self.node_for_slot(slot) != node:
+                self._set_slot(slot, node)
+        return node
+
+    def _set_slot(self, slot: int, node: Node):
+        ranges = []
+        for start, end, owner in self.ranges:
+            if start <= slot <= end:
+                if start < slot:
+                    ranges.append((start, slot - 1, owner))
+                if slot < end:
+                    ranges.append((slot + 1, end, owner))
+            else:
+                ranges.append((start, end, owner))
+        ranges.append((slot, slot, node))
+        self._set_ranges(ranges)
+
+    def node_for_slot(self, slot: int) -> Optional[Node]:
+        ranges, starts = self._table
+        index = bisect.bisect_right(starts, slot) - 1
+        if index < 0:
+            return None
+        start, end, node = ranges[index]
+        if start <= slot <= end:
+            return node
+        return None
+
+    def node_for_key(self, key) -> Optional[Node]:
+        return self.node_for_slot(key_hash_slot(key))
+
+    def masters(self) -> List[Node]:
+        """去重后的master列表，保持slot顺序"""
+        nodes = []
+        for _, _, node in self.ranges:
+            if node not in nodes:
+                nodes.append(node)
+        return nodes
+
+    def slots_of(self, node: Node) -> List[Tuple[int, int]]:
+        return [(start, end) for start, end, owner in self.ranges if owner == node]
+
+
+class NodeClients:
+    """每个节点一个连接池，按(host, port)取客户端"""
+
+    def __init__(self, password: str = None, connect_timeout: int = 5, max_connections: int = 4,
+                 decode_responses: bool = False, socket_timeout: float = None):
+        """socket_timeout: 读写超时，默认和connect_timeout相同；MIGRATE这种服务端可能执行很久的命令要单独设大"""
+        self.password = password
+        self.connect_timeout = connect_timeout
+        self.socket_timeout = connect_timeout if socket_timeout is None else socket_timeout
+        self.max_connections = max_connections
+        self.decode_responses = decode_responses
+        self.pools: Dict[Node, redis.ConnectionPool] = {}
+
+    def get(self, node: Node) -> redis.Redis:
+        pool = self.pools.get(node)
+        if pool is None:
+            pool = redis.BlockingConnectionPool(
+                host=node[0],
+                port=node[1],
+                password=self.password,
+                max_connections=self.max_connections,
+                socket_timeout=self.socket_timeout,
+                socket_connect_timeout=self.connect_timeout,
+                decode_responses=self.decode_responses
+            )
+            pool = self.pools.setdefault(node, pool)
+        return redis.Redis(connection_pool=pool)
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.disconnect()
+
+
+class RateLimiter:
+    """令牌桶限速，多个线程共享"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def acquire(self, n: int):
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + n / self.rate
+        if start > now:
+            time.sleep(start - now)
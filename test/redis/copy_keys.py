@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+把一批key从一个redis集群原样拷贝到另一个集群，用于排查问题或者迁移数据
+源端pipeline执行DUMP+PTTL，目标端pipeline执行RESTORE ... REPLACE，不关心key的类型，拷贝结果和源端字节级一致
+
+设计要点：
+1. key来源：--key-file给出的key文件（每行一个key，兼容fetch_key.py的格式），或者--prefix在每个源master上scan
+2. 批量：key按源端slot路由到所在master后攒批，DUMP结果再按目标端路由分组，两端都是一个节点一个pipeline
+3. 并发：多个worker并发处理不同批次，scan模式下每个源master一个扫描线程
+4. 限速：--batch-size控制单批大小，--rate-limit控制每秒拷贝的key数
+
+使用示例：
+python3 copy_keys.py --source-host 10.0.21.150 --dest-host 10.0.21.151 --key-file /tmp/bas_rm_key_new.csv
+python3 copy_keys.py --source-host 10.0.21.150 --dest-host 127.0.0.1 --prefix "string:perf_match_item" --rate-limit 5000
+"""
+
+import argparse
+import concurrent.futures
+import logging
+import sys
+import threading
+import time
+from queue import Queue
+from typing import Dict, Iterator, List, Tuple
+
+from redis.exceptions import RedisError
+
+from cluster_router import Node, NodeClients, RateLimiter, SlotRouter
+
+_STOP = object()
+
+
+def read_key_file(key_file: str) -> Iterator[bytes]:
+    """流式读取key文件，去掉换行和引号"""
+    with open(key_file, 'rb') as f:
+        for line in f:
+            key = line.rstrip(b'\r\n').replace(b'"', b'')
+            if key:
+                yield key
+
+
+class KeyCopier:
+    def __init__(self, source_host: str, dest_host: str, source_port: int = 6379, dest_port: int = 6379,
+                 source_password: str = None, dest_password: str = None, batch_size: int = 500,
+                 rate_limit: float = 0, max_workers: int = 4, scan_count: int = 1000, replace: bool = True,
+                 connect_timeout: int = 5, stats_interval: int = 10):
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.scan_count = scan_count
+        self.replace = replace
+        self.stats_interval = stats_interval
+        self.source_router = SlotRouter.from_seed(source_host, source_port, source_password, connect_timeout)
+        self.dest_router = SlotRouter.from_seed(dest_host, dest_port, dest_password, connect_timeout)
+        self.source_clients = NodeClients(source_password, connect_timeout, max_connections=max_workers)
+        self.dest_clients = NodeClients(dest_password, connect_timeout, max_connections=max_workers)
+        self.limiter = RateLimiter(rate_limit)
+        # 批次队列有界，生产者不会把整个key文件读进内存
+        self.batches: Queue = Queue(maxsize=max_workers * 2)
+        self.stop_event = threading.Event()
+        self.stats = {'copied': 0, 'missing': 0, 'errors': 0, 'unassigned': 0, 'bytes': 0, 'batches': 0}
+        self.stats_lock = threading.Lock()
+        self.start_time = time.time()
+
+    def _incr(self, **counts):
+        with self.stats_lock:
+            for name, value in counts.items():
+                self.stats[name] += value
+
+    def _stats_worker(self):
+        while not self.stop_event.wait(self.stats_interval):
+            self._print_stats()
+
+    def _print_stats(self):
+        with self.stats_lock:
+            duration = time.time() - self.start_time
+            rate = self.stats['copied'] / duration if duration > 0 else 0
+            logging.info(f"copied={self.stats['copied']} missing={self.stats['missing']} "
+                         f"errors={self.stats['errors']} unassigned={self.stats['unassigned']} bytes={self.stats['bytes']} "
+                         f"batches={self.stats['batches']} rate={rate:.0f} keys/s")
+
+    def _produce_from_file(self, key_file: str):
+        """按源端节点攒批，满了就放进批次队列"""
+        pending: Dict[Node, List[bytes]] = {}
+        for key in read_key_file(key_file):
+            if self.stop_event.is_set():
+                return
+            node = self.source_router.node_for_key(key)
+            # slot没有分配给任何master(集群不完整)，跳过并计数
+            if node is None:
+                logging.warning(f"Slot of {key!r} is not assigned in the source cluster, skipped")
+                self._incr(unassigned=1)
+                continue
+            keys = pending.setdefault(node, [])
+            keys.append(key)
+            if len(keys) >= self.batch_size:
+                self.batches.put((node, keys))
+                pending[node] = []
+        for node, keys in pending.items():
+            if keys:
+                self.batches.put((node, keys))
+
+    def _produce_from_scan(self, node: Node, prefix: str):
+        """在单个源master上scan前缀key"""
+        client = self.source_clients.get(node)
+        keys = []
+        for key in client.scan_iter(match=prefix + '*', count=self.scan_count):
+            if self.stop_event.is_set():
+                return
+            keys.append(key)
+            if len(keys) >= self.batch_size:
+                self.batches.put((node, keys))
+                keys = []
+        if keys:
+            self.batches.put((node, keys))
+
+    def _copy_batch(self, node: Node, keys: List[bytes], retry: bool = True):
+        self.limiter.acquire(len(keys))
+        pipeline = self.source_clients.get(node).pipeline(transaction=False)
+        for key in keys:
+            pipeline.dump(key)
+            pipeline.pttl(key)
+        replies = pipeline.execute(raise_on_error=False)
+
+        # 按目标端节点分组
+        groups: Dict[Node, List[Tuple[bytes, int, bytes]]] = {}
+        moved: Dict[Node, List[bytes]] = {}
+        missing = 0
+        errors = 0
+        unassigned = 0
+        for i, key in enumerate(keys):
+            payload, pttl = replies[2 * i], replies[2 * i + 1]
+            # slot已经迁走了，刷新源端路由后换节点重试一次
+            moved_to = self.source_router.handle_moved(payload) if isinstance(payload, Exception) else None
+            if moved_to is not None and retry:
+                moved.setdefault(moved_to, []).append(key)
+                continue
+            if isinstance(payload, Exception) or isinstance(pttl, Exception):
+                logging.error(f"DUMP {key!r} on {node[0]}:{node[1]} failed: {payload if isinstance(payload, Exception) else pttl}")
+                errors += 1
+                continue
+            # 在DUMP和PTTL之间过期的key也当成不存在
+            if payload is None or pttl == -2:
+                missing += 1
+                continue
+            dest_node = self.dest_router.node_for_key(key)
+            if dest_node is None:
+                logging.warning(f"Slot of {key!r} is not assigned in the destination cluster, skipped")
+                unassigned += 1
+                continue
+            groups.setdefault(dest_node, []).append((key, max(pttl, 0), payload))
+
+        copied = 0
+        copied_bytes = 0
+        for dest_node, items in groups.items():
+            pipeline = self.dest_clients.get(dest_node).pipeline(transaction=False)
+            for key, ttl, payload in items:
+                pipeline.restore(key, ttl, payload, replace=self.replace)
+            results = pipeline.execute(raise_on_error=False)
+            for (key, ttl, payload), result in zip(items, results):
+                moved_to = self.dest_router.handle_moved(result) if isinstance(result, Exception) else None
+                if moved_to is not None:
+                    try:
+                        self.dest_clients.get(moved_to).restore(key, ttl, payload, replace=self.replace)
+                        result = True
+                    except RedisError as e:
+                        result = e
+                if isinstance(result, Exception):
+                    logging.error(f"RESTORE {key!r} on {dest_node[0]}:{dest_node[1]} failed: {result}")
+                    errors += 1
+                else:
+                    copied += 1
+                    copied_bytes += len(payload)
+        self._incr(copied=copied, missing=missing, errors=errors, unassigned=unassigned, bytes=copied_bytes,
+                   batches=1)
+        for moved_node, moved_keys in moved.items():
+            self._copy_batch(moved_node, moved_keys, retry=False)
+
+    def _worker(self):
+        while True:
+            item = self.batches.get()
+            if item is _STOP:
+                return
+            if self.stop_event.is_set():
+                continue
+            node, keys = item
+            # 任何异常都只算这一批失败，worker退出的话生产者会阻塞在有界队列的put上，copy()永远不返回
+            try:
+                self._copy_batch(node, keys)
+            except Exception as e:
+                logging.error(f"Copy batch from {node[0]}:{node[1]} failed: {str(e)}")
+                self._incr(errors=len(keys))
+
+    def copy(self, key_file: str = None, prefix: str = None):
+        stats_thread = threading.Thread(target=self._stats_worker, daemon=True)
+        stats_thread.start()
+        workers = [threading.Thread(target=self._worker, daemon=True) for _ in range(self.max_workers)]
+        for worker in workers:
+            worker.start()
+        try:
+            if key_file:
+                self._produce_from_file(key_file)
+            else:
+                masters = self.source_router.masters()
+                with concurrent.futures.ThreadPoolExecutor(max_workers=len(masters)) as executor:
+                    futures = [executor.submit(self._produce_from_scan, node, prefix) for node in masters]
+                    # 离开with时executor会等所有扫描线程结束，要在这之前通知它们停下
+                    try:
+                        for future in concurrent.futures.as_completed(futures):
+                            future.result()
+                    except BaseException:
+                        self.stop_event.set()
+                        raise
+        except KeyboardInterrupt:
+            logging.info("Ctrl+C pressed. Shutting down gracefully.")
+            self.stop_event.set()
+        finally:
+            for _ in workers:
+                self.batches.put(_STOP)
+            for worker in workers:
+                worker.join()
+            self.stop_event.set()
+            self.source_clients.close()
+            self.dest_clients.close()
+            self._print_stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy redis keys between clusters with DUMP/RESTORE.")
+    parser.add_argument('--source-host', type=str, required=True, help='Any node of the source cluster')
+    parser.add_argument('--source-port', type=int, default=6379, help='Source port (default: 6379)')
+    parser.add_argument('--source-password', type=str, help='Source password (default: None)')
+    parser.add_argument('--dest-host', type=str, required=True, help='Any node of the destination cluster')
+    parser.add_argument('--dest-port', type=int, default=6379, help='Destination port (default: 6379)')
+    parser.add_argument('--dest-password', type=str, help='Destination password (default: None)')
+    parser.add_argument('--key-file', type=str, help='File with one key per line')
+    parser.add_argument('--prefix', type=str, help='Copy all keys with this prefix instead of a key file')
+    parser.add_argument('--batch-size', type=int, default=500, help='Keys per DUMP/RESTORE batch (default: 500)')
+    parser.add_argument('--rate-limit', type=float, default=0, help='Max keys copied per second, 0 means unlimited (default: 0)')
+    parser.add_argument('--max-workers', type=int, default=4, help='Concurrent copy workers (default: 4)')
+    parser.add_argument('--scan-count', type=int, default=1000, help='SCAN count in prefix mode (default: 1000)')
+    parser.add_argument('--no-replace', action='store_true', help='Fail instead of overwriting existing destination keys')
+    parser.add_argument('--connect-timeout', type=int, default=5, help='Redis connection timeout in seconds (default: 5)')
+    parser.add_argument('--stats-interval', type=int, default=10, help='Statistics output interval in seconds (default: 10)')
+    parser.add_argument('--log-level', type=str, default='INFO', help='Logging level (default: INFO)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, args.log_level.upper()),
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    if bool(args.key_file) == bool(args.prefix):
+        print("exactly one of --key-file and --prefix is required", file=sys.stderr)
+        sys.exit(1)
+    if args.prefix is not None and '*' in args.prefix:
+        print("prefix cannot contain '*'", file=sys.stderr)
+        sys.exit(1)
+
+    copier = KeyCopier(
+        source_host=args.source_host,
+        dest_host=args.dest_host,
+        source_port=args.source_port,
+        dest_port=args.dest_port,
+        source_password=args.source_password,
+        dest_password=args.dest_password,
+        batch_size=args.batch_size,
+        rate_limit=args.rate_limit,
+        max_workers=args.max_workers,
+        scan_count=args.scan_count,
+        replace=not args.no_replace,
+        connect_timeout=args.connect_timeout,
+        stats_interval=args.stats_interval
+    )
+    copier.copy(key_file=args.key_file, prefix=args.prefix)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# encoding: utf-8
+import argparse
+import concurrent.futures
+import threading
+import time
+
+import redis
+
+from write_combining_counter import AT_LEAST_ONCE, BOUNDED_LOSS, CombiningCounter
+
+# 对比直接HINCRBY和写合并两种方式：客户端每秒能做多少次自增、服务端每秒处理多少条命令，最后核对计数是否一致
+# usage: python3 counter_bench.py --host 127.0.0.1 -p 6379 --threads 8 --duration 10
+
+
+def server_commands(client) -> int:
+    return client.info('stats')['total_commands_processed']
+
+
+def run(client, threads: int, duration: float, key: str, field: str, counter=None) -> int:
+    stop = threading.Event()
+
+    def worker():
+        # 直接模式每个线程一个连接，和incr_test.py一样
+        conn = None if counter else redis.Redis(connection_pool=client.connection_pool)
+        n = 0
+        while not stop.is_set():
+            if counter:
+                counter.hincrby(key, field)
+            else:
+                conn.hincrby(key, field)
+            n += 1
+        return n
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = [executor.submit(worker) for _ in range(threads)]
+        time.sleep(duration)
+        stop.set()
+        return sum(f.result() for f in futures)
+
+
+def bench(client, name: str, threads: int, duration: float, key: str, field: str, counter_factory=None):
+    client.delete(key)
+    before = server_commands(client)
+    start = time.time()
+    counter = counter_factory() if counter_factory else None
+    increments = run(client, threads, duration, key, field, counter)
+    if counter:
+        counter.close()
+    elapsed = time.time() - start
+    # 减掉INFO/DELETE自己的命令
+    commands = server_commands(client) - before - 1
+    value = int(client.hget(key, field) or 0)
+    print(f"{name:<24}{increments / elapsed:>14.0f}{commands / elapsed:>14.0f}{increments:>12}{value:>12}"
+          f"{'ok' if value == increments else 'MISMATCH':>10}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark write combining for hot counters')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=6379)
+    parser.add_argument('-a', '--password', type=str, default=None)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--flush-interval', type=float, default=0.05)
+    parser.add_argument('--key', type=str, default='bench:k1')
+    parser.add_argument('--field', type=str, default='f1')
+    args = parser.parse_args()
+
+    client = redis.Redis(host=args.host, port=args.port, password=args.password, max_connections=args.threads + 2)
+    print(f"{'mode':<24}{'client inc/s':>14}{'server ops/s':>14}{'increments':>12}{'value':>12}{'check':>10}")
+    bench(client, 'direct', args.threads, args.duration, args.key, args.field)
+    for mode in (AT_LEAST_ONCE, BOUNDED_LOSS):
+        bench(client, f'combined/{mode}', args.threads, args.duration, args.key, args.field,
+              lambda: CombiningCounter(client, flush_interval=args.flush_interval, mode=mode))
+    client.delete(args.key)
@@ -1,30 +1,76 @@
 # encoding: utf-8
 import argparse
+import os
+import sys
 
-import redis
+from cluster_router import SlotRouter
+from slot import CLUSTER_SLOTS, key_hash_slot
 
 # 从redis集群中查找key位于哪个node上
+# slot在本地计算，路由表(CLUSTER SLOTS)连同cluster epoch缓存在磁盘上，缓存过期后只用一次CLUSTER INFO确认epoch有没有变化
+# 批量模式从文件或者标准输入读key，每行输出: key slot host:port
 # usage: python3 find_key.py --host=10.212.154.48 --key=mykey
+#        python3 find_key.py --host=10.212.154.48 --key-file=keys.txt > key_nodes.txt
+#        cat keys.txt | python3 find_key.py --host=10.212.154.48 --key-file=-
+
+
+def default_cache_file(host: str, port: int) -> str:
+    return os.path.join(os.path.expanduser('~'), '.cache', 'redis_slots', f'{host}_{port}.json')
+
+
+def assign_keys(router: SlotRouter, lines, output):
+    """批量计算key所在的节点。每个slot的节点只用bisect查一次，后面直接查表"""
+    labels = [None] * CLUSTER_SLOTS
+    for slot in range(CLUSTER_SLOTS):
+        node = router.node_for_slot(slot)
+        labels[slot] = f'{node[0]}:{node[1]}'.encode('utf-8') if node else b'unassigned'
+    buffer = []
+    for line in lines:
+        key = line.rstrip(b'\r\n')
+        if not key:
+            continue
+        slot = key_hash_slot(key)
+        buffer.append(b'%s %d %s\n' % (key, slot, labels[slot]))
+        if len(buffer) >= 10000:
+            output.write(b''.join(buffer))
+            buffer = []
+    output.write(b''.join(buffer))
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='find key in which node.')
     parser.add_argument('--host', type=str, help='redis cluster中随机一个节点的ip', required=True)
-    parser.add_argument('-k', '--key', type=str, help='要查询的redis key', required=True)
+    parser.add_argument('-p', '--port', type=int, help='redis port', default=6379)
+    parser.add_argument('-a', '--password', type=str, help='redis password', default=None)
+    parser.add_argument('-k', '--key', type=str, help='要查询的redis key')
+    parser.add_argument('-f', '--key-file', type=str, help='批量查询的key文件，每行一个key，-表示标准输入')
+    parser.add_argument('--cache-file', type=str, help='路由表缓存文件，默认~/.cache/redis_slots/<host>_<port>.json')
+    parser.add_argument('--max-age', type=int, help='缓存超过这么多秒后检查一次epoch', default=3600)
+    parser.add_argument('--refresh', action='store_true', help='忽略缓存，重新拉取路由表')
+    parser.add_argument('--offline', action='store_true', help='只用缓存，不访问redis')
     args = parser.parse_args()
+    if bool(args.key) == bool(args.key_file):
+        print('--key和--key-file必须指定一个', file=sys.stderr)
+        sys.exit(1)
+
+    cache_file = args.cache_file or default_cache_file(args.host, args.port)
+    if args.refresh:
+        router = SlotRouter.from_seed(args.host, args.port, args.password)
+        router.save(cache_file)
+    else:
+        router = SlotRouter.from_cache(cache_file, args.host, args.port, args.password, max_age=args.max_age,
+                                       offline=args.offline)
 
-    conn = redis.Redis(host=args.host, port=6379, db=0)
-    """
-        {'10.14.223.11:6379@16379': {'node_id': '053004d9a956b0d667a2bf3be88da126ac283e7c', 'flags': 'myself,master', 'master_id': '-', 'last_ping_sent': '0', 'last_pong_rcvd': '1693222365000', 'epoch': '4', 'slots': [['0', '5460']], 'connected': True}}
-    """
-    cluster_nodes = conn.cluster("nodes")
-    slot_pos = conn.cluster("keyslot", args.key)
-    print(f'slot={slot_pos}')
-    for node in cluster_nodes:
-        outer_arr = cluster_nodes[node]['slots']
-        for inner_arr in outer_arr:
-            if len(inner_arr) == 0:
-                continue
-            min_slot = int(inner_arr[0])
-            max_slot = int(inner_arr[1])
-            if max_slot > int(slot_pos) > min_slot:
-                print(f'key={args.key} in node {node}')
+    if args.key:
+        slot = key_hash_slot(args.key)
+        node = router.node_for_slot(slot)
+        print(f'slot={slot}')
+        if node is None:
+            print(f'key={args.key} slot {slot} is not assigned')
+        else:
+            print(f'key={args.key} in node {node[0]}:{node[1]}')
+    elif args.key_file == '-':
+        assign_keys(router, sys.stdin.buffer, sys.stdout.buffer)
+    else:
+        with open(args.key_file, 'rb') as f:
+            assign_keys(router, f, sys.stdout.buffer)
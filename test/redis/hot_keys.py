@@ -0,0 +1,271 @@
+# encoding: utf-8
+import argparse
+import concurrent.futures
+import hashlib
+import heapq
+import logging
+import re
+import time
+from typing import Dict, List, Tuple
+
+from redis.exceptions import ResponseError
+
+from cluster_router import Node, NodeClients, RateLimiter, SlotRouter
+from key_stats import TopKeys
+from slot import key_hash_slot
+
+# 找出集群里每个master上的热点key
+# 先CONFIG GET maxmemory-policy看节点是不是LFU策略：
+# 1. LFU节点：SCAN采样，pipeline批量OBJECT FREQ拿到每个key的对数访问计数，保留计数最大的候选；
+#    间隔--confirm-seconds后再读一次候选的计数，按计数增长反推这段时间的访问次数，估算ops/s。
+#    计数是对数的(lfu-log-factor)，计数越大一次增长代表的访问越多，估算只能看量级
+# 2. 其他节点：开一个MONITOR连接，最多抓--monitor-seconds秒/--monitor-max-lines行，
+#    用Count-Min sketch计数，同时维护top k候选，ops/s = 次数 / 抓取时长。MONITOR本身会拖慢节点，窗口不要开太长
+# 输出每个节点的top k热点key、slot和估算的ops/s，用来判断要不要迁移slot或者加客户端缓存
+# usage: python3 hot_keys.py --host 10.0.21.150 --top 20
+#        python3 hot_keys.py --host 10.0.21.150 --method monitor --monitor-seconds 5
+
+LFU_INIT_VAL = 5
+
+# 没有key参数的命令
+NO_KEY_COMMANDS = {
+    'ping', 'info', 'config', 'cluster', 'client', 'select', 'auth', 'hello', 'monitor', 'slowlog', 'scan',
+    'dbsize', 'time', 'command', 'multi', 'exec', 'discard', 'script', 'eval', 'evalsha', 'publish', 'subscribe',
+    'psubscribe', 'unsubscribe', 'punsubscribe', 'memory', 'latency', 'echo', 'readonly', 'readwrite', 'role',
+    'replconf', 'psync', 'sync', 'flushdb', 'flushall', 'randomkey', 'wait', 'quit', 'debug', 'lastsave',
+}
+# 所有参数都是key的命令
+MULTI_KEY_COMMANDS = {'mget', 'del', 'unlink', 'exists', 'touch', 'watch'}
+
+_MONITOR_ARG = re.compile(rb'"((?:[^"\\]|\\.)*)"')
+_ESCAPE = re.compile(rb'\\(x[0-9a-fA-F]{2}|.)', re.S)
+_ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'a': b'\a', b'b': b'\b'}
+
+
+def _unescape(value: bytes) -> bytes:
+    def replace(match):
+        escaped = match.group(1)
+        if escaped[:1] == b'x' and len(escaped) == 3:
+            return bytes([int(escaped[1:], 16)])
+        return _ESCAPES.get(escaped, escaped)
+
+    return _ESCAPE.sub(replace, value) if b'\\' in value else value
+
+
+def parse_monitor_line(line: bytes) -> List[bytes]:
+    """1700000000.123456 [0 127.0.0.1:5555] "hincrby" "k1" "f1" -> 命令涉及的key"""
+    _, _, args = line.partition(b'] ')
+    args = _MONITOR_ARG.findall(args)
+    if len(args) < 2:
+        return []
+    command = args[0].decode('utf-8', 'replace').lower()
+    if command in NO_KEY_COMMANDS:
+        return []
+    if command in MULTI_KEY_COMMANDS:
+        return [_unescape(arg) for arg in args[1:]]
+    if command == 'mset':
+        return [_unescape(arg) for arg in args[1::2]]
+    return [_unescape(args[1])]
+
+
+def lfu_hits(counter: int, log_factor: int) -> float:
+    """LFU计数从初始值涨到counter平均需要的访问次数，计数c涨到c+1的概率是1/((c-5)*factor+1)"""
+    n = max(counter - LFU_INIT_VAL, 0)
+    return n + log_factor * n * (n - 1) / 2
+
+
+class CountMinSketch:
+    def __init__(self, width: int = 1 << 16, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self.rows = [[0] * width for _ in range(depth)]
+        # 每行用不同salt的blake2b，各行的hash相互独立；
+        # 不能用crc32换初始值，crc是线性的，等长的key在一行冲突就在每一行都冲突
+        self.salts = [row.to_bytes(hashlib.blake2b.SALT_SIZE, 'little') for row in range(depth)]
+
+    def indexes(self, key: bytes) -> List[int]:
+        return [int.from_bytes(hashlib.blake2b(key, digest_size=8, salt=salt).digest(), 'little') % self.width
+                for salt in self.salts]
+
+    def add(self, key: bytes, count: int = 1) -> int:
+        """计数并返回估计值(只会高估不会低估)"""
+        estimate = None
+        for row, index in zip(self.rows, self.indexes(key)):
+            row[index] += count
+            if estimate is None or row[index] < estimate:
+                estimate = row[index]
+        return estimate
+
+
+class HeavyHitters:
+    """Count-Min sketch + 候选集合，保留估计次数最大的k个key"""
+
+    def __init__(self, k: int = 20, width: int = 1 << 16, depth: int = 4):
+        self.k = k
+        self.sketch = CountMinSketch(width, depth)
+        self.candidates: Dict[bytes, int] = {}
+        self.total = 0
+
+    def add(self, key: bytes):
+        self.total += 1
+        estimate = self.sketch.add(key)
+        if key in self.candidates or len(self.candidates) < self.k:
+            self.candidates[key] = estimate
+            return
+        weakest = min(self.candidates, key=self.candidates.get)
+        if estimate > self.candidates[weakest]:
+            del self.candidates[weakest]
+            self.candidates[key] = estimate
+
+    def items(self) -> List[Tuple[int, bytes]]:
+        return sorted(((count, key) for key, count in self.candidates.items()), reverse=True)
+
+
+class HotKeyDetector:
+    def __init__(self, clients: NodeClients, args):
+        self.clients = clients
+        self.args = args
+
+    def node_policy(self, node: Node) -> Tuple[str, int]:
+        """返回(maxmemory-policy, lfu-log-factor)，CONFIG被禁用时返回空策略"""
+        client = self.clients.get(node)
+        try:
+            config = client.config_get('maxmemory-policy')
+            config.update(client.config_get('lfu-log-factor'))
+        except ResponseError as e:
+            logging.warning(f'{node[0]}:{node[1]} CONFIG GET failed, falling back to MONITOR: {str(e)}')
+            return '', 10
+        return config.get('maxmemory-policy', ''), int(config.get('lfu-log-factor', 10))
+
+    def _read_freq(self, client, keys: List[bytes]) -> List:
+        pipeline = client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.execute_command('OBJECT', 'FREQ', key)
+        return pipeline.execute(raise_on_error=False)
+
+    def sample_lfu(self, node: Node, log_factor: int) -> List[Tuple[float, bytes, int, str]]:
+        args = self.args
+        client = self.clients.get(node)
+        limiter = RateLimiter(args.max_keys_per_sec)
+        # 多留一些候选，第二次读计数后重新排序
+        top = TopKeys(args.top * 4)
+        sampled = 0
+        cursor = 0
+        while True:
+            cursor, keys = client.scan(cursor=cursor, match=args.match, count=args.scan_count)
+            if keys:
+                limiter.acquire(len(keys))
+                for key, freq in zip(keys, self._read_freq(client, keys)):
+                    # scan之后被删掉的key
+                    if isinstance(freq, int):
+                        top.add(key, freq)
+                sampled += len(keys)
+            if cursor == 0 or (args.sample_keys and sampled >= args.sample_keys):
+                break
+        candidates = [(freq, key) for freq, key, _, _ in top.items()]
+        if not candidates:
+            return []
+        time.sleep(args.confirm_seconds)
+        result = []
+        second = self._read_freq(client, [key for _, key in candidates])
+        for (freq, key), freq2 in zip(candidates, second):
+            if not isinstance(freq2, int):
+                continue
+            # 计数只会因为衰减变小，变小了按没有访问算
+            delta = max(lfu_hits(freq2, log_factor) - lfu_hits(freq, log_factor), 0)
+            result.append((delta / args.confirm_seconds, key, freq2, 'lfu'))
+        result.sort(reverse=True)
+        logging.info(f'{node[0]}:{node[1]} lfu sampled {sampled} keys')
+        return result[:args.top]
+
+    def capture_monitor(self, node: Node) -> List[Tuple[float, bytes, int, str]]:
+        args = self.args
+        client = self.clients.get(node)
+        heavy = HeavyHitters(args.top, args.sketch_width, args.sketch_depth)
+        connection = client.connection_pool.get_connection('MONITOR')
+        lines = 0
+        start = time.monotonic()
+        deadline = start + args.monitor_seconds
+        try:
+            connection.send_command('MONITOR')
+            connection.read_response()
+            while lines < args.monitor_max_lines and time.monotonic() < deadline:
+                if not connection.can_read(timeout=0.5):
+                    continue
+                line = connection.read_response()
+                lines += 1
+                for key in parse_monitor_line(line):
+                    heavy.add(key)
+        finally:
+            # MONITOR连接不能再放回连接池复用
+            connection.disconnect()
+            client.connection_pool.release(connection)
+        elapsed = max(time.monotonic() - start, 1e-6)
+        logging.info(f'{node[0]}:{node[1]} monitor captured {lines} commands, {heavy.total} key accesses '
+                     f'in {elapsed:.1f}s')
+        return [(count / elapsed, key, count, 'monitor') for count, key in heavy.items()]
+
+    def detect(self, node: Node) -> List[Tuple[float, bytes, int, str]]:
+        method = self.args.method
+        log_factor = 10
+        if method == 'auto':
+            policy, log_factor = self.node_policy(node)
+            method = 'lfu' if 'lfu' in policy else 'monitor'
+        elif method == 'lfu':
+            _, log_factor = self.node_policy(node)
+        if method == 'lfu':
+            return self.sample_lfu(node, log_factor)
+        return self.capture_monitor(node)
+
+
+def print_hot_keys(node: Node, hot: List[Tuple[float, bytes, int, str]]):
+    print(f"\n{'=' * 100}")
+    print(f'{node[0]}:{node[1]}')
+    print(f"{'ops/s':>12}{'count/freq':>12}{'slot':>8}  {'method':<9}key")
+    for ops, key, count, method in hot:
+        print(f"{ops:>12.1f}{count:>12}{key_hash_slot(key):>8}  {method:<9}{key.decode('utf-8', 'replace')}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='find hot keys on every master')
+    parser.add_argument('--host', type=str, help='redis集群中随机一个节点的ip', required=True)
+    parser.add_argument('-p', '--port', type=int, help='redis port', default=6379)
+    parser.add_argument('-a', '--password', type=str, help='redis password', default=None)
+    parser.add_argument('--method', type=str, choices=['auto', 'lfu', 'monitor'], default='auto',
+                        help='auto uses OBJECT FREQ on LFU nodes and MONITOR on the others')
+    parser.add_argument('--top', type=int, help='hot keys shown per node', default=20)
+    parser.add_argument('-m', '--match', type=str, help='lfu: scan match', default='*')
+    parser.add_argument('-b', '--scan-count', type=int, help='lfu: scan count', default=1000)
+    parser.add_argument('--sample-keys', type=int, help='lfu: max keys sampled per node, 0 means all', default=100000)
+    parser.add_argument('--max-keys-per-sec', type=float, help='lfu: max keys sampled per second per node',
+                        default=20000)
+    parser.add_argument('--confirm-seconds', type=float, help='lfu: interval between the two counter reads',
+                        default=10)
+    parser.add_argument('--monitor-seconds', type=float, help='monitor: capture window per node', default=5)
+    parser.add_argument('--monitor-max-lines', type=int, help='monitor: stop after this many commands',
+                        default=1000000)
+    parser.add_argument('--sketch-width', type=int, help='monitor: count-min sketch width', default=1 << 16)
+    parser.add_argument('--sketch-depth', type=int, help='monitor: count-min sketch depth', default=4)
+    parser.add_argument('--max-workers', type=int, help='max nodes sampled concurrently', default=8)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    router = SlotRouter.from_seed(args.host, args.port, args.password)
+    clients = NodeClients(args.password, max_connections=2)
+    detector = HotKeyDetector(clients, args)
+    results: Dict[Node, List] = {}
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+            futures = {executor.submit(detector.detect, node): node for node in router.masters()}
+            for future in concurrent.futures.as_completed(futures):
+                results[futures[future]] = future.result()
+    finally:
+        clients.close()
+
+    for node in sorted(results):
+        print_hot_keys(node, results[node])
+    overall = heapq.nlargest(args.top, ((ops, key, node) for node, hot in results.items()
+                                        for ops, key, _, _ in hot))
+    print(f"\n{'=' * 100}\ncluster top {args.top}")
+    for ops, key, node in overall:
+        print(f"{ops:>12.1f}{key_hash_slot(key):>8}  {node[0]}:{node[1]:<6} {key.decode('utf-8', 'replace')}")
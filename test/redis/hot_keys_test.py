@@ -0,0 +1,61 @@
+import binascii
+import unittest
+
+from hot_keys import CountMinSketch, HeavyHitters, parse_monitor_line
+
+
+class TestCountMinSketch(unittest.TestCase):
+    def test_rows_are_independent(self):
+        sketch = CountMinSketch(1 << 16, 4)
+        a, b = b'user:0001623', b'user:0008000'
+        # 这两个key用crc32换初始值的做法在每一行都冲突
+        def crc_indexes(key):
+            return [binascii.crc32(key, seed * 0x9E3779B1 & 0xFFFFFFFF) % sketch.width for seed in range(4)]
+
+        self.assertEqual(crc_indexes(a), crc_indexes(b))
+        self.assertNotEqual(sketch.indexes(a), sketch.indexes(b))
+        sketch.add(a, 1000)
+        self.assertEqual(sketch.add(b), 1)
+
+    def test_estimates_never_low(self):
+        # 宽度很小，冲突很多，估计值只会偏大
+        sketch = CountMinSketch(64, 4)
+        counts = {b'key:%d' % i: i % 7 + 1 for i in range(500)}
+        for key, count in counts.items():
+            sketch.add(key, count)
+        for key, count in counts.items():
+            self.assertGreaterEqual(sketch.add(key, 0), count)
+        self.assertEqual(len(sketch.indexes(b'x')), 4)
+
+    def test_heavy_hitters(self):
+        heavy = HeavyHitters(k=3, width=1024)
+        for i in range(2000):
+            heavy.add(b'cold:%d' % i)
+            if i % 4 == 0:
+                heavy.add(b'hot:a')
+            if i % 8 == 0:
+                heavy.add(b'hot:b')
+        self.assertEqual([key for _, key in heavy.items()[:2]], [b'hot:a', b'hot:b'])
+        # 估计值只会偏大
+        self.assertGreaterEqual(heavy.items()[0][0], 500)
+        self.assertEqual(heavy.total, 2750)
+
+
+class TestParseMonitorLine(unittest.TestCase):
+    def test_commands(self):
+        prefix = b'1700000000.123456 [0 127.0.0.1:5555] '
+        self.assertEqual(parse_monitor_line(prefix + b'"hincrby" "k1" "f1" "1"'), [b'k1'])
+        self.assertEqual(parse_monitor_line(prefix + b'"MGET" "a" "b" "c"'), [b'a', b'b', b'c'])
+        self.assertEqual(parse_monitor_line(prefix + b'"mset" "a" "1" "b" "2"'), [b'a', b'b'])
+        self.assertEqual(parse_monitor_line(prefix + b'"ping"'), [])
+        self.assertEqual(parse_monitor_line(prefix + b'"config" "get" "maxmemory"'), [])
+        self.assertEqual(parse_monitor_line(b'OK'), [])
+
+    def test_escapes(self):
+        prefix = b'1700000000.123456 [0 unix:/tmp/redis.sock] '
+        self.assertEqual(parse_monitor_line(prefix + rb'"get" "a\"b\\c\x01\n"'), [b'a"b\\c\x01\n'])
+        self.assertEqual(parse_monitor_line(prefix + b'"set" "k y" "v"'), [b'k y'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,26 +1,200 @@
 # encoding: utf-8
-import redis
+import argparse
+import logging
+import socket
+import sys
+import time
+from typing import Dict, List
+
+from cluster_router import Node, SlotRouter
+
+# 批量刷入redis数据(mass insertion)
+# 流式读文件，不经过redis-py的命令构建，直接在一个复用的bytearray里编码RESP协议，写到socket上
+# 同一个key的多个member合并成一条变长的SADD key m1 m2 ...，回复数量有上限，避免把服务端的输出缓冲区撑爆
+# 文件格式：
+#   --key k1       每行是一个member，全部写进同一个set(原来的用法)
+#   不指定--key     每行是"key member"，按--sep分隔
+# usage: python3 input.py --host 127.0.0.1 -p 6379 -f /tmp/brand_user_id.sql --key k1
+#        python3 input.py --host 10.0.21.150 -p 6379 -f /tmp/key_member.txt --cluster
+
+
+def encode_command(buf: bytearray, args: List[bytes]):
+    """把一条命令按RESP数组编码追加到buf"""
+    buf += b'*%d\r\n' % len(args)
+    for arg in args:
+        buf += b'$%d\r\n' % len(arg)
+        buf += arg
+        buf += b'\r\n'
+
+
+class RespWriter:
+    """单个节点的写连接，记录在途的命令数，超过上限就先读回复"""
+
+    def __init__(self, node: Node, password: str = None, max_inflight: int = 1000, flush_bytes: int = 1 << 16,
+                 connect_timeout: int = 5):
+        self.node = node
+        self.max_inflight = max_inflight
+        self.flush_bytes = flush_bytes
+        self.sock = socket.create_connection(node, timeout=connect_timeout)
+        self.sock.settimeout(None)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buf = bytearray()
+        self.pending = b''
+        self.inflight = 0
+        self.added = 0
+        self.errors = 0
+        if password:
+            self.send([b'AUTH', password.encode('utf-8')])
+            self.drain()
+            if self.errors:
+                raise ConnectionError(f'AUTH failed on {node[0]}:{node[1]}')
+
+    def send(self, args: List[bytes]):
+        encode_command(self.buf, args)
+        self.inflight += 1
+        if len(self.buf) >= self.flush_bytes:
+            self.flush()
+        if self.inflight > self.max_inflight:
+            self.flush()
+            self._read_replies(self.max_inflight // 2)
+
+    def flush(self):
+        if self.buf:
+            self.sock.sendall(self.buf)
+            # 清空但保留已分配的内存
+            del self.buf[:]
+
+    def _read_replies(self, target: int):
+        """读回复直到在途命令数不超过target。SADD/AUTH的回复都是单行的(:n/+OK/-ERR)"""
+        while self.inflight > target:
+            data = self.sock.recv(1 << 16)
+            if not data:
+                raise ConnectionError(f'connection closed by {self.node[0]}:{self.node[1]}')
+            lines = (self.pending + data).split(b'\r\n')
+            self.pending = lines.pop()
+            for line in lines:
+                self.inflight -= 1
+                if line[:1] == b':':
+                    self.added += int(line[1:])
+                elif line[:1] == b'-':
+                    self.errors += 1
+                    if self.errors <= 10:
+                        logging.error(f"{self.node[0]}:{self.node[1]} replied {line.decode('utf-8', 'replace')}")
+
+    def drain(self):
+        self.flush()
+        self._read_replies(0)
+
+    def close(self):
+        self.sock.close()
+
+
+class BulkLoader:
+    def __init__(self, targets: Dict[Node, RespWriter], router: SlotRouter = None, members_per_command: int = 500,
+                 max_pending_keys: int = 10000):
+        self.targets = targets
+        self.router = router
+        self.members_per_command = members_per_command
+        self.max_pending_keys = max_pending_keys
+        # key -> 还没发出去的member
+        self.pending: Dict[bytes, List[bytes]] = {}
+        self.commands = 0
+
+    def _writer(self, key: bytes) -> RespWriter:
+        if self.router is None:
+            return next(iter(self.targets.values()))
+        return self.targets[self.router.node_for_key(key)]
+
+    def _emit(self, key: bytes, members: List[bytes]):
+        self._writer(key).send([b'SADD', key] + members)
+        self.commands += 1
+
+    def add(self, key: bytes, member: bytes):
+        members = self.pending.get(key)
+        if members is None:
+            if len(self.pending) >= self.max_pending_keys:
+                self.flush_pending()
+            members = self.pending[key] = []
+        members.append(member)
+        if len(members) >= self.members_per_command:
+            self._emit(key, members)
+            del self.pending[key]
+
+    def flush_pending(self):
+        for key, members in self.pending.items():
+            self._emit(key, members)
+        self.pending.clear()
+
+    def finish(self):
+        self.flush_pending()
+        for writer in self.targets.values():
+            writer.drain()
+
+
+def report(lines: int, loader: BulkLoader, start: float, final: bool = False):
+    duration = time.time() - start
+    rate = lines / duration if duration > 0 else 0
+    msg = f'lines={lines} commands={loader.commands} rate={rate:.0f} lines/s'
+    if final:
+        added = sum(w.added for w in loader.targets.values())
+        errors = sum(w.errors for w in loader.targets.values())
+        msg += f' added={added} errors={errors} duration={duration:.2f}s'
+    logging.info(msg)
 
-# 批量刷入redis数据
 
 if __name__ == '__main__':
-    source_host = "127.0.0.1"
-    port = 6379
-    conn = redis.Redis(host=source_host, port=port, db=0)
-    with open('/Users/jiayun/Downloads/tmp/brand_user_id.sql', 'r') as file:
-        lines = file.readlines()
-        print(len(lines))
-        count = 0
-        pipeline = conn.pipeline()
-        batch = 1
-        for line in lines:
-            count = count + 1
-            line = line.replace("\n", "")
-            pipeline.sadd("k1", line)
-            if count > 10000:
-                print(f'batch={batch}')
-                pipeline.execute()
-                count = 0
-                batch = batch + 1
-                pipeline = conn.pipeline()
-        pipeline.execute()
+    parser = argparse.ArgumentParser(description='bulk load set members with raw RESP')
+    parser.add_argument('-host', '--hostname', type=str, help='redis hostname', default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, help='redis port', default=6379)
+    parser.add_argument('-a', '--password', type=str, help='redis password', default=None)
+    parser.add_argument('-f', '--file', type=str, help='input file', required=True)
+    parser.add_argument('-k', '--key', type=str, help='put every line into this set', default=None)
+    parser.add_argument('-s', '--sep', type=str, help='separator of "key member" lines', default=' ')
+    parser.add_argument('-c', '--cluster', action='store_true', help='route keys by slot to cluster masters')
+    parser.add_argument('-m', '--members_per_command', type=int, help='members per SADD', default=500)
+    parser.add_argument('-i', '--max_inflight', type=int, help='max commands without reply per node', default=1000)
+    parser.add_argument('-r', '--report_interval', type=int, help='progress report interval in seconds', default=5)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.members_per_command <= 0 or args.max_inflight <= 0:
+        print('members_per_command and max_inflight must greater than 0')
+        sys.exit(1)
+
+    router = None
+    if args.cluster:
+        router = SlotRouter.from_seed(args.hostname, args.port, args.password)
+        nodes = router.masters()
+    else:
+        nodes = [(args.hostname, args.port)]
+    writers = {node: RespWriter(node, args.password, args.max_inflight) for node in nodes}
+    loader = BulkLoader(writers, router, args.members_per_command)
+
+    fixed_key = args.key.encode('utf-8') if args.key else None
+    sep = args.sep.encode('utf-8')
+    start = time.time()
+    last_report = start
+    count = 0
+    try:
+        with open(args.file, 'rb') as file:
+            for line in file:
+                line = line.rstrip(b'\r\n')
+                if not line:
+                    continue
+                if fixed_key is not None:
+                    loader.add(fixed_key, line)
+                else:
+                    key, _, member = line.partition(sep)
+                    if not member:
+                        logging.warning(f'skip line without member: {line[:100]!r}')
+                        continue
+                    loader.add(key, member)
+                count += 1
+                if count % 100000 == 0 and time.time() - last_report >= args.report_interval:
+                    last_report = time.time()
+                    report(count, loader, start)
+        loader.finish()
+        report(count, loader, start, final=True)
+    finally:
+        for writer in writers.values():
+            writer.close()
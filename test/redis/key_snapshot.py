@@ -0,0 +1,233 @@
+# encoding: utf-8
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from queue import Queue
+from typing import Iterator, List, Optional, Tuple
+
+# 删除前快照的segment文件格式，redis_delete_prefix_keys.py写，snapshot_restore.py读
+# 文件头: MAGIC
+# 之后是若干block: 4字节大端长度 + zlib压缩后的数据，一个block对应删除时的一个pipeline批次
+# block解压后是连续的记录: 4字节key长度 + key + 8字节过期时间(绝对毫秒时间戳，-1表示不过期) + 4字节value长度 + DUMP结果
+# 每个segment写满segment_bytes后换下一个文件，restore时按文件并发
+# 写segment出错后剩下的block不压缩，写进spill文件(文件头SPILL_MAGIC，block格式相同只是数据没有压缩)，restore一样能读
+
+MAGIC = b'RDSNAP1\n'
+SPILL_MAGIC = b'RDSNAPR\n'
+_BLOCK_HEADER = struct.Struct('>I')
+_KEY_LEN = struct.Struct('>I')
+_EXPIRE_VALUE_LEN = struct.Struct('>qI')
+
+# (key, 过期时间绝对毫秒或-1, DUMP结果)
+SnapshotRecord = Tuple[bytes, int, bytes]
+
+
+def encode_records(records: List[SnapshotRecord]) -> bytes:
+    parts = []
+    for key, expire_at_ms, payload in records:
+        parts.append(_KEY_LEN.pack(len(key)))
+        parts.append(key)
+        parts.append(_EXPIRE_VALUE_LEN.pack(expire_at_ms, len(payload)))
+        parts.append(payload)
+    return b''.join(parts)
+
+
+def decode_records(data: bytes) -> Iterator[SnapshotRecord]:
+    pos = 0
+    end = len(data)
+    while pos < end:
+        (key_len,) = _KEY_LEN.unpack_from(data, pos)
+        pos += _KEY_LEN.size
+        key = data[pos:pos + key_len]
+        pos += key_len
+        expire_at_ms, value_len = _EXPIRE_VALUE_LEN.unpack_from(data, pos)
+        pos += _EXPIRE_VALUE_LEN.size
+        yield key, expire_at_ms, data[pos:pos + value_len]
+        pos += value_len
+
+
+def read_segment(path: str) -> Iterator[List[SnapshotRecord]]:
+    """按block读segment文件，每次返回一个block里的所有记录"""
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+        if magic not in (MAGIC, SPILL_MAGIC):
+            raise ValueError(f'{path} is not a snapshot segment')
+        decompress = zlib.decompress if magic == MAGIC else bytes
+        while True:
+            header = f.read(_BLOCK_HEADER.size)
+            if not header:
+                return
+            if len(header) < _BLOCK_HEADER.size:
+                raise ValueError(f'{path} is truncated')
+            (size,) = _BLOCK_HEADER.unpack(header)
+            block = f.read(size)
+            if len(block) < size:
+                # 写到一半进程被杀，前面完整的block仍然可以恢复
+                logging.warning(f'{path} has a truncated last block, {size - len(block)} bytes missing')
+                return
+            yield list(decode_records(decompress(block)))
+
+
+def list_segments(directory: str) -> List[str]:
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.seg'))
+
+
+class ByteBudget:
+    """限制还没写到磁盘的快照总字节数，超过预算时生产者阻塞"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, n: int):
+        with self.condition:
+            # 单个批次比预算还大时也放行，否则会永远等下去
+            while self.used and self.used + n > self.limit:
+                self.condition.wait()
+            self.used += n
+
+    def release(self, n: int):
+        with self.condition:
+            self.used -= n
+            self.condition.notify_all()
+
+
+class SnapshotWriter:
+    """
+        后台线程把批次压缩后写成segment文件，删除线程只负责把DUMP结果放进队列，压缩和写盘和删除重叠执行
+        多个写线程各自写自己的segment序列，zlib压缩时会释放GIL
+    """
+
+    def __init__(self, directory: str, segment_bytes: int = 256 * 1024 * 1024,
+                 max_buffer_bytes: int = 64 * 1024 * 1024, threads: int = 2, level: int = 1,
+                 spill_dir: str = None):
+        """spill_dir: 写segment出错后剩下的block写到这里，默认和directory相同"""
+        self.directory = directory
+        self.spill_dir = spill_dir or directory
+        self.segment_bytes = segment_bytes
+        self.level = level
+        self.budget = ByteBudget(max_buffer_bytes)
+        self.queue: Queue = Queue()
+        self.error: Optional[Exception] = None
+        self.stats = {'keys': 0, 'raw_bytes': 0, 'written_bytes': 0, 'segments': 0, 'spilled_keys': 0,
+                      'lost_keys': 0}
+        self.stats_lock = threading.Lock()
+        self.prefix = time.strftime('%Y%m%d%H%M%S')
+        os.makedirs(directory, exist_ok=True)
+        os.makedirs(self.spill_dir, exist_ok=True)
+        self.threads = [threading.Thread(target=self._run, args=(i,), name=f'snapshot-writer-{i}', daemon=True)
+                        for i in range(threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def add(self, records: List[SnapshotRecord]) -> Future:
+        return self.add_block(encode_records(records), len(records))
+
+    def add_block(self, data: bytes, keys: int) -> Future:
+        """
+            放进一段已经按记录格式编码好的数据，内存预算用完时阻塞；写线程出错后抛出异常，调用方应该停止删除
+            返回的Future在这个block写进segment或者spill文件(交给操作系统)之后完成，两个都没写成功时是异常
+        """
+        if self.error is not None:
+            raise RuntimeError(f'snapshot writer failed: {self.error}')
+        written = Future()
+        if not keys:
+            written.set_result(None)
+            return written
+        self.budget.acquire(len(data))
+        self.queue.put((data, keys, written))
+        return written
+
+    def _open_segment(self, index: int, seq: int):
+        path = os.path.join(self.directory, f'{self.prefix}-{index}-{seq:05d}.seg')
+        f = open(path, 'wb')
+        f.write(MAGIC)
+        with self.stats_lock:
+            self.stats['segments'] += 1
+        return f
+
+    def _spill(self, index: int, spill, raw: bytes, keys: int):
+        """segment写不了之后的block原样追加到spill文件，返回打开的spill文件"""
+        if spill is None:
+            path = os.path.join(self.spill_dir, f'{self.prefix}-{index}-spill.seg')
+            spill = open(path, 'wb')
+            spill.write(SPILL_MAGIC)
+            logging.error(f'snapshot writer {index} spills the remaining blocks to {path}')
+        spill.write(_BLOCK_HEADER.pack(len(raw)))
+        spill.write(raw)
+        spill.flush()
+        with self.stats_lock:
+            self.stats['spilled_keys'] += keys
+        return spill
+
+    def _run(self, index: int):
+        seq = 0
+        f = spill = None
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+                raw, keys, written = item
+                size = len(raw)
+                try:
+                    # 这批key已经删掉了，出错后也不能丢：后面的block都写spill文件
+                    if self.error is None:
+                        try:
+                            data = zlib.compress(raw, self.level)
+                            if f is None or f.tell() >= self.segment_bytes:
+                                if f is not None:
+                                    f.close()
+                                f = self._open_segment(index, seq)
+                                seq += 1
+                            f.write(_BLOCK_HEADER.pack(len(data)))
+                            f.write(data)
+                            f.flush()
+                            with self.stats_lock:
+                                self.stats['keys'] += keys
+                                self.stats['raw_bytes'] += size
+                                self.stats['written_bytes'] += len(data) + _BLOCK_HEADER.size
+                            written.set_result(None)
+                            continue
+                        except Exception as e:
+                            logging.error(f'snapshot writer {index} failed: {str(e)}')
+                            self.error = e
+                    spill = self._spill(index, spill, raw, keys)
+                    written.set_result(None)
+                except Exception as e:
+                    logging.error(f'snapshot writer {index} lost {keys} keys: {str(e)}')
+                    with self.stats_lock:
+                        self.stats['lost_keys'] += keys
+                    written.set_exception(e)
+                finally:
+                    self.budget.release(size)
+        finally:
+            for opened in (f, spill):
+                if opened is not None:
+                    try:
+                        opened.flush()
+                        os.fsync(opened.fileno())
+                        opened.close()
+                    except OSError as e:
+                        logging.error(f'snapshot writer {index} failed to close {opened.name}: {str(e)}')
+                        if self.error is None:
+                            self.error = e
+
+    def close(self):
+        """等队列里的批次全部写完"""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        logging.info(f"Snapshot written to {self.directory}: keys={self.stats['keys']} "
+                     f"raw={self.stats['raw_bytes']} written={self.stats['written_bytes']} "
+                     f"segments={self.stats['segments']} spilled_keys={self.stats['spilled_keys']} "
+                     f"lost_keys={self.stats['lost_keys']}")
+        if self.error is not None:
+            raise RuntimeError(f"snapshot writer failed: {self.error}, {self.stats['spilled_keys']} keys spilled to "
+                               f"{self.spill_dir}, {self.stats['lost_keys']} keys lost")
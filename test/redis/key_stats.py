@@ -0,0 +1,178 @@
+# encoding: utf-8
+import heapq
+import re
+from typing import Dict, List, Optional, Tuple
+
+# 按前缀统计key的数量、内存和过期时间，在线扫描(scan_memory.py)和离线rdb分析(rdb_analyzer.py)共用同一份报告格式
+# key按分隔符切成多段，前depth段组成前缀树；纯数字、uuid、长hex这种id段归一成*，避免每个id都长出一个节点
+
+TTL_BUCKETS = [('<1h', 3600), ('<1d', 86400), ('<7d', 7 * 86400), ('>=7d', None)]
+OTHER = '...'
+_ID_SEGMENT = re.compile(r'^(\d+|[0-9a-fA-F]{16,}|[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12})$')
+
+
+def ttl_bucket(ttl_ms: int) -> str:
+    """ttl_ms小于0表示没有过期时间"""
+    if ttl_ms < 0:
+        return 'no_ttl'
+    for name, limit in TTL_BUCKETS:
+        if limit is None or ttl_ms < limit * 1000:
+            return name
+    return TTL_BUCKETS[-1][0]
+
+
+def format_bytes(size: float) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size) < 1024:
+            return f'{size:.1f}{unit}'
+        size /= 1024
+    return f'{size:.1f}TB'
+
+
+class PrefixNode:
+    __slots__ = ('children', 'count', 'memory', 'ttl')
+
+    def __init__(self):
+        self.children: Dict[str, 'PrefixNode'] = {}
+        self.count = 0
+        self.memory = 0
+        self.ttl: Dict[str, int] = {}
+
+    def add(self, memory: int, bucket: str, count: int = 1):
+        self.count += count
+        self.memory += memory
+        self.ttl[bucket] = self.ttl.get(bucket, 0) + count
+
+
+class PrefixTree:
+    def __init__(self, delimiters: str = ':', depth: int = 3, max_children: int = 1000):
+        self.delimiters = delimiters
+        self.depth = depth
+        self.max_children = max_children
+        self.root = PrefixNode()
+        self.types: Dict[str, List[int]] = {}
+        self._splitter = re.compile('([' + re.escape(delimiters) + '])') if delimiters else None
+
+    def split(self, key: str) -> List[str]:
+        """切出前depth段前缀，每段带上它后面的分隔符，例如user:123:name -> ['user:', '*:']"""
+        if self._splitter is None:
+            return []
+        parts = self._splitter.split(key, maxsplit=self.depth)
+        segments = []
+        # parts是[段, 分隔符, 段, 分隔符, ..., 剩余部分]，最后没有分隔符的部分不算前缀
+        for i in range(0, len(parts) - 1, 2):
+            segment = parts[i]
+            if _ID_SEGMENT.match(segment):
+                segment = '*'
+            segments.append(segment + parts[i + 1])
+        return segments
+
+    def add(self, key, memory: int, ttl_ms: int = -1, key_type: str = None):
+        if isinstance(key, bytes):
+            key = key.decode('utf-8', 'backslashreplace')
+        bucket = ttl_bucket(ttl_ms)
+        node = self.root
+        node.add(memory, bucket)
+        for segment in self.split(key):
+            child = node.children.get(segment)
+            if child is None:
+                # 子节点太多时归到同一个兜底节点里
+                if len(node.children) >= self.max_children:
+                    segment = OTHER
+                    child = node.children.get(segment)
+                if child is None:
+                    child = node.children[segment] = PrefixNode()
+            child.add(memory, bucket)
+            node = child
+            if segment == OTHER:
+                break
+        if key_type is not None:
+            stat = self.types.setdefault(key_type, [0, 0])
+            stat[0] += 1
+            stat[1] += memory
+
+    def merge(self, other: 'PrefixTree'):
+        def merge_node(dst: PrefixNode, src: PrefixNode):
+            dst.count += src.count
+            dst.memory += src.memory
+            for bucket, count in src.ttl.items():
+                dst.ttl[bucket] = dst.ttl.get(bucket, 0) + count
+            for segment, child in src.children.items():
+                merge_node(dst.children.setdefault(segment, PrefixNode()), child)
+
+        merge_node(self.root, other.root)
+        for key_type, (count, memory) in other.types.items():
+            stat = self.types.setdefault(key_type, [0, 0])
+            stat[0] += count
+            stat[1] += memory
+
+    def rows(self, min_share: float = 0.01) -> List[Tuple[str, PrefixNode]]:
+        """前缀树展开成(前缀, 节点)，只保留内存占比不低于min_share的节点"""
+        total = self.root.memory or 1
+        result = []
+
+        def walk(prefix: str, node: PrefixNode):
+            for segment, child in sorted(node.children.items(), key=lambda item: -item[1].memory):
+                if child.memory / total < min_share:
+                    continue
+                name = prefix + segment
+                result.append((name, child))
+                walk(name, child)
+
+        walk('', self.root)
+        return result
+
+
+class TopKeys:
+    """固定大小的小顶堆，保存内存最大的k个key"""
+
+    def __init__(self, k: int = 20):
+        self.k = k
+        self.heap: List[Tuple[int, bytes, str, int]] = []
+
+    def add(self, key, memory: int, key_type: str = None, ttl_ms: int = -1):
+        self._push((memory, key, key_type or '', ttl_ms))
+
+    def _push(self, item: Tuple[int, bytes, str, int]):
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, item)
+        elif item[0] > self.heap[0][0]:
+            heapq.heappushpop(self.heap, item)
+
+    def merge(self, other: 'TopKeys'):
+        for item in other.heap:
+            self._push(item)
+
+    def items(self) -> List[Tuple[int, bytes, str, int]]:
+        return sorted(self.heap, reverse=True)
+
+
+def print_report(tree: PrefixTree, top: Optional[TopKeys] = None, min_share: float = 0.01,
+                 used_memory: int = None, title: str = 'memory by prefix'):
+    total = tree.root.memory
+    print(f"\n{'=' * 100}")
+    print(f"{title}: keys={tree.root.count} memory={format_bytes(total)}", end='')
+    if used_memory:
+        print(f" used_memory={format_bytes(used_memory)} covered={total / used_memory:.2%}", end='')
+    print()
+    print(f"{'=' * 100}")
+    print(f"{'prefix':<48}{'keys':>12}{'memory':>12}{'share':>9}{'no_ttl':>9}  ttl")
+    for name, node in tree.rows(min_share):
+        share = node.memory / total if total else 0
+        no_ttl = node.ttl.get('no_ttl', 0) / node.count if node.count else 0
+        ttl = ' '.join(f'{b}={node.ttl[b]}' for b, _ in TTL_BUCKETS if node.ttl.get(b))
+        print(f"{name + '*':<48}{node.count:>12}{format_bytes(node.memory):>12}{share:>9.2%}{no_ttl:>9.2%}  {ttl}")
+
+    if tree.types:
+        print(f"\n{'type':<16}{'keys':>12}{'memory':>12}{'share':>9}")
+        for key_type, (count, memory) in sorted(tree.types.items(), key=lambda item: -item[1][1]):
+            share = memory / total if total else 0
+            print(f"{key_type:<16}{count:>12}{format_bytes(memory):>12}{share:>9.2%}")
+
+    if top is not None and top.heap:
+        print(f"\ntop {top.k} keys by memory:")
+        for memory, key, key_type, ttl_ms in top.items():
+            if isinstance(key, bytes):
+                key = key.decode('utf-8', 'backslashreplace')
+            ttl = f'{ttl_ms / 1000:.0f}s' if ttl_ms >= 0 else '-'
+            print(f"{format_bytes(memory):>12}  {key_type:<8}{ttl:>10}  {key}")
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+keyspace列式快照：线上只SCAN一次，把每个key的元数据存成列，之后的分析都在本地查，不用每个问题重新扫一遍线上
+
+设计要点：
+1. build：和scan_memory.py一样所有master并发SCAN，每页key用pipeline执行TYPE、MEMORY USAGE、PTTL、OBJECT IDLETIME
+2. 存储：key按字节序排序后，所有key拼成一个keys.bin，offsets.npy记录每个key的起止位置；
+   slot/type/ttl/size/idle各是一个NumPy数组，用np.save存成.npy，查询时np.load(mmap_mode='r')映射进来，打开几乎不花时间
+3. 前缀查询：key是排好序的，同一个前缀的key是连续的一段，二分查找两次就得到范围，不用逐个比较
+4. 按前缀分组：build时按分隔符切出前1..depth级前缀(和scan_memory.py一样id段替换成*)，每一级存一列前缀id(prefix1.npy...)和对应的前缀表，
+   分组统计就是np.bincount，百万级key也是毫秒级
+5. TTL是快照时刻的剩余时间(毫秒，-1表示不过期)，idle是OBJECT IDLETIME(秒，maxmemory-policy是LFU时为-1)
+
+使用示例：
+python3 keyspace_snapshot.py build --host 10.74.110.58 --out ./ks_snapshot --max-keys-per-sec 5000
+python3 keyspace_snapshot.py query --dir ./ks_snapshot --prefix "user:" --type zset --ttl-lt 3600 --group-depth 2
+"""
+
+import argparse
+import concurrent.futures
+import json
+import logging
+import os
+import threading
+import time
+from array import array
+from typing import Dict, List
+
+import numpy as np
+
+from cluster_router import Node, NodeClients, RateLimiter, SlotRouter
+from key_stats import PrefixTree
+from slot import key_hash_slot
+
+TYPES = ['string', 'list', 'set', 'zset', 'hash', 'stream', 'other']
+TYPE_CODES = {name: code for code, name in enumerate(TYPES)}
+# save时每次处理的key数
+SAVE_CHUNK = 65536
+COLUMNS = {'slot': np.uint16, 'type': np.uint8, 'ttl': np.int64, 'size': np.uint64, 'idle': np.int32}
+
+
+def _key_words(data: np.ndarray, starts: np.ndarray, lengths: np.ndarray, pos: int) -> np.ndarray:
+    """每个key从pos开始的8个字节按大端拼成uint64，key不够长的部分补0"""
+    word = np.zeros(len(starts), dtype=np.uint64)
+    for j in range(8):
+        inside = lengths > pos + j
+        byte = np.zeros(len(starts), dtype=np.uint64)
+        byte[inside] = data[starts[inside] + pos + j]
+        word = (word << np.uint64(8)) | byte
+    return word
+
+
+def sort_keys(data: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+        data里拼接的key按字节序排序，返回排序后的下标，不为每个key建Python对象
+        每轮比较8个字节：只有前面的字节都相同的key(同一段)才继续比较下一个8字节，
+        补0的字节和真实的0区分不开，所以同时比较剩余长度(最多取到9，超过8的下一轮再比)
+    """
+    count = len(offsets) - 1
+    starts = offsets[:-1].astype(np.int64)
+    lengths = np.diff(offsets).astype(np.int64)
+    order = np.arange(count, dtype=np.int64)
+    # active是order里还没排好的位置(升序)，group是它们所在的段号，段是连续的，段号随位置递增
+    active = order.copy()
+    group = np.zeros(count, dtype=np.int64)
+    pos = 0
+    while len(active) > 1:
+        keys = order[active]
+        word = _key_words(data, starts[keys], lengths[keys], pos)
+        rest = np.minimum(lengths[keys] - pos, 9)
+        index = np.lexsort((rest, word, group))
+        keys, group, word, rest = keys[index], group[index], word[index], rest[index]
+        order[active] = keys
+        boundary = np.ones(len(keys), dtype=bool)
+        boundary[1:] = (group[1:] != group[:-1]) | (word[1:] != word[:-1]) | (rest[1:] != rest[:-1])
+        group = np.cumsum(boundary) - 1
+        # 只剩自己的段已经排好；剩余长度不超过8的key这一轮已经比较完了，段里剩下的都是相同的key
+        keep = (np.bincount(group)[group] > 1) & (rest > 8)
+        active, group = active[keep], group[keep]
+        pos += 8
+    return order
+
+
+class ColumnBuilder:
+    """按行追加key的元数据，save时排序并写成列文件"""
+
+    def __init__(self, delimiters: str = ':', depth: int = 2):
+        self.delimiters = delimiters
+        # 和scan_memory.py的前缀树切法一致，id段替换成*，前缀表不会随key数增长
+        self.splitter = PrefixTree(delimiters, depth)
+        self.depth = depth
+        # 所有key拼在一个bytearray里，key_ends记每个key的结束位置，千万级key也不会有千万个bytes对象
+        self.key_data = bytearray()
+        self.key_ends = array('Q')
+        self.columns = {'slot': array('H'), 'type': array('B'), 'ttl': array('q'), 'size': array('Q'),
+                        'idle': array('l')}
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.key_ends)
+
+    def add_rows(self, rows):
+        """rows: [(key, type名, ttl毫秒, size, idle秒)]"""
+        with self.lock:
+            for key, key_type, ttl, size, idle in rows:
+                self.key_data += key
+                self.key_ends.append(len(self.key_data))
+                self.columns['slot'].append(key_hash_slot(key))
+                self.columns['type'].append(TYPE_CODES.get(key_type, TYPE_CODES['other']))
+                self.columns['ttl'].append(ttl)
+                self.columns['size'].append(size)
+                self.columns['idle'].append(idle)
+
+    def save(self, directory: str, meta: dict = None):
+        os.makedirs(directory, exist_ok=True)
+        count = len(self.key_ends)
+        data = np.frombuffer(self.key_data, dtype=np.uint8)
+        ends = np.frombuffer(self.key_ends, dtype=np.uint64)
+        source_offsets = np.zeros(count + 1, dtype=np.uint64)
+        source_offsets[1:] = ends
+        order = sort_keys(data, source_offsets)
+        offsets = np.zeros(count + 1, dtype=np.uint64)
+        np.cumsum(np.diff(source_offsets)[order], out=offsets[1:])
+        np.save(os.path.join(directory, 'offsets.npy'), offsets)
+        for name, dtype in COLUMNS.items():
+            column = np.frombuffer(self.columns[name], dtype=self.columns[name].typecode).astype(dtype)
+            np.save(os.path.join(directory, f'{name}.npy'), column[order])
+        tables: List[Dict[str, int]] = [{} for _ in range(self.depth)]
+        ids = np.zeros((self.depth, count), dtype=np.uint32)
+        view = memoryview(self.key_data)
+        with open(os.path.join(directory, 'keys.bin'), 'wb') as f:
+            # 按块转成Python int，不一次性生成count个
+            for begin in range(0, count, SAVE_CHUNK):
+                chunk = order[begin:begin + SAVE_CHUNK]
+                bounds = zip(source_offsets[chunk].tolist(), source_offsets[chunk + 1].tolist())
+                for i, (start, end) in enumerate(bounds, begin):
+                    f.write(view[start:end])
+                    segments = self.splitter.split(str(view[start:end], 'utf-8', 'backslashreplace'))
+                    # 分隔符不够深的key归到它最深的那一级前缀
+                    for level, table in enumerate(tables):
+                        ids[level, i] = table.setdefault(''.join(segments[:level + 1]), len(table))
+        for level in range(self.depth):
+            np.save(os.path.join(directory, f'prefix{level + 1}.npy'), ids[level])
+        prefix_tables = [list(table) for table in tables]
+        meta = dict(meta or {}, count=count, types=TYPES, delimiters=self.delimiters,
+                    depth=self.depth, created_at=(meta or {}).get('created_at', time.time()))
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        with open(os.path.join(directory, 'prefixes.json'), 'w') as f:
+            json.dump(prefix_tables, f)
+
+
+class KeyspaceSnapshot:
+    """映射快照目录里的列文件，提供过滤和聚合"""
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, 'meta.json')) as f:
+            self.meta = json.load(f)
+        with open(os.path.join(directory, 'prefixes.json')) as f:
+            self.prefix_tables = json.load(f)
+        self.count = self.meta['count']
+        self.offsets = np.load(os.path.join(directory, 'offsets.npy'), mmap_mode='r')
+        path = os.path.join(directory, 'keys.bin')
+        self.keys = np.memmap(path, dtype=np.uint8, mode='r') if os.path.getsize(path) else np.zeros(0, np.uint8)
+        for name in COLUMNS:
+            setattr(self, name, np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r'))
+        self.prefix_ids = [np.load(os.path.join(directory, f'prefix{level + 1}.npy'), mmap_mode='r')
+                           for level in range(self.meta['depth'])]
+
+    def key(self, i: int) -> bytes:
+        return self.keys[int(self.offsets[i]):int(self.offsets[i + 1])].tobytes()
+
+    def _bisect_prefix(self, prefix: bytes, lo: int, right: bool) -> int:
+        """排好序的key截取前len(prefix)个字节之后仍然是有序的，在截取后的序列上二分"""
+        hi = self.count
+        size = len(prefix)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = int(self.offsets[mid])
+            head = self.keys[start:min(start + size, int(self.offsets[mid + 1]))].tobytes()
+            if head < prefix or (right and head == prefix):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def prefix_range(self, prefix) -> range:
+        """key排好序，前缀相同的key是连续的一段"""
+        if isinstance(prefix, str):
+            prefix = prefix.encode('utf-8')
+        start = self._bisect_prefix(prefix, 0, right=False)
+        end = self._bisect_prefix(prefix, start, right=True)
+        return range(start, end)
+
+    def select(self, prefix=None, key_type: str = None, ttl_lt: float = None, ttl_ge: float = None,
+               no_ttl: bool = False, min_size: int = None, idle_gt: int = None) -> np.ndarray:
+        """返回满足条件的key的下标。ttl单位是秒，ttl_lt/ttl_ge只匹配有过期时间的key"""
+        rows = self.prefix_range(prefix) if prefix else range(self.count)
+        window = slice(rows.start, rows.stop)
+        mask = np.ones(len(rows), dtype=bool)
+        if key_type is not None:
+            mask &= self.type[window] == TYPE_CODES[key_type]
+        ttl = self.ttl[window]
+        if ttl_lt is not None:
+            mask &= (ttl >= 0) & (ttl < ttl_lt * 1000)
+        if ttl_ge is not None:
+            mask &= ttl >= ttl_ge * 1000
+        if no_ttl:
+            mask &= ttl < 0
+        if min_size is not None:
+            mask &= self.size[window] >= min_size
+        if idle_gt is not None:
+            mask &= self.idle[window] > idle_gt
+        return np.flatnonzero(mask) + rows.start
+
+    def summary(self, rows: np.ndarray) -> dict:
+        return {'count': int(len(rows)), 'memory': int(self.size[rows].sum()) if len(rows) else 0}
+
+    def group_by_prefix(self, rows: np.ndarray, depth: int = 1, top: int = 20) -> List[dict]:
+        """按第depth级前缀统计key数和内存，按内存从大到小"""
+        ids = self.prefix_ids[depth - 1][rows]
+        table = self.prefix_tables[depth - 1]
+        counts = np.bincount(ids, minlength=len(table))
+        memory = np.bincount(ids, weights=self.size[rows].astype(np.float64), minlength=len(table))
+        order = np.argsort(memory)[::-1][:top]
+        return [{'prefix': table[i], 'count': int(counts[i]), 'memory': int(memory[i])} for i in order if counts[i]]
+
+    def group_by_type(self, rows: np.ndarray) -> List[dict]:
+        types = self.type[rows]
+        counts = np.bincount(types, minlength=len(TYPES))
+        memory = np.bincount(types, weights=self.size[rows].astype(np.float64), minlength=len(TYPES))
+        return [{'type': TYPES[i], 'count': int(counts[i]), 'memory': int(memory[i])}
+                for i in range(len(TYPES)) if counts[i]]
+
+    def top_keys(self, rows: np.ndarray, top: int = 20) -> List[dict]:
+        sizes = self.size[rows]
+        order = np.argsort(sizes)[::-1][:top]
+        return [{'key': self.key(int(rows[i])).decode('utf-8', 'backslashreplace'), 'type': TYPES[self.type[rows[i]]],
+                 'memory': int(sizes[i]), 'ttl': int(self.ttl[rows[i]])} for i in order]
+
+
+def scan_node(clients: NodeClients, node: Node, builder: ColumnBuilder, args) -> int:
+    client = clients.get(node)
+    limiter = RateLimiter(args.max_keys_per_sec)
+    scanned = 0
+    cursor = 0
+    while True:
+        cursor, keys = client.scan(cursor=cursor, match=args.match, count=args.scan_count)
+        if keys:
+            limiter.acquire(len(keys))
+            pipeline = client.pipeline(transaction=False)
+            for key in keys:
+                pipeline.type(key)
+                pipeline.memory_usage(key, samples=args.samples)
+                pipeline.pttl(key)
+                pipeline.object('idletime', key)
+            replies = pipeline.execute(raise_on_error=False)
+            rows = []
+            for i, key in enumerate(keys):
+                key_type, memory, pttl, idle = replies[4 * i:4 * i + 4]
+                # scan之后被删掉或者过期的key
+                if memory is None or isinstance(memory, Exception) or key_type == b'none' or pttl == -2:
+                    continue
+                # maxmemory-policy是LFU时OBJECT IDLETIME会报错
+                idle = -1 if idle is None or isinstance(idle, Exception) else idle
+                rows.append((key, key_type.decode('utf-8'), pttl, memory, idle))
+            builder.add_rows(rows)
+            scanned += len(keys)
+        if cursor == 0:
+            break
+    logging.info(f"Finished {node[0]}:{node[1]}, scanned={scanned}")
+    return scanned
+
+
+def build(args):
+    router = SlotRouter.from_seed(args.host, args.port, args.password)
+    masters = router.masters()
+    clients = NodeClients(args.password, max_connections=1)
+    builder = ColumnBuilder(args.delimiters, args.depth)
+    start = time.time()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+            for future in concurrent.futures.as_completed(
+                    [executor.submit(scan_node, clients, node, builder, args) for node in masters]):
+                future.result()
+    finally:
+        clients.close()
+    scan_seconds = time.time() - start
+    builder.save(args.out, {'source': f'{args.host}:{args.port}', 'match': args.match, 'created_at': start})
+    logging.info(f"Saved {len(builder)} keys to {args.out}, scan {scan_seconds:.1f}s, "
+                 f"save {time.time() - start - scan_seconds:.1f}s")
+
+
+def query(args):
+    start = time.perf_counter()
+    snapshot = KeyspaceSnapshot(args.dir)
+    rows = snapshot.select(args.prefix, args.type, args.ttl_lt, args.ttl_ge, args.no_ttl, args.min_size, args.idle_gt)
+    result = {'snapshot': {k: snapshot.meta[k] for k in ('source', 'count', 'created_at') if k in snapshot.meta},
+              'matched': snapshot.summary(rows),
+              'by_type': snapshot.group_by_type(rows),
+              'by_prefix': snapshot.group_by_prefix(rows, args.group_depth, args.top)}
+    if args.top_keys:
+        result['top_keys'] = snapshot.top_keys(rows, args.top_keys)
+    result['query_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Columnar keyspace snapshot: scan once, query locally.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='Scan all masters and save the snapshot')
+    build_parser.add_argument('--host', type=str, required=True, help='Any node of the redis cluster')
+    build_parser.add_argument('-p', '--port', type=int, default=6379, help='Redis port (default: 6379)')
+    build_parser.add_argument('-a', '--password', type=str, default=None, help='Redis password (default: None)')
+    build_parser.add_argument('--out', type=str, required=True, help='Snapshot directory')
+    build_parser.add_argument('-m', '--match', type=str, default='*', help='SCAN MATCH pattern (default: *)')
+    build_parser.add_argument('--scan-count', type=int, default=1000, help='SCAN COUNT (default: 1000)')
+    build_parser.add_argument('-s', '--samples', type=int, default=5, help='MEMORY USAGE SAMPLES (default: 5)')
+    build_parser.add_argument('-d', '--delimiters', type=str, default=':', help='Prefix delimiters (default: :)')
+    build_parser.add_argument('--depth', type=int, default=2, help='Prefix levels to index (default: 2)')
+    build_parser.add_argument('--max-keys-per-sec', type=float, default=0, help='Max keys per second per node, 0 means unlimited (default: 0)')
+    build_parser.add_argument('--max-workers', type=int, default=8, help='Max nodes scanned concurrently (default: 8)')
+
+    query_parser = subparsers.add_parser('query', help='Query a saved snapshot')
+    query_parser.add_argument('--dir', type=str, required=True, help='Snapshot directory')
+    query_parser.add_argument('--prefix', type=str, help='Key prefix (default: all keys)')
+    query_parser.add_argument('--type', type=str, choices=TYPES, help='Key type (default: all)')
+    query_parser.add_argument('--ttl-lt', type=float, help='Only keys expiring within this many seconds')
+    query_parser.add_argument('--ttl-ge', type=float, help='Only keys with at least this many seconds to live')
+    query_parser.add_argument('--no-ttl', action='store_true', help='Only keys without expiry')
+    query_parser.add_argument('--min-size', type=int, help='Only keys using at least this many bytes')
+    query_parser.add_argument('--idle-gt', type=int, help='Only keys idle for more than this many seconds')
+    query_parser.add_argument('--group-depth', type=int, default=1, help='Prefix level to group by (default: 1)')
+    query_parser.add_argument('--top', type=int, default=20, help='Prefixes to show (default: 20)')
+    query_parser.add_argument('--top-keys', type=int, default=0, help='Biggest matching keys to show (default: 0)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == 'build':
+        build(args)
+    else:
+        query(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import random
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from keyspace_snapshot import ColumnBuilder, KeyspaceSnapshot, sort_keys
+
+
+class TestKeyspaceSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        builder = ColumnBuilder(':', depth=2)
+        rows = []
+        for i in range(1000):
+            rows.append((f'user:{i}:profile'.encode(), 'hash', -1, 200, 10))
+            rows.append((f'user:{i}:rank'.encode(), 'zset', 1000 * i, 500, 3600))
+            rows.append((f'session:{i}'.encode(), 'string', 60000, 100, 5))
+        rows.append((b'user', 'string', -1, 50, 0))
+        rows.append((b'user\xff:x', 'string', -1, 50, 0))
+        # 分两批加，模拟多个节点
+        builder.add_rows(rows[:1500])
+        builder.add_rows(rows[1500:])
+        builder.save(self.dir, {'source': 'test'})
+        self.snapshot = KeyspaceSnapshot(self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_prefix_type_ttl(self):
+        rows = self.snapshot.select('user:', key_type='zset', ttl_lt=100)
+        self.assertEqual(self.snapshot.summary(rows), {'count': 100, 'memory': 50000})
+        self.assertTrue(all(self.snapshot.key(i).startswith(b'user:') for i in rows))
+        self.assertEqual(len(self.snapshot.select('user:')), 2000)
+        self.assertEqual(len(self.snapshot.select('user')), 2002)
+        self.assertEqual(len(self.snapshot.select('user:99')), 22)
+        self.assertEqual(len(self.snapshot.select('nope')), 0)
+        self.assertEqual(len(self.snapshot.select(no_ttl=True)), 1002)
+        self.assertEqual(len(self.snapshot.select(idle_gt=100)), 1000)
+
+    def test_group_by(self):
+        rows = self.snapshot.select()
+        groups = self.snapshot.group_by_prefix(rows, depth=1)
+        self.assertEqual(groups[0], {'prefix': 'user:', 'count': 2000, 'memory': 700000})
+        self.assertEqual(groups[1], {'prefix': 'session:', 'count': 1000, 'memory': 100000})
+        level2 = {g['prefix']: g['count'] for g in self.snapshot.group_by_prefix(rows, depth=2)}
+        self.assertEqual(level2['user:*:'], 2000)
+        self.assertEqual(level2['session:'], 1000)
+        by_type = {g['type']: g['count'] for g in self.snapshot.group_by_type(rows)}
+        self.assertEqual(by_type, {'string': 1002, 'zset': 1000, 'hash': 1000})
+        self.assertEqual(self.snapshot.top_keys(rows, 1)[0]['memory'], 500)
+
+    def test_sort_keys(self):
+        rng = random.Random(7)
+        # 少量字母让前缀大量重复，覆盖补0、真实的0字节、重复key和跨过8字节的比较
+        keys = [bytes(rng.choice(b'ab\x00\xff') for _ in range(rng.randint(0, 20))) for _ in range(3000)]
+        keys += [b'', b'', b'a' * 16, b'a' * 16 + b'\x00', b'a' * 8]
+        offsets = np.zeros(len(keys) + 1, dtype=np.uint64)
+        np.cumsum([len(key) for key in keys], out=offsets[1:])
+        data = np.frombuffer(b''.join(keys), dtype=np.uint8)
+        order = sort_keys(data, offsets)
+        self.assertEqual([keys[i] for i in order], sorted(keys))
+        self.assertEqual(sorted(order.tolist()), list(range(len(keys))))
+
+    def test_save_order(self):
+        keys = [f'k:{i}'.encode() for i in range(200)] + [b'k\x00', b'k', b'']
+        builder = ColumnBuilder(':', depth=1)
+        builder.add_rows([(key, 'string', -1, i, 0) for i, key in enumerate(keys)])
+        self.assertEqual(len(builder), len(keys))
+        directory = tempfile.mkdtemp()
+        try:
+            builder.save(directory)
+            snapshot = KeyspaceSnapshot(directory)
+            saved = [snapshot.key(i) for i in range(snapshot.count)]
+            self.assertEqual(saved, sorted(keys))
+            # 列跟着key一起重排
+            self.assertEqual([int(snapshot.size[i]) for i in range(snapshot.count)],
+                             [keys.index(key) for key in saved])
+            self.assertEqual(snapshot.prefix_range('k:1'), range(4, 4 + 111))
+            self.assertEqual(len(snapshot.prefix_range(b'k')), 202)
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
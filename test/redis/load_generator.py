@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+多地域redis压测工具，由incr_test.py改造而来
+
+设计要点：
+1. 开环压测：每个地域按目标qps排好每个请求的计划发送时间，不等上一个请求返回；延迟从计划发送时间开始算，
+   服务端变慢导致请求排队的时间也会算进延迟里，避免coordinated omission(闭环压测只会测到"发得出去"的请求)
+2. asyncio：每个地域一个调度协程 + 若干worker协程，worker数就是该地域的最大并发连接数
+3. 命令混合：INCR/HINCRBY/GET/SET按权重随机，key在--keys个key里随机，默认只有k1，和incr_test.py的热点场景一样
+4. 统计：每个地域一个HDR风格的对数分桶直方图，定期输出区间内的p50/p99/p999，结束时输出全程的统计，可以导出json
+5. 有--duration，到时间自动停止
+
+使用示例：
+# 本地测试
+python3 load_generator.py --region local=127.0.0.1:6379 --rate 2000 --duration 10
+# 多地域，每个地域单独设置qps
+python3 load_generator.py --region sh=10.13.246.139:12345@5000 --region hz=10.214.236.185:12345 \\
+    --region nj=10.212.190.235:12345 --rate 3000 --mix hincrby=8,get=2 --duration 300 --json-output result.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+import time
+from typing import Dict, List
+
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+
+OPERATIONS = ('incr', 'hincrby', 'get', 'set')
+
+
+class LatencyHistogram:
+    """
+        HDR风格的直方图：小于2^sub_bits的值精确记录，更大的值按2的幂分段，每段再均分成2^(sub_bits-1)个桶，
+        相对误差不超过2^(1-sub_bits)，默认sub_bits=11，误差约0.1%。单位是微秒
+    """
+
+    def __init__(self, sub_bits: int = 11, max_value: int = 3600 * 1000 * 1000):
+        self.sub_bits = sub_bits
+        self.half = 1 << (sub_bits - 1)
+        self.counts = [0] * (self._index(max_value) + 1)
+        self.max_value = max_value
+        self.total = 0
+        self.sum = 0
+        self.max = 0
+
+    def _index(self, value: int) -> int:
+        shift = value.bit_length() - self.sub_bits
+        if shift <= 0:
+            return value
+        return shift * self.half + (value >> shift)
+
+    def _value_at(self, index: int) -> int:
+        """桶里能表示的最大值"""
+        if index < 2 * self.half:
+            return index
+        shift = index // self.half - 1
+        sub = index - shift * self.half
+        return ((sub + 1) << shift) - 1
+
+    def record(self, value: int, count: int = 1):
+        value = min(max(int(value), 0), self.max_value)
+        self.counts[self._index(value)] += count
+        self.total += count
+        self.sum += value * count
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p: float) -> int:
+        if self.total == 0:
+            return 0
+        target = max(1, int(round(self.total * p / 100.0 + 0.5 - 1e-9)))
+        target = min(target, self.total)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count:
+                seen += count
+                if seen >= target:
+                    return min(self._value_at(index), self.max)
+        return self.max
+
+    def mean(self) -> float:
+        return self.sum / self.total if self.total else 0.0
+
+    def merge(self, other: 'LatencyHistogram'):
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.total += other.total
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.total = 0
+        self.sum = 0
+        self.max = 0
+
+    def summary(self) -> Dict[str, float]:
+        """单位毫秒"""
+        return {
+            'count': self.total,
+            'mean_ms': round(self.mean() / 1000, 3),
+            'p50_ms': self.percentile(50) / 1000,
+            'p99_ms': self.percentile(99) / 1000,
+            'p999_ms': self.percentile(99.9) / 1000,
+            'max_ms': self.max / 1000,
+        }
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for item in mix.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip().lower()
+        if name not in OPERATIONS:
+            raise ValueError(f'unknown operation {name}, supported: {",".join(OPERATIONS)}')
+        weights[name] = float(weight or 1)
+    return weights
+
+
+class Region:
+    def __init__(self, name: str, host: str, port: int, rate: float):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.rate = rate
+        self.total = LatencyHistogram()
+        self.interval = LatencyHistogram()
+        self.errors = 0
+        self.interval_errors = 0
+        self.sent = 0
+
+    @classmethod
+    def parse(cls, spec: str, default_rate: float) -> 'Region':
+        """name=host:port[@rate]"""
+        name, _, address = spec.partition('=')
+        if not address:
+            name, address = spec, spec
+        address, _, rate = address.partition('@')
+        host, _, port = address.rpartition(':')
+        return cls(name, host, int(port), float(rate) if rate else default_rate)
+
+
+class LoadGenerator:
+    def __init__(self, regions: List[Region], mix: Dict[str, float], workers: int = 50, keys: int = 1,
+                 key_prefix: str = 'k', field: str = 'f1', value_size: int = 16, duration: float = 60,
+                 report_interval: float = 5, password: str = None):
+        self.regions = regions
+        self.operations = list(mix.keys())
+        self.weights = list(mix.values())
+        self.workers = workers
+        self.keys = [f'{key_prefix}{i + 1}' for i in range(keys)]
+        self.field = field
+        self.value = 'x' * value_size
+        self.duration = duration
+        self.report_interval = report_interval
+        self.password = password
+        self.intervals: List[Dict] = []
+
+    def _pick(self):
+        op = random.choices(self.operations, self.weights)[0]
+        key = self.keys[0] if len(self.keys) == 1 else random.choice(self.keys)
+        return op, key
+
+    async def _call(self, client, op: str, key: str):
+        # 不同类型的命令用不同的key，避免WRONGTYPE；HINCRBY直接用k1，和incr_test.py一致
+        if op == 'hincrby':
+            await client.hincrby(key, self.field)
+        elif op == 'incr':
+            await client.incr(f'{key}:incr')
+        elif op == 'get':
+            await client.get(f'{key}:str')
+        else:
+            await client.set(f'{key}:str', self.value)
+
+    async def _worker(self, region: Region, client, queue: asyncio.Queue):
+        while True:
+            intended = await queue.get()
+            if intended is None:
+                return
+            op, key = self._pick()
+            try:
+                await self._call(client, op, key)
+            except RedisError as e:
+                region.errors += 1
+                region.interval_errors += 1
+                if region.errors <= 10:
+                    logging.error(f"[{region.name}] {op} failed: {str(e)}")
+                continue
+            # 从计划发送时间开始算，排队等待的时间也算进去
+            latency_us = (time.perf_counter() - intended) * 1e6
+            region.total.record(latency_us)
+            region.interval.record(latency_us)
+
+    async def _schedule(self, region: Region, queue: asyncio.Queue, start: float):
+        """按固定间隔排请求，落后了也不跳过，保证开环"""
+        period = 1.0 / region.rate
+        end = start + self.duration
+        index = 0
+        while True:
+            intended = start + index * period
+            if intended >= end:
+                break
+            delay = intended - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await queue.put(intended)
+            region.sent += 1
+            index += 1
+
+    async def _run_region(self, region: Region, start: float):
+        client = aioredis.Redis(host=region.host, port=region.port, password=self.password,
+                                max_connections=self.workers, socket_timeout=10)
+        # 队列有上限，服务端跟不上时调度协程会被阻塞，但是延迟仍然从计划时间算
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.workers * 100)
+        workers = [asyncio.create_task(self._worker(region, client, queue)) for _ in range(self.workers)]
+        try:
+            await self._schedule(region, queue, start)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            await client.aclose()
+
+    async def _reporter(self, start: float):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            elapsed = time.perf_counter() - start
+            snapshot = {'elapsed_s': round(elapsed, 1), 'regions': {}}
+            for region in self.regions:
+                summary = region.interval.summary()
+                summary['qps'] = round(summary['count'] / self.report_interval, 1)
+                summary['errors'] = region.interval_errors
+                snapshot['regions'][region.name] = summary
+                logging.info(f"[{region.name}] t={elapsed:.0f}s qps={summary['qps']} p50={summary['p50_ms']}ms "
+                             f"p99={summary['p99_ms']}ms p999={summary['p999_ms']}ms max={summary['max_ms']}ms "
+                             f"errors={region.interval_errors}")
+                region.interval.reset()
+                region.interval_errors = 0
+            self.intervals.append(snapshot)
+
+    async def run(self) -> Dict:
+        # 所有地域共用同一个起始时间
+        start = time.perf_counter() + 0.1
+        reporter = asyncio.create_task(self._reporter(start))
+        try:
+            await asyncio.gather(*[self._run_region(region, start) for region in self.regions])
+        finally:
+            reporter.cancel()
+        elapsed = time.perf_counter() - start
+        result = {'duration_s': round(elapsed, 2), 'regions': {}, 'intervals': self.intervals}
+        for region in self.regions:
+            summary = region.total.summary()
+            summary.update({'target_qps': region.rate, 'achieved_qps': round(summary['count'] / elapsed, 1),
+                            'sent': region.sent, 'errors': region.errors})
+            result['regions'][region.name] = summary
+        return result
+
+
+def print_result(result: Dict):
+    print(f"\n{'=' * 100}")
+    print(f"duration: {result['duration_s']}s")
+    print(f"{'region':<12}{'target':>10}{'achieved':>10}{'count':>10}{'errors':>8}"
+          f"{'p50(ms)':>10}{'p99(ms)':>10}{'p999(ms)':>10}{'max(ms)':>10}")
+    for name, s in result['regions'].items():
+        print(f"{name:<12}{s['target_qps']:>10.0f}{s['achieved_qps']:>10.0f}{s['count']:>10}{s['errors']:>8}"
+              f"{s['p50_ms']:>10.3f}{s['p99_ms']:>10.3f}{s['p999_ms']:>10.3f}{s['max_ms']:>10.3f}")
+    print(f"{'=' * 100}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Open-loop multi-region redis load generator.")
+    parser.add_argument('--region', action='append', help='name=host:port[@rate], can be repeated '
+                                                          '(default: local=127.0.0.1:6379)')
+    parser.add_argument('--rate', type=float, default=1000, help='Target requests per second per region (default: 1000)')
+    parser.add_argument('--mix', type=str, default='hincrby=1', help='Operation weights, example: incr=1,get=3 (default: hincrby=1)')
+    parser.add_argument('--workers', type=int, default=50, help='Concurrent connections per region (default: 50)')
+    parser.add_argument('--keys', type=int, default=1, help='Number of distinct keys, k1..kN (default: 1)')
+    parser.add_argument('--field', type=str, default='f1', help='Hash field for HINCRBY (default: f1)')
+    parser.add_argument('--value-size', type=int, default=16, help='Value size for SET (default: 16)')
+    parser.add_argument('--duration', type=float, default=60, help='Run time in seconds (default: 60)')
+    parser.add_argument('--report-interval', type=float, default=5, help='Interval report period in seconds (default: 5)')
+    parser.add_argument('--password', type=str, help='Redis password (default: None)')
+    parser.add_argument('--json-output', type=str, help='Write the full result with intervals to this file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        sys.exit(1)
+    regions = [Region.parse(spec, args.rate) for spec in (args.region or ['local=127.0.0.1:6379'])]
+    generator = LoadGenerator(regions, mix, args.workers, args.keys, field=args.field, value_size=args.value_size,
+                              duration=args.duration, report_interval=args.report_interval, password=args.password)
+    result = asyncio.run(generator.run())
+    print_result(result)
+    if args.json_output:
+        with open(args.json_output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
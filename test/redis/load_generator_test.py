@@ -0,0 +1,39 @@
+import random
+import unittest
+
+from load_generator import LatencyHistogram, Region, parse_mix
+
+
+class TestLatencyHistogram(unittest.TestCase):
+    def test_percentiles_within_precision(self):
+        values = [random.randint(1, 5_000_000) for _ in range(100000)]
+        histogram = LatencyHistogram()
+        for value in values:
+            histogram.record(value)
+        values.sort()
+        for p in (50, 99, 99.9):
+            exact = values[int(len(values) * p / 100) - 1]
+            self.assertAlmostEqual(histogram.percentile(p), exact, delta=exact * 0.002 + 1)
+        self.assertEqual(histogram.percentile(100), values[-1])
+
+    def test_small_values_exact_and_merge(self):
+        a = LatencyHistogram()
+        b = LatencyHistogram()
+        for value in range(1, 1001):
+            (a if value % 2 else b).record(value)
+        a.merge(b)
+        self.assertEqual(a.total, 1000)
+        self.assertEqual(a.percentile(50), 500)
+        self.assertEqual(a.percentile(99.9), 999)
+
+    def test_parse_args(self):
+        region = Region.parse('sh=10.0.0.1:12345@5000', 1000)
+        self.assertEqual((region.name, region.host, region.port, region.rate), ('sh', '10.0.0.1', 12345, 5000))
+        self.assertEqual(Region.parse('127.0.0.1:6379', 1000).rate, 1000)
+        self.assertEqual(parse_mix('incr=1,get=3'), {'incr': 1, 'get': 3})
+        with self.assertRaises(ValueError):
+            parse_mix('del=1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+把一批slot迁移到目标节点，替代一次只迁一个key的外部工具
+
+设计要点：
+1. 每个slot按redis-cli --cluster reshard的流程：目标节点SETSLOT IMPORTING，源节点SETSLOT MIGRATING，
+   GETKEYSINSLOT取一批key用一条MIGRATE ... KEYS k1..kN迁走，取不到key之后把SETSLOT NODE发给目标、源和其他master
+2. 多个slot并发迁移(--parallel)，每个slot在一个线程里完成整个流程；源节点可以不止一个，按CLUSTER SLOTS确定
+3. 大key单独迁：每批key先pipeline MEMORY USAGE估算大小，超过--big-key-mb的key一个一个MIGRATE，用更长的超时，
+   不会拖慢同一批的小key，也不会因为一批太大超时
+4. MIGRATE超时(IOERR)时这个slot的批大小减半重试，已经迁走的key不会再出现在GETKEYSINSLOT里；
+   IOERR时目标可能已经收到了一部分key而源还没有删掉，不带REPLACE重试会BUSYKEY，所以IOERR之后这个slot的MIGRATE都带REPLACE：
+   slot处于MIGRATING状态时源上的数据是权威的，覆盖目标上的副本是安全的；
+   中途失败的slot保持MIGRATING/IMPORTING状态，重新执行同样的命令会继续迁移
+   MIGRATE的超时是服务端每次读写的超时，整条命令可能执行得更久，MIGRATE用单独的连接池，
+   读超时是--migrate-socket-timeout(至少比--big-key-timeout-ms长)，客户端不会先超时把还在迁移的slot判成失败
+5. 报告整体吞吐，以及每个slot的停顿：MIGRATE执行期间源和目标都是阻塞的，单次MIGRATE的最长耗时就是这个slot上请求的最长停顿；
+   同时报告slot处于迁移状态(客户端会收到ASK)的总时长
+
+使用示例：
+python3 migrate_slots.py --host 127.0.0.1 --port 7101 --slots 0-1000,2000 --target 127.0.0.1:7102
+python3 migrate_slots.py --host 10.74.110.58 --slots 5461-6000 --target 10.74.40.101:6379 --parallel 8 --batch-keys 2000
+"""
+
+import argparse
+import concurrent.futures
+import logging
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from redis.exceptions import RedisError, ResponseError
+
+from cluster_router import Node, NodeClients, SlotRouter
+from slot import CLUSTER_SLOTS
+
+
+def parse_slots(spec: str) -> List[int]:
+    """'0-100,200,300-310' -> 排好序的slot列表"""
+    slots = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        first = int(first)
+        last = int(last) if last else first
+        if not 0 <= first <= last < CLUSTER_SLOTS:
+            raise ValueError(f'invalid slot range {part}')
+        slots.update(range(first, last + 1))
+    return sorted(slots)
+
+
+def parse_node(spec: str) -> Node:
+    host, _, port = spec.rpartition(':')
+    return host, int(port)
+
+
+def _to_str(value) -> str:
+    return value.decode('utf-8') if isinstance(value, bytes) else str(value)
+
+
+class SlotMigrator:
+    def __init__(self, host: str, port: int, target: Node, password: str = None, batch_keys: int = 1000,
+                 parallel: int = 4, big_key_bytes: int = 8 * 1024 * 1024, timeout_ms: int = 5000,
+                 big_key_timeout_ms: int = 60000, replace: bool = False, connect_timeout: int = 5,
+                 migrate_socket_timeout: float = 600):
+        self.router = SlotRouter.from_seed(host, port, password, connect_timeout)
+        self.clients = NodeClients(password, connect_timeout, max_connections=parallel + 1)
+        # MIGRATE专用，读超时要比服务端的MIGRATE超时长
+        socket_timeout = max(migrate_socket_timeout, max(timeout_ms, big_key_timeout_ms) / 1000 + connect_timeout)
+        self.migrate_clients = NodeClients(password, connect_timeout, max_connections=parallel,
+                                           socket_timeout=socket_timeout)
+        self.target = target
+        self.password = password
+        self.batch_keys = batch_keys
+        self.parallel = parallel
+        self.big_key_bytes = big_key_bytes
+        self.timeout_ms = timeout_ms
+        self.big_key_timeout_ms = big_key_timeout_ms
+        self.replace = replace
+        # 目标可以是还没有slot的新master，不在CLUSTER SLOTS里，单独问它的id
+        self.nodes = self.router.masters()
+        if target not in self.nodes:
+            self.nodes.append(target)
+        self.ids: Dict[Node, str] = {node: self._node_id(node) for node in self.nodes}
+        self.stats = {'slots': 0, 'keys': 0, 'big_keys': 0, 'migrate_calls': 0, 'retries': 0, 'errors': 0}
+        self.stats_lock = threading.Lock()
+        # slot -> (key数, 迁移状态持续秒数, 单次MIGRATE最长秒数)
+        self.slot_reports: Dict[int, Tuple[int, float, float]] = {}
+
+    def _node_id(self, node: Node) -> str:
+        return _to_str(self.clients.get(node).execute_command('CLUSTER', 'MYID'))
+
+    def _incr(self, **counts):
+        with self.stats_lock:
+            for name, value in counts.items():
+                self.stats[name] += value
+
+    def _split_big(self, client, keys: List[bytes]) -> Tuple[List[bytes], List[bytes]]:
+        """按MEMORY USAGE把一批key分成小key和大key"""
+        if self.big_key_bytes <= 0:
+            return keys, []
+        pipeline = client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.memory_usage(key)
+        small, big = [], []
+        for key, size in zip(keys, pipeline.execute()):
+            (big if size and size >= self.big_key_bytes else small).append(key)
+        return small, big
+
+    def _migrate(self, client, keys: List[bytes], timeout_ms: int, replace: bool = False) -> float:
+        """一条MIGRATE迁走一批key，返回耗时"""
+        args = [self.target[0], self.target[1], '', 0, timeout_ms]
+        if self.password:
+            args += ['AUTH', self.password]
+        if self.replace or replace:
+            args.append('REPLACE')
+        start = time.monotonic()
+        client.execute_command('MIGRATE', *args, 'KEYS', *keys)
+        self._incr(migrate_calls=1)
+        return time.monotonic() - start
+
+    def migrate_slot(self, slot: int):
+        source = self.router.node_for_slot(slot)
+        if source == self.target:
+            logging.info(f"Slot {slot} is already on {self.target[0]}:{self.target[1]}")
+            return
+        if source is None:
+            raise RedisError(f'slot {slot} is not assigned')
+        src = self.clients.get(source)
+        dst = self.clients.get(self.target)
+        migrate_src = self.migrate_clients.get(source)
+        start = time.monotonic()
+        dst.execute_command('CLUSTER', 'SETSLOT', slot, 'IMPORTING', self.ids[source])
+        src.execute_command('CLUSTER', 'SETSLOT', slot, 'MIGRATING', self.ids[self.target])
+        batch = self.batch_keys
+        moved = 0
+        max_pause = 0.0
+        # IOERR之后目标上可能有还没从源删掉的key
+        replace = False
+        while True:
+            keys = src.execute_command('CLUSTER', 'GETKEYSINSLOT', slot, batch)
+            if not keys:
+                break
+            small, big = self._split_big(src, keys)
+            try:
+                if small:
+                    max_pause = max(max_pause, self._migrate(migrate_src, small, self.timeout_ms, replace))
+                    moved += len(small)
+                    self._incr(keys=len(small))
+                for key in big:
+                    max_pause = max(max_pause, self._migrate(migrate_src, [key], self.big_key_timeout_ms, replace))
+                    moved += 1
+                    self._incr(keys=1, big_keys=1)
+            except ResponseError as e:
+                # IOERR是超时或者连接目标失败，减小批次重试；BUSYKEY等其他错误直接失败
+                if 'IOERR' not in str(e) or batch == 1:
+                    raise
+                batch = max(1, batch // 2)
+                replace = True
+                self._incr(retries=1)
+                logging.warning(f"MIGRATE on slot {slot} failed ({str(e)}), retry with batch {batch} and REPLACE")
+                continue
+        # 先通知目标再通知源，源收到后不会再把请求ASK到目标之外的地方
+        for node in [self.target, source] + [n for n in self.nodes if n not in (self.target, source)]:
+            try:
+                self.clients.get(node).execute_command('CLUSTER', 'SETSLOT', slot, 'NODE', self.ids[self.target])
+            except RedisError as e:
+                if node in (self.target, source):
+                    raise
+                # 其他master会通过gossip拿到新的配置
+                logging.warning(f"SETSLOT {slot} NODE on {node[0]}:{node[1]} failed: {str(e)}")
+        window = time.monotonic() - start
+        with self.stats_lock:
+            self.stats['slots'] += 1
+            self.slot_reports[slot] = (moved, window, max_pause)
+        logging.debug(f"Slot {slot}: {moved} keys in {window * 1000:.1f}ms, max pause {max_pause * 1000:.1f}ms")
+
+    def run(self, slots: List[int]) -> bool:
+        start = time.monotonic()
+        failed = []
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.parallel) as executor:
+                futures = {executor.submit(self.migrate_slot, slot): slot for slot in slots}
+                for future in concurrent.futures.as_completed(futures):
+                    try:
+                        future.result()
+                    except RedisError as e:
+                        slot = futures[future]
+                        failed.append(slot)
+                        self._incr(errors=1)
+                        logging.error(f"Migrate slot {slot} failed, it is left in migrating state: {str(e)}")
+        finally:
+            self.clients.close()
+            self.migrate_clients.close()
+        self.report(time.monotonic() - start)
+        if failed:
+            logging.error(f"Failed slots: {','.join(map(str, sorted(failed)))}")
+        return not failed
+
+    def report(self, duration: float):
+        rate = self.stats['keys'] / duration if duration > 0 else 0
+        logging.info(' '.join(f'{k}={v}' for k, v in self.stats.items()) +
+                     f' duration={duration:.2f}s rate={rate:.0f} keys/s')
+        if not self.slot_reports:
+            return
+        windows = sorted(report[1] for report in self.slot_reports.values())
+        pauses = sorted(report[2] for report in self.slot_reports.values())
+        logging.info(f"Slot migrating window p50={windows[len(windows) // 2] * 1000:.1f}ms "
+                     f"max={windows[-1] * 1000:.1f}ms; "
+                     f"longest MIGRATE pause p50={pauses[len(pauses) // 2] * 1000:.1f}ms max={pauses[-1] * 1000:.1f}ms")
+        slowest = sorted(self.slot_reports.items(), key=lambda item: item[1][2], reverse=True)[:10]
+        print(f"{'slot':>6}{'keys':>10}{'window ms':>12}{'pause ms':>11}")
+        for slot, (keys, window, pause) in slowest:
+            print(f"{slot:>6}{keys:>10}{window * 1000:>12.1f}{pause * 1000:>11.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Migrate cluster slots to a target node with batched MIGRATE KEYS.')
+    parser.add_argument('--host', type=str, required=True, help='Any node of the redis cluster')
+    parser.add_argument('--port', type=int, default=6379, help='Redis port (default: 6379)')
+    parser.add_argument('--password', type=str, help='Redis password (default: None)')
+    parser.add_argument('--slots', type=str, required=True, help='Slots to migrate, e.g. 0-100,200')
+    parser.add_argument('--target', type=str, required=True, help='Target master, host:port')
+    parser.add_argument('--batch-keys', type=int, default=1000, help='Keys per MIGRATE call (default: 1000)')
+    parser.add_argument('--parallel', type=int, default=4, help='Slots migrated concurrently (default: 4)')
+    parser.add_argument('--big-key-mb', type=float, default=8, help='Keys larger than this are migrated one by one, 0 disables the check (default: 8)')
+    parser.add_argument('--timeout-ms', type=int, default=5000, help='MIGRATE timeout in milliseconds (default: 5000)')
+    parser.add_argument('--big-key-timeout-ms', type=int, default=60000, help='MIGRATE timeout for big keys in milliseconds (default: 60000)')
+    parser.add_argument('--replace', action='store_true', help='Overwrite keys that already exist on the target')
+    parser.add_argument('--migrate-socket-timeout', type=float, default=600,
+                        help='Client read timeout in seconds for MIGRATE calls, at least the MIGRATE timeouts (default: 600)')
+    parser.add_argument('--connect-timeout', type=int, default=5, help='Redis connection timeout in seconds (default: 5)')
+    parser.add_argument('--log-level', type=str, default='INFO', help='Log level (default: INFO)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, args.log_level.upper()), format='%(asctime)s - %(levelname)s - %(message)s')
+    migrator = SlotMigrator(args.host, args.port, parse_node(args.target), args.password, args.batch_keys,
+                            args.parallel, int(args.big_key_mb * 1024 * 1024), args.timeout_ms,
+                            args.big_key_timeout_ms, args.replace, args.connect_timeout,
+                            args.migrate_socket_timeout)
+    if not migrator.run(parse_slots(args.slots)):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
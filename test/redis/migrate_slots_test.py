@@ -0,0 +1,195 @@
+import collections
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+import unittest
+
+import redis
+from redis.cluster import RedisCluster
+from redis.exceptions import ResponseError
+
+from migrate_slots import SlotMigrator, parse_slots
+from slot import CLUSTER_SLOTS, key_hash_slot
+
+REDIS_SERVER = shutil.which('redis-server')
+
+
+def free_port() -> int:
+    """找一个自己和集群总线端口(+10000)都空闲的端口"""
+    while True:
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]
+        if port + 10000 > 65535:
+            continue
+        with socket.socket() as s:
+            try:
+                s.bind(('127.0.0.1', port + 10000))
+            except OSError:
+                continue
+        return port
+
+
+class LocalCluster:
+    """在临时目录里起几个redis-server进程，手动分配slot组成集群"""
+
+    def __init__(self, masters: int = 3):
+        self.dir = tempfile.mkdtemp()
+        self.ports = [free_port() for _ in range(masters)]
+        self.processes = []
+        for port in self.ports:
+            node_dir = os.path.join(self.dir, str(port))
+            os.makedirs(node_dir)
+            self.processes.append(subprocess.Popen(
+                [REDIS_SERVER, '--port', str(port), '--bind', '127.0.0.1', '--cluster-enabled', 'yes',
+                 '--cluster-config-file', 'nodes.conf', '--dir', node_dir, '--save', '', '--appendonly', 'no'],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        self.clients = [redis.Redis(port=port) for port in self.ports]
+        for client in self.clients:
+            self._wait(client.ping)
+        for port in self.ports[1:]:
+            self.clients[0].execute_command('CLUSTER', 'MEET', '127.0.0.1', port)
+        step = CLUSTER_SLOTS // masters
+        for i, client in enumerate(self.clients):
+            last = CLUSTER_SLOTS if i == masters - 1 else (i + 1) * step
+            client.execute_command('CLUSTER', 'ADDSLOTS', *range(i * step, last))
+        self._wait(lambda: all(b'cluster_state:ok' in c.execute_command('CLUSTER', 'INFO') and
+                               len(c.execute_command('CLUSTER', 'SLOTS')) == masters for c in self.clients))
+
+    @staticmethod
+    def _wait(check, timeout: float = 20):
+        deadline = time.time() + timeout
+        while True:
+            try:
+                if check():
+                    return
+            except (redis.ConnectionError, redis.ResponseError):
+                pass
+            if time.time() > deadline:
+                raise TimeoutError('local cluster not ready')
+            time.sleep(0.1)
+
+    def close(self):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.wait()
+        shutil.rmtree(self.dir)
+
+
+@unittest.skipUnless(REDIS_SERVER, 'redis-server not found')
+class TestSlotMigrator(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.cluster = LocalCluster()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.cluster.close()
+
+    def setUp(self):
+        self.client = RedisCluster(host='127.0.0.1', port=self.cluster.ports[0])
+        self.client.flushall()
+        self.values = {}
+        pipeline = self.client.pipeline()
+        for i in range(5000):
+            key = f'migrate:{i}'
+            self.values[key.encode()] = str(i).encode()
+            pipeline.set(key, i)
+        pipeline.execute()
+
+    def tearDown(self):
+        self.client.close()
+
+    def slot_owner(self, slot: int) -> int:
+        for start, end, master, *_ in self.cluster.clients[0].execute_command('CLUSTER', 'SLOTS'):
+            if start <= slot <= end:
+                return master[1]
+
+    def assert_all_keys_readable(self):
+        # 新建客户端，按新的CLUSTER SLOTS路由，不依赖MOVED
+        client = RedisCluster(host='127.0.0.1', port=self.cluster.ports[0])
+        try:
+            keys = list(self.values)
+            self.assertEqual(client.mget_nonatomic(keys), [self.values[key] for key in keys])
+        finally:
+            client.close()
+
+    def test_parse_slots(self):
+        self.assertEqual(parse_slots('3-5, 1,5'), [1, 3, 4, 5])
+        with self.assertRaises(ValueError):
+            parse_slots('16380-16384')
+
+    def test_migrate_ranges_with_big_key(self):
+        source, target = self.cluster.ports[0], self.cluster.ports[1]
+        slots = list(range(0, 300))
+        big_key = next(f'big:{i}' for i in range(100000) if key_hash_slot(f'big:{i}') == 42)
+        big_value = os.urandom(200 * 1024)
+        self.client.set(big_key, big_value)
+        self.values[big_key.encode()] = big_value
+        expected = sum(1 for key in self.values if key_hash_slot(key) in slots)
+
+        migrator = SlotMigrator('127.0.0.1', source, ('127.0.0.1', target), batch_keys=50, parallel=4,
+                                big_key_bytes=64 * 1024)
+        self.assertTrue(migrator.run(slots))
+
+        self.assertEqual(migrator.stats['keys'], expected)
+        self.assertEqual(migrator.stats['big_keys'], 1)
+        self.assertEqual(migrator.stats['slots'], len(slots))
+        for slot in slots:
+            self.assertEqual(self.slot_owner(slot), target)
+            self.assertEqual(self.cluster.clients[0].execute_command('CLUSTER', 'COUNTKEYSINSLOT', slot), 0)
+        self.assert_all_keys_readable()
+
+    def test_resume_interrupted_slot(self):
+        source, target = self.cluster.ports[2], self.cluster.ports[0]
+        # 源节点上key最多的slot
+        counts = collections.Counter(key_hash_slot(key) for key in self.values)
+        slot = max(range(2 * (CLUSTER_SLOTS // 3), CLUSTER_SLOTS), key=lambda s: counts[s])
+        src, dst = self.cluster.clients[2], self.cluster.clients[0]
+        src_id = src.execute_command('CLUSTER', 'MYID')
+        dst_id = dst.execute_command('CLUSTER', 'MYID')
+        # 模拟上一次迁了一半就退出：slot停在MIGRATING/IMPORTING，一部分key已经在目标上
+        dst.execute_command('CLUSTER', 'SETSLOT', slot, 'IMPORTING', src_id)
+        src.execute_command('CLUSTER', 'SETSLOT', slot, 'MIGRATING', dst_id)
+        keys = src.execute_command('CLUSTER', 'GETKEYSINSLOT', slot, 1)
+        self.assertTrue(keys)
+        src.execute_command('MIGRATE', '127.0.0.1', target, '', 0, 5000, 'KEYS', *keys)
+
+        migrator = SlotMigrator('127.0.0.1', source, ('127.0.0.1', target))
+        self.assertTrue(migrator.run([slot]))
+        self.assertEqual(self.slot_owner(slot), target)
+        self.assertEqual(src.execute_command('CLUSTER', 'COUNTKEYSINSLOT', slot), 0)
+        self.assert_all_keys_readable()
+
+    def test_ioerr_retry_replaces_partial_copies(self):
+        source, target = self.cluster.ports[1], self.cluster.ports[2]
+        counts = collections.Counter(key_hash_slot(key) for key in self.values)
+        slot = max(range(CLUSTER_SLOTS // 3 + 1, 2 * (CLUSTER_SLOTS // 3)), key=lambda s: counts[s])
+        migrator = SlotMigrator('127.0.0.1', source, ('127.0.0.1', target), timeout_ms=1000)
+        # MIGRATE的读超时比服务端超时长，和普通命令的连接池分开
+        self.assertGreater(migrator.migrate_clients.socket_timeout, migrator.big_key_timeout_ms / 1000)
+        real_migrate = migrator._migrate
+        calls = []
+
+        def copy_then_ioerr(client, keys, timeout_ms, replace=False):
+            # 模拟目标已经收到key、源还没删掉时超时
+            calls.append(replace)
+            if len(calls) == 1:
+                client.execute_command('MIGRATE', '127.0.0.1', target, '', 0, timeout_ms, 'COPY', 'KEYS', *keys)
+                raise ResponseError('IOERR error or timeout reading to target instance')
+            return real_migrate(client, keys, timeout_ms, replace)
+
+        migrator._migrate = copy_then_ioerr
+        self.assertTrue(migrator.run([slot]))
+        self.assertEqual(calls[:2], [False, True])
+        self.assertEqual(migrator.stats['retries'], 1)
+        self.assertEqual(self.slot_owner(slot), target)
+        self.assert_all_keys_readable()
+
+
+if __name__ == '__main__':
+    unittest.main()
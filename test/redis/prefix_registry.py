@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+前缀登记索引：写key的时候顺便把key名登记到这个前缀的登记集合里，按前缀清理时直接把登记集合取出来删除，
+不需要SCAN整个节点(2亿个key里删5万个，SCAN要走完全部2亿个)
+
+设计要点：
+1. 登记集合按slot分片：前缀P在slot s上的登记集合是 __prefix_registry:{tag}:P，tag是一个crc16正好落在s上的短字符串，
+   所以登记集合和它登记的key在同一个slot、同一个节点上，写入时SADD和写命令可以放在同一个pipeline里一次发出去，
+   清理时lua脚本里SPOP+DEL访问的key也都在同一个slot里
+2. RegisteringClient包装redis客户端(单机、集群、pipeline都可以)，写命令的第一个参数是key，匹配已注册前缀时先SADD再写；
+   先登记后写入，进程中途挂掉最多留下登记了但是不存在的key，清理时按不存在计数
+3. redis_delete_prefix_keys.py --use-registry用drain_script按slot弹出登记的key并删除，dry run时用SSCAN只列出不弹出
+4. 登记集合和实际数据会有偏差：key过期、没有经过RegisteringClient的写入和删除。reconcile先用SSCAN+EXISTS去掉不存在的，
+   再SCAN前缀把没有登记的补上(先删后补，删除时刚好漏掉的正在写入的key会在补的阶段加回来)
+
+使用示例：
+# 写入方
+registry = PrefixRegistry(['session:', 'tmp:upload:'])
+client = RegisteringClient(redis.Redis(host='10.74.110.58'), registry)
+client.set('session:123', 'x', ex=3600)
+
+# 清理
+python3 ./redis_delete_prefix_keys.py --redis-ips 10.74.110.58 --prefix "session:" --dry-run False --use-registry
+
+# 修复偏差，低峰期执行
+python3 ./prefix_registry.py --host 10.74.110.58 --prefix "session:"
+"""
+
+import argparse
+import functools
+import itertools
+import logging
+import string
+import time
+from typing import Dict, List, Optional
+
+from redis.exceptions import RedisError
+
+from cluster_router import NodeClients, SlotRouter
+from slot import CLUSTER_SLOTS, key_hash_slot
+
+REGISTRY_PREFIX = '__prefix_registry:'
+
+# 写入时需要登记的命令(redis-py的方法名)，第一个参数都是key
+WRITE_COMMANDS = frozenset([
+    'set', 'setex', 'psetex', 'setnx', 'getset', 'append', 'setrange', 'setbit',
+    'incr', 'incrby', 'incrbyfloat', 'decr', 'decrby',
+    'hset', 'hsetnx', 'hmset', 'hincrby', 'hincrbyfloat',
+    'lpush', 'rpush', 'linsert', 'sadd', 'zadd', 'zincrby', 'pfadd', 'xadd', 'restore',
+])
+
+# KEYS[1]是一个slot的登记集合，ARGV[1]每次最多弹出的key数，ARGV[2]是前缀
+# 弹出的key只删除前缀匹配的，返回{删除的key, 已经不存在的key数, 集合剩余的key数}
+drain_script = """
+local members = redis.call('SPOP', KEYS[1], ARGV[1])
+local prefix = ARGV[2]
+local deleted = {}
+local missing = 0
+for _, key in ipairs(members) do
+    if string.sub(key, 1, #prefix) == prefix and redis.call('DEL', key) == 1 then
+        deleted[#deleted + 1] = key
+    else
+        missing = missing + 1
+    end
+end
+return {deleted, missing, redis.call('SCARD', KEYS[1])}
+"""
+
+
+@functools.lru_cache(maxsize=1)
+def slot_tags() -> List[str]:
+    """每个slot一个hash tag，crc16(tag)正好是这个slot，按长度从短到长找"""
+    tags: List[Optional[str]] = [None] * CLUSTER_SLOTS
+    found = 0
+    alphabet = string.ascii_letters + string.digits
+    for length in itertools.count(1):
+        for chars in itertools.product(alphabet, repeat=length):
+            tag = ''.join(chars)
+            slot = key_hash_slot(tag)
+            if tags[slot] is None:
+                tags[slot] = tag
+                found += 1
+                if found == CLUSTER_SLOTS:
+                    return tags
+
+
+def registry_key(prefix: str, slot: int) -> str:
+    return f'{REGISTRY_PREFIX}{{{slot_tags()[slot]}}}:{prefix}'
+
+
+def non_empty_slots(client, prefix: str, slots: List[int], batch: int = 1024) -> Dict[int, int]:
+    """pipeline批量SCARD，返回登记集合非空的{slot: key数}，空slot不用再逐个SSCAN/SPOP"""
+    result = {}
+    for i in range(0, len(slots), batch):
+        pipeline = client.pipeline(transaction=False)
+        for slot in slots[i:i + batch]:
+            pipeline.scard(registry_key(prefix, slot))
+        result.update((slot, size) for slot, size in zip(slots[i:i + batch], pipeline.execute()) if size)
+    return result
+
+
+class PrefixRegistry:
+    """已注册的前缀。前缀有嵌套时(a:和a:b:)key登记到所有匹配的前缀，按哪个前缀清理都不会漏"""
+
+    def __init__(self, prefixes: List[str]):
+        self.prefixes = list(prefixes)
+        self._encoded = [(p.encode('utf-8'), p) for p in self.prefixes]
+
+    def match(self, key) -> List[str]:
+        if isinstance(key, bytes):
+            return [prefix for encoded, prefix in self._encoded if key.startswith(encoded)]
+        return [prefix for prefix in self.prefixes if key.startswith(prefix)]
+
+    def registries_for(self, key) -> List[str]:
+        prefixes = self.match(key)
+        if not prefixes:
+            return prefixes
+        slot = key_hash_slot(key)
+        return [registry_key(prefix, slot) for prefix in prefixes]
+
+
+class RegisteringClient:
+    """
+        包装redis客户端，WRITE_COMMANDS里的命令写入已注册前缀的key时，同一个pipeline里先SADD到登记集合
+        包装的是pipeline时，execute()的结果里去掉SADD的结果，和原来的命令一一对应
+    """
+
+    def __init__(self, client, registry: PrefixRegistry, is_pipeline: bool = False):
+        self.client = client
+        self.registry = registry
+        self.is_pipeline = is_pipeline
+        self._registry_indexes = set()
+
+    def pipeline(self, transaction: bool = False):
+        return RegisteringClient(self.client.pipeline(transaction=transaction), self.registry, is_pipeline=True)
+
+    def execute(self, **kwargs):
+        results = self.client.execute(**kwargs)
+        indexes, self._registry_indexes = self._registry_indexes, set()
+        return [result for i, result in enumerate(results) if i not in indexes]
+
+    def __len__(self):
+        return len(self.client)
+
+    def reset(self):
+        self._registry_indexes = set()
+        self.client.reset()
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if name not in WRITE_COMMANDS:
+            return attr
+
+        def write(key, *args, **kwargs):
+            registries = self.registry.registries_for(key)
+            if not registries:
+                return attr(key, *args, **kwargs)
+            if self.is_pipeline:
+                for registry in registries:
+                    self._registry_indexes.add(len(self.client))
+                    self.client.sadd(registry, key)
+                return attr(key, *args, **kwargs)
+            pipeline = self.client.pipeline(transaction=False)
+            for registry in registries:
+                pipeline.sadd(registry, key)
+            getattr(pipeline, name)(key, *args, **kwargs)
+            return pipeline.execute()[-1]
+
+        return write
+
+
+class RegistryReconciler:
+    """修复一个前缀的登记集合和实际数据之间的偏差，每个master依次处理"""
+
+    def __init__(self, host: str, port: int = 6379, password: str = None, prefix: str = '',
+                 scan_count: int = 1000, batch_size: int = 500, connect_timeout: int = 5):
+        self.router = SlotRouter.from_seed(host, port, password, connect_timeout)
+        self.clients = NodeClients(password, connect_timeout, max_connections=1)
+        self.prefix = prefix
+        self.scan_count = scan_count
+        self.batch_size = batch_size
+        self.stats = {'removed': 0, 'added': 0, 'registered': 0}
+
+    def remove_missing(self, client, slot: int):
+        """SSCAN登记集合，去掉已经不存在的key"""
+        registry = registry_key(self.prefix, slot)
+        cursor = 0
+        while True:
+            cursor, members = client.sscan(registry, cursor, count=self.batch_size)
+            if members:
+                pipeline = client.pipeline(transaction=False)
+                for member in members:
+                    pipeline.exists(member)
+                missing = [member for member, exists in zip(members, pipeline.execute()) if not exists]
+                if missing:
+                    self.stats['removed'] += client.srem(registry, *missing)
+            if cursor == 0:
+                break
+        self.stats['registered'] += client.scard(registry)
+
+    def add_unregistered(self, client):
+        """SCAN前缀，把没有登记的key补进登记集合"""
+        match = self.prefix.replace('\\', '\\\\').replace('*', '\\*').replace('?', '\\?').replace('[', '\\[') + '*'
+        cursor = 0
+        while True:
+            cursor, keys = client.scan(cursor, match=match, count=self.scan_count)
+            if keys:
+                pipeline = client.pipeline(transaction=False)
+                for key in keys:
+                    pipeline.sadd(registry_key(self.prefix, key_hash_slot(key)), key)
+                added = sum(pipeline.execute())
+                self.stats['added'] += added
+                self.stats['registered'] += added
+            if cursor == 0:
+                break
+
+    def run(self) -> Dict[str, int]:
+        start = time.time()
+        try:
+            for node in self.router.masters():
+                client = self.clients.get(node)
+                slots = [slot for first, last in self.router.slots_of(node) for slot in range(first, last + 1)]
+                for slot in non_empty_slots(client, self.prefix, slots):
+                    self.remove_missing(client, slot)
+                self.add_unregistered(client)
+                logging.info(f"Reconciled {node[0]}:{node[1]}: {self.stats}")
+        finally:
+            self.clients.close()
+        logging.info(f"Reconciled registry of {self.prefix!r} in {time.time() - start:.1f}s: "
+                     + ' '.join(f'{k}={v}' for k, v in self.stats.items()))
+        return self.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reconcile the prefix registry sets with the keys that actually exist.')
+    parser.add_argument('--host', type=str, required=True, help='Any node of the redis cluster')
+    parser.add_argument('--port', type=int, default=6379, help='Redis port (default: 6379)')
+    parser.add_argument('--password', type=str, help='Redis password (default: None)')
+    parser.add_argument('--prefix', type=str, required=True, help='Registered key prefix')
+    parser.add_argument('--scan-count', type=int, default=1000, help='SCAN COUNT when looking for unregistered keys (default: 1000)')
+    parser.add_argument('--batch-size', type=int, default=500, help='SSCAN COUNT when checking registered keys (default: 500)')
+    parser.add_argument('--connect-timeout', type=int, default=5, help='Redis connection timeout in seconds (default: 5)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    try:
+        RegistryReconciler(args.host, args.port, args.password, args.prefix, args.scan_count, args.batch_size,
+                           args.connect_timeout).run()
+    except RedisError as e:
+        logging.error(f"Reconcile failed: {str(e)}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,689 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+离线分析rdb文件，按前缀统计key的数量、内存和过期时间，报告格式和scan_memory.py一致，全程不访问redis
+
+设计要点：
+1. mmap映射rdb文件，按位置流式解析，不把整个文件或整个value读进内存
+2. 支持string、list、set、zset、hash、stream，包括ziplist、listpack、intset、zipmap、quicklist等紧凑编码，以及LZF压缩的字符串
+3. 内存是估算值：key和value的编码长度加上每个对象、每个元素的固定开销，紧凑编码直接用blob长度
+4. 大文件可以用--workers多进程并行：先用跳过模式快速扫一遍找出key记录的边界，按偏移切成几段，每个进程解析一段，最后合并
+
+使用示例：
+python3 rdb_analyzer.py dump.rdb
+python3 rdb_analyzer.py dump.rdb --workers 8 --delimiters ':_' --depth 2 --top 50
+python3 rdb_analyzer.py dump.rdb --prefix 'string:perf_match_item' --type string
+"""
+
+import argparse
+import concurrent.futures
+import logging
+import mmap
+import os
+import struct
+import time
+from collections import namedtuple
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from key_stats import PrefixTree, TopKeys, print_report
+
+# opcode
+OPCODE_SLOT_INFO = 0xF4
+OPCODE_FUNCTION2 = 0xF5
+OPCODE_FUNCTION_PRE_GA = 0xF6
+OPCODE_MODULE_AUX = 0xF7
+OPCODE_IDLE = 0xF8
+OPCODE_FREQ = 0xF9
+OPCODE_AUX = 0xFA
+OPCODE_RESIZEDB = 0xFB
+OPCODE_EXPIRETIME_MS = 0xFC
+OPCODE_EXPIRETIME = 0xFD
+OPCODE_SELECTDB = 0xFE
+OPCODE_EOF = 0xFF
+
+# value类型
+TYPE_STRING = 0
+TYPE_LIST = 1
+TYPE_SET = 2
+TYPE_ZSET = 3
+TYPE_HASH = 4
+TYPE_ZSET_2 = 5
+TYPE_MODULE_PRE_GA = 6
+TYPE_MODULE_2 = 7
+TYPE_HASH_ZIPMAP = 9
+TYPE_LIST_ZIPLIST = 10
+TYPE_SET_INTSET = 11
+TYPE_ZSET_ZIPLIST = 12
+TYPE_HASH_ZIPLIST = 13
+TYPE_LIST_QUICKLIST = 14
+TYPE_STREAM_LISTPACKS = 15
+TYPE_HASH_LISTPACK = 16
+TYPE_ZSET_LISTPACK = 17
+TYPE_LIST_QUICKLIST_2 = 18
+TYPE_STREAM_LISTPACKS_2 = 19
+TYPE_SET_LISTPACK = 20
+TYPE_STREAM_LISTPACKS_3 = 21
+TYPE_HASH_METADATA_PRE_GA = 22
+TYPE_HASH_LISTPACK_EX_PRE_GA = 23
+TYPE_HASH_METADATA = 24
+TYPE_HASH_LISTPACK_EX = 25
+
+TYPE_NAMES = {
+    TYPE_STRING: 'string', TYPE_LIST: 'list', TYPE_SET: 'set', TYPE_ZSET: 'zset', TYPE_HASH: 'hash',
+    TYPE_ZSET_2: 'zset', TYPE_MODULE_2: 'module', TYPE_HASH_ZIPMAP: 'hash', TYPE_LIST_ZIPLIST: 'list',
+    TYPE_SET_INTSET: 'set', TYPE_ZSET_ZIPLIST: 'zset', TYPE_HASH_ZIPLIST: 'hash', TYPE_LIST_QUICKLIST: 'list',
+    TYPE_STREAM_LISTPACKS: 'stream', TYPE_HASH_LISTPACK: 'hash', TYPE_ZSET_LISTPACK: 'zset',
+    TYPE_LIST_QUICKLIST_2: 'list', TYPE_STREAM_LISTPACKS_2: 'stream', TYPE_SET_LISTPACK: 'set',
+    TYPE_STREAM_LISTPACKS_3: 'stream', TYPE_HASH_METADATA_PRE_GA: 'hash', TYPE_HASH_LISTPACK_EX_PRE_GA: 'hash',
+    TYPE_HASH_METADATA: 'hash', TYPE_HASH_LISTPACK_EX: 'hash',
+}
+
+# 紧凑编码的blob里每个元素对应几个entry，例如hash的ziplist是field,value交替存放
+BLOB_ENTRIES_PER_ELEMENT = {
+    TYPE_LIST_ZIPLIST: 1, TYPE_ZSET_ZIPLIST: 2, TYPE_HASH_ZIPLIST: 2, TYPE_HASH_LISTPACK: 2,
+    TYPE_ZSET_LISTPACK: 2, TYPE_SET_LISTPACK: 1, TYPE_HASH_LISTPACK_EX_PRE_GA: 3, TYPE_HASH_LISTPACK_EX: 3,
+}
+
+# 估算内存用的固定开销：dictEntry + redisObject + sds头，以及各种非紧凑编码每个元素的开销
+KEY_OVERHEAD = 48
+STRING_OVERHEAD = 16
+LIST_NODE_OVERHEAD = 32
+SET_ENTRY_OVERHEAD = 40
+HASH_ENTRY_OVERHEAD = 56
+ZSET_ENTRY_OVERHEAD = 80
+STREAM_OVERHEAD = 256
+
+# module序列化数据里的opcode
+MODULE_OPCODE_EOF = 0
+MODULE_OPCODE_SINT = 1
+MODULE_OPCODE_UINT = 2
+MODULE_OPCODE_FLOAT = 3
+MODULE_OPCODE_DOUBLE = 4
+MODULE_OPCODE_STRING = 5
+
+QUICKLIST_NODE_PLAIN = 1
+
+KeyRecord = namedtuple('KeyRecord', ['offset', 'db', 'key', 'type', 'expire_ms', 'memory', 'elements'])
+
+
+class RdbError(Exception):
+    pass
+
+
+def lzf_decompress(data, expected: int) -> bytes:
+    out = bytearray()
+    i = 0
+    n = len(data)
+    while i < n:
+        ctrl = data[i]
+        i += 1
+        if ctrl < 32:
+            # 字面量
+            out += data[i:i + ctrl + 1]
+            i += ctrl + 1
+            continue
+        # 回溯引用
+        length = ctrl >> 5
+        if length == 7:
+            length += data[i]
+            i += 1
+        ref = len(out) - ((ctrl & 0x1F) << 8) - data[i] - 1
+        i += 1
+        length += 2
+        if ref < 0:
+            raise RdbError('invalid lzf back reference')
+        if ref + length <= len(out):
+            out += out[ref:ref + length]
+        else:
+            for k in range(length):
+                out.append(out[ref + k])
+    if len(out) != expected:
+        raise RdbError(f'lzf length mismatch: expected {expected}, got {len(out)}')
+    return bytes(out)
+
+
+def ziplist_entries(blob) -> Iterator:
+    """遍历ziplist的entry，字符串返回bytes，整数返回int"""
+    pos = 10
+    while True:
+        if blob[pos] == 0xFF:
+            return
+        # prevlen
+        pos += 5 if blob[pos] == 0xFE else 1
+        enc = blob[pos]
+        kind = enc >> 6
+        if kind == 0:
+            length = enc & 0x3F
+            pos += 1
+        elif kind == 1:
+            length = ((enc & 0x3F) << 8) | blob[pos + 1]
+            pos += 2
+        elif kind == 2:
+            length = int.from_bytes(blob[pos + 1:pos + 5], 'big')
+            pos += 5
+        else:
+            pos += 1
+            if enc == 0xC0:
+                yield int.from_bytes(blob[pos:pos + 2], 'little', signed=True)
+                pos += 2
+            elif enc == 0xD0:
+                yield int.from_bytes(blob[pos:pos + 4], 'little', signed=True)
+                pos += 4
+            elif enc == 0xE0:
+                yield int.from_bytes(blob[pos:pos + 8], 'little', signed=True)
+                pos += 8
+            elif enc == 0xF0:
+                yield int.from_bytes(blob[pos:pos + 3], 'little', signed=True)
+                pos += 3
+            elif enc == 0xFE:
+                yield int.from_bytes(blob[pos:pos + 1], 'little', signed=True)
+                pos += 1
+            elif 0xF1 <= enc <= 0xFD:
+                yield (enc & 0x0F) - 1
+            else:
+                raise RdbError(f'invalid ziplist encoding {enc:#x}')
+            continue
+        yield bytes(blob[pos:pos + length])
+        pos += length
+
+
+def _listpack_backlen_size(entry_len: int) -> int:
+    if entry_len <= 127:
+        return 1
+    if entry_len < 16383:
+        return 2
+    if entry_len < 2097151:
+        return 3
+    if entry_len < 268435455:
+        return 4
+    return 5
+
+
+def listpack_entries(blob) -> Iterator:
+    """遍历listpack的entry，字符串返回bytes，整数返回int"""
+    pos = 6
+    while True:
+        enc = blob[pos]
+        if enc == 0xFF:
+            return
+        if enc < 0x80:
+            value, size = enc, 1
+        elif enc >> 6 == 2:
+            length = enc & 0x3F
+            value, size = bytes(blob[pos + 1:pos + 1 + length]), 1 + length
+        elif enc >> 5 == 6:
+            value = ((enc & 0x1F) << 8) | blob[pos + 1]
+            if value >= 1 << 12:
+                value -= 1 << 13
+            size = 2
+        elif enc >> 4 == 0xE:
+            length = ((enc & 0x0F) << 8) | blob[pos + 1]
+            value, size = bytes(blob[pos + 2:pos + 2 + length]), 2 + length
+        elif enc == 0xF0:
+            length = int.from_bytes(blob[pos + 1:pos + 5], 'little')
+            value, size = bytes(blob[pos + 5:pos + 5 + length]), 5 + length
+        elif enc in (0xF1, 0xF2, 0xF3, 0xF4):
+            width = {0xF1: 2, 0xF2: 3, 0xF3: 4, 0xF4: 8}[enc]
+            value = int.from_bytes(blob[pos + 1:pos + 1 + width], 'little', signed=True)
+            size = 1 + width
+        else:
+            raise RdbError(f'invalid listpack encoding {enc:#x}')
+        yield value
+        pos += size + _listpack_backlen_size(size)
+
+
+def intset_entries(blob) -> Iterator[int]:
+    width = int.from_bytes(blob[0:4], 'little')
+    length = int.from_bytes(blob[4:8], 'little')
+    if width not in (2, 4, 8):
+        raise RdbError(f'invalid intset encoding {width}')
+    for i in range(length):
+        start = 8 + i * width
+        yield int.from_bytes(blob[start:start + width], 'little', signed=True)
+
+
+def zipmap_entries(blob) -> Iterator[bytes]:
+    """遍历zipmap，field和value交替返回"""
+    pos = 1
+    while blob[pos] != 0xFF:
+        for is_value in (False, True):
+            length = blob[pos]
+            if length == 0xFE:
+                length = int.from_bytes(blob[pos + 1:pos + 5], 'little')
+                pos += 5
+            else:
+                pos += 1
+            free = 0
+            if is_value:
+                free = blob[pos]
+                pos += 1
+            yield bytes(blob[pos:pos + length])
+            pos += length + free
+
+
+def blob_elements(vtype: int, blob) -> int:
+    """紧凑编码的元素个数，头部记录的数量溢出时才遍历"""
+    if vtype == TYPE_SET_INTSET:
+        return int.from_bytes(blob[4:8], 'little')
+    if vtype == TYPE_HASH_ZIPMAP:
+        return sum(1 for _ in zipmap_entries(blob)) // 2
+    per_element = BLOB_ENTRIES_PER_ELEMENT[vtype]
+    if vtype in (TYPE_LIST_ZIPLIST, TYPE_ZSET_ZIPLIST, TYPE_HASH_ZIPLIST):
+        count = int.from_bytes(blob[8:10], 'little')
+        if count == 0xFFFF:
+            count = sum(1 for _ in ziplist_entries(blob))
+    else:
+        count = int.from_bytes(blob[4:6], 'little')
+        if count == 0xFFFF:
+            count = sum(1 for _ in listpack_entries(blob))
+    return count // per_element
+
+
+class RdbParser:
+    """在mmap(或bytes)上按位置解析rdb"""
+
+    def __init__(self, buf, pos: int = 0, db: int = 0):
+        self.buf = buf
+        self.pos = pos
+        self.db = db
+        self.version = None
+        self.aux: Dict[bytes, bytes] = {}
+
+    def read_header(self) -> int:
+        magic = bytes(self.buf[0:9])
+        if magic[:5] != b'REDIS':
+            raise RdbError('not a rdb file')
+        self.version = int(magic[5:9])
+        self.pos = 9
+        return self.version
+
+    def _take(self, n: int):
+        start = self.pos
+        self.pos += n
+        if self.pos > len(self.buf):
+            raise RdbError('unexpected end of file')
+        return self.buf[start:self.pos]
+
+    def read_length(self) -> Tuple[int, bool]:
+        """返回(长度, 是否是特殊编码)"""
+        b = self.buf[self.pos]
+        self.pos += 1
+        kind = b >> 6
+        if kind == 0:
+            return b & 0x3F, False
+        if kind == 1:
+            value = ((b & 0x3F) << 8) | self.buf[self.pos]
+            self.pos += 1
+            return value, False
+        if kind == 2:
+            if b == 0x80:
+                return int.from_bytes(self._take(4), 'big'), False
+            if b == 0x81:
+                return int.from_bytes(self._take(8), 'big'), False
+            raise RdbError(f'invalid length encoding {b:#x} at {self.pos - 1}')
+        return b & 0x3F, True
+
+    def read_string(self) -> bytes:
+        length, encoded = self.read_length()
+        if not encoded:
+            return bytes(self._take(length))
+        if length == 0:
+            return str(struct.unpack('<b', self._take(1))[0]).encode()
+        if length == 1:
+            return str(struct.unpack('<h', self._take(2))[0]).encode()
+        if length == 2:
+            return str(struct.unpack('<i', self._take(4))[0]).encode()
+        if length == 3:
+            clen = self.read_length()[0]
+            ulen = self.read_length()[0]
+            return lzf_decompress(self._take(clen), ulen)
+        raise RdbError(f'invalid string encoding {length}')
+
+    def skip_string(self) -> int:
+        """跳过一个字符串，返回它解压后的长度"""
+        length, encoded = self.read_length()
+        if not encoded:
+            self.pos += length
+            return length
+        if length in (0, 1, 2):
+            self.pos += 1 << length
+            return 8
+        if length == 3:
+            clen = self.read_length()[0]
+            ulen = self.read_length()[0]
+            self.pos += clen
+            return ulen
+        raise RdbError(f'invalid string encoding {length}')
+
+    def _read_blob_elements(self, vtype: int) -> Tuple[int, int]:
+        """读紧凑编码的blob，返回(blob长度, 元素个数)。没压缩时只读头部，不拷贝整个blob"""
+        start = self.pos
+        length, encoded = self.read_length()
+        if not encoded:
+            blob = self.buf[self.pos:self.pos + 10]
+            count = None
+            if vtype == TYPE_SET_INTSET:
+                count = blob_elements(vtype, blob)
+            elif vtype in (TYPE_LIST_ZIPLIST, TYPE_ZSET_ZIPLIST, TYPE_HASH_ZIPLIST):
+                if int.from_bytes(blob[8:10], 'little') != 0xFFFF:
+                    count = blob_elements(vtype, blob)
+            elif vtype != TYPE_HASH_ZIPMAP and int.from_bytes(blob[4:6], 'little') != 0xFFFF:
+                count = blob_elements(vtype, blob)
+            if count is None:
+                # 头部的数量溢出了，只能把blob读出来遍历
+                count = blob_elements(vtype, self.buf[self.pos:self.pos + length])
+            self.pos += length
+            return length, count
+        self.pos = start
+        blob = self.read_string()
+        return len(blob), blob_elements(vtype, blob)
+
+    def _skip_module_value(self):
+        while True:
+            opcode = self.read_length()[0]
+            if opcode == MODULE_OPCODE_EOF:
+                return
+            if opcode in (MODULE_OPCODE_SINT, MODULE_OPCODE_UINT):
+                self.read_length()
+            elif opcode == MODULE_OPCODE_FLOAT:
+                self.pos += 4
+            elif opcode == MODULE_OPCODE_DOUBLE:
+                self.pos += 8
+            elif opcode == MODULE_OPCODE_STRING:
+                self.skip_string()
+            else:
+                raise RdbError(f'invalid module opcode {opcode}')
+
+    def _skip_stream(self, vtype: int) -> Tuple[int, int]:
+        memory = STREAM_OVERHEAD
+        for _ in range(self.read_length()[0]):
+            memory += self.skip_string()
+            memory += self.skip_string()
+        elements = self.read_length()[0]
+        # last id
+        self.read_length()
+        self.read_length()
+        if vtype >= TYPE_STREAM_LISTPACKS_2:
+            # first id, max deleted id, entries added
+            for _ in range(5):
+                self.read_length()
+        for _ in range(self.read_length()[0]):
+            self.skip_string()
+            self.read_length()
+            self.read_length()
+            if vtype >= TYPE_STREAM_LISTPACKS_2:
+                self.read_length()
+            # 消费组的PEL: 16字节id + 8字节投递时间 + 投递次数
+            for _ in range(self.read_length()[0]):
+                self.pos += 24
+                self.read_length()
+            for _ in range(self.read_length()[0]):
+                self.skip_string()
+                self.pos += 16 if vtype >= TYPE_STREAM_LISTPACKS_3 else 8
+                self.pos += 16 * self.read_length()[0]
+        return memory, elements
+
+    def read_value(self, vtype: int, full: bool = True) -> Tuple[int, int]:
+        """解析一个value，返回(估算内存, 元素个数)。full为False时不解析blob内部，只用来找记录边界"""
+        if vtype == TYPE_STRING:
+            return self.skip_string() + STRING_OVERHEAD, 1
+        if vtype in (TYPE_LIST, TYPE_SET):
+            overhead = LIST_NODE_OVERHEAD if vtype == TYPE_LIST else SET_ENTRY_OVERHEAD
+            count = self.read_length()[0]
+            memory = 0
+            for _ in range(count):
+                memory += self.skip_string() + overhead
+            return memory, count
+        if vtype in (TYPE_ZSET, TYPE_ZSET_2):
+            count = self.read_length()[0]
+            memory = 0
+            for _ in range(count):
+                memory += self.skip_string() + ZSET_ENTRY_OVERHEAD
+                if vtype == TYPE_ZSET_2:
+                    self.pos += 8
+                else:
+                    # 字符串形式的double，253/254/255分别是nan/+inf/-inf
+                    length = self.buf[self.pos]
+                    self.pos += 1 if length >= 253 else 1 + length
+            return memory, count
+        if vtype == TYPE_HASH:
+            count = self.read_length()[0]
+            memory = 0
+            for _ in range(count):
+                memory += self.skip_string() + self.skip_string() + HASH_ENTRY_OVERHEAD
+            return memory, count
+        if vtype in (TYPE_HASH_METADATA_PRE_GA, TYPE_HASH_METADATA):
+            if vtype == TYPE_HASH_METADATA:
+                self.pos += 8
+            count = self.read_length()[0]
+            memory = 0
+            for _ in range(count):
+                self.read_length()
+                memory += self.skip_string() + self.skip_string() + HASH_ENTRY_OVERHEAD
+            return memory, count
+        if vtype in BLOB_ENTRIES_PER_ELEMENT or vtype in (TYPE_SET_INTSET, TYPE_HASH_ZIPMAP):
+            if vtype == TYPE_HASH_LISTPACK_EX:
+                self.pos += 8
+            if not full:
+                return self.skip_string(), 0
+            return self._read_blob_elements(vtype)
+        if vtype in (TYPE_LIST_QUICKLIST, TYPE_LIST_QUICKLIST_2):
+            nodes = self.read_length()[0]
+            memory = 0
+            elements = 0
+            for _ in range(nodes):
+                container = 2
+                if vtype == TYPE_LIST_QUICKLIST_2:
+                    container = self.read_length()[0]
+                if container == QUICKLIST_NODE_PLAIN or not full:
+                    memory += self.skip_string() + LIST_NODE_OVERHEAD
+                    elements += 1
+                    continue
+                inner = TYPE_LIST_ZIPLIST if vtype == TYPE_LIST_QUICKLIST else TYPE_SET_LISTPACK
+                size, count = self._read_blob_elements(inner)
+                memory += size + LIST_NODE_OVERHEAD
+                elements += count
+            return memory, elements
+        if vtype in (TYPE_STREAM_LISTPACKS, TYPE_STREAM_LISTPACKS_2, TYPE_STREAM_LISTPACKS_3):
+            return self._skip_stream(vtype)
+        if vtype == TYPE_MODULE_2:
+            self.read_length()
+            start = self.pos
+            self._skip_module_value()
+            return self.pos - start, 1
+        raise RdbError(f'unsupported value type {vtype} at {self.pos - 1}')
+
+    def records(self, end: Optional[int] = None, full: bool = True) -> Iterator[KeyRecord]:
+        """从当前位置开始逐个返回key记录，遇到EOF或者记录起点超过end时结束"""
+        buf = self.buf
+        expire_ms = -1
+        record_start = None
+        while True:
+            if record_start is None:
+                record_start = self.pos
+                if end is not None and record_start >= end:
+                    return
+            op = buf[self.pos]
+            self.pos += 1
+            # 这几个opcode是下一个key的前缀，属于同一条记录
+            if op == OPCODE_EXPIRETIME_MS:
+                expire_ms = int.from_bytes(self._take(8), 'little')
+                continue
+            if op == OPCODE_EXPIRETIME:
+                expire_ms = int.from_bytes(self._take(4), 'little') * 1000
+                continue
+            if op == OPCODE_FREQ:
+                self.pos += 1
+                continue
+            if op == OPCODE_IDLE:
+                self.read_length()
+                continue
+            if op == OPCODE_EOF:
+                return
+            if op == OPCODE_SELECTDB:
+                self.db = self.read_length()[0]
+            elif op == OPCODE_RESIZEDB:
+                self.read_length()
+                self.read_length()
+            elif op == OPCODE_AUX:
+                name = self.read_string()
+                self.aux[name] = self.read_string()
+            elif op == OPCODE_MODULE_AUX:
+                self.read_length()
+                if self.read_length()[0] != MODULE_OPCODE_UINT:
+                    raise RdbError('invalid module aux')
+                self.read_length()
+                self._skip_module_value()
+            elif op == OPCODE_FUNCTION2:
+                self.skip_string()
+            elif op == OPCODE_SLOT_INFO:
+                for _ in range(3):
+                    self.read_length()
+            elif op == OPCODE_FUNCTION_PRE_GA:
+                raise RdbError('pre-GA function opcode is not supported')
+            else:
+                if full:
+                    key = self.read_string()
+                    key_memory = len(key)
+                else:
+                    key = None
+                    key_memory = self.skip_string()
+                memory, elements = self.read_value(op, full)
+                yield KeyRecord(record_start, self.db, key, op, expire_ms, memory + key_memory + KEY_OVERHEAD,
+                                elements)
+                expire_ms = -1
+            record_start = None
+
+
+def open_rdb(path: str):
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def read_preamble(path: str) -> Tuple[int, Dict[bytes, bytes]]:
+    """读出版本号和第一个key之前的aux字段"""
+    buf = open_rdb(path)
+    try:
+        parser = RdbParser(buf)
+        version = parser.read_header()
+        for _ in parser.records(full=False):
+            break
+        return version, parser.aux
+    finally:
+        buf.close()
+
+
+def split_ranges(path: str, parts: int) -> List[Tuple[int, int, int]]:
+    """跳过模式扫一遍，按文件偏移把key记录均分成parts段，返回[(start, end, db)]"""
+    buf = open_rdb(path)
+    try:
+        size = len(buf)
+        parser = RdbParser(buf)
+        parser.read_header()
+        step = size / parts
+        ranges = []
+        next_cut = 0
+        for record in parser.records(full=False):
+            if record.offset >= next_cut:
+                if ranges:
+                    ranges[-1][1] = record.offset
+                ranges.append([record.offset, size, record.db])
+                next_cut = record.offset + step
+        return [tuple(item) for item in ranges]
+    finally:
+        buf.close()
+
+
+def analyze_range(path: str, start: Optional[int], end: Optional[int], db: int, options: dict):
+    """解析一段记录，返回这一段的前缀树、top keys和按db的key数"""
+    buf = open_rdb(path)
+    try:
+        parser = RdbParser(buf, db=db)
+        if start is None:
+            parser.read_header()
+        else:
+            parser.pos = start
+        tree = PrefixTree(options['delimiters'], options['depth'])
+        top = TopKeys(options['top'])
+        db_keys: Dict[int, int] = {}
+        prefix = options.get('prefix')
+        only_type = options.get('type')
+        only_db = options.get('db')
+        now_ms = options['now_ms']
+        for record in parser.records(end=end):
+            if only_db is not None and record.db != only_db:
+                continue
+            if prefix and not record.key.startswith(prefix):
+                continue
+            key_type = TYPE_NAMES.get(record.type, str(record.type))
+            if only_type and key_type != only_type:
+                continue
+            ttl_ms = max(record.expire_ms - now_ms, 0) if record.expire_ms >= 0 else -1
+            tree.add(record.key, record.memory, ttl_ms, key_type)
+            top.add(record.key, record.memory, key_type, ttl_ms)
+            db_keys[record.db] = db_keys.get(record.db, 0) + 1
+        return tree, top, db_keys
+    finally:
+        buf.close()
+
+
+def analyze(path: str, workers: int = 1, delimiters: str = ':', depth: int = 3, top: int = 20, prefix: bytes = None,
+            key_type: str = None, db: int = None, now_ms: int = None):
+    version, aux = read_preamble(path)
+    if now_ms is None:
+        # ttl按rdb生成的时间计算，没有ctime时用当前时间
+        ctime = aux.get(b'ctime')
+        now_ms = int(ctime) * 1000 if ctime else int(time.time() * 1000)
+    options = {'delimiters': delimiters, 'depth': depth, 'top': top, 'prefix': prefix, 'type': key_type, 'db': db,
+               'now_ms': now_ms}
+
+    tree = PrefixTree(delimiters, depth)
+    top_keys = TopKeys(top)
+    db_keys: Dict[int, int] = {}
+    if workers <= 1:
+        results = [analyze_range(path, None, None, 0, options)]
+    else:
+        ranges = split_ranges(path, workers)
+        logging.info(f"Split {path} into {len(ranges)} ranges")
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(analyze_range, path, start, end, range_db, options)
+                       for start, end, range_db in ranges]
+            results = [future.result() for future in futures]
+    for part_tree, part_top, part_db_keys in results:
+        tree.merge(part_tree)
+        top_keys.merge(part_top)
+        for key_db, count in part_db_keys.items():
+            db_keys[key_db] = db_keys.get(key_db, 0) + count
+    return version, aux, tree, top_keys, db_keys
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze memory usage by key prefix from a RDB file.")
+    parser.add_argument('rdb_file', type=str, help='Path of the RDB file')
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes (default: 1)')
+    parser.add_argument('--delimiters', type=str, default=':', help='Prefix delimiters (default: ":")')
+    parser.add_argument('--depth', type=int, default=3, help='Max prefix depth (default: 3)')
+    parser.add_argument('--top', type=int, default=20, help='Number of biggest keys to show (default: 20)')
+    parser.add_argument('--min-share', type=float, default=0.01, help='Hide prefixes below this memory share (default: 0.01)')
+    parser.add_argument('--prefix', type=str, help='Only count keys with this prefix')
+    parser.add_argument('--type', type=str, help='Only count keys of this type, example: zset')
+    parser.add_argument('--db', type=int, help='Only count keys in this db')
+    parser.add_argument('--log-level', type=str, default='INFO', help='Logging level (default: INFO)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, args.log_level.upper()),
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    start = time.time()
+    prefix = args.prefix.encode('utf-8') if args.prefix else None
+    version, aux, tree, top, db_keys = analyze(args.rdb_file, args.workers, args.delimiters, args.depth, args.top,
+                                               prefix, args.type, args.db)
+    used_memory = int(aux[b'used-mem']) if b'used-mem' in aux else None
+    size = os.path.getsize(args.rdb_file)
+    print_report(tree, top, args.min_share, used_memory,
+                 title=f'rdb version {version}, {size / 1024 / 1024:.1f}MB, {time.time() - start:.1f}s')
+    print('\nkeys by db: ' + ' '.join(f'db{key_db}={count}' for key_db, count in sorted(db_keys.items())))
+
+
+if __name__ == "__main__":
+    main()
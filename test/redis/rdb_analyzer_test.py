@@ -0,0 +1,228 @@
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import tempfile
+import time
+import unittest
+
+from rdb_analyzer import RdbParser, analyze, intset_entries, listpack_entries, lzf_decompress, split_ranges, \
+    ziplist_entries
+
+# rdb测试文件都在本地生成：手工按格式拼出各种编码，再用redis-server(如果有)生成一份真实的rdb
+
+CTIME = 1700000000
+
+
+def enc_len(n):
+    if n < 1 << 6:
+        return bytes([n])
+    if n < 1 << 14:
+        return bytes([0x40 | (n >> 8), n & 0xFF])
+    return b'\x80' + struct.pack('>I', n)
+
+
+def enc_str(s):
+    return enc_len(len(s)) + s
+
+
+def enc_int_str(n):
+    return b'\xc1' + struct.pack('<h', n)
+
+
+def enc_lzf_abc():
+    # 'abc' * 20: 字面量'abc'，再从3个字节前回溯拷贝57个字节
+    data = b'\x02abc' + bytes([0xE0, 48, 2])
+    return b'\xc3' + enc_len(len(data)) + enc_len(60) + data
+
+
+def ziplist(entries):
+    body = b''
+    prev = 0
+    for entry in entries:
+        if isinstance(entry, int):
+            if 0 <= entry <= 12:
+                raw = bytes([0xF1 + entry])
+            else:
+                raw = b'\xc0' + struct.pack('<h', entry)
+        else:
+            raw = bytes([len(entry)]) + entry
+        raw = bytes([prev]) + raw
+        prev = len(raw)
+        body += raw
+    total = 10 + len(body) + 1
+    return struct.pack('<IIH', total, 0, len(entries)) + body + b'\xff'
+
+
+def listpack(entries):
+    body = b''
+    for entry in entries:
+        if isinstance(entry, int):
+            if 0 <= entry < 128:
+                raw = bytes([entry])
+            else:
+                value = entry & 0x1FFF
+                raw = bytes([0xC0 | (value >> 8), value & 0xFF])
+        else:
+            raw = bytes([0x80 | len(entry)]) + entry
+        body += raw + bytes([len(raw)])
+    total = 6 + len(body) + 1
+    return struct.pack('<IH', total, len(entries)) + body + b'\xff'
+
+
+def intset(values):
+    return struct.pack('<II', 2, len(values)) + b''.join(struct.pack('<h', v) for v in values)
+
+
+def key_record(vtype, key, value, expire_ms=None):
+    prefix = b''
+    if expire_ms is not None:
+        prefix = b'\xfc' + struct.pack('<Q', expire_ms)
+    return prefix + bytes([vtype]) + enc_str(key) + value
+
+
+def build_rdb():
+    now_ms = CTIME * 1000
+    out = b'REDIS0011'
+    out += b'\xfa' + enc_str(b'redis-ver') + enc_str(b'7.2.0')
+    out += b'\xfa' + enc_str(b'ctime') + enc_str(str(CTIME).encode())
+    out += b'\xfe' + enc_len(0) + b'\xfb' + enc_len(13) + enc_len(2)
+    out += key_record(0, b'user:1:name', enc_str(b'alice'), now_ms + 30 * 60 * 1000)
+    out += key_record(0, b'user:2:name', enc_int_str(12345))
+    out += key_record(0, b'user:3:bio', enc_lzf_abc())
+    out += key_record(10, b'list:zl', enc_str(ziplist([b'a', 7, -300])))
+    out += key_record(18, b'list:qk2', enc_len(2) + enc_len(2) + enc_str(listpack([b'x', b'y', 5]))
+                      + enc_len(1) + enc_str(b'p' * 100))
+    out += key_record(11, b'set:ints', enc_str(intset([1, 2, 3, -4])))
+    out += key_record(20, b'set:lp', enc_str(listpack([b'm1', b'm2', 1000])))
+    out += key_record(2, b'set:ht', enc_len(2) + enc_str(b'a') + enc_str(b'b'))
+    out += key_record(17, b'zset:lp', enc_str(listpack([b'm1', 1, b'm2', 2])))
+    out += key_record(5, b'zset:sk', enc_len(2) + enc_str(b'm1') + struct.pack('<d', 1.5)
+                      + enc_str(b'm2') + struct.pack('<d', 2.5))
+    out += key_record(16, b'hash:lp', enc_str(listpack([b'f1', b'v1', b'f2', -2000])))
+    out += key_record(13, b'hash:zl', enc_str(ziplist([b'f', b'v'])))
+    out += key_record(4, b'hash:ht', enc_len(1) + enc_str(b'f') + enc_str(b'v'), now_ms + 2 * 86400 * 1000)
+    out += b'\xfe' + enc_len(1)
+    # 秒级过期时间，以及LFU/LRU信息
+    out += b'\xfd' + struct.pack('<I', CTIME + 10) + b'\xf9\x05' + b'\xf8' + enc_len(3)
+    out += bytes([0]) + enc_str(b'order:9') + enc_str(b'paid')
+    out += b'\xff' + b'\x00' * 8
+    return out
+
+
+class TestRdbAnalyzer(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'dump.rdb')
+        with open(self.path, 'wb') as f:
+            f.write(build_rdb())
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_compact_encodings(self):
+        self.assertEqual(list(ziplist_entries(ziplist([b'a', 7, -300]))), [b'a', 7, -300])
+        self.assertEqual(list(listpack_entries(listpack([b'f1', 100, -2000]))), [b'f1', 100, -2000])
+        self.assertEqual(list(intset_entries(intset([1, -4]))), [1, -4])
+        self.assertEqual(lzf_decompress(enc_lzf_abc()[3:], 60), b'abc' * 20)
+
+    def test_records(self):
+        parser = RdbParser(build_rdb())
+        self.assertEqual(parser.read_header(), 11)
+        records = {r.key: r for r in parser.records()}
+        self.assertEqual(len(records), 14)
+        self.assertEqual(parser.aux[b'ctime'], str(CTIME).encode())
+        expected_elements = {
+            b'list:zl': 3, b'list:qk2': 4, b'set:ints': 4, b'set:lp': 3, b'set:ht': 2,
+            b'zset:lp': 2, b'zset:sk': 2, b'hash:lp': 2, b'hash:zl': 1, b'hash:ht': 1,
+        }
+        for key, elements in expected_elements.items():
+            self.assertEqual(records[key].elements, elements, key)
+        self.assertEqual(records[b'user:1:name'].expire_ms, CTIME * 1000 + 30 * 60 * 1000)
+        self.assertEqual(records[b'user:2:name'].expire_ms, -1)
+        self.assertEqual(records[b'order:9'].db, 1)
+        self.assertEqual(records[b'order:9'].expire_ms, (CTIME + 10) * 1000)
+
+    def test_report(self):
+        _, aux, tree, top, db_keys = analyze(self.path, top=3)
+        self.assertEqual(aux[b'redis-ver'], b'7.2.0')
+        self.assertEqual(tree.root.count, 14)
+        self.assertEqual(db_keys, {0: 13, 1: 1})
+        user = tree.root.children['user:']
+        self.assertEqual(user.count, 3)
+        self.assertEqual(user.ttl, {'<1h': 1, 'no_ttl': 2})
+        self.assertEqual(tree.root.children['hash:'].ttl, {'no_ttl': 2, '<7d': 1})
+        self.assertEqual(tree.types['set'][0], 3)
+        self.assertEqual(len(top.items()), 3)
+        self.assertEqual(top.items()[0][1], b'list:qk2')
+
+    def test_filters(self):
+        _, _, tree, _, _ = analyze(self.path, prefix=b'hash:', key_type='hash')
+        self.assertEqual(tree.root.count, 3)
+        _, _, tree, _, _ = analyze(self.path, db=1)
+        self.assertEqual(tree.root.count, 1)
+
+    def test_parallel_matches_single(self):
+        ranges = split_ranges(self.path, 4)
+        self.assertGreater(len(ranges), 1)
+        _, _, single, _, _ = analyze(self.path, workers=1)
+        _, _, parallel, _, db_keys = analyze(self.path, workers=4)
+        self.assertEqual(db_keys, {0: 13, 1: 1})
+        self.assertEqual(parallel.root.count, single.root.count)
+        self.assertEqual(parallel.root.memory, single.root.memory)
+        for name, node in single.rows(0):
+            self.assertIn(name, dict(parallel.rows(0)))
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@unittest.skipUnless(shutil.which('redis-server'), 'redis-server not installed')
+class TestRedisGeneratedRdb(unittest.TestCase):
+    def test_saved_rdb(self):
+        import redis
+
+        tmpdir = tempfile.mkdtemp()
+        port = _free_port()
+        server = subprocess.Popen(['redis-server', '--port', str(port), '--dir', tmpdir, '--save', ''],
+                                  stdout=subprocess.DEVNULL)
+        try:
+            client = redis.Redis(port=port)
+            for _ in range(50):
+                try:
+                    client.ping()
+                    break
+                except redis.ConnectionError:
+                    time.sleep(0.1)
+            pipeline = client.pipeline()
+            for i in range(100):
+                pipeline.set(f'str:{i}', 'v' * i, ex=3600)
+            pipeline.set('str:compressed', 'abcd' * 1000)
+            pipeline.rpush('list:small', *range(10))
+            pipeline.rpush('list:big', *[f'item-{i}' * 20 for i in range(1000)])
+            pipeline.sadd('set:ints', *range(100))
+            pipeline.sadd('set:big', *[f'member-{i}' for i in range(1000)])
+            pipeline.zadd('zset:small', {'a': 1, 'b': 2})
+            pipeline.zadd('zset:big', {f'm{i}': i for i in range(1000)})
+            pipeline.hset('hash:small', mapping={'f1': 'v1', 'f2': 2})
+            pipeline.hset('hash:big', mapping={f'f{i}': 'x' * 100 for i in range(1000)})
+            pipeline.xadd('stream:1', {'k': 'v'})
+            pipeline.execute()
+            client.save()
+            _, _, tree, _, _ = analyze(os.path.join(tmpdir, 'dump.rdb'))
+            self.assertEqual(tree.root.count, client.dbsize())
+            self.assertEqual(tree.root.children['str:'].count, 101)
+            self.assertEqual(tree.types['stream'][0], 1)
+            self.assertEqual(tree.types['zset'][0], 2)
+        finally:
+            server.terminate()
+            server.wait()
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
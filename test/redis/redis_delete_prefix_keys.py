@@ -10,6 +10,16 @@
 5. 监控统计：实时统计信息，详细日志记录，内存监控。实时打印统计信息，方便运维查看
 6. 配置灵活：丰富的命令行参数，可调整的并发度和超时时间
 7. 资源管理：连接池、内存限制、任务超时控制
+8. 可撤销：--snapshot-dir开启删除前快照，每个删除批次用一次lua脚本对每个key执行DUMP+PTTL+DEL，快照和删除是原子的；
+   每个节点最多有一个批次在后台执行，同时继续scan下一批，DUMP结果交给写线程压缩成segment文件(key_snapshot.py)，
+   上一批的快照写进文件之后才提交下一批；写segment出错时剩下的批次不压缩写进spill文件(--snapshot-spill-dir)，
+   并停止删除，退出码非0。误删后用snapshot_restore.py恢复
+9. 按key文件删除：--key-file直接读dry run生成的audit文件(可以是gzip)，本地算slot路由到所在的master，
+   每个master一个有界队列和一个删除线程，不用再scan一遍；已经不存在的key单独计数，内存占用和文件大小无关
+10. scan去重：--dedupe-mb开启后每个节点用固定内存预算的轮转集合记录最近scan到的key的hash，
+   rehash期间scan重复返回的key在进pipeline和audit文件之前丢掉，丢掉的数量计入统计
+11. 按登记集合删除：写入方用prefix_registry.RegisteringClient把key登记到按slot分片的登记集合，
+   --use-registry时每个节点只处理自己slot上的登记集合，用lua脚本SPOP+DEL，不需要scan整个节点
 
 使用前pip3 install redis
 psutil模块可选，用于显示内存使用情况
@@ -32,6 +42,51 @@ from datetime import datetime
 import gzip
 from typing import List, Dict, Any
 
+from cluster_router import NodeClients, SlotRouter
+from key_snapshot import SnapshotWriter
+from prefix_registry import drain_script, non_empty_slots, registry_key
+from slot import CLUSTER_SLOTS, key_hash_slot
+
+# dry run写进audit文件的格式，按key文件删除时要去掉
+DRY_RUN_MARKER = b'dry run deleted key: '
+
+# ARGV[1]是客户端当前的毫秒时间；要删除的key放在KEYS里(同一个slot)，或者不声明KEYS、跟在ARGV[1]后面
+# 对每个key执行DUMP+PTTL+DEL，直接在服务端拼成快照segment的记录格式，返回{快照的key数, 记录数据, 删除的key}
+# 用脚本而不是pipeline里逐个DUMP/PTTL/DEL，一个批次只有一条命令和一个回复，客户端几乎没有解析开销
+# scan和登记集合模式的key是本节点的key，没有通过KEYS声明，一批里有多个slot的key。只在redis 6.2上验证过可以这样执行，
+# 6.2不检查脚本里未声明的key属于哪个slot；其他版本(7.x对脚本访问的key加了slot检查)使用前要先验证
+# 按key文件删除时key按slot分组通过KEYS传入，slot迁走了会返回MOVED
+snapshot_delete_script = """
+local now = tonumber(ARGV[1])
+local keys = KEYS
+if #keys == 0 then
+    keys = {}
+    for i = 2, #ARGV do
+        keys[#keys + 1] = ARGV[i]
+    end
+end
+local parts = {}
+local deleted = {}
+for _, key in ipairs(keys) do
+    local payload = redis.call('DUMP', key)
+    if payload then
+        local pttl = redis.call('PTTL', key)
+        local expire_at = -1
+        if pttl >= 0 then
+            expire_at = now + pttl
+        end
+        -- 分段放进table最后一次拼接，避免每条记录都复制一遍value
+        parts[#parts + 1] = struct.pack('>I4', #key)
+        parts[#parts + 1] = key
+        parts[#parts + 1] = struct.pack('>i8I4', expire_at, #payload)
+        parts[#parts + 1] = payload
+        redis.call('DEL', key)
+        deleted[#deleted + 1] = key
+    end
+end
+return {#deleted, table.concat(parts), deleted}
+"""
+
 # 尝试导入psutil，如果失败则设置为None
 try:
     import psutil
@@ -69,6 +124,13 @@ except ImportError:
     --stats-interval 统计信息输出间隔（秒），默认60
     --task-timeout 单个任务超时时间（秒），默认3600秒
     --overall-timeout 整体超时时间（秒），默认86400秒
+    --snapshot-dir 删除前快照目录，默认不做快照
+    --snapshot-buffer-mb 还没写盘的快照最多占用的内存（MB），默认64
+    --snapshot-segment-mb 单个快照segment文件大小（MB），默认256
+    --snapshot-spill-dir 快照写segment出错后剩下的批次写到这个目录，默认和--snapshot-dir相同
+    --key-file 按key文件删除，文件可以是dry run的audit输出，支持gzip，默认scan
+    --dedupe-mb 每个节点scan去重使用的内存（MB），0表示不去重，默认0
+    --use-registry 从prefix_registry.py的登记集合取key删除，不scan，默认False
 
     示例命令：
     # 先进行空跑测试
@@ -76,6 +138,16 @@ except ImportError:
     
     # 确认无误后执行实际删除
     python3 ./redis_delete_prefix_keys.py --redis-ips 10.74.110.58,10.74.40.101,10.74.204.2 --prefix "key:" --dry-run False --output-file audit.log
+
+    # 删除前做快照，误删后可以恢复
+    python3 ./redis_delete_prefix_keys.py --redis-ips 10.74.110.58,10.74.40.101,10.74.204.2 --prefix "key:" --dry-run False --snapshot-dir ./snapshot
+    python3 ./snapshot_restore.py --host 10.74.110.58 --snapshot-dir ./snapshot
+
+    # 直接用dry run的结果删除，不再scan
+    python3 ./redis_delete_prefix_keys.py --redis-ips 10.74.110.58 --prefix "key:" --dry-run False --key-file audit.log --output-file deleted.log
+
+    # key写入时已经用RegisteringClient登记过前缀
+    python3 ./redis_delete_prefix_keys.py --redis-ips 10.74.110.58,10.74.40.101,10.74.204.2 --prefix "session:" --dry-run False --use-registry
 """
 
 class FileWriter:
@@ -128,13 +200,43 @@ class FileWriter:
                 self.buffer = []
         logging.info(f"File writer stopped, total written: {self.total_written} lines")
 
+class RotatingKeySet:
+    """
+        固定内存预算的近似去重集合，只保存key的64位hash
+        当前集合写满一半预算后变成旧集合，再新建一个当前集合；判断是否重复时两个集合都查
+        scan重复返回的key和第一次返回的间隔不会太远，淘汰很久之前的key不影响去重效果
+        只比较hash：两个不同的key的64位hash相同时，后一个会被当成重复丢掉，这一轮不会删除，概率可以忽略
+    """
+
+    # 一个元素在set里最多占用的字节数: int对象约32字节 + hash表的槽位，刚扩容完时每个元素最多约100字节，
+    # 按最坏情况算，两个集合加起来不超过预算
+    ENTRY_BYTES = 144
+
+    def __init__(self, max_bytes: int):
+        self.capacity = max(1, max_bytes // 2 // self.ENTRY_BYTES)
+        self.current = set()
+        self.previous = set()
+
+    def seen(self, key) -> bool:
+        """key出现过返回True，否则记录下来返回False"""
+        h = hash(key)
+        if h in self.current or h in self.previous:
+            return True
+        if len(self.current) >= self.capacity:
+            self.previous = self.current
+            self.current = set()
+        self.current.add(h)
+        return False
+
 class ClusterKeyDeleter:
     def __init__(self, redis_ips: List[str], prefix: str, scan_count: int = 1000, pipeline_size: int = 200,
                  delete_interval: float = 100, dry_run: bool = True, connect_timeout: int = 5, max_retries: int = 3,
                  max_workers: int = 3, port: int = 6379, password: str = None, only_master: bool = True,
                  skip_slave: bool = True, output_file: str = 'audit.log', buffer_size: int = 1000,
                  compress: bool = False, log_level: str = 'INFO', max_memory: int = 1024,
-                 stats_interval: int = 60, task_timeout: int = 3600, overall_timeout: int = 86400):
+                 stats_interval: int = 60, task_timeout: int = 3600, overall_timeout: int = 86400,
+                 snapshot_dir: str = None, snapshot_buffer_mb: int = 64, snapshot_segment_mb: int = 256,
+                 dedupe_mb: int = 0, use_registry: bool = False, snapshot_spill_dir: str = None):
         self.redis_ips = redis_ips
         self.prefix = prefix
         self.scan_count = scan_count
@@ -153,6 +255,8 @@ class ClusterKeyDeleter:
         self.stats_interval = stats_interval
         self.task_timeout = task_timeout  # 单个任务超时时间（秒）
         self.overall_timeout = overall_timeout  # 整体超时时间（秒）
+        self.dedupe_bytes = dedupe_mb * 1024 * 1024  # 每个节点scan去重的内存预算，0表示不去重
+        self.use_registry = use_registry
         
         # 设置日志
         self._setup_logging(log_level)
@@ -169,7 +273,36 @@ class ClusterKeyDeleter:
                 socket_connect_timeout=connect_timeout,
                 decode_responses=True  # 自动解码响应
             )
-        
+
+        # 快照模式下DUMP返回的是二进制，需要不解码的连接池，key也按原始字节处理
+        self.snapshot_writer = None
+        self.snapshot_script = None
+        self.snapshot_executor = None
+        self.snapshot_local = threading.local()
+        # 快照没有完整写下来(写segment出错，或者spill也失败)，main按非0退出
+        self.snapshot_failed = False
+        self.raw_pools = {}
+        if snapshot_dir and not dry_run:
+            for ip in redis_ips:
+                self.raw_pools[ip] = redis.ConnectionPool(
+                    host=ip,
+                    port=port,
+                    password=password,
+                    max_connections=3,  # scan和后台执行的快照批次各用一个
+                    socket_timeout=connect_timeout,
+                    socket_connect_timeout=connect_timeout,
+                    decode_responses=False
+                )
+            self.snapshot_writer = SnapshotWriter(snapshot_dir, snapshot_segment_mb * 1024 * 1024,
+                                                  snapshot_buffer_mb * 1024 * 1024, spill_dir=snapshot_spill_dir)
+            self.snapshot_script = redis.StrictRedis(connection_pool=self.raw_pools[redis_ips[0]]).register_script(
+                snapshot_delete_script)
+            self.snapshot_executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+        self.drain_script = None
+        if use_registry:
+            self.drain_script = redis.StrictRedis(connection_pool=self.pools[redis_ips[0]]).register_script(drain_script)
+
         self.file_writer = FileWriter(output_file, buffer_size, compress)
         self.stop_event = False
         self.total_deleted = 0
@@ -180,10 +313,16 @@ class ClusterKeyDeleter:
             'nodes_processed': 0,
             'nodes_skipped': 0,
             'errors': 0,
-            'retries': 0
+            'retries': 0,
+            'missing': 0,  # 按key文件、登记集合删除或者快照脚本执行时已经不存在的key
+            'skipped': 0,  # 按key文件删除时前缀不匹配的key
+            'duplicates_dropped': 0  # scan重复返回被去重丢掉的key
         }
         self.stats_lock = Lock()
         self.processed_nodes = set()  # 用于跟踪已处理的节点
+        # 按key文件删除时使用，节点从CLUSTER SLOTS获取
+        self.key_router = None
+        self.key_clients = None
         
         # 启动统计信息线程
         self.stats_thread = threading.Thread(target=self._stats_worker, daemon=True)
@@ -227,16 +366,21 @@ class ClusterKeyDeleter:
                 f"删除key数: {self.total_deleted}\n"
                 f"错误数: {self.stats['errors']}\n"
                 f"重试次数: {self.stats['retries']}\n"
+                f"不存在的key数: {self.stats['missing']}\n"
+                f"跳过的key数: {self.stats['skipped']}\n"
+                f"去重丢掉的key数: {self.stats['duplicates_dropped']}\n"
             )
             
             if HAS_PSUTIL:
                 memory_usage = psutil.Process().memory_info().rss
                 stats_msg += f"内存使用: {memory_usage/1024/1024:.2f}MB\n"
             
-            stats_msg += (
-                f"文件写入: {self.file_writer.total_written}行\n"
-                f"{'='*50}\n"
-            )
+            stats_msg += f"文件写入: {self.file_writer.total_written}行\n"
+            if self.snapshot_writer is not None:
+                snapshot_stats = self.snapshot_writer.stats
+                stats_msg += (f"快照: {snapshot_stats['keys']}个key, 原始{snapshot_stats['raw_bytes']/1024/1024:.2f}MB, "
+                              f"写入{snapshot_stats['written_bytes']/1024/1024:.2f}MB\n")
+            stats_msg += f"{'='*50}\n"
             self._safe_print(stats_msg)
 
     def _check_memory(self):
@@ -276,6 +420,123 @@ class ClusterKeyDeleter:
         """写入消息到文件缓冲区"""
         self.file_writer.write(message)
 
+    def _execute_pipeline(self, r, pipeline, batch_keys: list) -> int:
+        """
+            执行一个删除批次，返回这次确认删除的key数
+            快照模式下pipeline是空的，批次里的key在batch_keys里，用脚本快照并删除；脚本在后台执行，
+            返回的是上一个批次脚本实际删除的key数，不存在的key和失败的批次不计数
+        """
+        if self.snapshot_writer is None:
+            return len(pipeline.execute())
+        # 每个节点最多一个批次在后台执行，上一批的错误在这里抛出
+        deleted = self._wait_snapshot_batch()
+        # 快照已经写不下去了就不能再删
+        if self.snapshot_writer.error is not None:
+            raise RuntimeError(f"snapshot writer failed, stop deleting: {self.snapshot_writer.error}")
+        keys = list(batch_keys)
+        batch_keys.clear()
+        self.snapshot_local.pending = self.snapshot_executor.submit(self._snapshot_delete, r, keys)
+        return deleted
+
+    def _snapshot_delete(self, r, keys: list) -> int:
+        """在后台执行：快照并删除一批key，等这批快照写进文件再返回，节点线程等到它返回才提交下一批"""
+        reply = self.snapshot_script(args=[int(time.time() * 1000)] + keys, client=r)
+        written = self.snapshot_writer.add_block(reply[1], reply[0])
+        self._write_deleted(reply[2])
+        with self.stats_lock:
+            self.stats['missing'] += len(keys) - reply[0]
+        written.result()
+        return reply[0]
+
+    def _write_deleted(self, keys: list):
+        """快照模式下audit文件只记脚本实际删除的key，和非快照模式DEL返回1的key一致"""
+        for key in keys:
+            self._write_to_file(key.decode('utf-8', 'backslashreplace'))
+
+    def _wait_snapshot_batch(self) -> int:
+        """等当前节点线程提交的快照批次执行完，返回它删除的key数"""
+        future = getattr(self.snapshot_local, 'pending', None)
+        if future is None:
+            return 0
+        self.snapshot_local.pending = None
+        return future.result()
+
+    def _owned_slots(self, r) -> List[int]:
+        """当前节点负责的slot，非集群模式是全部slot"""
+        try:
+            my_id = r.execute_command('CLUSTER', 'MYID')
+        except ResponseError as e:
+            if 'cluster support disabled' not in str(e):
+                raise
+            return list(range(CLUSTER_SLOTS))
+        return [slot for item in r.execute_command('CLUSTER', 'SLOTS') if item[2][2] == my_id
+                for slot in range(int(item[0]), int(item[1]) + 1)]
+
+    def _drain_registry(self, r, ip: str) -> int:
+        """按slot取出登记集合里的key删除，返回这个节点删除的key数"""
+        node_deleted = 0
+        raw_prefix = self.prefix.encode('utf-8')
+        sizes = non_empty_slots(r, self.prefix, self._owned_slots(r))
+        if self.dry_run:
+            # 只列出不弹出
+            for slot in sizes:
+                for key in r.sscan_iter(registry_key(self.prefix, slot), count=self.pipeline_size):
+                    self._write_to_file(f"dry run deleted key: {key}")
+            return node_deleted
+        while sizes and not self.stop_event:
+            # 登记的key很分散时一个slot只有几个key，按SCARD的结果把多个slot凑成一批，一批大约pipeline_size个key
+            batch = []
+            batch_size = 0
+            for slot, size in sizes.items():
+                if batch and batch_size + min(size, self.pipeline_size) > self.pipeline_size:
+                    break
+                batch.append(slot)
+                batch_size += min(size, self.pipeline_size)
+            pipeline = r.pipeline(transaction=False)
+            for slot in batch:
+                if self.snapshot_writer is not None:
+                    pipeline.spop(registry_key(self.prefix, slot), self.pipeline_size)
+                    pipeline.scard(registry_key(self.prefix, slot))
+                else:
+                    self.drain_script(keys=[registry_key(self.prefix, slot)],
+                                      args=[self.pipeline_size, self.prefix], client=pipeline)
+            results = pipeline.execute()
+            if self.snapshot_writer is not None:
+                # 快照脚本需要key列表，先SPOP出来；SPOP之后删除之前进程挂掉的话，key还在但是不在登记集合里，reconcile会补回来
+                # 脚本在后台执行，这里拿到的是上一批实际删除的key数
+                keys = [key for popped in results[0::2] for key in popped if key.startswith(raw_prefix)]
+                deleted = self._execute_pipeline(r, None, keys) if keys else 0
+                remaining = results[1::2]
+            else:
+                deleted = missing = 0
+                remaining = []
+                for deleted_keys, slot_missing, slot_remaining in results:
+                    for key in deleted_keys:
+                        self._write_to_file(key)
+                    deleted += len(deleted_keys)
+                    missing += slot_missing
+                    remaining.append(slot_remaining)
+                with self.stats_lock:
+                    self.stats['missing'] += missing
+            for slot, slot_remaining in zip(batch, remaining):
+                if slot_remaining:
+                    sizes[slot] = slot_remaining
+                else:
+                    del sizes[slot]
+            if deleted:
+                node_deleted += deleted
+                with self.total_deleted_lock:
+                    self.total_deleted += deleted
+                logging.info(f"Deleted {deleted} keys from {ip} registry ({len(batch)} slots), node total: {node_deleted}, global total: {self.total_deleted}")
+            if self.delete_interval > 0:
+                time.sleep(self.delete_interval)
+        if self.snapshot_writer is not None:
+            deleted = self._wait_snapshot_batch()
+            node_deleted += deleted
+            with self.total_deleted_lock:
+                self.total_deleted += deleted
+        return node_deleted
+
     def _is_master(self, redis_client) -> bool:
         """检查节点是否为master"""
         try:
@@ -336,7 +597,7 @@ class ClusterKeyDeleter:
         try:
             # 创建Redis连接
             r = redis.StrictRedis(
-                connection_pool=self.pools[ip]
+                connection_pool=self.raw_pools[ip] if self.snapshot_writer is not None else self.pools[ip]
             )
             
             # 检查节点角色
@@ -353,11 +614,21 @@ class ClusterKeyDeleter:
                         logging.warning(f"Node {ip} is slave, will try to process but may fail")
                 else:
                     logging.info(f"Processing slave node: {ip}")
+
+            if self.use_registry:
+                node_deleted = self._drain_registry(r, ip)
+                with self.stats_lock:
+                    self.stats['nodes_processed'] += 1
+                logging.info(f"Finished draining registry on node {ip}, total deleted: {node_deleted}")
+                self.processed_nodes.add(ip)  # 标记为已处理
+                return
             
             # 创建pipeline
             pipeline = r.pipeline(transaction=False)
             pipeline_size = 0
             node_deleted = 0
+            batch_keys = []
+            dedupe = RotatingKeySet(self.dedupe_bytes) if self.dedupe_bytes > 0 else None
             
             # 开始scan
             cursor = 0
@@ -375,6 +646,14 @@ class ClusterKeyDeleter:
                         count=self.scan_count
                     )
                     
+                    if keys and dedupe is not None:
+                        # 去掉scan重复返回的key，不会重复DEL，也不会重复写audit
+                        unique_keys = [key for key in keys if not dedupe.seen(key)]
+                        if len(unique_keys) < len(keys):
+                            with self.stats_lock:
+                                self.stats['duplicates_dropped'] += len(keys) - len(unique_keys)
+                        keys = unique_keys
+
                     if keys:
                         for key in keys:
                             if self.stop_event:  # 检查是否需要停止
@@ -383,18 +662,22 @@ class ClusterKeyDeleter:
                                 self._write_to_file(f"dry run deleted key: {key}")
                             else:
                                 try:
-                                    self._write_to_file(f"{key}")
-                                    pipeline.delete(key)
+                                    if self.snapshot_writer is not None:
+                                        # audit在脚本执行完之后按实际删除的key写
+                                        batch_keys.append(key)
+                                    else:
+                                        self._write_to_file(f"{key}")
+                                        pipeline.delete(key)
                                     pipeline_size += 1
-                                    node_deleted += 1
                                     
                                     # 当pipeline达到指定大小时执行
                                     if pipeline_size >= self.pipeline_size:
                                         try:
-                                            pipeline.execute()
+                                            deleted = self._execute_pipeline(r, pipeline, batch_keys)
+                                            node_deleted += deleted
                                             with self.total_deleted_lock:
-                                                self.total_deleted += pipeline_size
-                                            logging.info(f"Deleted {pipeline_size} keys from {ip}, node total: {node_deleted}, global total: {self.total_deleted}")
+                                                self.total_deleted += deleted
+                                            logging.info(f"Deleted {deleted} keys from {ip}, node total: {node_deleted}, global total: {self.total_deleted}")
                                             pipeline_size = 0
                                             if self.delete_interval > 0:
                                                 time.sleep(self.delete_interval)
@@ -423,10 +706,11 @@ class ClusterKeyDeleter:
             # 执行剩余的pipeline命令
             if pipeline_size > 0 and not self.dry_run and not self.stop_event:
                 try:
-                    pipeline.execute()
+                    deleted = self._execute_pipeline(r, pipeline, batch_keys)
+                    node_deleted += deleted
                     with self.total_deleted_lock:
-                        self.total_deleted += pipeline_size
-                    logging.info(f"Deleted {pipeline_size} keys from {ip}, node total: {node_deleted}, global total: {self.total_deleted}")
+                        self.total_deleted += deleted
+                    logging.info(f"Deleted {deleted} keys from {ip}, node total: {node_deleted}, global total: {self.total_deleted}")
                 except ReadOnlyError:
                     if not is_master:
                         logging.error(f"Node {ip} is slave, skipping delete operation")
@@ -434,6 +718,16 @@ class ClusterKeyDeleter:
                         logging.error(f"Node {ip} became read-only, skipping delete operation")
                 except ResponseError as e:
                     logging.error(f"Pipeline execution error on {ip}: {str(e)}")
+            if self.snapshot_writer is not None:
+                try:
+                    deleted = self._wait_snapshot_batch()
+                    node_deleted += deleted
+                    with self.total_deleted_lock:
+                        self.total_deleted += deleted
+                except (RedisError, RuntimeError) as e:
+                    logging.error(f"Snapshot batch error on {ip}: {str(e)}")
+                    with self.stats_lock:
+                        self.stats['errors'] += 1
             
             with self.stats_lock:
                 self.stats['nodes_processed'] += 1
@@ -475,25 +769,211 @@ class ClusterKeyDeleter:
         finally:
             # 打印未处理的节点信息
             self._print_unprocessed_nodes()
-            
-            # 确保所有数据都写入文件
-            logging.info("Stopping file writer...")
-            self.stop_event = True
-            self.file_writer.stop()
-            logging.info("File writer stopped")
-            
-            # 打印最终统计信息
-            logging.info("Printing final statistics...")
-            self._print_stats()
-            
-            # 关闭所有连接池
-            logging.info("Closing Redis connection pools...")
-            for pool in self.pools.values():
-                pool.disconnect()
-            logging.info("All Redis connection pools closed")
+            self._shutdown()
         
         logging.info(f"Finished deleting keys from all Redis nodes. Total deleted: {self.total_deleted}")
-        logging.info("Program completed successfully")
+        if self.snapshot_failed:
+            logging.error("Program stopped early, the snapshot is incomplete")
+        else:
+            logging.info("Program completed successfully")
+
+    def _shutdown(self):
+        """写完文件、打印最终统计、关闭连接池"""
+        # 确保所有数据都写入文件
+        logging.info("Stopping file writer...")
+        self.stop_event = True
+        self._close_snapshot_writer()
+        self.file_writer.stop()
+        logging.info("File writer stopped")
+
+        # 打印最终统计信息
+        logging.info("Printing final statistics...")
+        self._print_stats()
+
+        # 关闭所有连接池
+        logging.info("Closing Redis connection pools...")
+        for pool in list(self.pools.values()) + list(self.raw_pools.values()):
+            pool.disconnect()
+        if self.key_clients is not None:
+            self.key_clients.close()
+        logging.info("All Redis connection pools closed")
+
+    def _read_key_file(self, key_file: str):
+        """流式读取key文件，支持gzip；兼容audit文件的两种格式：'dry run deleted key: xxx'和一行一个key"""
+        with open(key_file, 'rb') as f:
+            gzipped = f.read(2) == b'\x1f\x8b'
+        open_func = gzip.open if gzipped else open
+        with open_func(key_file, 'rb') as f:
+            for line in f:
+                key = line.rstrip(b'\r\n')
+                if key.startswith(DRY_RUN_MARKER):
+                    key = key[len(DRY_RUN_MARKER):]
+                if key:
+                    yield key
+
+    def _delete_key_batch(self, node, keys: list, retry: bool = True):
+        """在一个master上删除一批key，返回值为DEL 0的算不存在；slot迁走了刷新路由后在新节点重试一次"""
+        client = self.key_clients.get(node)
+        if self.snapshot_writer is not None and not self.dry_run:
+            # 快照已经写不下去了就不能再删，否则删掉的key没有快照
+            if self.snapshot_writer.error is not None:
+                raise RuntimeError(f"snapshot writer failed, stop deleting: {self.snapshot_writer.error}")
+            # 按slot分组，一个slot一次脚本调用，key通过KEYS传入；slot迁走了返回MOVED，和DEL一样换节点重试一次
+            slots: Dict[int, list] = {}
+            for key in keys:
+                slots.setdefault(key_hash_slot(key), []).append(key)
+            now = int(time.time() * 1000)
+            pipeline = client.pipeline(transaction=False)
+            for slot_keys in slots.values():
+                self.snapshot_script(keys=slot_keys, args=[now], client=pipeline)
+            results = pipeline.execute(raise_on_error=False)
+            deleted = missing = errors = 0
+            moved = {}
+            blocks = []
+            for slot_keys, result in zip(slots.values(), results):
+                if isinstance(result, Exception):
+                    moved_to = self.key_router.handle_moved(result)
+                    if moved_to is not None and retry:
+                        moved.setdefault(moved_to, []).extend(slot_keys)
+                    else:
+                        logging.error(f"Snapshot delete of {len(slot_keys)} keys on {node[0]}:{node[1]} failed: {str(result)}")
+                        errors += len(slot_keys)
+                    continue
+                count, data, deleted_keys = result
+                if count:
+                    blocks.append(data)
+                    self._write_deleted(deleted_keys)
+                deleted += count
+                missing += len(slot_keys) - count
+            # 一个批次的记录合成一个block压缩，写进文件之后这个节点才删下一批
+            written = self.snapshot_writer.add_block(b''.join(blocks), deleted)
+        else:
+            written = None
+            pipeline = client.pipeline(transaction=False)
+            for key in keys:
+                if self.dry_run:
+                    pipeline.exists(key)
+                else:
+                    pipeline.delete(key)
+            results = pipeline.execute(raise_on_error=False)
+            deleted = missing = errors = 0
+            moved = {}
+            for key, result in zip(keys, results):
+                if isinstance(result, Exception):
+                    moved_to = self.key_router.handle_moved(result)
+                    if moved_to is not None and retry:
+                        moved.setdefault(moved_to, []).append(key)
+                    else:
+                        logging.error(f"Delete key {key!r} on {node[0]}:{node[1]} failed: {str(result)}")
+                        errors += 1
+                elif result:
+                    deleted += 1
+                    key_text = key.decode('utf-8', 'backslashreplace')
+                    self._write_to_file(f"dry run deleted key: {key_text}" if self.dry_run else key_text)
+                else:
+                    missing += 1
+        with self.total_deleted_lock:
+            self.total_deleted += deleted
+        with self.stats_lock:
+            self.stats['missing'] += missing
+            self.stats['errors'] += errors
+        if written is not None:
+            written.result()
+        for moved_node, moved_keys in moved.items():
+            self._delete_key_batch(moved_node, moved_keys, retry=False)
+
+    def _key_file_worker(self, node, batches: Queue):
+        """一个master一个删除线程，同时执行删除的线程数不超过max_workers"""
+        while True:
+            keys = batches.get()
+            if keys is None:
+                return
+            if self.stop_event:
+                continue
+            with self.key_file_slots:
+                # 任何异常都只算这一批失败，线程不能退出：读文件的线程会阻塞在这个master已满的队列上
+                try:
+                    self._delete_key_batch(node, keys)
+                    logging.debug(f"Deleted batch of {len(keys)} keys on {node[0]}:{node[1]}")
+                except Exception as e:
+                    logging.error(f"Delete batch on {node[0]}:{node[1]} failed: {str(e)}")
+                    with self.stats_lock:
+                        self.stats['errors'] += len(keys)
+                    # 快照写不下去了，停止删除，剩下的批次只取出来丢掉
+                    if self.snapshot_writer is not None and self.snapshot_writer.error is not None:
+                        self.stop_event = True
+            if self.delete_interval > 0:
+                time.sleep(self.delete_interval)
+
+    def delete_from_key_file(self, key_file: str):
+        """按key文件删除，key按本地算出的slot路由到master，每个master攒满pipeline_size个key一批"""
+        prefix = self.prefix.encode('utf-8')
+        self.key_router = SlotRouter.from_seed(self.redis_ips[0], self.port, self.password, self.connect_timeout)
+        self.key_clients = NodeClients(self.password, self.connect_timeout, max_connections=2)
+        self.key_file_slots = threading.Semaphore(self.max_workers)
+        queues = {}
+        workers = []
+        pending = {}
+        skipped = 0
+
+        def queue_for(node):
+            # MOVED刷新路由后可能出现新的master
+            if node not in queues:
+                queues[node] = Queue(maxsize=4)
+                worker = threading.Thread(target=self._key_file_worker, args=(node, queues[node]), daemon=True)
+                worker.start()
+                workers.append(worker)
+            return queues[node]
+
+        try:
+            for key in self._read_key_file(key_file):
+                if self.stop_event:
+                    break
+                # 只删除前缀匹配的key，防止传错文件
+                if not key.startswith(prefix):
+                    skipped += 1
+                    continue
+                node = self.key_router.node_for_key(key)
+                if node is None:
+                    logging.error(f"Slot of key {key!r} is not assigned")
+                    with self.stats_lock:
+                        self.stats['errors'] += 1
+                    continue
+                keys = pending.setdefault(node, [])
+                keys.append(key)
+                if len(keys) >= self.pipeline_size:
+                    # 队列满了会阻塞，内存占用只和节点数、队列长度、pipeline大小有关
+                    queue_for(node).put(keys)
+                    pending[node] = []
+            for node, keys in pending.items():
+                if keys and not self.stop_event:
+                    queue_for(node).put(keys)
+        except Exception as e:
+            logging.error(f"Error reading key file {key_file}: {str(e)}")
+        finally:
+            for batches in list(queues.values()):
+                batches.put(None)
+            for worker in workers:
+                worker.join()
+            with self.stats_lock:
+                self.stats['skipped'] += skipped
+                self.stats['nodes_processed'] = len(queues)
+            self._shutdown()
+
+        logging.info(f"Finished deleting keys from {key_file}. Total deleted: {self.total_deleted}, "
+                     f"missing: {self.stats['missing']}, skipped: {self.stats['skipped']}")
+
+    def _close_snapshot_writer(self):
+        """等快照全部写到磁盘"""
+        if self.snapshot_writer is None:
+            return
+        # 先等后台的删除批次执行完，它们的结果还要写进快照
+        self.snapshot_executor.shutdown(wait=True)
+        try:
+            self.snapshot_writer.close()
+        except RuntimeError as e:
+            self.snapshot_failed = True
+            logging.error(f"Snapshot is incomplete: {str(e)}")
 
     def signal_handler(self, sig, frame):
         """处理Ctrl+C信号"""
@@ -502,10 +982,11 @@ class ClusterKeyDeleter:
         # 关闭所有连接池
         for pool in self.pools.values():
             pool.disconnect()
+        self._close_snapshot_writer()
         self.file_writer.stop()
         self._print_stats()
         logging.info("Exiting...")
-        sys.exit(0)
+        sys.exit(1 if self.snapshot_failed else 0)
 
 def main():
     parser = argparse.ArgumentParser(description="Delete Redis keys with a specified prefix from multiple nodes concurrently.")
@@ -530,6 +1011,13 @@ def main():
     parser.add_argument('--stats-interval', type=int, default=60, help='Statistics output interval in seconds (default: 60)')
     parser.add_argument('--task-timeout', type=int, default=3600, help='Timeout for each task in seconds (default: 3600)')
     parser.add_argument('--overall-timeout', type=int, default=86400, help='Overall timeout in seconds (default: 86400)')
+    parser.add_argument('--snapshot-dir', type=str, help='Dump keys into this directory before deleting them (default: None)')
+    parser.add_argument('--snapshot-buffer-mb', type=int, default=64, help='Maximum snapshot data waiting to be written in MB (default: 64)')
+    parser.add_argument('--snapshot-segment-mb', type=int, default=256, help='Snapshot segment file size in MB (default: 256)')
+    parser.add_argument('--snapshot-spill-dir', type=str, help='Write the remaining snapshot batches here uncompressed if writing segments fails (default: --snapshot-dir)')
+    parser.add_argument('--dedupe-mb', type=int, default=0, help='Memory budget in MB per node for dropping keys SCAN returns more than once, 0 disables (default: 0)')
+    parser.add_argument('--use-registry', action='store_true', help='Drain the prefix registry sets written by prefix_registry.RegisteringClient instead of scanning')
+    parser.add_argument('--key-file', type=str, help='Delete keys listed in this file (plain or gzipped audit output) instead of scanning (default: None)')
 
     args = parser.parse_args()
 
@@ -562,6 +1050,10 @@ def main():
         print("prefix cannot contain '*'", file=sys.stderr)
         sys.exit(1)
 
+    if args.dedupe_mb and (args.key_file or args.use_registry):
+        print("--dedupe-mb only applies to scan mode, not to --key-file or --use-registry", file=sys.stderr)
+        sys.exit(1)
+
     # 创建删除器实例
     deleter = ClusterKeyDeleter(
         redis_ips=redis_ips,
@@ -584,7 +1076,13 @@ def main():
         max_memory=args.max_memory,
         stats_interval=args.stats_interval,
         task_timeout=args.task_timeout,
-        overall_timeout=args.overall_timeout
+        overall_timeout=args.overall_timeout,
+        snapshot_dir=args.snapshot_dir,
+        snapshot_buffer_mb=args.snapshot_buffer_mb,
+        snapshot_segment_mb=args.snapshot_segment_mb,
+        dedupe_mb=args.dedupe_mb,
+        use_registry=args.use_registry,
+        snapshot_spill_dir=args.snapshot_spill_dir
     )
 
     # 设置信号处理
@@ -612,7 +1110,11 @@ def main():
         'Max memory': f"{args.max_memory}MB",
         'Stats interval': f"{args.stats_interval}s",
         'Task timeout': f"{args.task_timeout}s",
-        'Overall timeout': f"{args.overall_timeout}s"
+        'Overall timeout': f"{args.overall_timeout}s",
+        'Snapshot dir': args.snapshot_dir or "None",
+        'Key file': args.key_file or "None",
+        'Dedupe MB': args.dedupe_mb,
+        'Use registry': args.use_registry
     }
     
     logging.info("Configuration:")
@@ -620,7 +1122,12 @@ def main():
         logging.info(f"  {key}: {value}")
 
     # 开始删除
-    deleter.delete_keys()
+    if args.key_file:
+        deleter.delete_from_key_file(args.key_file)
+    else:
+        deleter.delete_keys()
+    if deleter.snapshot_failed:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
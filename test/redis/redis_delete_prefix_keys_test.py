@@ -0,0 +1,303 @@
+import gzip
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import redis
+
+from cluster_router import SlotRouter
+from key_snapshot import list_segments, read_segment
+from migrate_slots_test import LocalCluster
+from prefix_registry import PrefixRegistry, RegisteringClient
+from redis_delete_prefix_keys import ClusterKeyDeleter, RotatingKeySet
+from slot import CLUSTER_SLOTS
+
+REDIS_SERVER = shutil.which('redis-server')
+
+
+class Colliding:
+    """hash相同但不相等的key"""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __hash__(self):
+        return 42
+
+    def __eq__(self, other):
+        return isinstance(other, Colliding) and other.name == self.name
+
+
+class TestRotatingKeySet(unittest.TestCase):
+    def test_rotation(self):
+        keys = RotatingKeySet(RotatingKeySet.ENTRY_BYTES * 20)
+        self.assertEqual(keys.capacity, 10)
+        self.assertFalse(any(keys.seen(i) for i in range(10)))
+        self.assertTrue(keys.seen(9))
+        # 第11个key时当前集合变成旧集合，旧集合里的key仍然算重复
+        self.assertFalse(keys.seen(10))
+        self.assertEqual((len(keys.previous), len(keys.current)), (10, 1))
+        self.assertTrue(keys.seen(5))
+        self.assertFalse(any(keys.seen(i) for i in range(11, 20)))
+        # 再轮转一次，最早的一批被淘汰，再出现时不算重复
+        self.assertFalse(keys.seen(20))
+        self.assertFalse(keys.seen(5))
+        self.assertTrue(keys.seen(15))
+
+    def test_memory_budget(self):
+        def size(items):
+            return sys.getsizeof(items) + sum(sys.getsizeof(h) for h in items)
+
+        for budget in (64 * 1024, 1024 * 1024, 3 * 1024 * 1024):
+            keys = RotatingKeySet(budget)
+            peak = 0
+            for i in range(keys.capacity * 3):
+                keys.seen(b'key:%d' % i)
+                # 两个集合都满的时候占用最多
+                if len(keys.current) == keys.capacity:
+                    peak = max(peak, size(keys.current) + size(keys.previous))
+            self.assertLessEqual(len(keys.current) + len(keys.previous), keys.capacity * 2)
+            self.assertLessEqual(peak, budget)
+
+    def test_hash_collision_is_dropped(self):
+        # 只保存hash，hash相同的不同key会被当成重复
+        keys = RotatingKeySet(1024)
+        self.assertFalse(keys.seen(Colliding('a')))
+        self.assertTrue(keys.seen(Colliding('b')))
+
+
+class DeleterTestMixin:
+    def setUp(self):
+        # 删除器会在当前目录写日志文件，并且往root logger加handler
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)
+        self.handlers = list(logging.getLogger().handlers)
+
+    def tearDown(self):
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            if handler not in self.handlers:
+                root.removeHandler(handler)
+                handler.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+
+    def deleter(self, port: int, **kwargs) -> ClusterKeyDeleter:
+        kwargs.setdefault('dry_run', False)
+        kwargs.setdefault('pipeline_size', 100)
+        return ClusterKeyDeleter(['127.0.0.1'], 'del:', port=port, delete_interval=0,
+                                 output_file=os.path.join(self.dir, 'audit.log'), log_level='WARNING',
+                                 stats_interval=3600, **kwargs)
+
+    def audit_keys(self):
+        with open(os.path.join(self.dir, 'audit.log'), 'rb') as f:
+            return sorted(f.read().split(b'\n')[:-1])
+
+    def snapshot_keys(self):
+        return sorted(key for path in list_segments(os.path.join(self.dir, 'snapshot'))
+                      for block in read_segment(path) for key, _, _ in block)
+
+    def write_key_file(self, keys, name: str = 'keys.txt', compress: bool = False) -> str:
+        path = os.path.join(self.dir, name)
+        with (gzip.open if compress else open)(path, 'wb') as f:
+            f.write(b''.join(key + b'\n' for key in keys))
+        return path
+
+
+@unittest.skipUnless(REDIS_SERVER, 'redis-server not found')
+class TestClusterKeyDeleter(DeleterTestMixin, unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            cls.port = s.getsockname()[1]
+        cls.server_dir = tempfile.mkdtemp()
+        cls.server = subprocess.Popen([REDIS_SERVER, '--port', str(cls.port), '--bind', '127.0.0.1',
+                                       '--dir', cls.server_dir, '--save', '', '--appendonly', 'no'],
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        cls.client = redis.Redis(port=cls.port)
+        deadline = time.time() + 5
+        while True:
+            try:
+                cls.client.ping()
+                break
+            except redis.ConnectionError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.01)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.client.close()
+        cls.server.terminate()
+        cls.server.wait()
+        shutil.rmtree(cls.server_dir)
+
+    def setUp(self):
+        super().setUp()
+        self.client.flushall()
+        self.client.mset({f'del:{i}': i for i in range(500)})
+        self.client.mset({f'keep:{i}': i for i in range(50)})
+
+    def key_file(self, compress: bool = False) -> str:
+        # 前缀不匹配的跳过，已经不存在的计数，兼容dry run的audit格式
+        keys = [b'dry run deleted key: del:%d' % i for i in range(200)]
+        keys += [b'del:%d' % i for i in range(200, 300)] + [b'keep:1', b'del:gone1', b'del:gone2']
+        return self.write_key_file(keys, compress=compress)
+
+    def test_scan_snapshot_counts_deleted_keys(self):
+        deleter = self.deleter(self.port, snapshot_dir=os.path.join(self.dir, 'snapshot'))
+        script = deleter.snapshot_script
+
+        def drop_some(args, client):
+            # 模拟SCAN之后被别人删掉的key：每批去掉10个，不会被删除也不会计数
+            return script(args=args[:1] + args[11:], client=client)
+
+        deleter.snapshot_script = drop_some
+        deleter.delete_keys()
+        remaining = self.client.dbsize() - 50
+        self.assertEqual(remaining, 50)
+        self.assertEqual(deleter.total_deleted, 450)
+        self.assertEqual(len(self.snapshot_keys()), 450)
+        # audit只记实际删除的key
+        self.assertEqual(self.audit_keys(), self.snapshot_keys())
+
+    def test_scan_snapshot_write_failure(self):
+        # 压缩失败之后已经删掉的key写进spill文件，不再提交新的批次
+        deleter = self.deleter(self.port, snapshot_dir=os.path.join(self.dir, 'snapshot'))
+        with mock.patch('key_snapshot.zlib.compress', side_effect=OSError('No space left on device')):
+            deleter.delete_keys()
+        deleted = sorted(b'del:%d' % i for i in range(500) if not self.client.exists(f'del:{i}'))
+        self.assertTrue(deleter.snapshot_failed)
+        self.assertLessEqual(len(deleted), 100)
+        self.assertEqual(self.snapshot_keys(), deleted)
+        self.assertEqual(self.audit_keys(), deleted)
+        self.assertEqual(deleter.snapshot_writer.stats['spilled_keys'], len(deleted))
+
+    def test_key_file_snapshot_write_failure(self):
+        deleter = self.deleter(self.port, pipeline_size=30, snapshot_dir=os.path.join(self.dir, 'snapshot'))
+        with mock.patch('key_snapshot.zlib.compress', side_effect=OSError('No space left on device')):
+            deleter.delete_from_key_file(self.key_file())
+        deleted = sorted(b'del:%d' % i for i in range(500) if not self.client.exists(f'del:{i}'))
+        self.assertTrue(deleter.snapshot_failed)
+        self.assertLess(len(deleted), 300)
+        self.assertEqual(self.snapshot_keys(), deleted)
+
+    def test_scan_dedupe(self):
+        deleter = self.deleter(self.port, dedupe_mb=1)
+        real_scan = redis.Redis.scan
+
+        def scan_twice(client, cursor=0, **kwargs):
+            # 模拟rehash期间SCAN重复返回同一批key
+            next_cursor, keys = real_scan(client, cursor, **kwargs)
+            return next_cursor, keys + keys
+
+        with mock.patch.object(redis.Redis, 'scan', scan_twice):
+            deleter.delete_keys()
+        self.assertEqual(deleter.total_deleted, 500)
+        self.assertEqual(deleter.stats['duplicates_dropped'], 500)
+        self.assertEqual(len(self.audit_keys()), 500)
+        self.assertEqual(self.client.dbsize(), 50)
+
+    def register_keys(self):
+        # 通过RegisteringClient写的key登记在登记集合里，其中10个之后被直接删掉，清理时按不存在计数
+        self.client.flushall()
+        client = RegisteringClient(self.client, PrefixRegistry(['del:']))
+        pipeline = client.pipeline()
+        for i in range(500):
+            pipeline.set(f'del:{i}', i)
+        pipeline.execute()
+        self.client.delete(*[f'del:{i}' for i in range(10)])
+        self.client.mset({f'keep:{i}': i for i in range(50)})
+
+    def test_registry(self):
+        self.register_keys()
+        deleter = self.deleter(self.port, use_registry=True)
+        deleter.delete_keys()
+        self.assertEqual(deleter.total_deleted, 490)
+        self.assertEqual(deleter.stats['missing'], 10)
+        self.assertEqual(len(self.audit_keys()), 490)
+        self.assertEqual(self.client.dbsize(), 50)
+
+    def test_registry_snapshot(self):
+        self.register_keys()
+        deleter = self.deleter(self.port, use_registry=True, snapshot_dir=os.path.join(self.dir, 'snapshot'))
+        deleter.delete_keys()
+        expected = sorted(b'del:%d' % i for i in range(10, 500))
+        self.assertEqual(deleter.total_deleted, 490)
+        self.assertEqual(deleter.stats['missing'], 10)
+        self.assertEqual(self.snapshot_keys(), expected)
+        self.assertEqual(self.audit_keys(), expected)
+        self.assertEqual(self.client.dbsize(), 50)
+
+    def test_key_file(self):
+        deleter = self.deleter(self.port, pipeline_size=30)
+        deleter.delete_from_key_file(self.key_file(compress=True))
+        expected = sorted(b'del:%d' % i for i in range(300))
+        self.assertEqual(deleter.total_deleted, 300)
+        self.assertEqual((deleter.stats['missing'], deleter.stats['skipped'], deleter.stats['errors']), (2, 1, 0))
+        self.assertEqual(self.audit_keys(), expected)
+        self.assertEqual(self.client.exists('del:299', 'del:300', 'keep:1'), 2)
+
+    def test_key_file_snapshot(self):
+        deleter = self.deleter(self.port, pipeline_size=30, snapshot_dir=os.path.join(self.dir, 'snapshot'))
+        deleter.delete_from_key_file(self.key_file())
+        expected = sorted(b'del:%d' % i for i in range(300))
+        self.assertEqual(deleter.total_deleted, 300)
+        self.assertEqual((deleter.stats['missing'], deleter.stats['skipped'], deleter.stats['errors']), (2, 1, 0))
+        self.assertEqual(self.audit_keys(), expected)
+        self.assertEqual(self.snapshot_keys(), expected)
+
+    def test_key_file_stops_when_snapshot_fails(self):
+        deleter = self.deleter(self.port, pipeline_size=5, snapshot_dir=os.path.join(self.dir, 'snapshot'))
+        deleter.snapshot_writer.error = OSError('disk full')
+        # 批次数远多于队列长度，删除线程退出的话读文件的线程会一直阻塞
+        thread = threading.Thread(target=deleter.delete_from_key_file, args=(self.key_file(),), daemon=True)
+        thread.start()
+        thread.join(30)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(deleter.total_deleted, 0)
+        self.assertEqual(self.client.dbsize(), 550)
+
+
+@unittest.skipUnless(REDIS_SERVER, 'redis-server not found')
+class TestKeyFileCluster(DeleterTestMixin, unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.cluster = LocalCluster(masters=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.cluster.close()
+
+    def test_snapshot_batch_follows_moved(self):
+        client = redis.RedisCluster(host='127.0.0.1', port=self.cluster.ports[0])
+        try:
+            client.mset_nonatomic({f'del:{i}': i for i in range(300)})
+        finally:
+            client.close()
+        first = ('127.0.0.1', self.cluster.ports[0])
+        stale = SlotRouter([(0, CLUSTER_SLOTS - 1, first)], seed=first)
+        # 过期的路由表把所有slot都当成第一个节点的，另一个节点上的slot返回MOVED后重试
+        with mock.patch.object(SlotRouter, 'from_seed', return_value=stale):
+            deleter = self.deleter(self.cluster.ports[0], snapshot_dir=os.path.join(self.dir, 'snapshot'))
+            deleter.delete_from_key_file(self.write_key_file([b'del:%d' % i for i in range(300)]))
+        expected = sorted(b'del:%d' % i for i in range(300))
+        self.assertEqual(deleter.total_deleted, 300)
+        self.assertEqual(deleter.stats['errors'], 0)
+        self.assertEqual(self.snapshot_keys(), expected)
+        self.assertEqual(self.audit_keys(), expected)
+        self.assertEqual(sum(c.dbsize() for c in self.cluster.clients), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
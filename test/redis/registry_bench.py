@@ -0,0 +1,84 @@
+# encoding: utf-8
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import redis
+
+from prefix_registry import PrefixRegistry, RegisteringClient, registry_key
+from redis_delete_prefix_keys import ClusterKeyDeleter
+from slot import CLUSTER_SLOTS
+
+# 对比按前缀清理时scan整个节点和用前缀登记集合的耗时，要删除的key只占很小一部分时差距最明显
+# 只用于测试环境：会往目标实例写入--background-keys个背景key和--keys个要删除的key，结束后全部删掉
+# usage: python3 registry_bench.py --host 127.0.0.1 -p 6379 --background-keys 1000000 --keys 50000
+
+
+def populate(client, prefix: str, keys: int):
+    pipeline = client.pipeline(transaction=False)
+    for i in range(keys):
+        pipeline.set(f'{prefix}{i}', i)
+        if len(pipeline) >= 1000:
+            pipeline.execute()
+    pipeline.execute()
+
+
+def drop_registry(client, prefix: str):
+    pipeline = client.pipeline(transaction=False)
+    for slot in range(CLUSTER_SLOTS):
+        pipeline.delete(registry_key(prefix, slot))
+    pipeline.execute()
+
+
+def run_delete(args, workdir: str, use_registry: bool) -> float:
+    deleter = ClusterKeyDeleter([args.host], args.prefix + 'purge:', scan_count=args.scan_count,
+                                pipeline_size=args.pipeline_size, delete_interval=0, dry_run=False, port=args.port,
+                                password=args.password, output_file=os.path.join(workdir, 'audit.log'),
+                                buffer_size=10000, log_level='WARNING', stats_interval=3600,
+                                use_registry=use_registry)
+    start = time.time()
+    deleter.delete_keys()
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark prefix purge with and without the registry index')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=6379)
+    parser.add_argument('-a', '--password', type=str, default=None)
+    parser.add_argument('--prefix', type=str, default='registry_bench:')
+    parser.add_argument('--background-keys', type=int, default=1000000)
+    parser.add_argument('--keys', type=int, default=50000)
+    parser.add_argument('--scan-count', type=int, default=1000)
+    parser.add_argument('--pipeline-size', type=int, default=500)
+    args = parser.parse_args()
+
+    client = redis.Redis(host=args.host, port=args.port, password=args.password)
+    registering = RegisteringClient(client, PrefixRegistry([args.prefix + 'purge:']))
+    workdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    # 删除器会在当前目录写redis_key_deleter.log
+    os.chdir(workdir)
+    try:
+        populate(client, args.prefix + 'bg:', args.background_keys)
+        populate(registering, args.prefix + 'purge:', args.keys)
+        scan = run_delete(args, workdir, use_registry=False)
+        # scan模式删完之后登记集合还在，先清掉再重新写一遍
+        drop_registry(client, args.prefix + 'purge:')
+        populate(registering, args.prefix + 'purge:', args.keys)
+        registry = run_delete(args, workdir, use_registry=True)
+        left = sum(1 for _ in client.scan_iter(match=args.prefix + 'purge:*', count=1000))
+
+        total = client.dbsize()
+        print(f"{'mode':<12}{'seconds':>10}{'keys/s':>12}")
+        print(f"{'scan':<12}{scan:>10.2f}{args.keys / scan:>12.0f}")
+        print(f"{'registry':<12}{registry:>10.2f}{args.keys / registry:>12.0f}")
+        print(f"dbsize {total}, deleted {args.keys} keys, left {left}, speedup {scan / registry:.1f}x")
+    finally:
+        os.chdir(cwd)
+        for key in client.scan_iter(match=args.prefix + '*', count=1000):
+            client.delete(key)
+        drop_registry(client, args.prefix + 'purge:')
+        shutil.rmtree(workdir)
@@ -1,26 +1,95 @@
 # encoding: utf-8
-from rediscluster import RedisCluster
-
-source_host = "10.0.21.150"
-port = 6379
-startup_nodes = [{"host": source_host, "port": port}]
-r = RedisCluster(startup_nodes=startup_nodes, decode_responses=True)
-
-key_type = "string:perf_match_item*"  # 需要查询的 key 类型
-key_memory_usage = 0  # 初始化 key 内存使用量为 0
-total_memory_usage = r.info('memory')['used_memory']  # 获取 Redis 总内存使用量
-
-# 使用 SCAN 命令迭代所有的 key，数据量小还可以用，数据量大了最好离线分析
-cursor = 0
-while True:
-    keys = r.scan(match=key_type, cursor=cursor, count=1000)  # 每次迭代 1000 个 key
-    cursor = keys[0]
-    if cursor == 0:
-        break
-    for key in keys[1]:
-        if r.type(key) == key_type:  # 如果 key 类型匹配，则统计其内存使用量
-            key_memory_usage += r.debug_object(key)['serializedlength']
-
-        # 计算特定类型 key 的内存占比
-key_memory_ratio = key_memory_usage / total_memory_usage
-print("Memory usage of {} keys: {:.2%}".format(key_type, key_memory_ratio))
+import argparse
+import concurrent.futures
+import logging
+import time
+from typing import Tuple
+
+from cluster_router import Node, NodeClients, RateLimiter, SlotRouter
+from key_stats import PrefixTree, TopKeys, print_report
+
+# 在线按前缀统计redis的内存占用
+# 所有master并发SCAN，每页key用pipeline批量执行TYPE、MEMORY USAGE key SAMPLES n、PTTL
+# 结果按分隔符聚合成前缀树，同时用小顶堆保留内存最大的top k个key
+# --max-keys-per-sec限制每个节点每秒处理的key数，控制对线上的压力
+# 在线扫描还是会给master带来压力，数据量大了最好离线分析(rdb_analyzer.py)
+# usage: python3 scan_memory.py --host 10.0.21.150 -m 'string:perf_match_item*' --max-keys-per-sec 5000
+
+
+def analyze_node(clients: NodeClients, node: Node, args) -> Tuple[PrefixTree, TopKeys, int]:
+    """扫描单个master，返回这个节点的前缀树、top keys和used_memory"""
+    client = clients.get(node)
+    tree = PrefixTree(args.delimiters, args.depth)
+    top = TopKeys(args.top)
+    limiter = RateLimiter(args.max_keys_per_sec)
+    used_memory = client.info('memory')['used_memory']
+    scanned = 0
+    cursor = 0
+    while True:
+        cursor, keys = client.scan(cursor=cursor, match=args.match, count=args.scan_count)
+        if keys:
+            limiter.acquire(len(keys))
+            pipeline = client.pipeline(transaction=False)
+            for key in keys:
+                pipeline.type(key)
+                pipeline.memory_usage(key, samples=args.samples)
+                pipeline.pttl(key)
+            replies = pipeline.execute(raise_on_error=False)
+            for i, key in enumerate(keys):
+                key_type, memory, pttl = replies[3 * i:3 * i + 3]
+                # scan之后被删掉或者过期的key
+                if memory is None or isinstance(memory, Exception) or key_type == b'none':
+                    continue
+                key_type = key_type.decode('utf-8')
+                if args.type and key_type != args.type:
+                    continue
+                tree.add(key, memory, pttl, key_type)
+                top.add(key, memory, key_type, pttl)
+            scanned += len(keys)
+        # 最后一页(cursor返回0)的key也要处理
+        if cursor == 0:
+            break
+    logging.info(f"Finished {node[0]}:{node[1]}, scanned={scanned} matched={tree.root.count}")
+    return tree, top, used_memory
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='analyze redis memory by key prefix')
+    parser.add_argument('--host', type=str, help='redis集群中随机一个节点的ip', required=True)
+    parser.add_argument('-p', '--port', type=int, help='redis port', default=6379)
+    parser.add_argument('-a', '--password', type=str, help='redis password', default=None)
+    parser.add_argument('-m', '--match', type=str, help='scan match, example: prefix*', default='*')
+    parser.add_argument('-t', '--type', type=str, help='only count keys of this type, example: string', default=None)
+    parser.add_argument('-b', '--scan-count', type=int, help='scan count', default=1000)
+    parser.add_argument('-s', '--samples', type=int, help='MEMORY USAGE SAMPLES, 0 means all elements', default=5)
+    parser.add_argument('-d', '--delimiters', type=str, help='prefix delimiters', default=':')
+    parser.add_argument('--depth', type=int, help='max prefix depth', default=3)
+    parser.add_argument('--top', type=int, help='number of biggest keys to show', default=20)
+    parser.add_argument('--min-share', type=float, help='hide prefixes below this memory share', default=0.01)
+    parser.add_argument('--max-keys-per-sec', type=float, help='max keys analyzed per second per node, 0 means '
+                                                               'unlimited', default=0)
+    parser.add_argument('--max-workers', type=int, help='max nodes scanned concurrently', default=8)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    router = SlotRouter.from_seed(args.host, args.port, args.password)
+    masters = router.masters()
+    clients = NodeClients(args.password, max_connections=1)
+
+    start = time.time()
+    tree = PrefixTree(args.delimiters, args.depth)
+    top = TopKeys(args.top)
+    total_memory = 0
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+            futures = [executor.submit(analyze_node, clients, node, args) for node in masters]
+            for future in concurrent.futures.as_completed(futures):
+                node_tree, node_top, used_memory = future.result()
+                tree.merge(node_tree)
+                top.merge(node_top)
+                total_memory += used_memory
+    finally:
+        clients.close()
+
+    print_report(tree, top, args.min_share, total_memory,
+                 title=f'{len(masters)} masters, match={args.match}, {time.time() - start:.1f}s')
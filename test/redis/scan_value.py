@@ -1,22 +1,172 @@
 # encoding: utf-8
-import redis
-from rediscluster import RedisCluster
-
-source_host = "xxxx"
-port = 6379
-startup_nodes = [{"host": source_host, "port": port}]
-r = redis.Redis(host=source_host, port=6379, db=0)
-# r = RedisCluster(startup_nodes=startup_nodes, decode_responses=True)
-
-# 使用 SCAN 命令迭代所有的 key，数据量小还可以用，数据量大了最好离线分析
-cursor = 0
-while True:
-    keys = r.scan(match='v7.SS.available*', cursor=cursor, count=1000)  # 每次迭代 1000 个 key
-    cursor = keys[0]
-    if cursor == 0:
-        break
-    for key in keys[1]:
-        value = r.get(key)
-        if value == "OK":
-            print(f'key={key}, value={value}')
+import argparse
+import concurrent.futures
+import logging
+import re
+import sys
+import threading
+from typing import Callable, Dict, List, Optional
 
+from cluster_router import Node, NodeClients, SlotRouter
+from slot import key_hash_slot
+
+# 按value查找key：所有master并发SCAN，只输出value满足条件的key
+# script模式：SCAN和比较都在服务端的lua脚本里做，每次只把命中的key返回给客户端，不匹配的value不会经过网络
+# mget模式：每页key按slot分组，一个slot一条MGET，pipeline批量发出去，在客户端比较(正则只能用这个模式)
+# usage: python3 scan_value.py --host 10.0.21.150 -m 'v7.SS.available*' --equals OK
+#        python3 scan_value.py --host 10.0.21.150 -m 'user:*' --regex '^\{"vip":true' --output /tmp/keys.txt
+
+# ARGV: cursor, match, count, op(eq/prefix), needle
+# 返回{下一个cursor, GET出错的key数, 第一个错误信息, 命中的key...}
+# pcall出错(比如非string类型的WRONGTYPE)返回的是带err字段的table，计数后返回给调用方，结果不完整时能知道
+# SCAN和GET之间被删掉的key返回false，不算错误
+scan_match_script = """
+local reply = redis.call('SCAN', ARGV[1], 'MATCH', ARGV[2], 'COUNT', ARGV[3])
+local result = {reply[1], 0, ''}
+local op = ARGV[4]
+local needle = ARGV[5]
+for _, key in ipairs(reply[2]) do
+    local value = redis.pcall('GET', key)
+    if type(value) == 'string' then
+        if (op == 'eq' and value == needle) or (op == 'prefix' and string.sub(value, 1, #needle) == needle) then
+            table.insert(result, key)
+        end
+    elseif type(value) == 'table' and value.err then
+        result[2] = result[2] + 1
+        if result[3] == '' then
+            result[3] = key .. ': ' .. value.err
+        end
+    end
+end
+return result
+"""
+
+
+def build_predicate(op: str, needle: bytes) -> Callable[[Optional[bytes]], bool]:
+    if op == 'eq':
+        return lambda value: value == needle
+    if op == 'prefix':
+        return lambda value: value is not None and value.startswith(needle)
+    pattern = re.compile(needle)
+    return lambda value: value is not None and pattern.search(value) is not None
+
+
+class ValueScanner:
+    def __init__(self, clients: NodeClients, match: str, op: str, needle: bytes, scan_count: int = 1000,
+                 use_script: bool = True, output=sys.stdout.buffer):
+        self.clients = clients
+        self.match = match
+        self.op = op
+        self.needle = needle
+        self.scan_count = scan_count
+        self.use_script = use_script
+        self.predicate = build_predicate(op, needle)
+        self.output = output
+        self.output_lock = threading.Lock()
+
+    def _emit(self, keys: List[bytes]):
+        if keys:
+            with self.output_lock:
+                self.output.write(b''.join(key + b'\n' for key in keys))
+
+    def _scan_with_script(self, node: Node) -> Dict[str, int]:
+        client = self.clients.get(node)
+        script = client.register_script(scan_match_script)
+        matched = 0
+        errors = 0
+        cursor = 0
+        while True:
+            reply = script(args=[cursor, self.match, self.scan_count, self.op, self.needle])
+            cursor = int(reply[0])
+            if reply[1]:
+                if not errors:
+                    logging.warning(f"GET failed on {node[0]}:{node[1]}: {reply[2].decode('utf-8', 'replace')}")
+                errors += reply[1]
+            self._emit(reply[3:])
+            matched += len(reply) - 3
+            if cursor == 0:
+                break
+        return {'matched': matched, 'errors': errors}
+
+    def _scan_with_mget(self, node: Node) -> Dict[str, int]:
+        client = self.clients.get(node)
+        scanned = 0
+        matched = 0
+        cursor = 0
+        while True:
+            cursor, keys = client.scan(cursor=cursor, match=self.match, count=self.scan_count)
+            if keys:
+                # 集群模式下MGET的key必须在同一个slot
+                slots: Dict[int, List[bytes]] = {}
+                for key in keys:
+                    slots.setdefault(key_hash_slot(key), []).append(key)
+                pipeline = client.pipeline(transaction=False)
+                for slot_keys in slots.values():
+                    pipeline.mget(slot_keys)
+                hits = []
+                for slot_keys, values in zip(slots.values(), pipeline.execute()):
+                    hits.extend(key for key, value in zip(slot_keys, values) if self.predicate(value))
+                self._emit(hits)
+                scanned += len(keys)
+                matched += len(hits)
+            # 最后一页(cursor返回0)的key也要处理
+            if cursor == 0:
+                break
+        return {'scanned': scanned, 'matched': matched}
+
+    def scan_node(self, node: Node) -> Dict[str, int]:
+        if self.use_script:
+            stats = self._scan_with_script(node)
+        else:
+            stats = self._scan_with_mget(node)
+        logging.info(f"Finished {node[0]}:{node[1]}, " + ' '.join(f'{k}={v}' for k, v in stats.items()))
+        return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='find keys whose value matches a predicate')
+    parser.add_argument('--host', type=str, help='redis集群中随机一个节点的ip', required=True)
+    parser.add_argument('-p', '--port', type=int, help='redis port', default=6379)
+    parser.add_argument('-a', '--password', type=str, help='redis password', default=None)
+    parser.add_argument('-m', '--match', type=str, help='scan match, example: prefix*', default='*')
+    parser.add_argument('-b', '--scan-count', type=int, help='scan count', default=1000)
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--equals', type=str, help='value equals')
+    group.add_argument('--value-prefix', type=str, help='value starts with')
+    group.add_argument('--regex', type=str, help='value matches regex (client side, mget mode)')
+    parser.add_argument('--mode', type=str, choices=['script', 'mget'], default='script',
+                        help='compare values in a server side script or in the client')
+    parser.add_argument('--max-workers', type=int, help='max nodes scanned concurrently', default=8)
+    parser.add_argument('-o', '--output', type=str, help='write matched keys to this file instead of stdout')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.equals is not None:
+        op, needle = 'eq', args.equals
+    elif args.value_prefix is not None:
+        op, needle = 'prefix', args.value_prefix
+    else:
+        op, needle = 'regex', args.regex
+    use_script = args.mode == 'script' and op != 'regex'
+
+    router = SlotRouter.from_seed(args.host, args.port, args.password)
+    clients = NodeClients(args.password, max_connections=1)
+    output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    scanner = ValueScanner(clients, args.match, op, needle.encode('utf-8'), args.scan_count, use_script, output)
+    total = 0
+    errors = 0
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+            futures = [executor.submit(scanner.scan_node, node) for node in router.masters()]
+            for future in concurrent.futures.as_completed(futures):
+                stats = future.result()
+                total += stats['matched']
+                errors += stats.get('errors', 0)
+    finally:
+        clients.close()
+        output.flush()
+        if args.output:
+            output.close()
+    logging.info(f'total matched={total}')
+    if errors:
+        logging.warning(f'{errors} keys could not be read (e.g. not a string), the result may be incomplete')
@@ -0,0 +1,78 @@
+import io
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+import unittest
+
+import redis
+
+from cluster_router import NodeClients
+from scan_value import ValueScanner
+
+REDIS_SERVER = shutil.which('redis-server')
+
+
+@unittest.skipUnless(REDIS_SERVER, 'redis-server not found')
+class TestValueScanner(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            cls.port = s.getsockname()[1]
+        cls.dir = tempfile.mkdtemp()
+        cls.server = subprocess.Popen([REDIS_SERVER, '--port', str(cls.port), '--bind', '127.0.0.1', '--dir', cls.dir,
+                                       '--save', '', '--appendonly', 'no'],
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        cls.client = redis.Redis(port=cls.port)
+        deadline = time.time() + 5
+        while True:
+            try:
+                cls.client.ping()
+                break
+            except redis.ConnectionError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.01)
+        cls.client.mset({f'v:{i}': 'OK' if i % 3 == 0 else f'NO{i}' for i in range(300)})
+        cls.client.hset('v:hash', 'f', 'OK')
+        cls.client.rpush('v:list', 'OK')
+        cls.client.set('other', 'OK')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.client.close()
+        cls.server.terminate()
+        cls.server.wait()
+        shutil.rmtree(cls.dir)
+
+    def scan(self, op: str, needle: bytes, use_script: bool):
+        clients = NodeClients()
+        output = io.BytesIO()
+        try:
+            scanner = ValueScanner(clients, 'v:*', op, needle, scan_count=50, use_script=use_script, output=output)
+            stats = scanner.scan_node(('127.0.0.1', self.port))
+        finally:
+            clients.close()
+        return sorted(output.getvalue().split()), stats
+
+    def test_script_counts_errors(self):
+        expected = sorted(f'v:{i}'.encode() for i in range(0, 300, 3))
+        keys, stats = self.scan('eq', b'OK', True)
+        self.assertEqual(keys, expected)
+        self.assertEqual(stats, {'matched': 100, 'errors': 2})
+        keys, stats = self.scan('prefix', b'NO29', True)
+        self.assertEqual(keys, [b'v:29', b'v:290', b'v:292', b'v:293', b'v:295', b'v:296', b'v:298', b'v:299'])
+        self.assertEqual(stats['errors'], 2)
+
+    def test_mget_mode(self):
+        keys, stats = self.scan('eq', b'OK', False)
+        self.assertEqual(len(keys), 100)
+        self.assertEqual(stats['scanned'], 302)
+        keys, _ = self.scan('regex', rb'^NO1\d$', False)
+        self.assertEqual(keys, sorted(f'v:{i}'.encode() for i in range(10, 20) if i % 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,17 @@
+import binascii
 import re
 import unittest
-import crc16
+
+# redis cluster一共16384个slot
+CLUSTER_SLOTS = 16384
 
 
 def redis_crc16(raw_key):
-    # Redis的CRC16算法是基于CCITT标准的CRC16算法的变种
-    # 该变种使用大端字节序 (big-endian)
-    crc = crc16.crc16xmodem(raw_key.encode('utf-8')) & 4095
+    # Redis的CRC16算法是基于CCITT标准的CRC16算法的变种(XMODEM)
+    # binascii.crc_hqx就是同一个算法，C实现，不需要再依赖crc16模块(crc16模块在python3.10以上无法使用)
+    if isinstance(raw_key, str):
+        raw_key = raw_key.encode('utf-8')
+    crc = binascii.crc_hqx(raw_key, 0) & 0x3FFF
     return crc
 
 
@@ -26,6 +31,21 @@ def get_redis_slot(raw_key):
     return slot
 
 
+def key_hash_slot(key) -> int:
+    """
+        按redis的规则计算key所在的slot，key可以是bytes或str
+        hash tag规则：第一个'{'和它之后的第一个'}'之间的内容非空时，只对这部分做hash
+    """
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    start = key.find(b'{')
+    if start != -1:
+        end = key.find(b'}', start + 1)
+        if end > start + 1:
+            key = key[start + 1:end]
+    return binascii.crc_hqx(key, 0) & 0x3FFF
+
+
 # class TestSlotExample(unittest.TestCase):
 #     def test_get_slot(self):
 #         key = b"4test5555_8_2028_801"
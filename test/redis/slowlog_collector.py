@@ -0,0 +1,220 @@
+# encoding: utf-8
+import argparse
+import concurrent.futures
+import json
+import logging
+import re
+import time
+from collections import namedtuple
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from cluster_router import Node, NodeClients, SlotRouter
+from key_stats import PrefixTree
+
+# 从所有master并发拉SLOWLOG GET，按命令指纹聚合，用来定位是哪个工具/哪类命令导致的延迟
+# 指纹 = 命令名(带子命令) + key归一后的前缀模式，其他参数全部丢掉，例如 DEL user:123:name -> del user:*:*
+# 按(指纹, 节点)统计次数、总耗时、p99耗时；--by-client会把客户端名字也放进指纹里
+# slowlog是固定长度的环形缓冲区，会被覆盖，可以用--save定期把拉到的记录追加到文件里，再用--input一起分析
+# --since/--until选一个时间窗口，再给--baseline-since/--baseline-until就输出两个窗口的对比
+# usage: python3 slowlog_collector.py --host 10.0.21.150 --since 30m
+#        python3 slowlog_collector.py --host 10.0.21.150 --save slowlog.jsonl
+#        python3 slowlog_collector.py --input slowlog.jsonl --since 1700003600 --until 1700007200 \
+#            --baseline-since 1700000000 --baseline-until 1700003600
+
+Entry = namedtuple('Entry', ['node', 'id', 'start_time', 'duration_us', 'args', 'client_addr', 'client_name'])
+
+# 第二个参数是子命令而不是key的命令
+SUBCOMMAND_COMMANDS = {
+    'client', 'cluster', 'config', 'command', 'debug', 'function', 'latency', 'memory', 'module', 'object',
+    'pubsub', 'script', 'slowlog', 'xgroup', 'xinfo', 'acl',
+}
+NO_KEY_COMMANDS = {
+    'ping', 'info', 'select', 'auth', 'hello', 'monitor', 'scan', 'dbsize', 'time', 'multi', 'exec', 'discard',
+    'publish', 'flushdb', 'flushall', 'randomkey', 'wait', 'bgsave', 'bgrewriteaof', 'save', 'keys', 'eval',
+    'evalsha', 'eval_ro', 'evalsha_ro', 'fcall', 'fcall_ro', 'swapdb', 'lastsave', 'role', 'echo',
+}
+_RELATIVE_TIME = re.compile(r'^-?(\d+)([smhd])$')
+_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_time(value: Optional[str], now: float) -> Optional[float]:
+    """epoch秒，或者30m/2h这种相对现在往前的时间"""
+    if value is None:
+        return None
+    match = _RELATIVE_TIME.match(value)
+    if match:
+        return now - int(match.group(1)) * _UNITS[match.group(2)]
+    return float(value)
+
+
+class Fingerprinter:
+    def __init__(self, delimiters: str = ':', depth: int = 3, by_client: bool = False):
+        self.tree = PrefixTree(delimiters, depth)
+        self.by_client = by_client
+
+    def key_pattern(self, key: str) -> str:
+        segments = self.tree.split(key)
+        return ''.join(segments) + '*' if segments else '*'
+
+    def __call__(self, entry: Entry) -> str:
+        args = [arg.decode('utf-8', 'replace') if isinstance(arg, bytes) else arg for arg in entry.args]
+        if not args:
+            return '?'
+        command = args[0].lower()
+        parts = [command]
+        if command in SUBCOMMAND_COMMANDS and len(args) > 1:
+            parts.append(args[1].lower())
+        elif command in ('eval', 'evalsha', 'eval_ro', 'evalsha_ro'):
+            # evalsha按脚本区分，eval的脚本正文太长只保留开头
+            if len(args) > 1:
+                parts.append(args[1][:8] if command.startswith('evalsha') else 'script')
+        elif command not in NO_KEY_COMMANDS and len(args) > 1 and not args[1].startswith('... ('):
+            parts.append(self.key_pattern(args[1]))
+        if self.by_client:
+            parts.append(f'[{entry.client_name or "-"}]')
+        return ' '.join(parts)
+
+
+def fetch_slowlog(clients: NodeClients, node: Node, count: int) -> List[Entry]:
+    client = clients.get(node)
+    # 直接用原始回复，redis-py解析后的command是用空格拼起来的字符串，分不清参数边界
+    reply = client.execute_command('SLOWLOG', 'GET', count)
+    entries = []
+    for item in reply:
+        client_addr = item[4].decode() if len(item) > 4 else ''
+        client_name = item[5].decode() if len(item) > 5 else ''
+        entries.append(Entry(f'{node[0]}:{node[1]}', item[0], item[1], item[2], item[3], client_addr, client_name))
+    logging.info(f'{node[0]}:{node[1]} fetched {len(entries)} slowlog entries')
+    return entries
+
+
+def save_entries(path: str, entries: Iterable[Entry]):
+    with open(path, 'a') as f:
+        for entry in entries:
+            record = entry._asdict()
+            record['args'] = [arg.decode('utf-8', 'backslashreplace') for arg in entry.args]
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def load_entries(path: str) -> List[Entry]:
+    entries = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                record['args'] = [arg.encode('utf-8') for arg in record['args']]
+                entries.append(Entry(**record))
+    return entries
+
+
+def dedupe(entries: Iterable[Entry]) -> List[Entry]:
+    """多次保存的文件里同一条记录会出现多次，按(节点, id, 时间)去重"""
+    seen = {}
+    for entry in entries:
+        seen.setdefault((entry.node, entry.id, entry.start_time), entry)
+    return list(seen.values())
+
+
+def percentile(sorted_values: List[int], p: float) -> int:
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, max(0, int(len(sorted_values) * p / 100 + 0.5) - 1))
+    return sorted_values[index]
+
+
+def aggregate(entries: Iterable[Entry], fingerprint: Fingerprinter, since: float = None,
+              until: float = None) -> Dict[Tuple[str, str], Dict[str, float]]:
+    """返回{(指纹, 节点): {count, total_ms, p99_ms, max_ms}}，节点为*的是所有节点合计"""
+    durations: Dict[Tuple[str, str], List[int]] = {}
+    for entry in entries:
+        if (since is not None and entry.start_time < since) or (until is not None and entry.start_time >= until):
+            continue
+        name = fingerprint(entry)
+        durations.setdefault((name, entry.node), []).append(entry.duration_us)
+        durations.setdefault((name, '*'), []).append(entry.duration_us)
+    result = {}
+    for group, values in durations.items():
+        values.sort()
+        result[group] = {
+            'count': len(values),
+            'total_ms': sum(values) / 1000,
+            'p99_ms': percentile(values, 99) / 1000,
+            'max_ms': values[-1] / 1000,
+        }
+    return result
+
+
+def print_aggregate(stats: Dict[Tuple[str, str], Dict[str, float]], top: int, per_node: bool):
+    rows = sorted(((s['total_ms'], group, s) for group, s in stats.items() if per_node or group[1] == '*'),
+                  reverse=True)[:top]
+    print(f"{'count':>8}{'total(ms)':>12}{'p99(ms)':>10}{'max(ms)':>10}  {'node':<22}fingerprint")
+    for _, (name, node), s in rows:
+        print(f"{s['count']:>8}{s['total_ms']:>12.1f}{s['p99_ms']:>10.1f}{s['max_ms']:>10.1f}  {node:<22}{name}")
+
+
+def print_diff(current: Dict, baseline: Dict, top: int, per_node: bool):
+    """按总耗时的增量从大到小排序，基线里没有的指纹按0算"""
+    empty = {'count': 0, 'total_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0}
+    groups = {group for group in list(current) + list(baseline) if per_node or group[1] == '*'}
+    rows = []
+    for group in groups:
+        now, before = current.get(group, empty), baseline.get(group, empty)
+        rows.append((now['total_ms'] - before['total_ms'], group, now, before))
+    rows.sort(reverse=True)
+    print(f"{'count':>15}{'total(ms)':>22}{'p99(ms)':>18}  {'node':<22}fingerprint")
+    for delta, (name, node), now, before in rows[:top]:
+        print(f"{before['count']:>7}->{now['count']:<7}{before['total_ms']:>10.1f}->{now['total_ms']:<10.1f}"
+              f"{before['p99_ms']:>8.1f}->{now['p99_ms']:<8.1f}  {node:<22}{name}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='collect and aggregate SLOWLOG from all masters')
+    parser.add_argument('--host', type=str, help='redis集群中随机一个节点的ip')
+    parser.add_argument('-p', '--port', type=int, help='redis port', default=6379)
+    parser.add_argument('-a', '--password', type=str, help='redis password', default=None)
+    parser.add_argument('-n', '--count', type=int, help='SLOWLOG GET count per node, -1 means all', default=-1)
+    parser.add_argument('--input', type=str, action='append', help='load entries saved by --save, can be repeated')
+    parser.add_argument('--save', type=str, help='append fetched entries to this jsonl file')
+    parser.add_argument('--since', type=str, help='window start, epoch seconds or relative like 30m (30 minutes ago)')
+    parser.add_argument('--until', type=str, help='window end, epoch seconds or relative like 5m')
+    parser.add_argument('--baseline-since', type=str, help='baseline window start, enables diff output')
+    parser.add_argument('--baseline-until', type=str, help='baseline window end')
+    parser.add_argument('-d', '--delimiters', type=str, help='key delimiters', default=':')
+    parser.add_argument('--depth', type=int, help='key prefix depth kept in fingerprints', default=2)
+    parser.add_argument('--by-client', action='store_true', help='include client name in fingerprints')
+    parser.add_argument('--per-node', action='store_true', help='show rows per node, not only cluster totals')
+    parser.add_argument('--top', type=int, help='rows shown', default=30)
+    parser.add_argument('--max-workers', type=int, help='max nodes fetched concurrently', default=16)
+    args = parser.parse_args()
+    if not args.host and not args.input:
+        parser.error('--host or --input is required')
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    entries: List[Entry] = []
+    for path in args.input or []:
+        entries.extend(load_entries(path))
+    if args.host:
+        router = SlotRouter.from_seed(args.host, args.port, args.password)
+        clients = NodeClients(args.password, max_connections=1)
+        fetched = []
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+                futures = [executor.submit(fetch_slowlog, clients, node, args.count) for node in router.masters()]
+                for future in concurrent.futures.as_completed(futures):
+                    fetched.extend(future.result())
+        finally:
+            clients.close()
+        if args.save:
+            save_entries(args.save, fetched)
+        entries.extend(fetched)
+    entries = dedupe(entries)
+
+    now = time.time()
+    fingerprint = Fingerprinter(args.delimiters, args.depth, args.by_client)
+    current = aggregate(entries, fingerprint, parse_time(args.since, now), parse_time(args.until, now))
+    if args.baseline_since or args.baseline_until:
+        baseline = aggregate(entries, fingerprint, parse_time(args.baseline_since, now),
+                             parse_time(args.baseline_until, now))
+        print_diff(current, baseline, args.top, args.per_node)
+    else:
+        print_aggregate(current, args.top, args.per_node)
@@ -0,0 +1,77 @@
+# encoding: utf-8
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import redis
+
+from redis_delete_prefix_keys import ClusterKeyDeleter
+from snapshot_restore import SnapshotRestorer
+
+# 对比删除时开/关快照的吞吐，快照模式下再恢复一遍并核对key数
+# 只用于测试环境：会往目标实例写入并删除--prefix开头的key
+# usage: python3 snapshot_bench.py --host 127.0.0.1 -p 6379 --keys 200000 --value-size 256
+
+
+def populate(client, prefix: str, keys: int, value_size: int):
+    # 每个key的value都不一样，快照压缩的开销接近真实数据
+    pipeline = client.pipeline(transaction=False)
+    for i in range(keys):
+        pipeline.set(f'{prefix}{i}', os.urandom(value_size // 2).hex(), ex=3600 if i % 2 else None)
+        if len(pipeline) >= 1000:
+            pipeline.execute()
+    pipeline.execute()
+
+
+def run_delete(args, workdir: str, snapshot_dir: str = None) -> float:
+    deleter = ClusterKeyDeleter([args.host], args.prefix, scan_count=1000, pipeline_size=args.pipeline_size,
+                                delete_interval=0, dry_run=False, port=args.port, password=args.password,
+                                output_file=os.path.join(workdir, 'audit.log'), buffer_size=10000,
+                                log_level='WARNING', stats_interval=3600, snapshot_dir=snapshot_dir)
+    start = time.time()
+    deleter.delete_keys()
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark delete throughput with and without snapshots')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=6379)
+    parser.add_argument('-a', '--password', type=str, default=None)
+    parser.add_argument('--prefix', type=str, default='snapshot_bench:')
+    parser.add_argument('--keys', type=int, default=200000)
+    parser.add_argument('--value-size', type=int, default=256)
+    parser.add_argument('--pipeline-size', type=int, default=500)
+    args = parser.parse_args()
+
+    client = redis.Redis(host=args.host, port=args.port, password=args.password)
+    workdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    # 删除器会在当前目录写redis_key_deleter.log
+    os.chdir(workdir)
+    try:
+        populate(client, args.prefix, args.keys, args.value_size)
+        plain = run_delete(args, workdir)
+        populate(client, args.prefix, args.keys, args.value_size)
+        snapshot_dir = os.path.join(workdir, 'snapshot')
+        snapshot = run_delete(args, workdir, snapshot_dir)
+        size = sum(os.path.getsize(os.path.join(snapshot_dir, name)) for name in os.listdir(snapshot_dir))
+        restorer = SnapshotRestorer(args.host, args.port, args.password, max_workers=4)
+        start = time.time()
+        restorer.run(snapshot_dir)
+        restore = time.time() - start
+        restored = sum(1 for _ in client.scan_iter(match=args.prefix + '*', count=1000))
+
+        print(f"{'mode':<12}{'seconds':>10}{'keys/s':>12}")
+        print(f"{'delete':<12}{plain:>10.2f}{args.keys / plain:>12.0f}")
+        print(f"{'+snapshot':<12}{snapshot:>10.2f}{args.keys / snapshot:>12.0f}")
+        print(f"{'restore':<12}{restore:>10.2f}{args.keys / restore:>12.0f}")
+        print(f"snapshot size {size / 1024 / 1024:.1f}MB, restored {restored}/{args.keys} keys, "
+              f"throughput ratio {plain / snapshot:.2f}")
+    finally:
+        os.chdir(cwd)
+        for key in client.scan_iter(match=args.prefix + '*', count=1000):
+            client.delete(key)
+        shutil.rmtree(workdir)
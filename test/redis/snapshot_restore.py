@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+把redis_delete_prefix_keys.py --snapshot-dir生成的快照恢复回redis(集群或者单机)
+
+设计要点：
+1. 每个segment文件一个线程并发读取、解压，block里的记录按key所在的master分组，一个节点一个pipeline执行RESTORE
+2. 快照里存的是绝对过期时间，恢复时用RESTORE ... ABSTTL，已经过期的key直接跳过
+3. 默认不覆盖已经存在的key(BUSYKEY算exists)，--replace时覆盖
+4. slot迁移导致的MOVED会刷新路由后在新节点上重试
+5. 删除时写segment出错留下的spill文件(*-spill.seg，没有压缩)也按segment读；--snapshot-spill-dir不是快照目录时，
+   对spill目录再执行一次
+
+使用示例：
+python3 snapshot_restore.py --host 10.74.110.58 --snapshot-dir ./snapshot
+python3 snapshot_restore.py --host 127.0.0.1 --port 7001 --snapshot-dir ./snapshot --prefix "key:" --replace
+"""
+
+import argparse
+import concurrent.futures
+import logging
+import threading
+import time
+from typing import Dict, List
+
+from redis.exceptions import RedisError
+
+from cluster_router import Node, NodeClients, RateLimiter, SlotRouter
+from key_snapshot import SnapshotRecord, list_segments, read_segment
+
+
+class SnapshotRestorer:
+    def __init__(self, host: str, port: int = 6379, password: str = None, replace: bool = False,
+                 prefix: str = None, rate_limit: float = 0, max_workers: int = 4, connect_timeout: int = 5):
+        self.router = SlotRouter.from_seed(host, port, password, connect_timeout)
+        self.clients = NodeClients(password, connect_timeout, max_connections=max_workers)
+        self.replace = replace
+        self.prefix = prefix.encode('utf-8') if prefix else None
+        self.limiter = RateLimiter(rate_limit)
+        self.max_workers = max_workers
+        self.stats = {'restored': 0, 'exists': 0, 'expired': 0, 'skipped': 0, 'errors': 0}
+        self.stats_lock = threading.Lock()
+
+    def _incr(self, **counts):
+        with self.stats_lock:
+            for name, value in counts.items():
+                self.stats[name] += value
+
+    def _restore(self, node: Node, records: List[SnapshotRecord], retry: bool = True):
+        pipeline = self.clients.get(node).pipeline(transaction=False)
+        for key, expire_at_ms, payload in records:
+            if expire_at_ms > 0:
+                pipeline.restore(key, expire_at_ms, payload, replace=self.replace, absttl=True)
+            else:
+                pipeline.restore(key, 0, payload, replace=self.replace)
+        results = pipeline.execute(raise_on_error=False)
+        restored = exists = errors = 0
+        moved: Dict[Node, List[SnapshotRecord]] = {}
+        for record, result in zip(records, results):
+            if not isinstance(result, Exception):
+                restored += 1
+                continue
+            moved_to = self.router.handle_moved(result)
+            if moved_to is not None and retry:
+                moved.setdefault(moved_to, []).append(record)
+            elif 'BUSYKEY' in str(result):
+                exists += 1
+            else:
+                logging.error(f"RESTORE {record[0]!r} on {node[0]}:{node[1]} failed: {str(result)}")
+                errors += 1
+        self._incr(restored=restored, exists=exists, errors=errors)
+        for moved_node, moved_records in moved.items():
+            self._restore(moved_node, moved_records, retry=False)
+
+    def restore_segment(self, path: str):
+        for records in read_segment(path):
+            now_ms = int(time.time() * 1000)
+            groups: Dict[Node, List[SnapshotRecord]] = {}
+            expired = skipped = 0
+            for record in records:
+                key, expire_at_ms, _ = record
+                if self.prefix is not None and not key.startswith(self.prefix):
+                    skipped += 1
+                elif 0 < expire_at_ms <= now_ms:
+                    expired += 1
+                else:
+                    groups.setdefault(self.router.node_for_key(key), []).append(record)
+            self._incr(expired=expired, skipped=skipped)
+            for node, node_records in groups.items():
+                self.limiter.acquire(len(node_records))
+                try:
+                    self._restore(node, node_records)
+                except RedisError as e:
+                    logging.error(f"Restore batch on {node[0]}:{node[1]} failed: {str(e)}")
+                    self._incr(errors=len(node_records))
+        logging.info(f"Finished {path}")
+
+    def run(self, snapshot_dir: str):
+        start = time.time()
+        segments = list_segments(snapshot_dir)
+        logging.info(f"Restoring {len(segments)} segments from {snapshot_dir}")
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for future in concurrent.futures.as_completed(
+                        [executor.submit(self.restore_segment, path) for path in segments]):
+                    future.result()
+        finally:
+            self.clients.close()
+        duration = time.time() - start
+        rate = self.stats['restored'] / duration if duration > 0 else 0
+        logging.info(' '.join(f'{k}={v}' for k, v in self.stats.items()) + f' rate={rate:.0f} keys/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Restore keys from a snapshot taken by redis_delete_prefix_keys.py.')
+    parser.add_argument('--host', type=str, required=True, help='Any node of the target redis cluster')
+    parser.add_argument('--port', type=int, default=6379, help='Redis port (default: 6379)')
+    parser.add_argument('--password', type=str, help='Redis password (default: None)')
+    parser.add_argument('--snapshot-dir', type=str, required=True, help='Snapshot directory')
+    parser.add_argument('--prefix', type=str, help='Only restore keys with this prefix (default: all)')
+    parser.add_argument('--replace', action='store_true', help='Overwrite keys that already exist')
+    parser.add_argument('--rate-limit', type=float, default=0, help='Max keys restored per second, 0 means unlimited (default: 0)')
+    parser.add_argument('--max-workers', type=int, default=4, help='Segments restored concurrently (default: 4)')
+    parser.add_argument('--connect-timeout', type=int, default=5, help='Redis connection timeout in seconds (default: 5)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    restorer = SnapshotRestorer(args.host, args.port, args.password, args.replace, args.prefix, args.rate_limit,
+                                args.max_workers, args.connect_timeout)
+    restorer.run(args.snapshot_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+# encoding: utf-8
+import lzma
+import zlib
+from typing import Dict, Iterable, List, Optional
+
+# 写入redis的value透明压缩
+# 集群里很多value是重复度很高的json和id列表，超过threshold的value压缩后再写，读的时候按头部标记自动解压
+#
+# 格式：压缩过的value以MAGIC开头，后面一个字节是压缩方式，用字典压缩时再跟一个字节的字典id
+#   MAGIC(0xc1) + ZLIB + zlib数据
+#   MAGIC(0xc1) + ZLIB_DICT + 字典id + deflate raw数据(没有zlib头和校验和，解压对象创建时就能设置好字典)
+#   MAGIC(0xc1) + LZMA + lzma raw数据
+#   MAGIC(0xc1) + RAW + 原始value  (原始value本身以MAGIC开头时才这样转义)
+# 0xc1在utf-8里不会出现，文本value不可能以它开头；没有头部的value原样返回，所以可以在已有数据上直接开启
+# 小于threshold或者压缩后没有明显变小的value不压缩，数字不会被压缩，INCR照样能用
+#
+# 字典：短json单独压缩时几乎没有可以引用的历史数据，用采样的value训练一个字典(zlib的zdict)，
+# 常见的字段名、公共片段在字典里，压缩率能明显提高。字典按id区分，换字典时旧id的字典要保留到旧数据过期
+#
+# usage:
+#   codec = ValueCodec('zlib', threshold=128, dictionaries={1: train_dictionary(samples)}, dict_id=1)
+#   client = CompressingClient(redis.Redis(host='10.13.246.139', port=12345), codec)
+#   client.set('user:1', json.dumps(user))
+#   client.get('user:1')
+
+MAGIC = 0xc1
+RAW = 0
+ZLIB = 1
+LZMA = 2
+ZLIB_DICT = 3
+
+# raw格式没有文件头，解压时要给出和压缩时一样大的字典；value一般不大，固定1MB，解压时不用分配preset默认的8MB
+_LZMA_DICT_SIZE = 1 << 20
+
+
+def train_dictionary(samples: Iterable[bytes], size: int = 32 * 1024) -> bytes:
+    """
+        把采样的value拼成字典，zlib压缩时可以直接引用字典里相同的片段
+        比按出现次数挑公共子串效果更好：json的字段名、嵌套结构是成段重复的，整条样本正好覆盖
+        重复的样本只放一次，超过size时保留最后的部分(zlib窗口只有32KB，引用越近编码越短)
+    """
+    seen = set()
+    pieces = []
+    total = 0
+    for sample in samples:
+        if isinstance(sample, str):
+            sample = sample.encode('utf-8')
+        if sample in seen:
+            continue
+        seen.add(sample)
+        pieces.append(sample)
+        total += len(sample)
+        while total - len(pieces[0]) >= size:
+            total -= len(pieces.pop(0))
+    return b''.join(pieces)[-size:]
+
+
+class ValueCodec:
+    def __init__(self, method: str = 'zlib', threshold: int = 256, level: int = 6,
+                 dictionaries: Dict[int, bytes] = None, dict_id: int = None, min_ratio: float = 0.9):
+        if method not in ('zlib', 'lzma'):
+            raise ValueError(f'unknown method {method}')
+        if dict_id is not None and method != 'zlib':
+            raise ValueError('dictionaries are only supported by zlib')
+        self.dictionaries = dict(dictionaries or {})
+        if dict_id is not None and not 0 <= dict_id <= 255:
+            raise ValueError('dict_id must be in 0..255')
+        if dict_id is not None and dict_id not in self.dictionaries:
+            raise ValueError(f'dictionary {dict_id} not found')
+        self.method = method
+        self.threshold = threshold
+        self.level = level
+        self.dict_id = dict_id
+        self.min_ratio = min_ratio
+        self.filters = [{'id': lzma.FILTER_LZMA2, 'preset': level, 'dict_size': _LZMA_DICT_SIZE}]
+        # 设置zdict要对整个字典建hash表，每个value都重新设置的话比压缩本身还慢；
+        # 预先建好带字典的压缩/解压对象，每次copy()一份，只复制状态不用重新计算
+        self._compressor = None
+        if dict_id is not None:
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=self.dictionaries[dict_id])
+        self._decompressors = {}
+
+    def _compress(self, data: bytes) -> bytes:
+        if self.method == 'lzma':
+            return bytes((MAGIC, LZMA)) + lzma.compress(data, format=lzma.FORMAT_RAW, filters=self.filters)
+        if self.dict_id is None:
+            return bytes((MAGIC, ZLIB)) + zlib.compress(data, self.level)
+        compressor = self._compressor.copy()
+        return bytes((MAGIC, ZLIB_DICT, self.dict_id)) + compressor.compress(data) + compressor.flush()
+
+    def encode(self, value):
+        """返回写入redis的值；数字、小value、压不动的value原样返回"""
+        if isinstance(value, (int, float)):
+            return value
+        data = value.encode('utf-8') if isinstance(value, str) else bytes(value)
+        if len(data) >= self.threshold:
+            compressed = self._compress(data)
+            if len(compressed) <= len(data) * self.min_ratio:
+                return compressed
+        if data[:1] == bytes((MAGIC,)):
+            return bytes((MAGIC, RAW)) + data
+        return value
+
+    def decode(self, data: Optional[bytes]) -> Optional[bytes]:
+        """解码从redis读回来的值，没有头部的原样返回。客户端不能开decode_responses"""
+        if not data or data[0] != MAGIC or len(data) < 2:
+            return data
+        kind = data[1]
+        if kind == ZLIB:
+            return zlib.decompress(data[2:])
+        if kind == ZLIB_DICT:
+            decompressor = self._decompressors.get(data[2])
+            if decompressor is None:
+                dictionary = self.dictionaries.get(data[2])
+                if dictionary is None:
+                    raise ValueError(f'dictionary {data[2]} not loaded')
+                decompressor = self._decompressors.setdefault(data[2], zlib.decompressobj(-zlib.MAX_WBITS, zdict=dictionary))
+            decompressor = decompressor.copy()
+            return decompressor.decompress(data[3:]) + decompressor.flush()
+        if kind == LZMA:
+            return lzma.decompress(data[2:], format=lzma.FORMAT_RAW,
+                                   filters=[{'id': lzma.FILTER_LZMA2, 'dict_size': _LZMA_DICT_SIZE}])
+        if kind == RAW:
+            return data[2:]
+        raise ValueError(f'unknown codec {kind}')
+
+    def decode_list(self, values: List[Optional[bytes]]) -> List[Optional[bytes]]:
+        return [self.decode(value) for value in values]
+
+    def decode_dict(self, mapping: dict) -> dict:
+        return {field: self.decode(value) for field, value in mapping.items()}
+
+
+class CompressingClient:
+    """
+        包装redis客户端(单机、集群、pipeline都可以)，string和hash的value自动压缩/解压，其他命令原样转发
+        包装的是pipeline时，读命令的结果在execute()里解码
+    """
+
+    def __init__(self, client, codec: ValueCodec, is_pipeline: bool = False):
+        self.client = client
+        self.codec = codec
+        self.is_pipeline = is_pipeline
+        self._decoders = {}
+
+    def pipeline(self, transaction: bool = False):
+        return CompressingClient(self.client.pipeline(transaction=transaction), self.codec, is_pipeline=True)
+
+    def execute(self, **kwargs):
+        results = self.client.execute(**kwargs)
+        decoders, self._decoders = self._decoders, {}
+        return [decoders[i](result) if i in decoders and not isinstance(result, Exception) else result
+                for i, result in enumerate(results)]
+
+    def reset(self):
+        self._decoders = {}
+        self.client.reset()
+
+    def __len__(self):
+        return len(self.client)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _read(self, decoder, method, *args, **kwargs):
+        if self.is_pipeline:
+            self._decoders[len(self.client)] = decoder
+            return method(*args, **kwargs)
+        return decoder(method(*args, **kwargs))
+
+    # 写
+    def set(self, name, value, *args, **kwargs):
+        return self.client.set(name, self.codec.encode(value), *args, **kwargs)
+
+    def setex(self, name, time, value):
+        return self.client.setex(name, time, self.codec.encode(value))
+
+    def psetex(self, name, time_ms, value):
+        return self.client.psetex(name, time_ms, self.codec.encode(value))
+
+    def setnx(self, name, value):
+        return self.client.setnx(name, self.codec.encode(value))
+
+    def mset(self, mapping: dict):
+        return self.client.mset({k: self.codec.encode(v) for k, v in mapping.items()})
+
+    def hset(self, name, key=None, value=None, mapping: dict = None, items: list = None):
+        if key is not None:
+            value = self.codec.encode(value)
+        if mapping:
+            mapping = {k: self.codec.encode(v) for k, v in mapping.items()}
+        if items:
+            items = [v if i % 2 == 0 else self.codec.encode(v) for i, v in enumerate(items)]
+        return self.client.hset(name, key, value, mapping, items)
+
+    # 读
+    def get(self, name):
+        return self._read(self.codec.decode, self.client.get, name)
+
+    def getset(self, name, value):
+        return self._read(self.codec.decode, self.client.getset, name, self.codec.encode(value))
+
+    def mget(self, keys, *args):
+        return self._read(self.codec.decode_list, self.client.mget, keys, *args)
+
+    def hget(self, name, key):
+        return self._read(self.codec.decode, self.client.hget, name, key)
+
+    def hmget(self, name, keys, *args):
+        return self._read(self.codec.decode_list, self.client.hmget, name, keys, *args)
+
+    def hvals(self, name):
+        return self._read(self.codec.decode_list, self.client.hvals, name)
+
+    def hgetall(self, name):
+        return self._read(self.codec.decode_dict, self.client.hgetall, name)
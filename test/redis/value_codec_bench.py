@@ -0,0 +1,111 @@
+# encoding: utf-8
+import argparse
+import base64
+import json
+import os
+import random
+import time
+
+import redis
+
+from value_codec import ValueCodec, train_dictionary
+
+# 对比几种value压缩方式省下的内存(MEMORY USAGE)和客户端花的CPU
+# 每种value各生成一批写进redis，MEMORY USAGE按key累加；编码/解码只统计客户端的CPU时间(process_time)
+# 只用于测试环境：会往目标实例写入并删除--prefix开头的key
+# usage: python3 value_codec_bench.py --host 127.0.0.1 -p 6379 --keys 5000
+
+
+def user_json(i: int) -> str:
+    return json.dumps({'user_id': 10000000 + i, 'nickname': f'user_{random.randint(1, 10 ** 8)}',
+                       'level': random.randint(1, 60), 'vip': random.random() < 0.2,
+                       'tags': random.sample(['new', 'active', 'churn', 'gold', 'silver', 'risk'], 2),
+                       'last_login': int(time.time()) - random.randint(0, 86400 * 30),
+                       'address': {'province': random.choice(['beijing', 'shanghai', 'guangdong']),
+                                   'city': random.choice(['haidian', 'pudong', 'shenzhen'])}})
+
+
+def order_list_json(i: int) -> str:
+    return json.dumps([{'order_id': f'{i}{n:06d}', 'sku': random.randint(100000, 999999), 'count': random.randint(1, 5),
+                        'price': round(random.uniform(1, 500), 2), 'status': random.choice(['paid', 'shipped', 'done'])}
+                       for n in range(random.randint(10, 30))])
+
+
+def id_list(i: int) -> str:
+    start = random.randint(10 ** 8, 10 ** 9)
+    return ','.join(str(start + n * random.randint(1, 50)) for n in range(random.randint(50, 200)))
+
+
+def random_blob(i: int) -> str:
+    return base64.b64encode(os.urandom(random.randint(200, 800))).decode()
+
+
+PROFILES = {
+    'user_json': user_json,
+    'order_list': order_list_json,
+    'id_list': id_list,
+    'random_b64': random_blob,
+}
+
+
+def memory_usage(client, keys) -> int:
+    pipeline = client.pipeline(transaction=False)
+    for key in keys:
+        pipeline.memory_usage(key, samples=0)
+    return sum(pipeline.execute())
+
+
+def bench(client, prefix: str, values, codec):
+    start = time.process_time()
+    encoded = [codec.encode(value) for value in values] if codec is not None else values
+    encode_cpu = time.process_time() - start
+    keys = [f'{prefix}{i}' for i in range(len(values))]
+    pipeline = client.pipeline(transaction=False)
+    for key, value in zip(keys, encoded):
+        pipeline.set(key, value)
+    pipeline.execute()
+    memory = memory_usage(client, keys)
+    stored = client.mget(keys)
+    start = time.process_time()
+    if codec is not None:
+        decoded = codec.decode_list(stored)
+        assert decoded == [value.encode() for value in values]
+    decode_cpu = time.process_time() - start
+    client.delete(*keys)
+    stored_bytes = sum(len(value) for value in stored)
+    return memory, stored_bytes, encode_cpu, decode_cpu
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark memory saved by value compression against client CPU')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('-p', '--port', type=int, default=6379)
+    parser.add_argument('-a', '--password', type=str, default=None)
+    parser.add_argument('--prefix', type=str, default='value_codec_bench:')
+    parser.add_argument('--keys', type=int, default=5000)
+    parser.add_argument('--threshold', type=int, default=128)
+    parser.add_argument('--samples', type=int, default=500, help='values used to train the dictionary')
+    args = parser.parse_args()
+
+    client = redis.Redis(host=args.host, port=args.port, password=args.password)
+    print(f"{'profile':<12}{'codec':<11}{'raw B':>8}{'stored B':>10}{'mem B/key':>11}{'saved':>8}"
+          f"{'enc us':>9}{'dec us':>9}")
+    for name, make in PROFILES.items():
+        random.seed(1)
+        samples = [make(i) for i in range(args.samples)]
+        values = [make(i) for i in range(args.samples, args.samples + args.keys)]
+        raw = sum(len(value) for value in values) / len(values)
+        codecs = {
+            'none': None,
+            'zlib': ValueCodec('zlib', args.threshold),
+            'zlib+dict': ValueCodec('zlib', args.threshold, dictionaries={1: train_dictionary(samples)}, dict_id=1),
+            'lzma': ValueCodec('lzma', args.threshold),
+        }
+        baseline = None
+        for codec_name, codec in codecs.items():
+            memory, stored, encode_cpu, decode_cpu = bench(client, args.prefix, values, codec)
+            if baseline is None:
+                baseline = memory
+            print(f"{name:<12}{codec_name:<11}{raw:>8.0f}{stored / len(values):>10.0f}{memory / len(values):>11.0f}"
+                  f"{1 - memory / baseline:>8.1%}{encode_cpu / len(values) * 1e6:>9.1f}"
+                  f"{decode_cpu / len(values) * 1e6:>9.1f}")
@@ -0,0 +1,50 @@
+import json
+import os
+import unittest
+
+from value_codec import MAGIC, ValueCodec, train_dictionary
+
+
+class TestValueCodec(unittest.TestCase):
+    def setUp(self):
+        self.values = [json.dumps({'user_id': i, 'name': f'user{i}', 'tags': ['vip', 'active'],
+                                   'address': {'city': 'beijing', 'street': f'road {i}'}}).encode()
+                       for i in range(300)]
+
+    def test_round_trip(self):
+        dictionary = train_dictionary(self.values[:100])
+        codecs = [ValueCodec('zlib', 64), ValueCodec('lzma', 64),
+                  ValueCodec('zlib', 64, dictionaries={7: dictionary}, dict_id=7)]
+        for codec in codecs:
+            encoded = [codec.encode(value) for value in self.values[100:]]
+            self.assertEqual([codec.decode(value) for value in encoded], self.values[100:])
+            self.assertTrue(all(value[0] == MAGIC for value in encoded))
+
+    def test_dictionary_improves_small_json(self):
+        plain = ValueCodec('zlib', 64)
+        trained = ValueCodec('zlib', 64, dictionaries={1: train_dictionary(self.values[:100])}, dict_id=1)
+        plain_size = sum(len(plain.encode(value)) for value in self.values[100:])
+        trained_size = sum(len(trained.encode(value)) for value in self.values[100:])
+        self.assertLess(trained_size, plain_size * 0.7)
+
+    def test_passthrough(self):
+        codec = ValueCodec('zlib', 64)
+        self.assertEqual(codec.encode(42), 42)
+        self.assertEqual(codec.encode('short'), 'short')
+        # 第一个字节不能是MAGIC，否则会被转义
+        noise = bytes((MAGIC ^ 0xff,)) + os.urandom(999)
+        self.assertEqual(codec.encode(noise), noise)
+        # 原始value以MAGIC开头时转义，读回来不会被当成压缩数据
+        tricky = bytes((MAGIC, 1)) + b'not zlib'
+        self.assertEqual(codec.decode(codec.encode(tricky)), tricky)
+        self.assertEqual(codec.decode(b'plain'), b'plain')
+        self.assertIsNone(codec.decode(None))
+
+    def test_unknown_dictionary(self):
+        writer = ValueCodec('zlib', 64, dictionaries={2: train_dictionary(self.values[:10])}, dict_id=2)
+        with self.assertRaises(ValueError):
+            ValueCodec('zlib', 64).decode(writer.encode(self.values[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
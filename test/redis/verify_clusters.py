@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+校验两个redis集群(或者单机实例)的数据是否一致，用于迁移、copy_keys.py拷贝之后的核对
+
+设计要点：
+1. 按slot算摘要：每个slot的摘要 = key数量 + 所有key的(key名, value)哈希的异或，和key的顺序无关
+   哈希在服务端的lua脚本里算(CLUSTER GETKEYSINSLOT + DUMP/读value + redis.sha1hex)，客户端只拿到每个slot几个整数，
+   网络流量和key的数量无关；一次脚本调用只处理一个slot，多个调用用pipeline发出去，一个pipeline里的key数
+   不超过--max-keys-per-call。key数超过--max-keys-per-call的大slot不整个放进一次脚本调用：
+   先GETKEYSINSLOT拿到key名，再按--max-keys-per-call分块作为KEYS传给keys_hash_script，在客户端异或，
+   这样的slot流量和key的数量成正比
+   脚本里的key是GETKEYSINSLOT现查出来的，没法事先作为KEYS传入，但都在同一个slot、属于当前节点，在redis 6.2上验证过；
+   已知key名的脚本(keys_hash_script)按slot分组，key作为KEYS传入
+2. 两边并发算摘要，只比较摘要，摘要不同的slot才去拉每个key的哈希做key级别的对比
+3. value的算法：
+   dump：直接哈希DUMP的结果，最快，但是两边redis版本、编码(listpack/ziplist/hashtable)不同时DUMP也会不同
+   logical：按类型把value规范化(hash/set排序后)再哈希，和编码无关
+   默认用dump算摘要，key级别对比时DUMP不同的key再用logical复查，只是编码不同的不算差异
+4. 非集群模式的实例没有GETKEYSINSLOT，改成SCAN一遍，在客户端按slot累加异或，这时流量和key的数量成正比；
+   扫描时把每个key的哈希按slot留在内存里(最多--max-cached-keys个)，对比key时不用再扫一遍，超过了才重新扫
+5. 不比较过期时间
+
+使用示例：
+python3 verify_clusters.py --source-host 10.0.21.150 --dest-host 10.0.21.151
+python3 verify_clusters.py --source-host 10.0.21.150 --dest-host 127.0.0.1 --dest-port 6380 --mode logical -o diff.txt
+"""
+
+import argparse
+import concurrent.futures
+import logging
+import sys
+import time
+from typing import Dict, Iterable, List, Set, Tuple
+
+from redis.exceptions import ResponseError
+
+from cluster_router import Node, NodeClients, SlotRouter
+from slot import key_hash_slot
+
+# 公共部分：按mode取value的规范形式，计算key的哈希
+_DIGEST_LIB = """
+local function joined(items)
+    local out = {}
+    for i, s in ipairs(items) do
+        out[i] = #s .. ':' .. s
+    end
+    return table.concat(out)
+end
+
+local function logical_value(key)
+    local t = redis.call('TYPE', key)['ok']
+    if t == 'string' then
+        return t .. joined({redis.call('GET', key)})
+    elseif t == 'hash' then
+        local flat = redis.call('HGETALL', key)
+        local pairs_ = {}
+        for i = 1, #flat, 2 do
+            pairs_[#pairs_ + 1] = #flat[i] .. ':' .. flat[i] .. #flat[i + 1] .. ':' .. flat[i + 1]
+        end
+        table.sort(pairs_)
+        return t .. table.concat(pairs_)
+    elseif t == 'set' then
+        local members = redis.call('SMEMBERS', key)
+        table.sort(members)
+        return t .. joined(members)
+    elseif t == 'zset' then
+        return t .. joined(redis.call('ZRANGE', key, 0, -1, 'WITHSCORES'))
+    elseif t == 'list' then
+        return t .. joined(redis.call('LRANGE', key, 0, -1))
+    elseif t == 'stream' then
+        local flat = {}
+        for _, entry in ipairs(redis.call('XRANGE', key, '-', '+')) do
+            flat[#flat + 1] = entry[1]
+            for _, item in ipairs(entry[2]) do
+                flat[#flat + 1] = item
+            end
+        end
+        return t .. joined(flat)
+    elseif t == 'none' then
+        return nil
+    end
+    return t .. redis.call('DUMP', key)
+end
+
+local function key_hash(key, mode)
+    local value
+    if mode == 'dump' then
+        value = redis.call('DUMP', key)
+    else
+        value = logical_value(key)
+    end
+    if not value then
+        return nil
+    end
+    return redis.sha1hex(#key .. ':' .. key .. value)
+end
+"""
+
+# ARGV: mode, slot  返回{count, w0, w1, w2, w3}，w是128位异或摘要的4个32位字
+slot_digest_script = _DIGEST_LIB + """
+local mode = ARGV[1]
+local slot = tonumber(ARGV[2])
+local count = redis.call('CLUSTER', 'COUNTKEYSINSLOT', slot)
+local d = {0, 0, 0, 0}
+local n = 0
+for _, key in ipairs(redis.call('CLUSTER', 'GETKEYSINSLOT', slot, count)) do
+    local h = key_hash(key, mode)
+    if h then
+        n = n + 1
+        for w = 1, 4 do
+            d[w] = bit.bxor(d[w], tonumber(string.sub(h, w * 8 - 7, w * 8), 16))
+        end
+    end
+end
+return {n, d[1], d[2], d[3], d[4]}
+"""
+
+# ARGV: mode, slot  返回slot里每个key的{key, 哈希}
+slot_keys_script = _DIGEST_LIB + """
+local mode = ARGV[1]
+local slot = tonumber(ARGV[2])
+local count = redis.call('CLUSTER', 'COUNTKEYSINSLOT', slot)
+local result = {}
+for _, key in ipairs(redis.call('CLUSTER', 'GETKEYSINSLOT', slot, count)) do
+    local h = key_hash(key, mode)
+    if h then
+        table.insert(result, key)
+        table.insert(result, string.sub(h, 1, 32))
+    end
+end
+return result
+"""
+
+# KEYS: 同一个slot的key  ARGV: mode  返回对应key的哈希，key不存在返回false
+keys_hash_script = _DIGEST_LIB + """
+local mode = ARGV[1]
+local result = {}
+for i = 1, #KEYS do
+    result[i] = key_hash(KEYS[i], mode) or false
+end
+return result
+"""
+
+# 非集群模式: ARGV: mode, cursor, count  返回{下一个cursor, key, 哈希, key, 哈希...}
+scan_hash_script = _DIGEST_LIB + """
+local mode = ARGV[1]
+local reply = redis.call('SCAN', ARGV[2], 'COUNT', ARGV[3])
+local result = {reply[1]}
+for _, key in ipairs(reply[2]) do
+    local h = key_hash(key, mode)
+    if h then
+        table.insert(result, key)
+        table.insert(result, string.sub(h, 1, 32))
+    end
+end
+return result
+"""
+
+SlotDigests = Dict[int, Tuple[int, int]]
+
+
+def combine_words(words: Iterable[int]) -> int:
+    digest = 0
+    for word in words:
+        digest = (digest << 32) | (int(word) & 0xFFFFFFFF)
+    return digest
+
+
+class ClusterDigest:
+    """一边集群的摘要计算"""
+
+    def __init__(self, name: str, host: str, port: int = 6379, password: str = None, mode: str = 'dump',
+                 max_keys_per_call: int = 5000, scan_count: int = 1000, connect_timeout: int = 30,
+                 max_cached_keys: int = 1000000):
+        self.name = name
+        self.mode = mode
+        self.max_keys_per_call = max_keys_per_call
+        self.scan_count = scan_count
+        self.max_cached_keys = max_cached_keys
+        # 非集群模式扫描时留下的{slot: {key: 哈希}}，超过max_cached_keys时为None
+        self._scanned: Dict[int, Dict[bytes, str]] = None
+        self.router = SlotRouter.from_seed(host, port, password, connect_timeout)
+        self.clients = NodeClients(password, connect_timeout, max_connections=2)
+        self.cluster = self._is_cluster()
+
+    def _is_cluster(self) -> bool:
+        client = self.clients.get(self.router.masters()[0])
+        try:
+            client.execute_command('CLUSTER', 'COUNTKEYSINSLOT', 0)
+        except ResponseError as e:
+            if 'cluster support disabled' not in str(e):
+                raise
+            return False
+        return True
+
+    def close(self):
+        self.clients.close()
+
+    def _scan_hashes(self, node: Node, mode: str) -> Iterable[Tuple[bytes, str]]:
+        client = self.clients.get(node)
+        script = client.register_script(scan_hash_script)
+        cursor = 0
+        while True:
+            reply = script(args=[mode, cursor, self.scan_count])
+            cursor = int(reply[0])
+            for i in range(1, len(reply), 2):
+                yield reply[i], reply[i + 1].decode()
+            if cursor == 0:
+                break
+
+    def node_digests(self, node: Node) -> SlotDigests:
+        """一个master上所有slot的摘要：{slot: (key数, 摘要)}，空slot不返回"""
+        digests: SlotDigests = {}
+        if not self.cluster:
+            scanned: Dict[int, Dict[bytes, str]] = {}
+            cached = 0
+            for key, hexdigest in self._scan_hashes(node, self.mode):
+                slot = key_hash_slot(key)
+                count, digest = digests.get(slot, (0, 0))
+                digests[slot] = (count + 1, digest ^ int(hexdigest, 16))
+                if scanned is not None:
+                    scanned.setdefault(slot, {})[key] = hexdigest
+                    cached += 1
+                    if cached > self.max_cached_keys:
+                        scanned = None
+            self._scanned = scanned
+            return digests
+        client = self.clients.get(node)
+        slots = [slot for start, end in self.router.slots_of(node) for slot in range(start, end + 1)]
+        # 先pipeline拿每个slot的key数，再按key数把slot分组，一个slot一次脚本调用，一组一个pipeline
+        pipeline = client.pipeline(transaction=False)
+        for slot in slots:
+            pipeline.execute_command('CLUSTER', 'COUNTKEYSINSLOT', slot)
+        counts = pipeline.execute()
+        script = client.register_script(slot_digest_script)
+        batch, batch_keys = [], 0
+        for slot, count in zip(slots, counts):
+            if count == 0:
+                continue
+            if count > self.max_keys_per_call:
+                n, digest = 0, 0
+                for _, hexdigest in self._big_slot_hashes(client, slot):
+                    n += 1
+                    digest ^= int(hexdigest, 16)
+                if n:
+                    digests[slot] = (n, digest)
+                continue
+            if batch and batch_keys + count > self.max_keys_per_call:
+                self._run_digest_batch(client, script, batch, digests)
+                batch, batch_keys = [], 0
+            batch.append(slot)
+            batch_keys += count
+        if batch:
+            self._run_digest_batch(client, script, batch, digests)
+        return digests
+
+    def _big_slot_hashes(self, client, slot: int) -> Iterable[Tuple[bytes, str]]:
+        """key数超过max_keys_per_call的slot：取出key名后分块算哈希，一次脚本调用最多max_keys_per_call个key"""
+        count = client.execute_command('CLUSTER', 'COUNTKEYSINSLOT', slot)
+        keys = client.execute_command('CLUSTER', 'GETKEYSINSLOT', slot, count)
+        script = client.register_script(keys_hash_script)
+        for i in range(0, len(keys), self.max_keys_per_call):
+            chunk = keys[i:i + self.max_keys_per_call]
+            for key, hexdigest in zip(chunk, script(keys=chunk, args=[self.mode])):
+                # 取出key名之后被删掉的key
+                if hexdigest:
+                    yield key, hexdigest.decode()[:32]
+
+    def _run_digest_batch(self, client, script, slots: List[int], digests: SlotDigests):
+        pipeline = client.pipeline(transaction=False)
+        for slot in slots:
+            script(args=[self.mode, slot], client=pipeline)
+        for slot, (count, *words) in zip(slots, pipeline.execute()):
+            if count:
+                digests[slot] = (int(count), combine_words(words))
+
+    def digests(self, max_workers: int = 8) -> SlotDigests:
+        digests: SlotDigests = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for node_digests in executor.map(self.node_digests, self.router.masters()):
+                digests.update(node_digests)
+        return digests
+
+    def key_hashes(self, slots: Set[int]) -> Dict[int, Dict[bytes, str]]:
+        """摘要不一致的slot里每个key的哈希"""
+        result: Dict[int, Dict[bytes, str]] = {slot: {} for slot in slots}
+        if not self.cluster:
+            if self._scanned is not None:
+                return {slot: self._scanned.get(slot, {}) for slot in slots}
+            # 摘要阶段的key太多没有留下来，只能整个实例再扫一遍，只保留需要的slot
+            for node in self.router.masters():
+                for key, hexdigest in self._scan_hashes(node, self.mode):
+                    slot = key_hash_slot(key)
+                    if slot in result:
+                        result[slot][key] = hexdigest
+            return result
+        for slot in slots:
+            client = self.clients.get(self.router.node_for_slot(slot))
+            if client.execute_command('CLUSTER', 'COUNTKEYSINSLOT', slot) > self.max_keys_per_call:
+                result[slot] = dict(self._big_slot_hashes(client, slot))
+                continue
+            reply = client.register_script(slot_keys_script)(args=[self.mode, slot])
+            result[slot] = {reply[i]: reply[i + 1].decode() for i in range(0, len(reply), 2)}
+        return result
+
+    def logical_hashes(self, keys: List[bytes]) -> Dict[bytes, str]:
+        """按logical模式重新算一批key的哈希，key不存在的是None"""
+        result = {}
+        # 按节点、slot分组，一个slot的key作为KEYS传给一次脚本调用，一个节点的调用放进一个pipeline
+        by_node: Dict[Node, Dict[int, List[bytes]]] = {}
+        for key in keys:
+            slot = key_hash_slot(key)
+            by_node.setdefault(self.router.node_for_slot(slot), {}).setdefault(slot, []).append(key)
+        for node, slots in by_node.items():
+            client = self.clients.get(node)
+            script = client.register_script(keys_hash_script)
+            pipeline = client.pipeline(transaction=False)
+            chunks = []
+            for slot_keys in slots.values():
+                for i in range(0, len(slot_keys), 500):
+                    chunk = slot_keys[i:i + 500]
+                    script(keys=chunk, args=['logical'], client=pipeline)
+                    chunks.append(chunk)
+            for chunk, hexdigests in zip(chunks, pipeline.execute()):
+                for key, hexdigest in zip(chunk, hexdigests):
+                    result[key] = hexdigest.decode() if hexdigest else None
+        return result
+
+
+class ClusterVerifier:
+    def __init__(self, source: ClusterDigest, dest: ClusterDigest, max_workers: int = 8, output=None):
+        self.source = source
+        self.dest = dest
+        self.max_workers = max_workers
+        self.output = output
+        self.stats = {'slots_checked': 0, 'slots_mismatched': 0, 'keys_source': 0, 'keys_dest': 0,
+                      'missing': 0, 'extra': 0, 'value_diff': 0, 'encoding_only': 0}
+
+    def _report(self, kind: str, key: bytes):
+        self.stats[kind] += 1
+        if self.output:
+            self.output.write(b'%s %s\n' % (kind.encode(), key))
+
+    def compare_digests(self) -> Set[int]:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            source_future = executor.submit(self.source.digests, self.max_workers)
+            dest_future = executor.submit(self.dest.digests, self.max_workers)
+            source, dest = source_future.result(), dest_future.result()
+        self.stats['keys_source'] = sum(count for count, _ in source.values())
+        self.stats['keys_dest'] = sum(count for count, _ in dest.values())
+        slots = set(source) | set(dest)
+        self.stats['slots_checked'] = len(slots)
+        mismatched = {slot for slot in slots if source.get(slot) != dest.get(slot)}
+        self.stats['slots_mismatched'] = len(mismatched)
+        return mismatched
+
+    def drill_down(self, slots: Set[int]):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            source_future = executor.submit(self.source.key_hashes, slots)
+            dest_future = executor.submit(self.dest.key_hashes, slots)
+            source, dest = source_future.result(), dest_future.result()
+        changed = []
+        for slot in sorted(slots):
+            source_keys, dest_keys = source[slot], dest[slot]
+            for key in source_keys.keys() - dest_keys.keys():
+                self._report('missing', key)
+            for key in dest_keys.keys() - source_keys.keys():
+                self._report('extra', key)
+            changed.extend(key for key in source_keys.keys() & dest_keys.keys()
+                           if source_keys[key] != dest_keys[key])
+        if not changed:
+            return
+        if self.source.mode == 'logical':
+            for key in changed:
+                self._report('value_diff', key)
+            return
+        # DUMP不同的key按规范化的value再比一次，排除编码差异
+        source_logical = self.source.logical_hashes(changed)
+        dest_logical = self.dest.logical_hashes(changed)
+        for key in changed:
+            if source_logical[key] == dest_logical[key]:
+                self.stats['encoding_only'] += 1
+            else:
+                self._report('value_diff', key)
+
+    def run(self) -> bool:
+        start = time.time()
+        mismatched = self.compare_digests()
+        logging.info(f"digests done in {time.time() - start:.1f}s, slots={self.stats['slots_checked']} "
+                     f"mismatched={len(mismatched)}")
+        if mismatched:
+            self.drill_down(mismatched)
+        logging.info(' '.join(f'{k}={v}' for k, v in self.stats.items()) + f' elapsed={time.time() - start:.1f}s')
+        return self.stats['missing'] + self.stats['extra'] + self.stats['value_diff'] == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Verify two redis clusters hold the same data using per-slot digests.')
+    parser.add_argument('--source-host', type=str, required=True, help='Source redis host')
+    parser.add_argument('--source-port', type=int, default=6379, help='Source redis port (default: 6379)')
+    parser.add_argument('--source-password', type=str, help='Source redis password (default: None)')
+    parser.add_argument('--dest-host', type=str, required=True, help='Destination redis host')
+    parser.add_argument('--dest-port', type=int, default=6379, help='Destination redis port (default: 6379)')
+    parser.add_argument('--dest-password', type=str, help='Destination redis password (default: None)')
+    parser.add_argument('--mode', type=str, choices=['dump', 'logical'], default='dump',
+                        help='Value digest: DUMP payload, or an encoding independent canonical form (default: dump)')
+    parser.add_argument('--max-keys-per-call', type=int, default=5000,
+                        help='Max keys hashed in one script call, bounds server blocking; '
+                             'bigger slots are hashed in chunks from the client (default: 5000)')
+    parser.add_argument('--scan-count', type=int, default=1000, help='SCAN count for non-cluster instances (default: 1000)')
+    parser.add_argument('--max-cached-keys', type=int, default=1000000,
+                        help='Key hashes kept from the non-cluster scan for the drill-down (default: 1000000)')
+    parser.add_argument('--max-workers', type=int, default=8, help='Max nodes hashed concurrently per side (default: 8)')
+    parser.add_argument('-o', '--output', type=str, help='Write differing keys to this file (default: stdout)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    source = ClusterDigest('source', args.source_host, args.source_port, args.source_password, args.mode,
+                           args.max_keys_per_call, args.scan_count, max_cached_keys=args.max_cached_keys)
+    dest = ClusterDigest('dest', args.dest_host, args.dest_port, args.dest_password, args.mode,
+                         args.max_keys_per_call, args.scan_count, max_cached_keys=args.max_cached_keys)
+    output = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        same = ClusterVerifier(source, dest, args.max_workers, output).run()
+    finally:
+        source.close()
+        dest.close()
+        output.flush()
+        if args.output:
+            output.close()
+    sys.exit(0 if same else 1)
+
+
+if __name__ == "__main__":
+    main()
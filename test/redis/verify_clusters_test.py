@@ -0,0 +1,174 @@
+import io
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+import unittest
+
+import redis
+
+from migrate_slots_test import LocalCluster
+from slot import key_hash_slot
+from verify_clusters import ClusterDigest, ClusterVerifier
+
+REDIS_SERVER = shutil.which('redis-server')
+
+
+class LocalServer:
+    def __init__(self):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            self.port = s.getsockname()[1]
+        self.dir = tempfile.mkdtemp()
+        self.process = subprocess.Popen([REDIS_SERVER, '--port', str(self.port), '--bind', '127.0.0.1',
+                                         '--dir', self.dir, '--save', '', '--appendonly', 'no'],
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.client = redis.Redis(port=self.port)
+        deadline = time.time() + 5
+        while True:
+            try:
+                self.client.ping()
+                return
+            except redis.ConnectionError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.01)
+
+    def close(self):
+        self.client.close()
+        self.process.terminate()
+        self.process.wait()
+        shutil.rmtree(self.dir)
+
+
+def fill(clients, count: int = 2000):
+    """按key所在的节点写入，clients是[(slot区间列表, 客户端)]"""
+    def client_for(key):
+        slot = key_hash_slot(key)
+        return next(client for ranges, client in clients if any(start <= slot <= end for start, end in ranges))
+
+    for i in range(count):
+        client_for(f's:{i}').set(f's:{i}', i)
+    for i in range(20):
+        client_for(f'h:{i}').hset(f'h:{i}', mapping={'a': i, 'b': 'x'})
+        client_for(f'z:{i}').zadd(f'z:{i}', {'m1': 1, 'm2': i})
+    return client_for
+
+
+class VerifyMixin:
+    def verify(self, source_port: int, dest_port: int, **kwargs):
+        output = io.BytesIO()
+        source = ClusterDigest('source', '127.0.0.1', source_port, max_keys_per_call=300, scan_count=100, **kwargs)
+        dest = ClusterDigest('dest', '127.0.0.1', dest_port, max_keys_per_call=300, scan_count=100, **kwargs)
+        try:
+            verifier = ClusterVerifier(source, dest, output=output)
+            same = verifier.run()
+        finally:
+            source.close()
+            dest.close()
+        return same, verifier.stats, sorted(output.getvalue().splitlines())
+
+    def break_dest(self, client_for, config_client):
+        client_for('s:1').delete('s:1')
+        client_for('s:extra').set('s:extra', 1)
+        client_for('s:2').set('s:2', 'changed')
+        # 只有编码不同：目标端改成hashtable编码后重写
+        for client in config_client:
+            client.config_set('hash-max-ziplist-entries', 0)
+        client_for('h:3').delete('h:3')
+        client_for('h:3').hset('h:3', mapping={'b': 'x', 'a': 3})
+
+    def assert_broken(self, same, stats, lines):
+        self.assertFalse(same)
+        self.assertEqual(lines, [b'extra s:extra', b'missing s:1', b'value_diff s:2'])
+        self.assertEqual((stats['missing'], stats['extra'], stats['value_diff'], stats['encoding_only']),
+                         (1, 1, 1, 1))
+        self.assertEqual(stats['keys_source'], 2040)
+
+
+@unittest.skipUnless(REDIS_SERVER, 'redis-server not found')
+class TestVerifyStandalone(VerifyMixin, unittest.TestCase):
+    def setUp(self):
+        self.source = LocalServer()
+        self.dest = LocalServer()
+        fill([([(0, 16383)], self.source.client)])
+        self.client_for = fill([([(0, 16383)], self.dest.client)])
+
+    def tearDown(self):
+        self.source.close()
+        self.dest.close()
+
+    def test_same(self):
+        same, stats, lines = self.verify(self.source.port, self.dest.port)
+        self.assertTrue(same)
+        self.assertEqual(stats['slots_mismatched'], 0)
+        self.assertEqual(stats['keys_source'], stats['keys_dest'])
+        self.assertEqual(lines, [])
+
+    def test_diff(self):
+        self.break_dest(self.client_for, [self.dest.client])
+        self.assert_broken(*self.verify(self.source.port, self.dest.port))
+        # 扫描结果没有留在内存里时重新扫描，结果一样
+        self.assert_broken(*self.verify(self.source.port, self.dest.port, max_cached_keys=10))
+
+
+@unittest.skipUnless(REDIS_SERVER, 'redis-server not found')
+class TestVerifyCluster(VerifyMixin, unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.source = LocalCluster(masters=2)
+        cls.dest = LocalCluster(masters=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.source.close()
+        cls.dest.close()
+
+    @staticmethod
+    def node_clients(cluster):
+        clients = []
+        for client in cluster.clients:
+            port = client.connection_pool.connection_kwargs['port']
+            ranges = [(start, end) for start, end, master, *_ in client.execute_command('CLUSTER', 'SLOTS')
+                      if master[1] == port]
+            clients.append((ranges, client))
+        return clients
+
+    def setUp(self):
+        for client in self.source.clients + self.dest.clients:
+            client.flushall()
+            client.config_set('hash-max-ziplist-entries', 128)
+        fill(self.node_clients(self.source))
+        self.client_for = fill(self.node_clients(self.dest))
+
+    def test_same(self):
+        same, stats, lines = self.verify(self.source.ports[0], self.dest.ports[0])
+        self.assertTrue(same)
+        self.assertEqual(stats['slots_mismatched'], 0)
+        self.assertEqual(lines, [])
+
+    def test_diff(self):
+        self.break_dest(self.client_for, self.dest.clients)
+        self.assert_broken(*self.verify(self.source.ports[0], self.dest.ports[0]))
+        same, stats, lines = self.verify(self.source.ports[0], self.dest.ports[0], mode='logical')
+        self.assertEqual(lines, [b'extra s:extra', b'missing s:1', b'value_diff s:2'])
+        self.assertEqual(stats['encoding_only'], 0)
+
+    def test_big_slot(self):
+        # 一个slot里的key比max_keys_per_call多，分块算哈希
+        source = self.node_clients(self.source)
+        dest = self.node_clients(self.dest)
+        for clients in (source, dest):
+            client_for = fill(clients, count=0)
+            client_for('{big}').mset({f'{{big}}:{i}': i for i in range(700)})
+        client_for('{big}').set('{big}:5', 'changed')
+        client_for('{big}').delete('{big}:6')
+        same, stats, lines = self.verify(self.source.ports[0], self.dest.ports[0])
+        self.assertFalse(same)
+        self.assertEqual(lines, [b'missing {big}:6', b'value_diff {big}:5'])
+        self.assertEqual(stats['keys_source'], 2740)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+# encoding: utf-8
+import atexit
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from redis.exceptions import ConnectionError, RedisError, TimeoutError
+
+# 热点计数器的写合并客户端
+# incr_test.py那种场景，所有worker都在HINCRBY同一个k1/f1，请求全部打到一个分片上。
+# 这里先在内存里按(key, field)把增量累加起来，按时间或者待刷数量触发，一个(key, field)只发一条HINCRBY/INCRBY，
+# 同一批用一个pipeline发出去，服务端的ops从"每次加一"降到"每个字段每个周期一次"
+#
+# 两种模式：
+# at_least_once：刷新时连接失败，把这批增量合并回内存下次再刷，不丢数据；但是连接断开时服务端可能已经执行了一部分，会重复计数
+# bounded_loss：刷新失败直接丢掉这批，最多丢一个刷新周期(或者max_pending个字段)的增量，不会重复计数
+# 进程退出(close/atexit)时会再刷一次
+#
+# usage:
+#   counter = CombiningCounter(redis.Redis(host='10.13.246.139', port=12345), flush_interval=0.05)
+#   counter.hincrby('k1', 'f1')
+#   counter.incr('pv')
+#   counter.close()
+
+AT_LEAST_ONCE = 'at_least_once'
+BOUNDED_LOSS = 'bounded_loss'
+
+# field为None表示string类型的计数器，用INCRBY
+CounterKey = Tuple[str, Optional[str]]
+
+
+class CombiningCounter:
+    def __init__(self, client, flush_interval: float = 0.1, max_pending: int = 10000, mode: str = AT_LEAST_ONCE,
+                 close_retries: int = 3):
+        if mode not in (AT_LEAST_ONCE, BOUNDED_LOSS):
+            raise ValueError(f'unknown mode {mode}')
+        self.client = client
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.mode = mode
+        self.close_retries = close_retries
+        self.pending: Dict[CounterKey, int] = {}
+        self.lock = threading.Lock()
+        # 同一时间只有一个线程在刷，保证失败合并回去的增量不会和下一批乱序
+        self.flush_lock = threading.Lock()
+        self.stats = {'increments': 0, 'commands': 0, 'flushes': 0, 'failed_flushes': 0, 'command_errors': 0,
+                      'lost': 0}
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.flusher = threading.Thread(target=self._run, name='counter-flusher', daemon=True)
+        self.flusher.start()
+        atexit.register(self.close)
+
+    def incr(self, key: str, amount: int = 1):
+        self._add((key, None), amount)
+
+    def hincrby(self, key: str, field: str, amount: int = 1):
+        self._add((key, field), amount)
+
+    def _add(self, counter: CounterKey, amount: int):
+        # closed在lock里检查，close()置位之后不会再有增量进pending，最后一次flush不会漏掉
+        with self.lock:
+            if self.closed:
+                raise RuntimeError('counter is closed')
+            self.pending[counter] = self.pending.get(counter, 0) + amount
+            self.stats['increments'] += 1
+            full = len(self.pending) >= self.max_pending
+        if full:
+            self.wakeup.set()
+
+    def _run(self):
+        while not self.closed:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            if self.closed:
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f'flush failed: {str(e)}')
+
+    def _merge_back(self, batch: Dict[CounterKey, int]):
+        with self.lock:
+            for counter, delta in batch.items():
+                self.pending[counter] = self.pending.get(counter, 0) + delta
+
+    def flush(self) -> int:
+        """把当前累积的增量刷到redis，返回发出去的命令数"""
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = self.pending, {}
+            # 增减抵消为0的字段不用发
+            batch = {counter: delta for counter, delta in batch.items() if delta}
+            if not batch:
+                return 0
+            pipeline = self.client.pipeline(transaction=False)
+            for (key, field), delta in batch.items():
+                if field is None:
+                    pipeline.incrby(key, delta)
+                else:
+                    pipeline.hincrby(key, field, delta)
+            try:
+                results = pipeline.execute(raise_on_error=False)
+            except (ConnectionError, TimeoutError) as e:
+                self.stats['failed_flushes'] += 1
+                if self.mode == AT_LEAST_ONCE:
+                    self._merge_back(batch)
+                else:
+                    self.stats['lost'] += sum(batch.values())
+                logging.warning(f'flush of {len(batch)} counters failed ({self.mode}): {str(e)}')
+                raise
+            self.stats['flushes'] += 1
+            self.stats['commands'] += len(batch)
+            # WRONGTYPE这类命令错误重试也没用，记录下来丢掉
+            for ((key, field), delta), result in zip(batch.items(), results):
+                if isinstance(result, RedisError):
+                    self.stats['command_errors'] += 1
+                    logging.error(f'{key} {field or ""} +{delta} failed: {str(result)}')
+            return len(batch)
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        self.wakeup.set()
+        self.flusher.join()
+        atexit.unregister(self.close)
+        for attempt in range(self.close_retries):
+            try:
+                self.flush()
+                return
+            except (ConnectionError, TimeoutError):
+                time.sleep(min(0.1 * 2 ** attempt, 1))
+        with self.lock:
+            if self.pending:
+                self.stats['lost'] += sum(self.pending.values())
+                logging.error(f'{len(self.pending)} counters were not flushed before close')
+                self.pending = {}
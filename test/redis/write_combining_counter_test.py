@@ -0,0 +1,129 @@
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import redis
+
+from write_combining_counter import AT_LEAST_ONCE, BOUNDED_LOSS, CombiningCounter
+
+REDIS_SERVER = shutil.which('redis-server')
+
+
+@unittest.skipUnless(REDIS_SERVER, 'redis-server not found')
+class TestCombiningCounter(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            cls.port = s.getsockname()[1]
+        cls.dir = tempfile.mkdtemp()
+        cls.server = subprocess.Popen([REDIS_SERVER, '--port', str(cls.port), '--bind', '127.0.0.1', '--dir', cls.dir,
+                                       '--save', '', '--appendonly', 'no'],
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        cls.client = redis.Redis(port=cls.port)
+        deadline = time.time() + 5
+        while True:
+            try:
+                cls.client.ping()
+                break
+            except redis.ConnectionError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.01)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.client.close()
+        cls.server.terminate()
+        cls.server.wait()
+        shutil.rmtree(cls.dir)
+
+    def setUp(self):
+        self.client.flushall()
+
+    def counter(self, **kwargs) -> CombiningCounter:
+        # 不让后台线程自己刷，测试里手动flush
+        kwargs.setdefault('flush_interval', 3600)
+        return CombiningCounter(self.client, **kwargs)
+
+    def test_merge(self):
+        counter = self.counter()
+        try:
+            for _ in range(100):
+                counter.hincrby('k1', 'f1')
+                counter.incr('pv', 2)
+            counter.hincrby('k1', 'f2', 5)
+            counter.hincrby('k1', 'f2', -5)
+            # 每个(key, field)只发一条命令，抵消为0的不发
+            self.assertEqual(counter.flush(), 2)
+            self.assertEqual(self.client.hget('k1', 'f1'), b'100')
+            self.assertEqual(self.client.get('pv'), b'200')
+            self.assertFalse(self.client.hexists('k1', 'f2'))
+            self.assertEqual(counter.flush(), 0)
+            self.assertEqual((counter.stats['increments'], counter.stats['commands']), (202, 2))
+        finally:
+            counter.close()
+
+    def test_failed_flush(self):
+        failing = mock.patch.object(redis.client.Pipeline, 'execute', side_effect=redis.ConnectionError('gone'))
+        counter = self.counter(mode=AT_LEAST_ONCE)
+        try:
+            counter.incr('a', 3)
+            with failing, self.assertRaises(redis.ConnectionError):
+                counter.flush()
+            # 失败的增量合并回去，和之后的增量一起刷
+            counter.incr('a', 4)
+            self.assertEqual(counter.flush(), 1)
+            self.assertEqual(self.client.get('a'), b'7')
+        finally:
+            counter.close()
+
+        counter = self.counter(mode=BOUNDED_LOSS)
+        try:
+            counter.incr('b', 3)
+            with failing, self.assertRaises(redis.ConnectionError):
+                counter.flush()
+            counter.incr('b', 4)
+            counter.flush()
+            self.assertEqual(self.client.get('b'), b'4')
+            self.assertEqual(counter.stats['lost'], 3)
+        finally:
+            counter.close()
+
+    def test_close(self):
+        counter = self.counter()
+        stop = threading.Event()
+        added = []
+
+        def add():
+            count = 0
+            while not stop.is_set():
+                try:
+                    counter.incr('c')
+                except RuntimeError:
+                    break
+                count += 1
+            added.append(count)
+
+        threads = [threading.Thread(target=add) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        # close()时还在加的增量要么被最后一次flush带上，要么抛RuntimeError，不会丢
+        counter.close()
+        stop.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(int(self.client.get('c')), sum(added))
+        self.assertEqual(counter.stats['lost'], 0)
+        with self.assertRaises(RuntimeError):
+            counter.incr('c')
+
+
+if __name__ == '__main__':
+    unittest.main()